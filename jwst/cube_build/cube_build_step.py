@@ -5,6 +5,7 @@ from .. import datamodels
 from . import cube_build
 from . import ifu_cube
 from . import data_types
+from . import detector_map
 from ..assign_wcs.util import update_s_region_keyword
 
 
@@ -46,6 +47,10 @@ class CubeBuildStep (Step):
          rois = float(default=0.0) # region of interest spatial size, arc seconds
          roiw = float(default=0.0) # region of interest wavelength size, microns
          weight_power = float(default=0.0) # Weighting option to use for Modified Shepard Method
+         cloud_method = option('indexed','loop',default='indexed') # Point cloud matching: spaxel grid search or loop over points
+         maximum_cores = option('quarter', 'half', 'all', default=None) # max number of processes to create
+         coord_cache_dir = string(default=None) # Directory for detector coordinate map sidecar files
+         coord_cache_size = integer(default=0) # Bytes of detector coordinate maps cached in memory, 0 for none
          wavemin = float(default=None)  # Minimum wavelength to be used in the IFUCube
          wavemax = float(default=None)  # Maximum wavelength to be used in the IFUCube
          single = boolean(default=false) # Internal pipeline option used by mrs_imatch & outlier detection
@@ -70,6 +75,7 @@ class CubeBuildStep (Step):
         """
 
         self.log.info('Starting IFU Cube Building Step')
+        detector_map.detector_map_cache.resize(self.coord_cache_size)
 # ________________________________________________________________________________
 # For all parameters convert to a standard format
 # Report read in values to screen
@@ -248,6 +254,9 @@ class CubeBuildStep (Step):
             'interpolation': self.interpolation,
             'weighting': self.weighting,
             'weight_power': self.weight_power,
+            'cloud_method': self.cloud_method,
+            'maximum_cores': self.maximum_cores,
+            'coord_cache_dir': self.coord_cache_dir,
             'coord_system': self.coord_system,
             'rois': self.rois,
             'roiw': self.roiw,
@@ -344,6 +353,10 @@ class CubeBuildStep (Step):
                 cube_container.append(result)
             if self.debug_pixel == 1:
                 self.spaxel_debug.close()
+        cache = detector_map.detector_map_cache
+        self.log.debug('Detector map cache: %i hits, %i misses, %i maps held',
+                       cache.hits, cache.misses, len(cache.maps))
+
         for cube in cube_container:
             footprint = cube.meta.wcs.footprint(axis_type="spatial")
             update_s_region_keyword(cube, footprint)
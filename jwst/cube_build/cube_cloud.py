@@ -156,6 +156,185 @@ def match_det2cube_msm(naxis1, naxis2, naxis3,
 # _______________________________________________________________________
 
 
+def match_det2cube_msm_indexed(naxis1, naxis2, naxis3,
+                               cdelt1, cdelt2,
+                               zcdelt3,
+                               xcenters, ycenters, zcoord,
+                               spaxel_flux,
+                               spaxel_weight,
+                               spaxel_iflux,
+                               flux,
+                               coord1, coord2, wave,
+                               weighting_type,
+                               rois_pixel, roiw_pixel, weight_pixel,
+                               softrad_pixel, scalerad_pixel):
+
+    """ Map the detector pixels to the cube spaxels using a spaxel index
+
+    This routine gives the same results as match_det2cube_msm but, rather
+    than looping over the point cloud, it uses the regular spaxel grid of the
+    ifucube to find for chunks of point cloud members all the spaxels that
+    fall in their ROI at once. The modified shepard weights are computed for
+    all the matches of a chunk and summed into the spaxel arrays with
+    scatter-adds.
+
+    Parameters
+    ----------
+    The parameters are the same as for match_det2cube_msm.
+
+    Returns
+    -------
+    spaxel_flux, spaxel_weight, and spaxel_ifux updated with the information
+    from the detector pixels that fall within the roi if the spaxel center.
+    """
+
+    nplane = naxis1 * naxis2
+    total_num = nplane * naxis3
+
+    for ipt, ixy, iz in find_roi_spaxels(naxis1, naxis2,
+                                         xcenters, ycenters, zcoord,
+                                         coord1, coord2, wave,
+                                         rois_pixel, roiw_pixel):
+
+        d1 = (coord1[ipt] - xcenters[ixy]) / cdelt1
+        d2 = (coord2[ipt] - ycenters[ixy]) / cdelt2
+        d3 = (wave[ipt] - zcoord[iz]) / zcdelt3[iz]
+        wdistance = (d1 * d1) + (d2 * d2) + (d3 * d3)
+
+        if weighting_type == 'msm':
+            weight_distance = np.power(np.sqrt(wdistance), weight_pixel[ipt])
+            lower_limit = softrad_pixel[ipt]
+            too_small = weight_distance < lower_limit
+            weight_distance[too_small] = lower_limit[too_small]
+            weight_distance = 1.0 / weight_distance
+        elif weighting_type == 'emsm':
+            weight_distance = np.exp(-wdistance / (scalerad_pixel[ipt] / cdelt1))
+
+        weighted_flux = weight_distance * flux[ipt]
+        cube_index = iz * nplane + ixy
+
+        spaxel_flux += np.bincount(cube_index, weights=weighted_flux,
+                                   minlength=total_num)
+        spaxel_weight += np.bincount(cube_index, weights=weight_distance,
+                                     minlength=total_num)
+        spaxel_iflux += np.bincount(cube_index, minlength=total_num)
+# _______________________________________________________________________
+
+
+def find_roi_spaxels(naxis1, naxis2,
+                     xcenters, ycenters, zcoord,
+                     coord1, coord2, wave,
+                     rois_pixel, roiw_pixel,
+                     max_candidates=4000000):
+    """ Find the spaxels that fall within the ROI of each point cloud member
+
+    The spaxel centers of the ifucube form a regular grid: xcenters and
+    ycenters are the flattened (naxis2, naxis1) spatial plane and zcoord is
+    sorted. The grid is used as a spatial/spectral index: the spaxels within
+    the bounding box of the ROI of every point cloud member are found with
+    a binary search along each axis, and only these candidates are tested
+    against the ROI with the same conditions used in match_det2cube_msm.
+    The point cloud is processed in chunks so that the number of candidates
+    tested at once stays below max_candidates.
+
+    Parameters
+    ----------
+    naxis1 : int
+       size of the ifucube in 1st axis
+    naxis2 : int
+       size of the ifucube in 2nd axis
+    xcenters : numpy.ndarray
+       spaxel center locations 1st dimensions.
+    ycenters : numpy.ndarray
+       spaxel center locations 2nd dimensions.
+    zcoord : numpy.ndarray
+        spaxel center locations in 3rd dimensions
+    coord1 : numpy.ndarray
+       contains the spatial coordinate for 1st dimension for the mapped
+       detector pixel
+    coord2 : numpy.ndarray
+       contains the spatial coordinate for 2nd dimension for the mapped
+       detector pixel
+    wave : numpy.ndarray
+       contains the spectral coordinate  for the mapped detector pixel
+    rois_pixel : numpy.ndarray
+       region of influence size in spatial dimension
+    roiw_pixel : numpy.ndarray
+       region of influence size in spectral dimension
+    max_candidates : int
+       maximum number of candidate (point, spaxel) pairs tested at once
+
+    Returns
+    -------
+    Generator yielding for each chunk of the point cloud the arrays
+    ipt, ixy, iz: the index of the point cloud member, the index of the
+    spaxel in the flattened spatial plane and the wavelength plane index
+    of every (point, spaxel) pair that falls in the ROI.
+    """
+
+    naxis3 = zcoord.size
+    xcoord = xcenters[0:naxis1]
+    ycoord = ycenters[0:naxis1 * naxis2:naxis1]
+
+    # match_det2cube_msm does not use the last point of the point cloud,
+    # it is left out here as well so both routines give the same results.
+    nn = coord1.size - 1
+    if nn <= 0:
+        return
+    coord1 = coord1[0:nn]
+    coord2 = coord2[0:nn]
+    wave = wave[0:nn]
+    rois = rois_pixel[0:nn]
+    roiw = roiw_pixel[0:nn]
+
+    # bounding box of the ROI in spaxel indices. The boxes are widened by
+    # one spaxel on each side so that rounding at the ROI edge can not
+    # exclude a spaxel; the exact ROI test is done on the candidates.
+    ix1 = np.clip(np.searchsorted(xcoord, coord1 - rois, side='left') - 1, 0, naxis1)
+    ix2 = np.clip(np.searchsorted(xcoord, coord1 + rois, side='right') + 1, 0, naxis1)
+    iy1 = np.clip(np.searchsorted(ycoord, coord2 - rois, side='left') - 1, 0, naxis2)
+    iy2 = np.clip(np.searchsorted(ycoord, coord2 + rois, side='right') + 1, 0, naxis2)
+    iz1 = np.clip(np.searchsorted(zcoord, wave - roiw, side='left') - 1, 0, naxis3)
+    iz2 = np.clip(np.searchsorted(zcoord, wave + roiw, side='right') + 1, 0, naxis3)
+
+    nx = ix2 - ix1
+    ny = iy2 - iy1
+    nz = iz2 - iz1
+    ncandidates = nx * ny * nz
+
+    cumulative = np.cumsum(ncandidates)
+    istart = 0
+    while istart < nn:
+        offset = cumulative[istart] - ncandidates[istart]
+        iend = np.searchsorted(cumulative, offset + max_candidates, side='right')
+        iend = min(max(iend, istart + 1), nn)
+        chunk = np.arange(istart, iend)
+        istart = iend
+
+        nchunk = ncandidates[chunk]
+        if nchunk.sum() == 0:
+            continue
+        ipt = np.repeat(chunk, nchunk)
+        first = np.cumsum(nchunk) - nchunk
+        local = np.arange(ipt.size) - np.repeat(first, nchunk)
+
+        nxy = nx[ipt] * ny[ipt]
+        iz = iz1[ipt] + local // nxy
+        local = local % nxy
+        iy = iy1[ipt] + local // nx[ipt]
+        ix = ix1[ipt] + local % nx[ipt]
+
+        xdistance = xcoord[ix] - coord1[ipt]
+        ydistance = ycoord[iy] - coord2[ipt]
+        radius = np.sqrt(xdistance * xdistance + ydistance * ydistance)
+        good = (radius <= rois[ipt]) & (abs(zcoord[iz] - wave[ipt]) <= roiw[ipt])
+
+        ipt = ipt[good]
+        ixy = iy[good] * naxis1 + ix[good]
+        yield ipt, ixy, iz[good]
+# _______________________________________________________________________
+
+
 def match_det2cube_miripsf(alpha_resol, beta_resol, wave_resol,
                            naxis1, naxis2, naxis3,
                            xcenters, ycenters, zcoord,
@@ -264,20 +443,18 @@ def match_det2cube_miripsf(alpha_resol, beta_resol, wave_resol,
         indexr = np.where(radius <= rois_pixel[ipt])
         indexz = np.where(abs(zcoord - wave[ipt]) <= roiw_pixel[ipt])
 
+        # ________________________________________________________
+        # if weight is miripsf -distances determined in alpha-beta
+        # coordinate system
+        weights = FindNormalizationWeights(wave[ipt],
+                                           wave_resol,
+                                           alpha_resol,
+                                           beta_resol)
         # _______________________________________________________________
         # loop over the points in the ROI
         for iz, zz in enumerate(indexz[0]):
             istart = zz * nplane
             for ir, rr in enumerate(indexr[0]):
-                # ________________________________________________________
-                # if weight is miripsf -distances determined in alpha-beta
-                # coordinate system
-
-                weights = FindNormalizationWeights(wave[ipt],
-                                                   wave_resol,
-                                                   alpha_resol,
-                                                   beta_resol)
-
                 cube_index = istart + rr
 
                 alpha_distance = alpha_det[ipt] - spaxel_alpha[cube_index]
@@ -297,7 +474,7 @@ def match_det2cube_miripsf(alpha_resol, beta_resol, wave_resol,
                     weight_distance = np.power(np.sqrt(wdistance), weight_pixel[ipt])
                     if weight_distance < lower_limit:
                         weight_distance = lower_limit
-                        weight_distance = 1.0 / weight_distance
+                    weight_distance = 1.0 / weight_distance
                 elif weighting_type == 'emsm':
                     weight_distance = scalerad_pixel[ipt] * np.exp(1.0/wdistance)
 
@@ -307,6 +484,80 @@ def match_det2cube_miripsf(alpha_resol, beta_resol, wave_resol,
 # _______________________________________________________________________
 
 
+def match_det2cube_miripsf_indexed(alpha_resol, beta_resol, wave_resol,
+                                   naxis1, naxis2, naxis3,
+                                   xcenters, ycenters, zcoord,
+                                   spaxel_flux,
+                                   spaxel_weight,
+                                   spaxel_iflux,
+                                   spaxel_alpha, spaxel_beta, spaxel_wave,
+                                   flux,
+                                   coord1, coord2, wave, alpha_det, beta_det,
+                                   weighting_type,
+                                   rois_pixel, roiw_pixel,
+                                   weight_pixel,
+                                   softrad_pixel,
+                                   scalerad_pixel):
+    """ Map the detector pixels to the cube spaxels using miri PSF weighting
+
+    This routine gives the same results as match_det2cube_miripsf. The PSF
+    and LSF normalization only depends on the wavelength of the point cloud
+    member, so it is evaluated once for the whole point cloud. The spaxels
+    in the ROI are found with find_roi_spaxels and the alpha-beta weights of
+    all the matches of a chunk of the point cloud are evaluated at once and
+    summed into the spaxel arrays with scatter-adds.
+
+    Parameters
+    ----------
+    The parameters are the same as for match_det2cube_miripsf.
+
+    Returns
+    -------
+    spaxel_flux, spaxel_weight, and spaxel_ifux updated with the information
+    from the detector pixels that fall within the roi if the spaxel center.
+    """
+
+    nplane = naxis1 * naxis2
+    total_num = nplane * naxis3
+
+    alpha_weight, beta_weight, lambda_weight = FindNormalizationWeights(wave,
+                                                                        wave_resol,
+                                                                        alpha_resol,
+                                                                        beta_resol)
+
+    for ipt, ixy, iz in find_roi_spaxels(naxis1, naxis2,
+                                         xcenters, ycenters, zcoord,
+                                         coord1, coord2, wave,
+                                         rois_pixel, roiw_pixel):
+        cube_index = iz * nplane + ixy
+
+        alpha_distance = alpha_det[ipt] - spaxel_alpha[cube_index]
+        beta_distance = beta_det[ipt] - spaxel_beta[cube_index]
+        wave_distance = abs(wave[ipt] - spaxel_wave[cube_index])
+
+        xn = alpha_distance / alpha_weight[ipt]
+        yn = beta_distance / beta_weight[ipt]
+        wn = wave_distance / lambda_weight[ipt]
+
+        wdistance = (xn * xn + yn * yn + wn * wn)
+
+        if weighting_type == 'msm':
+            weight_distance = np.power(np.sqrt(wdistance), weight_pixel[ipt])
+            lower_limit = softrad_pixel[ipt]
+            too_small = weight_distance < lower_limit
+            weight_distance[too_small] = lower_limit[too_small]
+            weight_distance = 1.0 / weight_distance
+        elif weighting_type == 'emsm':
+            weight_distance = scalerad_pixel[ipt] * np.exp(1.0 / wdistance)
+
+        spaxel_flux += np.bincount(cube_index, weights=weight_distance * flux[ipt],
+                                   minlength=total_num)
+        spaxel_weight += np.bincount(cube_index, weights=weight_distance,
+                                     minlength=total_num)
+        spaxel_iflux += np.bincount(cube_index, minlength=total_num)
+# _______________________________________________________________________
+
+
 def FindNormalizationWeights(wavelength,
                              wave_resol,
                              alpha_resol,
@@ -320,6 +571,8 @@ def FindNormalizationWeights(wavelength,
 
     Parameters
     ----------
+    wavelength : float or numpy.ndarray
+      wavelength of the point cloud member(s)
     wave_resol : numpy.ndarray
       wavelength resolution array
     alpha_resol : numpy.ndarray
@@ -329,11 +582,9 @@ def FindNormalizationWeights(wavelength,
 
     Returns
     -------
-    normalized weighting for 3 dimension
+    normalized weighting for 3 dimension, each with the shape of wavelength
     """
-    alpha_weight = 1.0
-    beta_weight = 1.0
-    lambda_weight = 1.0
+    wavelength = np.asarray(wavelength)
 
     # alpha psf weighting
     alpha_wave_cutoff = alpha_resol[0]
@@ -341,10 +592,9 @@ def FindNormalizationWeights(wavelength,
     alpha_b_short = alpha_resol[2]
     alpha_a_long = alpha_resol[3]
     alpha_b_long = alpha_resol[4]
-    if wavelength < alpha_wave_cutoff:
-        alpha_weight = alpha_a_short + alpha_b_short * wavelength
-    else:
-        alpha_weight = alpha_a_long + alpha_b_long * wavelength
+    alpha_weight = np.where(wavelength < alpha_wave_cutoff,
+                            alpha_a_short + alpha_b_short * wavelength,
+                            alpha_a_long + alpha_b_long * wavelength)
 
     # beta psf weighting
     beta_wave_cutoff = beta_resol[0]
@@ -352,10 +602,9 @@ def FindNormalizationWeights(wavelength,
     beta_b_short = beta_resol[2]
     beta_a_long = beta_resol[3]
     beta_b_long = beta_resol[4]
-    if wavelength < beta_wave_cutoff:
-        beta_weight = beta_a_short + beta_b_short * wavelength
-    else:
-        beta_weight = beta_a_long + beta_b_long * wavelength
+    beta_weight = np.where(wavelength < beta_wave_cutoff,
+                           beta_a_short + beta_b_short * wavelength,
+                           beta_a_long + beta_b_long * wavelength)
 
     # wavelength weighting
     wavecenter = wave_resol[0]
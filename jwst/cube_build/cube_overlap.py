@@ -2,7 +2,6 @@
 the interoplation method = area
 """
 import numpy as np
-import math
 from ..datamodels import dqflags
 
 
@@ -366,12 +365,138 @@ def sh_find_overlap(xcenter, ycenter, xlength, ylength, xp_corner, yp_corner):
 # _____________________________________________________________________________
 
 
+def sh_find_overlap_array(xcenter, ycenter, xlength, ylength, xp_corner, yp_corner):
+    """ Find the overlap between many pixels and spaxels at once
+
+    Array version of sh_find_overlap. Each quadrilateral defined by a row of
+    xp_corner, yp_corner is clipped with the Sutherland-Hodgman algorithm by
+    the spaxel centered on the matching xcenter, ycenter. The four edges of
+    the spaxels are applied in turn to all the polygons together. The clipped
+    polygons are held in padded arrays with the number of valid vertices of
+    each polygon kept in nvertices.
+
+    Parameters
+    ---------
+    xcenter : numpy.ndarray
+      center of the spaxels in x dimension (along slice- alpha)
+    ycenter : numpy.ndarray
+      center of the spaxels in y dimension (lambda)
+    xlength : float
+      width of spaxel in x dimesion (along slice- alpha)
+    ylength : float
+      width of spaxel in y dimesion (lambda)
+    xp_corner : numpy.ndarray
+      x corner values of the pixels, shape (n, 4) or (4,)
+    yp_corner : numpy.ndarray
+      y corner values of the pixels, shape (n, 4) or (4,)
+
+    Returns
+    -------
+    area_overlap : numpy.ndarray
+      overlap area of each pixel and spaxel
+    """
+    xcenter, ycenter = np.broadcast_arrays(np.asarray(xcenter, dtype=float),
+                                           np.asarray(ycenter, dtype=float))
+    xcenter = xcenter.ravel()
+    ycenter = ycenter.ravel()
+    n = xcenter.size
+    xpixel = np.array(np.broadcast_to(xp_corner, (n, 4)), dtype=float)
+    ypixel = np.array(np.broadcast_to(yp_corner, (n, 4)), dtype=float)
+    nvertices = np.full(n, 4)
+
+    # 0:left, 1: right, 2: bottom, 3: top
+    limits = (xcenter - 0.5 * xlength, xcenter + 0.5 * xlength,
+              ycenter - 0.5 * ylength, ycenter + 0.5 * ylength)
+
+    for edge in range(4):
+        if xpixel.shape[1] == 0:
+            break
+        limit = limits[edge][:, np.newaxis]
+        nmax = xpixel.shape[1]
+        index = np.arange(nmax)
+        valid = index < nvertices[:, np.newaxis]
+        inext = np.where(index + 1 < nvertices[:, np.newaxis], index + 1, 0)
+
+        x1 = xpixel
+        y1 = ypixel
+        x2 = np.take_along_axis(xpixel, inext, axis=1)
+        y2 = np.take_along_axis(ypixel, inext, axis=1)
+
+        if edge == 0:
+            inside1 = x1 > limit
+            inside2 = x2 > limit
+        elif edge == 1:
+            inside1 = x1 < limit
+            inside2 = x2 < limit
+        elif edge == 2:
+            inside1 = y1 > limit
+            inside2 = y2 > limit
+        else:
+            inside1 = y1 < limit
+            inside2 = y2 < limit
+
+        # intersection of the polygon side with the spaxel edge
+        # (same arithmetic as solve_intersection)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slope = np.where(x2 != x1, (y2 - y1) / (x2 - x1), 0.0)
+            if edge < 2:
+                xcross = np.broadcast_to(limit, x1.shape)
+                ycross = y1 + slope * (xcross - x1)
+            else:
+                ycross = np.broadcast_to(limit, y1.shape)
+                xcross = np.where(x2 != x1, x1 + (1.0 / slope) * (ycross - y1), x1)
+
+        # side entering the spaxel: intersection and end point
+        # side inside the spaxel: end point
+        # side leaving the spaxel: intersection
+        entering = valid & ~inside1 & inside2
+        first_x = np.where(inside2 & inside1, x2, xcross)
+        first_y = np.where(inside2 & inside1, y2, ycross)
+        first_valid = valid & (inside1 | inside2)
+
+        xnew = np.stack((first_x, x2), axis=2).reshape(n, 2 * nmax)
+        ynew = np.stack((first_y, y2), axis=2).reshape(n, 2 * nmax)
+        keep = np.stack((first_valid, entering), axis=2).reshape(n, 2 * nmax)
+
+        # move the valid vertices to the front of each row
+        order = np.argsort(~keep, axis=1, kind='stable')
+        nvertices = keep.sum(axis=1)
+        nmax = nvertices.max() if n > 0 else 0
+        if nmax > 8:
+            raise Error2DPolygon(" Failure in finding the clipped polygon, nvertices2 > 9 ")
+        order = order[:, 0:nmax]
+        xpixel = np.take_along_axis(xnew, order, axis=1)
+        ypixel = np.take_along_axis(ynew, order, axis=1)
+
+    # area of the clipped polygons
+    area_clipped = np.zeros(n)
+    if xpixel.shape[1] == 0:
+        return area_clipped
+    index = np.arange(xpixel.shape[1])
+    valid = index < nvertices[:, np.newaxis]
+    inext = np.where(index + 1 < nvertices[:, np.newaxis], index + 1, 0)
+    has_area = nvertices > 0
+    xmin = np.where(valid, xpixel, np.inf).min(axis=1)
+    ymin = np.where(valid, ypixel, np.inf).min(axis=1)
+    xmin = np.where(has_area, xmin, 0.0)[:, np.newaxis]
+    ymin = np.where(has_area, ymin, 0.0)[:, np.newaxis]
+    xrel = np.where(valid, xpixel - xmin, 0.0)
+    yrel = np.where(valid, ypixel - ymin, 0.0)
+    xnext = np.take_along_axis(xrel, inext, axis=1)
+    ynext = np.take_along_axis(yrel, inext, axis=1)
+    cross = np.where(valid, xrel * ynext - xnext * yrel, 0.0)
+    area_clipped[has_area] = np.abs(0.5 * cross[has_area].sum(axis=1))
+    return area_clipped
+# _____________________________________________________________________________
+
+
 def match_det2cube(x, y, sliceno, start_slice, input_model, transform,
                    spaxel_flux,
                    spaxel_weight,
                    spaxel_iflux,
                    xcoord, zcoord,
-                   crval1, crval3, cdelt1, cdelt3, naxis1, naxis2):
+                   crval1, crval3, cdelt1, cdelt3, naxis1, naxis2,
+                   max_candidates=1000000):
     """ Match detector pixels to output plane in alpha-beta coordinate system
 
     This routine assumes a 1-1 mapping in beta - slice no.
@@ -382,6 +507,10 @@ def match_det2cube(x, y, sliceno, start_slice, input_model, transform,
     which it overlaps with in the cube. For each spaxel record the detector
     pixels that overlap with it - store flux,  % overlap, beta_distance.
 
+    The overlaps of all the pixels of the slice with the spaxels they may
+    overlap are found at once with sh_find_overlap_array, in chunks of at
+    most max_candidates pixel-spaxel pairs.
+
     Parameters
     ----------
     x : numpy.ndarray
@@ -396,6 +525,8 @@ def match_det2cube(x, y, sliceno, start_slice, input_model, transform,
       wcs transform to transform x,y to alpha,beta, lambda
     spaxel : list
       list of spaxels holding information on each cube pixel.
+    max_candidates : int
+      maximum number of pixel-spaxel pairs clipped at once
 
     Returns
     -------
@@ -403,6 +534,8 @@ def match_det2cube(x, y, sliceno, start_slice, input_model, transform,
     """
     nxc = len(xcoord)
     nzc = len(zcoord)
+    nplane = naxis1 * naxis2
+    total_num = spaxel_flux.size
 
     sliceno_use = sliceno - start_slice + 1
     # 1-1 mapping in beta
@@ -429,81 +562,70 @@ def match_det2cube(x, y, sliceno, start_slice, input_model, transform,
     xx_left = x
     xx_right = x + 1
 
-    alpha, beta, lam = transform(x, y)
     alpha1, beta1, lam1 = transform(xx_left, yy_bot)
     alpha2, beta2, lam2 = transform(xx_right, yy_bot)
     alpha3, beta3, lam3 = transform(xx_right, yy_top)
     alpha4, beta4, lam4 = transform(xx_left, yy_top)
 
-    nn = len(x)
-    # Loop over all pixels in slice
-    for ipixel in range(0, nn - 1):
-
-        # detector pixel -> 4 corners
-        # In alpha,wave space
-        # in beta space: beta center + width
-
-        alpha_corner = []
-        wave_corner = []
-
-        alpha_corner.append(alpha1[ipixel])
-        alpha_corner.append(alpha2[ipixel])
-        alpha_corner.append(alpha3[ipixel])
-        alpha_corner.append(alpha4[ipixel])
-
-        wave_corner.append(lam1[ipixel])
-        wave_corner.append(lam2[ipixel])
-        wave_corner.append(lam3[ipixel])
-        wave_corner.append(lam4[ipixel])
-
-# ________________________________________________________________________________
-# Now it does not matter the WCS method used
-        alpha_min = min(alpha_corner)
-        alpha_max = max(alpha_corner)
-        wave_min = min(wave_corner)
-        wave_max = max(wave_corner)
-
-        Area = find_area_quad(alpha_min, wave_min, alpha_corner, wave_corner)
-
-        # estimate the where the pixel overlaps in the cube
-        # find the min and max values in the cube xcoord,ycoord and zcoord
-
-        MinA = (alpha_min - crval1) / cdelt1
-        MaxA = (alpha_max - crval1) / cdelt1
-        ix1 = max(0, int(math.trunc(MinA)))
-        ix2 = int(math.ceil(MaxA))
-        if ix2 >= nxc:
-            ix2 = nxc - 1
-
-        MinW = (wave_min - crval3) / cdelt3
-        MaxW = (wave_max - crval3) / cdelt3
-        iz1 = int(math.trunc(MinW))
-        iz2 = int(math.ceil(MaxW))
-        if iz2 >= nzc:
-            iz2 = nzc - 1
-
-        # loop over possible overlapping cube pixels
-        # noverlap = 0
-        nplane = naxis1 * naxis2
-
-        for zz in range(iz1, iz2 + 1):
-            zcenter = zcoord[zz]
-            istart = zz * nplane
-
-            for xx in range(ix1, ix2 + 1):
-                cube_index = istart + yy * naxis1 + xx  # yy = slice # -1
-                xcenter = xcoord[xx]
-                area_overlap = sh_find_overlap(xcenter, zcenter,
+    # the last pixel of the slice has never been mapped
+    nn = len(x) - 1
+    if nn <= 0:
+        return
+    # detector pixel -> 4 corners in alpha,wave space
+    alpha_corner = np.stack((alpha1, alpha2, alpha3, alpha4), axis=1)[0:nn]
+    wave_corner = np.stack((lam1, lam2, lam3, lam4), axis=1)[0:nn]
+    pixel_flux = pixel_flux[0:nn]
+
+    alpha_min = alpha_corner.min(axis=1)
+    alpha_max = alpha_corner.max(axis=1)
+    wave_min = wave_corner.min(axis=1)
+    wave_max = wave_corner.max(axis=1)
+
+    area = find_area_quad(alpha_min, wave_min, alpha_corner.T, wave_corner.T)
+
+    # estimate the where the pixel overlaps in the cube
+    # find the min and max values in the cube xcoord,ycoord and zcoord
+    ix1 = np.maximum(0, np.trunc((alpha_min - crval1) / cdelt1)).astype(int)
+    ix2 = np.minimum(np.ceil((alpha_max - crval1) / cdelt1), nxc - 1).astype(int)
+    iz1 = np.maximum(0, np.trunc((wave_min - crval3) / cdelt3)).astype(int)
+    iz2 = np.minimum(np.ceil((wave_max - crval3) / cdelt3), nzc - 1).astype(int)
+
+    nx = np.maximum(ix2 - ix1 + 1, 0)
+    nz = np.maximum(iz2 - iz1 + 1, 0)
+    ncandidates = nx * nz
+    cumulative = np.cumsum(ncandidates)
+
+    istart = 0
+    while istart < nn:
+        offset = cumulative[istart] - ncandidates[istart]
+        iend = np.searchsorted(cumulative, offset + max_candidates, side='right')
+        iend = min(max(iend, istart + 1), nn)
+        chunk = np.arange(istart, iend)
+        istart = iend
+
+        nchunk = ncandidates[chunk]
+        if nchunk.sum() == 0:
+            continue
+        ipixel = np.repeat(chunk, nchunk)
+        first = np.cumsum(nchunk) - nchunk
+        local = np.arange(ipixel.size) - np.repeat(first, nchunk)
+        zz = iz1[ipixel] + local // nx[ipixel]
+        xx = ix1[ipixel] + local % nx[ipixel]
+
+        area_overlap = sh_find_overlap_array(xcoord[xx], zcoord[zz],
                                              cdelt1, cdelt3,
-                                             alpha_corner, wave_corner)
-
-                if area_overlap > 0.0:
-                    AreaRatio = area_overlap / Area
-                    spaxel_flux[cube_index] = spaxel_flux[cube_index] + \
-                        (AreaRatio * pixel_flux[ipixel])
-                    spaxel_weight[cube_index] = spaxel_weight[cube_index] + \
-                        AreaRatio
-                    spaxel_iflux[cube_index] = spaxel_iflux[cube_index] + 1
+                                             alpha_corner[ipixel],
+                                             wave_corner[ipixel])
+        overlap = area_overlap > 0.0
+        ipixel = ipixel[overlap]
+        area_ratio = area_overlap[overlap] / area[ipixel]
+        cube_index = zz[overlap] * nplane + yy * naxis1 + xx[overlap]  # yy = slice # -1
+
+        spaxel_flux += np.bincount(cube_index, weights=area_ratio * pixel_flux[ipixel],
+                                   minlength=total_num)
+        spaxel_weight += np.bincount(cube_index, weights=area_ratio,
+                                     minlength=total_num)
+        spaxel_iflux += np.bincount(cube_index, minlength=total_num)
 # ________________________________________________________________________________
 
 
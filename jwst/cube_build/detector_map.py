@@ -0,0 +1,330 @@
+""" Cache of the detector to sky coordinate maps used in cube building
+"""
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import zipfile
+from collections import OrderedDict
+
+import asdf
+import numpy as np
+from gwcs import wcstools
+
+from jwst.transforms.models import _toindex
+from ..assign_wcs import nirspec
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+
+class DetectorMapCache():
+
+    def __init__(self, max_bytes=0):
+        """ Least recently used cache of detector coordinate maps
+
+        The maps are stored by a key built from the WCS of the exposure
+        (see detector_map_key), so the same exposure mapped by several cubes
+        (output_type = band or channel), by the single cubes built for
+        outlier detection, or by a later run of cube_build in the same
+        process only evaluates its WCS once.
+
+        Parameters
+        ----------
+        max_bytes : int
+           maximum size of the arrays held in the cache. The least recently
+           used maps are dropped when the cache grows beyond this size, and
+           maps larger than it are not stored; 0 turns the cache off.
+        """
+        self.max_bytes = max_bytes
+        self.maps = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """ Return the map stored under key, or None """
+        detmap = self.maps.get(key)
+        if detmap is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.maps.move_to_end(key)
+        return detmap
+
+    def put(self, key, detmap):
+        """ Store a map under key, dropping the oldest maps if needed
+
+        A map larger than max_bytes is not stored.
+        """
+        if key in self.maps:
+            self.nbytes -= _map_nbytes(self.maps.pop(key))
+        nbytes = _map_nbytes(detmap)
+        if nbytes > self.max_bytes:
+            return
+        self.maps[key] = detmap
+        self.nbytes += nbytes
+        self._shrink()
+
+    def resize(self, max_bytes):
+        """ Set the maximum size, dropping the oldest maps if needed """
+        self.max_bytes = max_bytes
+        self._shrink()
+
+    def _shrink(self):
+        while self.nbytes > self.max_bytes:
+            oldkey, oldmap = self.maps.popitem(last=False)
+            self.nbytes -= _map_nbytes(oldmap)
+
+    def clear(self):
+        """ Remove all the maps from the cache """
+        self.maps.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+
+# cache shared by all the cube_build calls in this process, resized by the
+# coord_cache_size parameter of the step; it is off by default
+detector_map_cache = DetectorMapCache()
+# ********************************************************************************
+
+
+def _map_nbytes(detmap):
+    return sum(value.nbytes for value in detmap.values())
+# ********************************************************************************
+
+
+def detector_map_key(input_model, this_par1, alpha_beta):
+    """ Key identifying the detector map of an exposure
+
+    The key is a hash of the serialized WCS of the exposure together with
+    the data shape, the channel (MIRI) or grating (NIRSpec) mapped and
+    whether the alpha-beta coordinates are included. Two models with the
+    same WCS share their detector map, and any change to the WCS leads to
+    a new map.
+
+    Parameters
+    ----------
+    input_model : IFUImageModel
+       input data model
+    this_par1 : str
+       for MIRI this is the channel # for NIRSPEC this is the grating name
+    alpha_beta : boolean
+       if TRUE the map holds the alpha, beta coordinates of the pixels
+
+    Returns
+    -------
+    key : str
+    """
+    buff = io.BytesIO()
+    asdf.AsdfFile({'wcs': input_model.meta.wcs}).write_to(buff)
+    digest = hashlib.sha1(buff.getvalue())
+    digest.update(repr((input_model.data.shape, this_par1, alpha_beta)).encode())
+    return digest.hexdigest()
+# ********************************************************************************
+
+
+def get_detector_map(input_model, this_par1, instrument_info,
+                     alpha_beta=False, cache_dir=None):
+    """ Return the sky coordinates of the detector pixels of an exposure
+
+    The map is looked up in the detector map cache, if that is turned on.
+    If it is not found it is read from the sidecar file in cache_dir, if
+    that exists and can be read, and otherwise it is computed from the WCS
+    of the exposure (and written to cache_dir if cache_dir is set).
+
+    Parameters
+    ----------
+    input_model : IFUImageModel
+       input data model
+    this_par1 : str
+       for MIRI this is the channel # for NIRSPEC this is the grating name
+    instrument_info : InstrumentInfo
+       instrument default parameters
+    alpha_beta : boolean
+       if TRUE also return the alpha, beta coordinates of the pixels (MIRI)
+    cache_dir : str
+       directory holding the detector map sidecar files. If None the maps
+       are only kept in memory.
+
+    Returns
+    -------
+    detmap : dict
+       x, y, ra, dec, wave and slice_no of every valid detector pixel, and
+       alpha and beta if requested. The arrays should not be modified.
+    """
+    # The key serializes the WCS, so it is only built if it is used
+    key = None
+    if detector_map_cache.max_bytes > 0 or cache_dir is not None:
+        key = detector_map_key(input_model, this_par1, alpha_beta)
+    if detector_map_cache.max_bytes > 0:
+        detmap = detector_map_cache.get(key)
+        if detmap is not None:
+            log.debug('Using cached detector map %s', key)
+            return detmap
+
+    sidecar = None
+    if cache_dir is not None:
+        filename = input_model.meta.filename or 'ifu'
+        root = os.path.splitext(os.path.basename(filename))[0]
+        sidecar = os.path.join(cache_dir, '{}_{}_detmap.npz'.format(root, key[0:16]))
+
+    detmap = None
+    if sidecar is not None and os.path.isfile(sidecar):
+        detmap = _read_sidecar(sidecar)
+    if detmap is None:
+        if input_model.meta.instrument.name.upper() == 'MIRI':
+            detmap = _miri_detector_map(input_model, this_par1, instrument_info,
+                                        alpha_beta)
+        else:
+            detmap = _nirspec_detector_map(input_model)
+        if sidecar is not None:
+            log.info('Writing detector map to %s', sidecar)
+            _write_sidecar(sidecar, detmap)
+
+    for value in detmap.values():
+        value.flags.writeable = False
+    if key is not None:
+        detector_map_cache.put(key, detmap)
+    return detmap
+# ********************************************************************************
+
+
+def _read_sidecar(sidecar):
+    """ Read a detector map sidecar file, or return None if it is unreadable """
+    log.info('Reading detector map from %s', sidecar)
+    try:
+        with np.load(sidecar) as data:
+            return {name: data[name] for name in data.files}
+    except (OSError, ValueError, EOFError, zipfile.BadZipFile) as err:
+        log.warning('Cannot read detector map from %s (%s); computing it',
+                    sidecar, err)
+        return None
+# ********************************************************************************
+
+
+def _write_sidecar(sidecar, detmap):
+    """ Write a detector map sidecar file
+
+    The map is written to a temporary file in the directory of the sidecar
+    file, which is then renamed, so that cube_build runs sharing the
+    directory never read a partly written file.
+    """
+    fd, temp_name = tempfile.mkstemp(suffix='.npz',
+                                     dir=os.path.dirname(sidecar) or None,
+                                     prefix=os.path.basename(sidecar) + '.')
+    try:
+        with os.fdopen(fd, 'wb') as temp_file:
+            np.savez(temp_file, **detmap)
+        os.replace(temp_name, sidecar)
+    except BaseException:
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
+        raise
+# ********************************************************************************
+
+
+def _miri_detector_map(input_model, this_par1, instrument_info, alpha_beta):
+    """ Map the pixels of a MIRI channel to ra, dec and wavelength """
+
+    # find the slice number of each pixel and fill in slice_det
+    ysize, xsize = input_model.data.shape
+    slice_det = np.zeros((ysize, xsize), dtype=int)
+    det2ab_transform = input_model.meta.wcs.get_transform('detector',
+                                                          'alpha_beta')
+    start_region = instrument_info.GetStartSlice(this_par1)
+    end_region = instrument_info.GetEndSlice(this_par1)
+    regions = list(range(start_region, end_region + 1))
+    for i in regions:
+        ys, xs = (det2ab_transform.label_mapper.mapper == i).nonzero()
+        xind = _toindex(xs)
+        yind = _toindex(ys)
+        xind = np.ndarray.flatten(xind)
+        yind = np.ndarray.flatten(yind)
+        slice_det[yind, xind] = i
+
+    # define the x,y detector values of channel to be mapped to desired coordinate system
+    xstart, xend = instrument_info.GetMIRISliceEndPts(this_par1)
+    y, x = np.mgrid[:ysize, xstart:xend]
+    y = np.reshape(y, y.size)
+    x = np.reshape(x, x.size)
+
+    ra, dec, wave = input_model.meta.wcs(x, y)
+    valid1 = ~np.isnan(ra)
+    ra = ra[valid1]
+    dec = dec[valid1]
+    wave = wave[valid1]
+    x = x[valid1]
+    y = y[valid1]
+
+    xind = _toindex(x)
+    yind = _toindex(y)
+    xind = np.ndarray.flatten(xind)
+    yind = np.ndarray.flatten(yind)
+    slice_no = slice_det[yind, xind]
+
+    detmap = {'x': x, 'y': y, 'ra': ra, 'dec': dec, 'wave': wave,
+              'slice_no': slice_no}
+    if alpha_beta:
+        alpha, beta, lam = det2ab_transform(x, y)
+        detmap['alpha'] = alpha
+        detmap['beta'] = beta
+    return detmap
+# ********************************************************************************
+
+
+def _nirspec_detector_map(input_model):
+    """ Map the pixels of the 30 NIRSpec slices to ra, dec and wavelength """
+
+    # initialize the ra,dec, and wavelength arrays
+    # we will loop over slice_nos and fill in values
+    # the flag_det will be set when a slice_no pixel is filled in
+    #   at the end we will use this flag to pull out valid data
+
+    ysize, xsize = input_model.data.shape
+    ra_det = np.zeros((ysize, xsize))
+    dec_det = np.zeros((ysize, xsize))
+    lam_det = np.zeros((ysize, xsize))
+    flag_det = np.zeros((ysize, xsize))
+    slice_det = np.zeros((ysize, xsize), dtype=int)
+    # for NIRSPEC each file has 30 slices
+    # wcs information access seperately for each slice
+    nslices = 30
+    log.info("Mapping each NIRSpec slice to sky; this takes a while for NIRSpec data")
+    for ii in range(nslices):
+        slice_wcs = nirspec.nrs_wcs_set_input(input_model, ii)
+        x, y = wcstools.grid_from_bounding_box(slice_wcs.bounding_box)
+        ra, dec, lam = slice_wcs(x, y)
+
+        # the slices are curved on detector so a rectangular region
+        # returns NaNs
+        valid = ~np.isnan(lam)
+        ra = ra[valid]
+        dec = dec[valid]
+        lam = lam[valid]
+        x = x[valid]
+        y = y[valid]
+
+        xind = _toindex(x)
+        yind = _toindex(y)
+        xind = np.ndarray.flatten(xind)
+        yind = np.ndarray.flatten(yind)
+        ra = np.ndarray.flatten(ra)
+        dec = np.ndarray.flatten(dec)
+        lam = np.ndarray.flatten(lam)
+        ra_det[yind, xind] = ra
+        dec_det[yind, xind] = dec
+        lam_det[yind, xind] = lam
+        flag_det[yind, xind] = 1
+        slice_det[yind, xind] = ii + 1
+
+    # after looping over slices  - pull out valid values
+    valid_data = np.where(flag_det == 1)
+    y, x = valid_data
+    return {'x': x, 'y': y,
+            'ra': ra_det[valid_data],
+            'dec': dec_det[valid_data],
+            'wave': lam_det[valid_data],
+            'slice_no': slice_det[valid_data]}
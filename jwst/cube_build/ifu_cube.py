@@ -5,23 +5,27 @@ import time
 import numpy as np
 import logging
 import math
+import multiprocessing
 from ..model_blender import blendmeta
 from .. import datamodels
 from ..assign_wcs import pointing
-from jwst.transforms.models import _toindex
 from astropy.stats import circmean
 from astropy import units as u
-from gwcs import wcstools
-from ..assign_wcs import nirspec
 from ..datamodels import dqflags
+from ..lib.pipe_utils import number_of_processes
 from . import cube_build_wcs_util
 from . import cube_overlap
 from . import cube_cloud
 from . import coord
+from . import detector_map
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
+# IFUCubeData and spaxel coordinates shared with the forked processes
+# created by IFUCubeData.map_files_parallel
+_parallel_args = None
+
 
 class IFUCubeData():
 
@@ -68,6 +72,9 @@ class IFUCubeData():
         self.wavemax = pars_cube.get('wavemax')
         self.weighting = pars_cube.get('weighting')
         self.weight_power = pars_cube.get('weight_power')
+        self.cloud_method = pars_cube.get('cloud_method')
+        self.maximum_cores = pars_cube.get('maximum_cores')
+        self.coord_cache_dir = pars_cube.get('coord_cache_dir')
         self.debug = pars_cube.get('debug')
         self.xdebug = pars_cube.get('xdebug')
         self.ydebug = pars_cube.get('ydebug')
@@ -508,21 +515,14 @@ class IFUCubeData():
 # ra,dec, wave is independent of input_model
 # v2,v3, alpha,beta depends on the input_model
         if self.weighting == 'miripsf':
-            spaxel_ra = np.zeros(total_num)
-            spaxel_dec = np.zeros(total_num)
-            spaxel_wave = np.zeros(total_num)
-
-            nxy = self.xcenters.size
             nz = self.zcoord.size
-            for iz in range(nz):
-                istart = iz * nxy
-                for ixy in range(nxy):
-                    ii = istart + ixy
-                    spaxel_ra[ii], spaxel_dec[ii] = coord.std2radec(self.crval1,
-                                                                    self.crval2,
-                                                                    self.xcenters[ixy],
-                                                                    self.ycenters[ixy])
-                    spaxel_wave[ii] = self.zcoord[iz]
+            plane_ra, plane_dec = coord.std2radec(self.crval1,
+                                                  self.crval2,
+                                                  self.xcenters,
+                                                  self.ycenters)
+            spaxel_ra = np.tile(plane_ra, nz)
+            spaxel_dec = np.tile(plane_dec, nz)
+            spaxel_wave = np.repeat(self.zcoord, self.xcenters.size)
 # ______________________________________________________________________________
         subtract_background = True
 
@@ -532,6 +532,7 @@ class IFUCubeData():
         # and map the detector pixels to the cube spaxel
 
         number_bands = len(self.list_par1)
+        file_list = []
 
         for i in range(number_bands):
             this_par1 = self.list_par1[i]
@@ -542,117 +543,18 @@ class IFUCubeData():
             for k in range(nfiles):
                 ifile = self.master_table.FileMap[self.instrument][this_par1][this_par2][k]
                 self.this_cube_filenames.append(ifile)
-                log.debug("Working on Band defined by: %s %s ", this_par1, this_par2)
-# --------------------------------------------------------------------------------
-                if self.interpolation == 'pointcloud':
-                    t0 = time.time()
-                    pixelresult = self.map_detector_to_outputframe(this_par1,
-                                                                   subtract_background,
-                                                                   ifile)
-
-                    coord1, coord2, wave, flux, slice_no, rois_pixel, roiw_pixel, weight_pixel,\
-                        softrad_pixel, scalerad_pixel, alpha_det, beta_det = pixelresult
-                    t1 = time.time()
-                    log.info("Time to transform pixels to output frame = %.1f s" % (t1 - t0,))
-
-                    # If setting the DQ plane of the IFU
-                    if self.skip_dqflagging:
-                        log.info("Skipping setting DQ flagging")
-                    else:
-                        t0 = time.time()
-                        roiw_ave = np.mean(roiw_pixel)
-                        self.map_fov_to_dqplane(this_par1, coord1, coord2, wave, roiw_ave, slice_no)
-                        t1 = time.time()
-                        log.info("Time to set initial dq values = %.1f s" % (t1 - t0,))
-                    if self.weighting == 'msm' or self.weighting == 'emsm':
-                        t0 = time.time()
-                        cube_cloud.match_det2cube_msm(self.naxis1, self.naxis2, self.naxis3,
-                                                      self.cdelt1, self.cdelt2,
-                                                      self.cdelt3_normal,
-                                                      self.xcenters, self.ycenters, self.zcoord,
-                                                      self.spaxel_flux,
-                                                      self.spaxel_weight,
-                                                      self.spaxel_iflux,
-                                                      flux,
-                                                      coord1, coord2, wave,
-                                                      self.weighting,
-                                                      rois_pixel, roiw_pixel,
-                                                      weight_pixel,
-                                                      softrad_pixel,
-                                                      scalerad_pixel)
-
-                        t1 = time.time()
-                        log.info("Time to match file to ifucube = %.1f s" % (t1 - t0,))
-# ________________________________________________________________________________
-                    elif self.weighting == 'miripsf':
-                        with datamodels.IFUImageModel(ifile) as input_model:
-                            wave_resol = self.instrument_info.Get_RP_ave_Wave(this_par1,
-                                                                              this_par2)
-
-                            alpha_resol = self.instrument_info.Get_psf_alpha_parameters()
-                            beta_resol = self.instrument_info.Get_psf_beta_parameters()
-
-                            worldtov23 = input_model.meta.wcs.get_transform("world", "v2v3")
-                            v2ab_transform = input_model.meta.wcs.get_transform('v2v3',
-                                                                                'alpha_beta')
-
-                            spaxel_v2, spaxel_v3, zl = worldtov23(spaxel_ra,
-                                                                  spaxel_dec,
-                                                                  spaxel_wave)
-
-                            spaxel_alpha, spaxel_beta, spaxel_wave = v2ab_transform(spaxel_v2,
-                                                                                    spaxel_v3,
-                                                                                    zl)
-                            cube_cloud.match_det2cube_miripsf(alpha_resol,
-                                                              beta_resol,
-                                                              wave_resol,
-                                                              self.naxis1, self.naxis2, self.naxis3,
-                                                              self.xcenters, self.ycenters, self.zcoord,
-                                                              self.spaxel_flux,
-                                                              self.spaxel_weight,
-                                                              self.spaxel_iflux,
-                                                              spaxel_alpha, spaxel_beta, spaxel_wave,
-                                                              flux,
-                                                              coord1, coord2, wave,
-                                                              alpha_det, beta_det,
-                                                              self.weighting,
-                                                              rois_pixel, roiw_pixel,
-                                                              weight_pixel,
-                                                              softrad_pixel,
-                                                              scalerad_pixel)
-# --------------------------------------------------------------------------------
-# 2D area method - only works for single files and coord_system = 'alpha-beta'
-# --------------------------------------------------------------------------------
-                elif self.interpolation == 'area':
-                    with datamodels.IFUImageModel(ifile) as input_model:
-                        det2ab_transform = input_model.meta.wcs.get_transform('detector',
-                                                                              'alpha_beta')
-                        start_region = self.instrument_info.GetStartSlice(this_par1)
-                        end_region = self.instrument_info.GetEndSlice(this_par1)
-                        regions = list(range(start_region, end_region + 1))
-                        t0 = time.time()
-                        for i in regions:
-                            log.info('Working on Slice # %d', i)
-                            y, x = (det2ab_transform.label_mapper.mapper == i).nonzero()
+                file_list.append((this_par1, this_par2, k))
 
-# getting pixel corner - ytop = y + 1 (routine fails for y = 1024)
-                            index = np.where(y < 1023)
-                            y = y[index]
-                            x = x[index]
-                            cube_overlap.match_det2cube(x, y, i,
-                                                        start_region,
-                                                        input_model,
-                                                        det2ab_transform,
-                                                        self.spaxel_flux,
-                                                        self.spaxel_weight,
-                                                        self.spaxel_iflux,
-                                                        self.xcoord, self.zcoord,
-                                                        self.crval1, self.crval3,
-                                                        self.cdelt1, self.cdelt3,
-                                                        self.naxis1, self.naxis2)
-                        t1 = time.time()
-
-                        log.info("Time to Map All slices on Detector to Cube = %.1f s" % (t1 - t0,))
+        num_processes = min(number_of_processes(self.maximum_cores), len(file_list))
+        if num_processes > 1 and self.interpolation == 'pointcloud':
+            self.map_files_parallel(file_list, num_processes, subtract_background,
+                                    spaxel_ra, spaxel_dec, spaxel_wave)
+        else:
+            for this_par1, this_par2, k in file_list:
+                ifile = self.master_table.FileMap[self.instrument][this_par1][this_par2][k]
+                self.map_file_to_cube(this_par1, this_par2, ifile,
+                                      subtract_background,
+                                      spaxel_ra, spaxel_dec, spaxel_wave)
 # _______________________________________________________________________
 # Mapped all data to cube or Point Cloud
 # now determine Cube Spaxel flux
@@ -671,6 +573,191 @@ class IFUCubeData():
         return ifucube_model
 # ********************************************************************************
 
+    def map_file_to_cube(self, this_par1, this_par2, ifile,
+                         subtract_background,
+                         spaxel_ra, spaxel_dec, spaxel_wave):
+        """ Map the detector pixels of one file to the IFU cube
+
+        The detector pixels of ifile are mapped to the output frame and the
+        weighted fluxes are added to self.spaxel_flux, self.spaxel_weight and
+        self.spaxel_iflux. The initial DQ flagging is added to self.spaxel_dq.
+
+        Parameters
+        ----------
+        this_par1 : str
+           for MIRI this is the channel # for NIRSPEC this is the grating name
+        this_par2 : str
+           for MIRI this is the sub-channel for NIRSPEC this is the filter name
+        ifile : datamodel
+           input data model
+        subtract_background : boolean
+           if TRUE then subtract the background found in the mrs_imatch step
+        spaxel_ra : numpy.ndarray
+           ra of the spaxel centers, only used for miripsf weighting
+        spaxel_dec : numpy.ndarray
+           dec of the spaxel centers, only used for miripsf weighting
+        spaxel_wave : numpy.ndarray
+           wavelength of the spaxel centers, only used for miripsf weighting
+        """
+        log.debug("Working on Band defined by: %s %s ", this_par1, this_par2)
+# --------------------------------------------------------------------------------
+        if self.interpolation == 'pointcloud':
+            t0 = time.time()
+            pixelresult = self.map_detector_to_outputframe(this_par1,
+                                                           subtract_background,
+                                                           ifile)
+
+            coord1, coord2, wave, flux, slice_no, rois_pixel, roiw_pixel, weight_pixel,\
+                softrad_pixel, scalerad_pixel, alpha_det, beta_det = pixelresult
+            t1 = time.time()
+            log.info("Time to transform pixels to output frame = %.1f s" % (t1 - t0,))
+
+            # If setting the DQ plane of the IFU
+            if self.skip_dqflagging:
+                log.info("Skipping setting DQ flagging")
+            else:
+                t0 = time.time()
+                roiw_ave = np.mean(roiw_pixel)
+                self.map_fov_to_dqplane(this_par1, coord1, coord2, wave, roiw_ave, slice_no)
+                t1 = time.time()
+                log.info("Time to set initial dq values = %.1f s" % (t1 - t0,))
+            if self.weighting == 'msm' or self.weighting == 'emsm':
+                t0 = time.time()
+                match_det2cube_msm = self.select_cloud_routine()
+                match_det2cube_msm(self.naxis1, self.naxis2, self.naxis3,
+                                   self.cdelt1, self.cdelt2,
+                                   self.cdelt3_normal,
+                                   self.xcenters, self.ycenters, self.zcoord,
+                                   self.spaxel_flux,
+                                   self.spaxel_weight,
+                                   self.spaxel_iflux,
+                                   flux,
+                                   coord1, coord2, wave,
+                                   self.weighting,
+                                   rois_pixel, roiw_pixel,
+                                   weight_pixel,
+                                   softrad_pixel,
+                                   scalerad_pixel)
+
+                t1 = time.time()
+                log.info("Time to match file to ifucube = %.1f s" % (t1 - t0,))
+# ________________________________________________________________________________
+            elif self.weighting == 'miripsf':
+                with datamodels.IFUImageModel(ifile) as input_model:
+                    wave_resol = self.instrument_info.Get_RP_ave_Wave(this_par1,
+                                                                      this_par2)
+
+                    alpha_resol = self.instrument_info.Get_psf_alpha_parameters()
+                    beta_resol = self.instrument_info.Get_psf_beta_parameters()
+
+                    worldtov23 = input_model.meta.wcs.get_transform("world", "v2v3")
+                    v2ab_transform = input_model.meta.wcs.get_transform('v2v3',
+                                                                        'alpha_beta')
+
+                    spaxel_v2, spaxel_v3, zl = worldtov23(spaxel_ra,
+                                                          spaxel_dec,
+                                                          spaxel_wave)
+
+                    spaxel_alpha, spaxel_beta, spaxel_wave = v2ab_transform(spaxel_v2,
+                                                                            spaxel_v3,
+                                                                            zl)
+                    match_det2cube_miripsf = self.select_cloud_routine()
+                    match_det2cube_miripsf(alpha_resol,
+                                           beta_resol,
+                                           wave_resol,
+                                           self.naxis1, self.naxis2, self.naxis3,
+                                           self.xcenters, self.ycenters, self.zcoord,
+                                           self.spaxel_flux,
+                                           self.spaxel_weight,
+                                           self.spaxel_iflux,
+                                           spaxel_alpha, spaxel_beta, spaxel_wave,
+                                           flux,
+                                           coord1, coord2, wave,
+                                           alpha_det, beta_det,
+                                           self.weighting,
+                                           rois_pixel, roiw_pixel,
+                                           weight_pixel,
+                                           softrad_pixel,
+                                           scalerad_pixel)
+# --------------------------------------------------------------------------------
+# 2D area method - only works for single files and coord_system = 'alpha-beta'
+# --------------------------------------------------------------------------------
+        elif self.interpolation == 'area':
+            with datamodels.IFUImageModel(ifile) as input_model:
+                det2ab_transform = input_model.meta.wcs.get_transform('detector',
+                                                                      'alpha_beta')
+                start_region = self.instrument_info.GetStartSlice(this_par1)
+                end_region = self.instrument_info.GetEndSlice(this_par1)
+                regions = list(range(start_region, end_region + 1))
+                t0 = time.time()
+                for i in regions:
+                    log.info('Working on Slice # %d', i)
+                    y, x = (det2ab_transform.label_mapper.mapper == i).nonzero()
+
+# getting pixel corner - ytop = y + 1 (routine fails for y = 1024)
+                    index = np.where(y < 1023)
+                    y = y[index]
+                    x = x[index]
+                    cube_overlap.match_det2cube(x, y, i,
+                                                start_region,
+                                                input_model,
+                                                det2ab_transform,
+                                                self.spaxel_flux,
+                                                self.spaxel_weight,
+                                                self.spaxel_iflux,
+                                                self.xcoord, self.zcoord,
+                                                self.crval1, self.crval3,
+                                                self.cdelt1, self.cdelt3,
+                                                self.naxis1, self.naxis2)
+                t1 = time.time()
+
+                log.info("Time to Map All slices on Detector to Cube = %.1f s" % (t1 - t0,))
+# ********************************************************************************
+
+    def map_files_parallel(self, file_list, num_processes, subtract_background,
+                           spaxel_ra, spaxel_dec, spaxel_wave):
+        """ Map the files to the IFU cube using a pool of processes
+
+        Each process maps one input file at a time to its own set of spaxel
+        arrays (see _map_file_worker). The partial spaxel sums returned for
+        each file are added to self.spaxel_flux, self.spaxel_weight and
+        self.spaxel_iflux in file order, so the cube does not depend on which
+        process finishes first, and the initial DQ flags are combined with a
+        bitwise or.
+
+        The processes are forked, so they share the input models and the
+        cube geometry with this process without pickling them.
+
+        Parameters
+        ----------
+        file_list : list
+           (this_par1, this_par2, index in master_table.FileMap) of each file
+        num_processes : int
+           number of processes to create
+        subtract_background : boolean
+           if TRUE then subtract the background found in the mrs_imatch step
+        spaxel_ra, spaxel_dec, spaxel_wave : numpy.ndarray
+           spaxel center coordinates, only used for miripsf weighting
+        """
+        global _parallel_args
+        _parallel_args = (self, subtract_background, spaxel_ra, spaxel_dec, spaxel_wave)
+
+        log.info("Creating %d processes for mapping %d files to the IFU cube",
+                 num_processes, len(file_list))
+        t0 = time.time()
+        context = multiprocessing.get_context('fork')
+        with context.Pool(processes=num_processes) as pool:
+            for partial in pool.imap(_map_file_worker, file_list):
+                spaxel_flux, spaxel_weight, spaxel_iflux, spaxel_dq = partial
+                self.spaxel_flux += spaxel_flux
+                self.spaxel_weight += spaxel_weight
+                self.spaxel_iflux += spaxel_iflux
+                self.spaxel_dq = np.bitwise_or(self.spaxel_dq, spaxel_dq)
+        _parallel_args = None
+        t1 = time.time()
+        log.info("Time to map all files to ifucube = %.1f s" % (t1 - t0,))
+# ********************************************************************************
+
     def build_ifucube_single(self):
 
         """ Build a set of single mode IFU cubes used for outlier detection
@@ -709,24 +796,25 @@ class IFUCubeData():
             coord1, coord2, wave, flux, slice_no, rois_pixel, roiw_pixel, weight_pixel, \
                 softrad_pixel, scalerad_pixel, alpha_det, beta_det = pixelresult
 
-            cube_cloud.match_det2cube_msm(self.naxis1,
-                                          self.naxis2,
-                                          self.naxis3,
-                                          self.cdelt1, self.cdelt2,
-                                          self.cdelt3_normal,
-                                          self.xcenters,
-                                          self.ycenters,
-                                          self.zcoord,
-                                          self.spaxel_flux,
-                                          self.spaxel_weight,
-                                          self.spaxel_iflux,
-                                          flux,
-                                          coord1, coord2, wave,
-                                          self.weighting,
-                                          rois_pixel, roiw_pixel,
-                                          weight_pixel,
-                                          softrad_pixel,
-                                          scalerad_pixel)
+            match_det2cube_msm = self.select_cloud_routine()
+            match_det2cube_msm(self.naxis1,
+                               self.naxis2,
+                               self.naxis3,
+                               self.cdelt1, self.cdelt2,
+                               self.cdelt3_normal,
+                               self.xcenters,
+                               self.ycenters,
+                               self.zcoord,
+                               self.spaxel_flux,
+                               self.spaxel_weight,
+                               self.spaxel_iflux,
+                               flux,
+                               coord1, coord2, wave,
+                               self.weighting,
+                               rois_pixel, roiw_pixel,
+                               weight_pixel,
+                               softrad_pixel,
+                               scalerad_pixel)
 # _______________________________________________________________________
 # shove Flux and iflux in the  final ifucube
             self.find_spaxel_flux()
@@ -742,6 +830,25 @@ class IFUCubeData():
         return single_ifucube_container
 # **************************************************************************
 
+    def select_cloud_routine(self):
+        """ Select the routine used to match the point cloud to the spaxels
+
+        cloud_method = 'loop' uses the cube_cloud routines that loop over the
+        point cloud members. Otherwise the spaxel grid search routines
+        (match_det2cube_msm_indexed and match_det2cube_miripsf_indexed) are
+        used. Both give the same results, the loops are kept for regression
+        comparisons.
+        """
+        if self.weighting == 'miripsf':
+            if self.cloud_method == 'loop':
+                return cube_cloud.match_det2cube_miripsf
+            return cube_cloud.match_det2cube_miripsf_indexed
+
+        if self.cloud_method == 'loop':
+            return cube_cloud.match_det2cube_msm
+        return cube_cloud.match_det2cube_msm_indexed
+# **************************************************************************
+
     def determine_cube_parameters(self):
         """Determine the spatial and wavelength roi size to use for
         selecting point cloud elements around the spaxel centeres.
@@ -1134,106 +1241,36 @@ class IFUCubeData():
                     if(poly_ch == this_par1):
                         apply_background_2d(input_model, poly_ch, subtract=True)
 # --------------------------------------------------------------------------------
-            if self.instrument == 'MIRI':
-
-                # find the slice number of each pixel and fill in slice_det
+            if self.coord_system == 'world':
+                detmap = detector_map.get_detector_map(input_model, this_par1,
+                                                       self.instrument_info,
+                                                       alpha_beta=(self.weighting == 'miripsf'),
+                                                       cache_dir=self.coord_cache_dir)
+                x = detmap['x']
+                y = detmap['y']
+                ra = detmap['ra']
+                dec = detmap['dec']
+                wave = detmap['wave']
+                slice_no = detmap['slice_no']
+                if self.weighting == 'miripsf':
+                    alpha = detmap['alpha']
+                    beta = detmap['beta']
+            elif self.coord_system == 'alpha-beta':
                 ysize, xsize = input_model.data.shape
-                slice_det = np.zeros((ysize, xsize), dtype=int)
                 det2ab_transform = input_model.meta.wcs.get_transform('detector',
                                                                       'alpha_beta')
-                start_region = self.instrument_info.GetStartSlice(this_par1)
-                end_region = self.instrument_info.GetEndSlice(this_par1)
-                regions = list(range(start_region, end_region + 1))
-                for i in regions:
-                    ys, xs = (det2ab_transform.label_mapper.mapper == i).nonzero()
-                    xind = _toindex(xs)
-                    yind = _toindex(ys)
-                    xind = np.ndarray.flatten(xind)
-                    yind = np.ndarray.flatten(yind)
-                    slice_det[yind, xind] = i
-
-                # define the x,y detector values of channel to be mapped to desired coordinate system
                 xstart, xend = self.instrument_info.GetMIRISliceEndPts(this_par1)
                 y, x = np.mgrid[:ysize, xstart:xend]
                 y = np.reshape(y, y.size)
                 x = np.reshape(x, x.size)
 
-                if self.coord_system == 'world':
-                    ra, dec, wave = input_model.meta.wcs(x, y)
-                    valid1 = ~np.isnan(ra)
-                    ra = ra[valid1]
-                    dec = dec[valid1]
-                    wave = wave[valid1]
-                    x = x[valid1]
-                    y = y[valid1]
-
-                    xind = _toindex(x)
-                    yind = _toindex(y)
-                    xind = np.ndarray.flatten(xind)
-                    yind = np.ndarray.flatten(yind)
-                    slice_no = slice_det[yind, xind]
-
-                    if self.weighting == 'miripsf':
-                        alpha, beta, lam = det2ab_transform(x, y)
-                elif self.coord_system == 'alpha-beta':
-                    alpha, beta, wave = det2ab_transform(x, y)
-                    valid1 = ~np.isnan(coord1)
-                    alpha = alpha[valid1]
-                    beta = beta[valid1]
-                    wave = wave[valid1]
-                    x = x[valid1]
-                    y = y[valid1]
-# ________________________________________________________________________________
-            elif self.instrument == 'NIRSPEC':
-                # initialize the ra,dec, and wavelength arrays
-                # we will loop over slice_nos and fill in values
-                # the flag_det will be set when a slice_no pixel is filled in
-                #   at the end we will use this flag to pull out valid data
-
-                ysize, xsize = input_model.data.shape
-                ra_det = np.zeros((ysize, xsize))
-                dec_det = np.zeros((ysize, xsize))
-                lam_det = np.zeros((ysize, xsize))
-                flag_det = np.zeros((ysize, xsize))
-                slice_det = np.zeros((ysize, xsize), dtype=int)
-                # for NIRSPEC each file has 30 slices
-                # wcs information access seperately for each slice
-                nslices = 30
-                log.info("Mapping each NIRSpec slice to sky; this takes a while for NIRSpec data")
-                for ii in range(nslices):
-                    slice_wcs = nirspec.nrs_wcs_set_input(input_model, ii)
-                    x, y = wcstools.grid_from_bounding_box(slice_wcs.bounding_box)
-                    ra, dec, lam = slice_wcs(x, y)
-
-                    # the slices are curved on detector so a rectangular region
-                    # returns NaNs
-                    valid = ~np.isnan(lam)
-                    ra = ra[valid]
-                    dec = dec[valid]
-                    lam = lam[valid]
-                    x = x[valid]
-                    y = y[valid]
-
-                    xind = _toindex(x)
-                    yind = _toindex(y)
-                    xind = np.ndarray.flatten(xind)
-                    yind = np.ndarray.flatten(yind)
-                    ra = np.ndarray.flatten(ra)
-                    dec = np.ndarray.flatten(dec)
-                    lam = np.ndarray.flatten(lam)
-                    ra_det[yind, xind] = ra
-                    dec_det[yind, xind] = dec
-                    lam_det[yind, xind] = lam
-                    flag_det[yind, xind] = 1
-                    slice_det[yind, xind] = ii+1
-
-                # after looping over slices  - pull out valid values
-                valid_data = np.where(flag_det == 1)
-                y, x = valid_data
-                ra = ra_det[valid_data]
-                dec = dec_det[valid_data]
-                wave = lam_det[valid_data]
-                slice_no = slice_det[valid_data]
+                alpha, beta, wave = det2ab_transform(x, y)
+                valid1 = ~np.isnan(coord1)
+                alpha = alpha[valid1]
+                beta = beta[valid1]
+                wave = wave[valid1]
+                x = x[valid1]
+                y = y[valid1]
 # ______________________________________________________________________________
 # The following is for both MIRI and NIRSPEC
 # grab the flux and DQ values for these pixles
@@ -1587,21 +1624,18 @@ class IFUCubeData():
         #                  (self.ycenters > etamin) & (self.ycenters < etamax))
 
         wave_slice_dq = np.zeros(self.naxis2 * self.naxis1, dtype=np.int32)
-        # loop over spaxels in the spatial plane and set slice_dq
-        nxy = self.xcenters.size  # size of spatial plane
-        for ixy in range(nxy):
-            area_box = self.cdelt1 * self.cdelt2
-            area_overlap = cube_overlap.sh_find_overlap(self.xcenters[ixy],
-                                                        self.ycenters[ixy],
-                                                        self.cdelt1, self.cdelt2,
-                                                        xi_corner, eta_corner)
-
-            overlap_coverage = area_overlap/area_box
-            if overlap_coverage > self.tolerance_dq_overlap:
-                if overlap_coverage > 0.95:
-                    wave_slice_dq[ixy] = self.overlap_full
-                else:
-                    wave_slice_dq[ixy] = self.overlap_partial
+        # find the overlap of the FOV with all the spaxels in the spatial plane
+        area_box = self.cdelt1 * self.cdelt2
+        area_overlap = cube_overlap.sh_find_overlap_array(self.xcenters,
+                                                          self.ycenters,
+                                                          self.cdelt1, self.cdelt2,
+                                                          xi_corner, eta_corner)
+
+        overlap_coverage = area_overlap / area_box
+        covered = overlap_coverage > self.tolerance_dq_overlap
+        wave_slice_dq[covered] = np.where(overlap_coverage[covered] > 0.95,
+                                          self.overlap_full,
+                                          self.overlap_partial)
 
         # set for a range of wavelengths
         if wmin != wmax:
@@ -2021,3 +2055,33 @@ class AreaInterpolation(Exception):
     is also set.
     """
     pass
+# ********************************************************************************
+
+
+def _map_file_worker(file_info):
+    """ Map one file to private spaxel arrays in a forked process
+
+    Parameters
+    ----------
+    file_info : tuple
+       (this_par1, this_par2, index of the file in master_table.FileMap)
+
+    Returns
+    -------
+    spaxel_flux, spaxel_weight, spaxel_iflux and spaxel_dq holding only the
+    contribution of this file
+    """
+    cube, subtract_background, spaxel_ra, spaxel_dec, spaxel_wave = _parallel_args
+    this_par1, this_par2, k = file_info
+    ifile = cube.master_table.FileMap[cube.instrument][this_par1][this_par2][k]
+
+    total_num = cube.naxis1 * cube.naxis2 * cube.naxis3
+    cube.spaxel_flux = np.zeros(total_num)
+    cube.spaxel_weight = np.zeros(total_num)
+    cube.spaxel_iflux = np.zeros(total_num)
+    cube.spaxel_dq = np.zeros((cube.naxis3, cube.naxis2 * cube.naxis1), dtype=np.uint32)
+
+    cube.map_file_to_cube(this_par1, this_par2, ifile,
+                          subtract_background,
+                          spaxel_ra, spaxel_dec, spaxel_wave)
+    return cube.spaxel_flux, cube.spaxel_weight, cube.spaxel_iflux, cube.spaxel_dq
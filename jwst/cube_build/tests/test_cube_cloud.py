@@ -0,0 +1,141 @@
+"""
+Unit test for Cube Build comparing the point cloud matching routines
+"""
+
+import numpy as np
+import pytest
+
+from jwst.cube_build import cube_cloud
+
+
+def setup_point_cloud(npts=500):
+    """ Set up a small ifucube and a random point cloud inside it """
+
+    naxis1 = 15
+    naxis2 = 12
+    naxis3 = 20
+    cdelt1 = 0.13
+    cdelt2 = 0.13
+    xcoord = (np.arange(naxis1) - naxis1 / 2.0) * cdelt1
+    ycoord = (np.arange(naxis2) - naxis2 / 2.0) * cdelt2
+    zcoord = 5.0 + 0.002 * np.arange(naxis3) ** 1.1
+    xcenters = np.tile(xcoord, naxis2)
+    ycenters = np.repeat(ycoord, naxis1)
+    zcdelt3 = np.zeros(naxis3)
+    zcdelt3[:-1] = zcoord[1:] - zcoord[:-1]
+    zcdelt3[-1] = zcdelt3[-2]
+
+    rng = np.random.RandomState(42)
+    coord1 = rng.uniform(xcoord[0] - cdelt1, xcoord[-1] + cdelt1, npts)
+    coord2 = rng.uniform(ycoord[0] - cdelt2, ycoord[-1] + cdelt2, npts)
+    wave = rng.uniform(zcoord[0] - 0.01, zcoord[-1] + 0.01, npts)
+    flux = rng.uniform(1.0, 10.0, npts)
+    rois_pixel = np.full(npts, 0.3)
+    roiw_pixel = np.full(npts, 0.005)
+    weight_pixel = np.full(npts, 2.0)
+    softrad_pixel = np.full(npts, 0.01)
+    scalerad_pixel = np.full(npts, 0.1)
+
+    geometry = (naxis1, naxis2, naxis3, cdelt1, cdelt2, zcdelt3,
+                xcenters, ycenters, zcoord)
+    cloud = (flux, coord1, coord2, wave)
+    roi = (rois_pixel, roiw_pixel, weight_pixel, softrad_pixel, scalerad_pixel)
+    return geometry, cloud, roi
+
+
+@pytest.mark.parametrize("weighting", ['msm', 'emsm'])
+def test_match_det2cube_msm_indexed(weighting):
+    """ The indexed routine gives the same spaxel sums as the loop """
+
+    geometry, cloud, roi = setup_point_cloud()
+    total_num = geometry[0] * geometry[1] * geometry[2]
+
+    results = []
+    for routine in (cube_cloud.match_det2cube_msm,
+                    cube_cloud.match_det2cube_msm_indexed):
+        spaxel_flux = np.zeros(total_num)
+        spaxel_weight = np.zeros(total_num)
+        spaxel_iflux = np.zeros(total_num)
+        routine(*geometry, spaxel_flux, spaxel_weight, spaxel_iflux,
+                *cloud, weighting, *roi)
+        results.append((spaxel_flux, spaxel_weight, spaxel_iflux))
+
+    assert results[0][2].sum() > 0
+    for loop_result, indexed_result in zip(*results):
+        np.testing.assert_allclose(indexed_result, loop_result, rtol=1e-12)
+
+
+def test_find_roi_spaxels_chunks():
+    """ Splitting the point cloud in chunks does not change the matches """
+
+    geometry, cloud, roi = setup_point_cloud(npts=50)
+    naxis1, naxis2 = geometry[0], geometry[1]
+    xcenters, ycenters, zcoord = geometry[6:9]
+    flux, coord1, coord2, wave = cloud
+
+    def matches(max_candidates):
+        found = set()
+        for ipt, ixy, iz in cube_cloud.find_roi_spaxels(
+                naxis1, naxis2, xcenters, ycenters, zcoord,
+                coord1, coord2, wave, roi[0], roi[1],
+                max_candidates=max_candidates):
+            found.update(zip(ipt, ixy, iz))
+        return found
+
+    assert len(matches(1)) > 0
+    assert matches(1) == matches(10000000)
+
+
+@pytest.mark.parametrize("weighting", ['msm', 'emsm'])
+def test_match_det2cube_miripsf_indexed(weighting):
+    """ The indexed miripsf routine gives the same spaxel sums as the loop """
+
+    geometry, cloud, roi = setup_point_cloud(npts=200)
+    naxis1, naxis2, naxis3 = geometry[0:3]
+    xcenters, ycenters, zcoord = geometry[6:9]
+    flux, coord1, coord2, wave = cloud
+    total_num = naxis1 * naxis2 * naxis3
+
+    # use the cube coordinates as a stand-in for the alpha-beta system
+    spaxel_alpha = np.tile(xcenters, naxis3)
+    spaxel_beta = np.tile(ycenters, naxis3)
+    spaxel_wave = np.repeat(zcoord, naxis1 * naxis2)
+    alpha_resol = np.array([5.02, 0.2, 0.01, 0.1, 0.02])
+    beta_resol = np.array([5.02, 0.3, 0.01, 0.2, 0.02])
+    wave_resol = np.array([5.02, 3000.0, 10.0, 0.5])
+
+    results = []
+    for routine in (cube_cloud.match_det2cube_miripsf,
+                    cube_cloud.match_det2cube_miripsf_indexed):
+        spaxel_flux = np.zeros(total_num)
+        spaxel_weight = np.zeros(total_num)
+        spaxel_iflux = np.zeros(total_num)
+        routine(alpha_resol, beta_resol, wave_resol,
+                naxis1, naxis2, naxis3,
+                xcenters, ycenters, zcoord,
+                spaxel_flux, spaxel_weight, spaxel_iflux,
+                spaxel_alpha, spaxel_beta, spaxel_wave,
+                flux, coord1, coord2, wave, coord1, coord2,
+                weighting, *roi)
+        results.append((spaxel_flux, spaxel_weight, spaxel_iflux))
+
+    assert results[0][2].sum() > 0
+    for loop_result, indexed_result in zip(*results):
+        np.testing.assert_allclose(indexed_result, loop_result, rtol=1e-12)
+
+
+def test_normalization_weights_array():
+    """ The normalization weights of an array match the scalar values """
+
+    alpha_resol = np.array([8.0, 0.2, 0.01, 0.1, 0.02])
+    beta_resol = np.array([9.0, 0.3, 0.01, 0.2, 0.02])
+    wave_resol = np.array([8.5, 3000.0, 10.0, 0.5])
+    wave = np.linspace(5.0, 12.0, 15)
+
+    weights = cube_cloud.FindNormalizationWeights(wave, wave_resol,
+                                                  alpha_resol, beta_resol)
+    for i, w in enumerate(wave):
+        scalar = cube_cloud.FindNormalizationWeights(w, wave_resol,
+                                                     alpha_resol, beta_resol)
+        for j in range(3):
+            assert weights[j][i] == pytest.approx(scalar[j])
@@ -0,0 +1,98 @@
+"""
+Unit test for Cube Build comparing the area overlap routines
+"""
+
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from jwst.cube_build import cube_overlap
+
+
+def random_pixels(npixels=2000):
+    """ Set up rotated and stretched detector pixels around some spaxels """
+
+    rng = np.random.RandomState(7)
+    xcenter = rng.uniform(-1.0, 1.0, npixels)
+    ycenter = rng.uniform(-1.0, 1.0, npixels)
+    angle = rng.uniform(-0.5, 0.5, npixels)[:, np.newaxis]
+    scale = rng.uniform(0.3, 1.5, npixels)[:, np.newaxis]
+    xoffset = rng.uniform(-1.0, 1.0, npixels)[:, np.newaxis]
+    yoffset = rng.uniform(-1.0, 1.0, npixels)[:, np.newaxis]
+
+    xp = np.array([[-0.5, 0.5, 0.5, -0.5]]) * scale
+    yp = np.array([[-0.5, -0.5, 0.5, 0.5]]) * scale
+    xp_corner = xp * np.cos(angle) - yp * np.sin(angle) + xoffset
+    yp_corner = xp * np.sin(angle) + yp * np.cos(angle) + yoffset
+    return xcenter, ycenter, xp_corner, yp_corner
+
+
+def test_sh_find_overlap_array():
+    """ Test the array overlap against the one pixel-spaxel routine """
+
+    xcenter, ycenter, xp_corner, yp_corner = random_pixels()
+    area = cube_overlap.sh_find_overlap_array(xcenter, ycenter, 0.7, 0.9,
+                                              xp_corner, yp_corner)
+    expected = [cube_overlap.sh_find_overlap(xcenter[i], ycenter[i], 0.7, 0.9,
+                                             xp_corner[i], yp_corner[i])
+                for i in range(xcenter.size)]
+
+    assert np.count_nonzero(area) > 0
+    assert np.count_nonzero(area) < area.size
+    assert area == pytest.approx(expected, abs=1e-14)
+
+
+def test_sh_find_overlap_array_broadcast():
+    """ Test one polygon clipped by many spaxels """
+
+    xcenters = np.array([0.0, 0.5, 3.0])
+    ycenters = np.array([0.0, 0.5, 3.0])
+    area = cube_overlap.sh_find_overlap_array(xcenters, ycenters, 1.0, 1.0,
+                                              [-0.5, 0.5, 0.5, -0.5],
+                                              [-0.5, -0.5, 0.5, 0.5])
+    assert area == pytest.approx([1.0, 0.25, 0.0])
+
+
+def test_match_det2cube_chunks():
+    """ Test the cube does not depend on the number of pairs clipped at once """
+
+    rng = np.random.RandomState(3)
+    data = rng.normal(size=(40, 30))
+    dq = np.zeros((40, 30), dtype=np.uint32)
+    dq[5, 5] = 1
+    model = SimpleNamespace(data=data, dq=dq)
+
+    def transform(x, y):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        alpha = 0.131 * x + 0.013 * y - 1.5
+        wave = 5.0 + 0.0213 * y + 0.0031 * x
+        return alpha, np.zeros_like(alpha), wave
+
+    y, x = np.mgrid[0:40, 0:30]
+    x = x.ravel()
+    y = y.ravel()
+    naxis1, naxis2, naxis3 = 30, 3, 60
+    xcoord = -2.0 + 0.1 * (np.arange(naxis1) + 0.5)
+    zcoord = 4.95 + 0.02 * (np.arange(naxis3) + 0.5)
+
+    cubes = []
+    for max_candidates in (7, 1000000):
+        flux = np.zeros(naxis1 * naxis2 * naxis3)
+        weight = np.zeros(naxis1 * naxis2 * naxis3)
+        iflux = np.zeros(naxis1 * naxis2 * naxis3)
+        cube_overlap.match_det2cube(x, y, 2, 1, model, transform,
+                                    flux, weight, iflux, xcoord, zcoord,
+                                    -2.0, 4.95, 0.1, 0.02, naxis1, naxis2,
+                                    max_candidates=max_candidates)
+        cubes.append((flux, weight, iflux))
+
+    # only the second slice plane is filled
+    weight = cubes[0][1].reshape(naxis3, naxis2, naxis1)
+    assert np.all(weight[:, 0, :] == 0)
+    assert np.all(weight[:, 2, :] == 0)
+    assert np.count_nonzero(weight[:, 1, :]) > 0
+
+    for first, second in zip(*cubes):
+        assert first == pytest.approx(second, abs=1e-12)
@@ -0,0 +1,123 @@
+"""
+Unit test for Cube Build detector coordinate map cache
+"""
+
+import numpy as np
+import pytest
+from astropy.modeling import models
+from gwcs import wcs
+
+from jwst import datamodels
+from jwst.cube_build import detector_map
+
+
+def make_model(shift):
+    """ Simple image model with a gwcs """
+    model = datamodels.IFUImageModel((10, 10))
+    transform = models.Shift(shift) & models.Shift(1.0)
+    model.meta.wcs = wcs.WCS([('detector', transform), ('world', None)])
+    return model
+
+
+def test_detector_map_key():
+    """ Models with the same WCS share a key, a new WCS gives a new key """
+
+    key1 = detector_map.detector_map_key(make_model(1.0), '1', False)
+    key2 = detector_map.detector_map_key(make_model(1.0), '1', False)
+    key3 = detector_map.detector_map_key(make_model(2.0), '1', False)
+    key4 = detector_map.detector_map_key(make_model(1.0), '2', False)
+    assert key1 == key2
+    assert key1 != key3
+    assert key1 != key4
+
+
+def test_detector_map_cache():
+    """ The least recently used maps are dropped beyond max_bytes """
+
+    cache = detector_map.DetectorMapCache(max_bytes=2500)
+    for key in ['a', 'b', 'c']:
+        cache.put(key, {'x': np.zeros(100)})
+    assert cache.get('a') is not None
+    cache.put('d', {'x': np.zeros(100)})
+
+    assert cache.get('b') is None
+    assert list(cache.maps.keys()) == ['c', 'a', 'd']
+    assert cache.nbytes == 2400
+    assert cache.hits == 1
+    assert cache.misses == 1
+
+    # maps larger than the cache are not stored, and resizing drops the
+    # oldest maps
+    cache.put('e', {'x': np.zeros(400)})
+    assert 'e' not in cache.maps
+    cache.resize(1600)
+    assert list(cache.maps.keys()) == ['a', 'd']
+    cache.resize(0)
+    assert cache.nbytes == 0
+
+
+@pytest.fixture
+def miri_model(monkeypatch):
+    """ MIRI model whose detector map computations are recorded """
+    calls = []
+
+    def fake_map(input_model, this_par1, instrument_info, alpha_beta):
+        calls.append(this_par1)
+        return {'x': np.arange(5), 'ra': np.linspace(0., 1., 5)}
+
+    monkeypatch.setattr(detector_map, '_miri_detector_map', fake_map)
+    monkeypatch.setattr(detector_map, 'detector_map_cache',
+                        detector_map.DetectorMapCache())
+    model = make_model(1.0)
+    model.meta.instrument.name = 'MIRI'
+    model.meta.filename = 'test_cal.fits'
+    return model, calls
+
+
+def test_detector_map_sidecar(tmpdir, miri_model):
+    """ Maps written to the sidecar file are read back """
+
+    model, calls = miri_model
+    detmap = detector_map.get_detector_map(model, '1', None, cache_dir=str(tmpdir))
+    assert len(tmpdir.listdir()) == 1
+
+    reread = detector_map.get_detector_map(model, '1', None, cache_dir=str(tmpdir))
+    assert calls == ['1']
+    np.testing.assert_array_equal(reread['ra'], detmap['ra'])
+
+    # from memory
+    detector_map.detector_map_cache.resize(10000)
+    cached = detector_map.get_detector_map(model, '1', None, cache_dir=str(tmpdir))
+    assert detector_map.get_detector_map(model, '1', None) is cached
+    assert calls == ['1']
+
+
+def test_detector_map_cache_off(miri_model):
+    """ Without a cache size, maps are computed for every call """
+
+    model, calls = miri_model
+    detector_map.get_detector_map(model, '1', None)
+    detector_map.get_detector_map(model, '1', None)
+    assert calls == ['1', '1']
+    assert len(detector_map.detector_map_cache.maps) == 0
+
+    # maps larger than the cache are not stored
+    detector_map.detector_map_cache.resize(50)
+    detector_map.get_detector_map(model, '1', None)
+    assert len(detector_map.detector_map_cache.maps) == 0
+
+
+def test_detector_map_bad_sidecar(tmpdir, miri_model):
+    """ A truncated sidecar file is computed again and replaced """
+
+    model, calls = miri_model
+    detector_map.get_detector_map(model, '1', None, cache_dir=str(tmpdir))
+    sidecar, = tmpdir.listdir()
+    sidecar.write_binary(sidecar.read_binary()[:100])
+
+    detmap = detector_map.get_detector_map(model, '1', None, cache_dir=str(tmpdir))
+    assert calls == ['1', '1']
+    np.testing.assert_array_equal(detmap['x'], np.arange(5))
+    assert tmpdir.listdir() == [sidecar]
+    detector_map.get_detector_map(model, '1', None, cache_dir=str(tmpdir))
+    assert calls == ['1', '1']
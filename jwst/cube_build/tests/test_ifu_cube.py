@@ -0,0 +1,63 @@
+"""
+Unit test for Cube Build mapping several files to an IFU cube in parallel
+"""
+
+import numpy as np
+
+from jwst.cube_build import ifu_cube
+
+
+class DummyTable:
+    """ Stand-in for the master table holding the files of each band """
+    def __init__(self, nfiles):
+        self.FileMap = {'MIRI': {'1': {'short': list(range(nfiles))}}}
+
+
+class DummyCube(ifu_cube.IFUCubeData):
+    """ IFUCubeData with a simple per-file mapping """
+
+    def map_file_to_cube(self, this_par1, this_par2, ifile,
+                         subtract_background,
+                         spaxel_ra, spaxel_dec, spaxel_wave):
+        index = np.arange(ifile, self.spaxel_flux.size, 3)
+        self.spaxel_flux[index] += 1.5 * (ifile + 1)
+        self.spaxel_weight[index] += ifile + 1
+        self.spaxel_iflux[index] += 1
+        self.spaxel_dq[ifile % self.naxis3, :] |= 2
+
+
+def setup_cube(nfiles):
+    pars_cube = {'interpolation': 'pointcloud',
+                 'weighting': 'msm',
+                 'coord_system': 'world'}
+    thiscube = DummyCube(3, None, None, None, None, 'MIRI', ['1'], ['short'],
+                         None, DummyTable(nfiles), **pars_cube)
+    thiscube.naxis1 = 4
+    thiscube.naxis2 = 5
+    thiscube.naxis3 = 6
+    total_num = thiscube.naxis1 * thiscube.naxis2 * thiscube.naxis3
+    thiscube.spaxel_flux = np.zeros(total_num)
+    thiscube.spaxel_weight = np.zeros(total_num)
+    thiscube.spaxel_iflux = np.zeros(total_num)
+    thiscube.spaxel_dq = np.zeros((thiscube.naxis3, thiscube.naxis2 * thiscube.naxis1),
+                                  dtype=np.uint32)
+    return thiscube
+
+
+def test_map_files_parallel():
+    """ Mapping the files in parallel gives the same spaxel sums """
+
+    nfiles = 5
+    file_list = [('1', 'short', k) for k in range(nfiles)]
+
+    serial = setup_cube(nfiles)
+    for this_par1, this_par2, k in file_list:
+        serial.map_file_to_cube(this_par1, this_par2, k, True, None, None, None)
+
+    parallel = setup_cube(nfiles)
+    parallel.map_files_parallel(file_list, 2, True, None, None, None)
+
+    np.testing.assert_allclose(parallel.spaxel_flux, serial.spaxel_flux)
+    np.testing.assert_allclose(parallel.spaxel_weight, serial.spaxel_weight)
+    np.testing.assert_allclose(parallel.spaxel_iflux, serial.spaxel_iflux)
+    np.testing.assert_array_equal(parallel.spaxel_dq, serial.spaxel_dq)
@@ -1,5 +1,6 @@
 from ..stpipe import Step
 from .. import datamodels
+from ..lib import reffile_cache
 from . import dark_sub
 
 
@@ -14,6 +15,8 @@ class DarkCurrentStep(Step):
 
     spec = """
         dark_output = output_file(default = None) # Dark model or averaged dark subtracted
+        dark_cache_dir = string(default=None) # Directory for frame-averaged dark files
+        reference_cache_size = integer(default=0) # Bytes of reference models cached for later exposures, 0 for none
     """
 
     reference_file_types = ['dark']
@@ -42,17 +45,29 @@ class DarkCurrentStep(Step):
                     None, basepath=dark_output, ignore_use_model=True
                 )
 
-            # Open the dark ref file data model - based on Instrument
+            # Get the dark ref file data model - based on Instrument;
+            # from the reference model cache if reference_cache_size is set.
+            # The size is shared between the caches of the dark models and
+            # of the frame-averaged darks.
             instrument = input_model.meta.instrument.name
             if(instrument == 'MIRI'):
-                dark_model = datamodels.DarkMIRIModel(self.dark_name)
+                dark_class = datamodels.DarkMIRIModel
             else:
-                dark_model = datamodels.DarkModel(self.dark_name)
+                dark_class = datamodels.DarkModel
+            cache_size = self.reference_cache_size // 2
+            cache = reffile_cache.get_cache('dark_current', cache_size)
+            dark_model = reffile_cache.get_reference_model(
+                input_model, self.dark_name, dark_class, subarray=False,
+                cache=cache)
 
-            # Do the dark correction
+            # Do the dark correction; the frame-averaged darks are cached
+            # too if reference_cache_size is set
+            averaged_cache = reffile_cache.get_cache(
+                'averaged_dark', self.reference_cache_size - cache_size)
             result = dark_sub.do_correction(
-                input_model, dark_model, dark_output
+                input_model, dark_model, dark_output, self.dark_cache_dir,
+                self.dark_name, averaged_cache
             )
-            dark_model.close()
+            reffile_cache.release_reference_model(dark_model, cache)
 
         return result
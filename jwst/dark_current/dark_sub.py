@@ -2,15 +2,21 @@
 #  Module for dark subtracting science data sets
 #
 
-import numpy as np
+import hashlib
 import logging
+import os
+import tempfile
+
+import numpy as np
 from .. import datamodels
+from ..lib.reffile_cache import reference_model_key
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
 
-def do_correction(input_model, dark_model, dark_output=None):
+def do_correction(input_model, dark_model, dark_output=None, cache_dir=None,
+                  dark_name=None, cache=None):
     """
     Short Summary
     -------------
@@ -27,6 +33,17 @@ def do_correction(input_model, dark_model, dark_output=None):
     dark_output: string
         file name in which to optionally save averaged dark data
 
+    cache_dir: string
+        directory in which the frame-averaged darks are saved, and looked
+        up by later exposures with the same readout pattern
+
+    dark_name: string
+        path of the dark reference file; if None the frame-averaged darks
+        are not cached
+
+    cache: ReferenceModelCache
+        cache of the frame-averaged darks, or None to only use cache_dir
+
     Returns
     -------
     output_model: data model object
@@ -83,14 +100,12 @@ def do_correction(input_model, dark_model, dark_output=None):
         input_model.meta.cal_step.dark_sub = 'SKIPPED'
         return input_model.copy()
 
-    # Replace NaN's in the dark with zeros
-    dark_model.data[np.isnan(dark_model.data)] = 0.0
-
     # Check whether the dark and science data have matching
     # nframes and groupgap settings.
     if sci_nframes == drk_nframes and sci_groupgap == drk_groupgap:
 
         # They match, so we can subtract the dark ref file data directly
+        dark_model = replace_nans(dark_model)
         output_model = subtract_dark(input_model, dark_model)
 
         # If the user requested to have the dark file saved,
@@ -102,19 +117,10 @@ def do_correction(input_model, dark_model, dark_output=None):
 
     else:
 
-        # Create a frame-averaged version of the dark data to match
+        # Get a frame-averaged version of the dark data to match
         # the nframes and groupgap settings of the science data.
-        # If the data are from MIRI, the darks are integration-dependent and
-        # we average them with a seperate routine.
-
-        if instrument == 'MIRI':
-            averaged_dark = average_MIRIdark_frames(
-                dark_model, sci_nints, sci_ngroups, sci_nframes, sci_groupgap
-            )
-        else:
-            averaged_dark = average_dark_frames(
-                dark_model, sci_ngroups, sci_nframes, sci_groupgap
-            )
+        averaged_dark = get_averaged_dark(input_model, dark_model, cache_dir,
+                                          dark_name, cache)
 
         # Save the frame-averaged dark data that was just created,
         # if requested by the user
@@ -125,13 +131,248 @@ def do_correction(input_model, dark_model, dark_output=None):
         # Subtract the frame-averaged dark data from the science data
         output_model = subtract_dark(input_model, averaged_dark)
 
-        averaged_dark.close()
-
     output_model.meta.cal_step.dark_sub = 'COMPLETE'
 
     return output_model
 
 
+def replace_nans(dark_model):
+    """
+    Replace NaN's in the dark data with zeros, in a copy of the dark model,
+    as the reference model may be shared with other exposures.
+
+    Parameters
+    ----------
+    dark_model: dark model object
+        the dark data
+
+    Returns
+    -------
+    dark_model: dark model object
+        the input model if it has no NaN's, otherwise a copy of it with
+        the NaN's set to zero
+    """
+    if np.isnan(dark_model.data).any():
+        dark_model = dark_model.copy()
+        dark_model.data[np.isnan(dark_model.data)] = 0.0
+    return dark_model
+
+
+def averaged_dark_key(input_model, dark_model, dark_name):
+    """
+    Key identifying the frame-averaged dark of an exposure
+
+    Parameters
+    ----------
+    input_model: data model object
+        the input science data
+
+    dark_model: dark model object
+        the dark data
+
+    dark_name: string
+        path of the dark reference file
+
+    Returns
+    -------
+    key: tuple
+        the reference model key of the dark file (its absolute path and
+        modification time), the dark shape, and the readout pattern and
+        subarray of the science data
+    """
+    exposure = input_model.meta.exposure
+    sub = input_model.meta.subarray
+    nints = input_model.data.shape[0]
+    if input_model.meta.instrument.name != 'MIRI':
+        nints = 1
+    key = reference_model_key(input_model, dark_name, type(dark_model), False)
+    return key + (dark_model.data.shape, nints, input_model.data.shape[1],
+                  exposure.nframes, exposure.groupgap,
+                  sub.xstart, sub.ystart, sub.xsize, sub.ysize)
+
+
+def get_averaged_dark(input_model, dark_model, cache_dir=None, dark_name=None,
+                      cache=None):
+    """
+    Get the frame-averaged dark matching the readout pattern of the science
+    data, from the averaged dark cache, from its file in cache_dir or by
+    averaging the dark frames. The averaged dark is cached by dark file
+    path and modification time, readout pattern and subarray, unless
+    dark_name is None. The arrays of a cached averaged dark are read-only.
+
+    Parameters
+    ----------
+    input_model: data model object
+        the input science data
+
+    dark_model: dark model object
+        the dark data
+
+    cache_dir: string
+        directory holding the averaged dark files, or None
+
+    dark_name: string
+        path of the dark reference file, or None
+
+    cache: ReferenceModelCache
+        cache of the averaged darks, or None
+
+    Returns
+    -------
+    averaged_dark: dark model object
+        the frame-averaged dark data
+    """
+    instrument = input_model.meta.instrument.name
+    nints, ngroups = input_model.data.shape[:2]
+    nframes = input_model.meta.exposure.nframes
+    groupgap = input_model.meta.exposure.groupgap
+
+    key = None
+    if isinstance(dark_name, str):
+        key = averaged_dark_key(input_model, dark_model, dark_name)
+    if key is not None and cache is not None:
+        averaged_dark = cache.get(key)
+        if averaged_dark is not None:
+            log.debug('Using cached frame-averaged dark')
+            return averaged_dark
+
+    # Name of the averaged dark file in cache_dir
+    cache_file = None
+    if key is not None and cache_dir is not None:
+        root = os.path.splitext(os.path.basename(key[0]))[0]
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        cache_file = os.path.join(cache_dir, '{}_{}_avgdark.fits'.format(root, digest[0:16]))
+
+    dark_class = datamodels.DarkMIRIModel if instrument == 'MIRI' else datamodels.DarkModel
+    if cache_file is not None and os.path.isfile(cache_file):
+        log.info('Reading frame-averaged dark from %s', cache_file)
+        averaged_dark = dark_class(cache_file)
+    else:
+        # If the data are from MIRI, the darks are integration-dependent and
+        # we average them with a seperate routine.
+        dark_model = replace_nans(dark_model)
+        if instrument == 'MIRI':
+            averaged_dark = average_MIRIdark_frames(
+                dark_model, nints, ngroups, nframes, groupgap
+            )
+        else:
+            averaged_dark = average_dark_frames(
+                dark_model, ngroups, nframes, groupgap
+            )
+        if cache_file is not None:
+            log.info('Writing frame-averaged dark to %s', cache_file)
+            save_atomic(averaged_dark, cache_file)
+
+    if key is not None and cache is not None:
+        for array in (averaged_dark.data, averaged_dark.err):
+            array.flags.writeable = False
+        cache.put(key, averaged_dark)
+    return averaged_dark
+
+
+def save_atomic(model, filename):
+    """
+    Save a data model to a temporary file in the directory of filename,
+    then rename it to filename, so that other processes looking up the
+    file never read a partly written one.
+
+    Parameters
+    ----------
+    model: data model object
+        the model to save
+
+    filename: string
+        the name of the file
+    """
+    fd, temp_name = tempfile.mkstemp(
+        suffix='.fits', dir=os.path.dirname(filename) or None,
+        prefix=os.path.basename(filename) + '.')
+    os.close(fd)
+    try:
+        model.save(temp_name)
+        os.replace(temp_name, filename)
+    except BaseException:
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
+        raise
+
+
+def average_groups(data, err, avg_data, avg_err, nframes, groupgap):
+    """
+    Copy or average the dark frames along the third to last axis of the
+    data and err arrays into the groups of a science data set, skipping
+    groupgap frames between groups. The groups that are complete within the
+    dark frames are averaged at once; groups running past the last dark
+    frame are averaged over the frames available.
+
+    Parameters
+    ----------
+    data: ndarray
+        dark SCI frames, along the third to last axis
+
+    err: ndarray
+        dark ERR frames, along the third to last axis
+
+    avg_data: ndarray
+        array receiving the SCI groups, with the groups along the third to
+        last axis
+
+    avg_err: ndarray
+        array receiving the ERR groups
+
+    nframes: int
+        number of frames per group in the science data set
+
+    groupgap: int
+        number of frames skipped between groups in the science data set
+    """
+    ngroups = avg_data.shape[-3]
+    ncomplete = min(ngroups, max(0, (data.shape[-3] - nframes) //
+                                 (nframes + groupgap) + 1))
+    groups = (Ellipsis, slice(0, ncomplete), slice(None), slice(None))
+
+    # View of the frames of each complete group, with the frames along
+    # the third to last axis split into groups of nframes frames
+    stride = data.strides[-3]
+    shape = data.shape[:-3] + (ncomplete, nframes) + data.shape[-2:]
+    strides = (data.strides[:-3] + (stride * (nframes + groupgap), stride) +
+               data.strides[-2:])
+    data_groups = np.lib.stride_tricks.as_strided(data, shape, strides,
+                                                  writeable=False)
+    stride = err.strides[-3]
+    strides = (err.strides[:-3] + (stride * (nframes + groupgap), stride) +
+               err.strides[-2:])
+    err_groups = np.lib.stride_tricks.as_strided(err, shape, strides,
+                                                 writeable=False)
+
+    # If there's only 1 frame per group, just copy the dark frames
+    if nframes == 1:
+        log.debug('copy dark frames')
+        avg_data[groups] = data_groups[..., 0, :, :]
+        avg_err[groups] = err_groups[..., 0, :, :]
+
+    # Otherwise average nframes into a new group: take the mean of
+    # the SCI arrays and the quadratic sum of the ERR arrays. The squares
+    # are added one frame at a time, so that no squared copy of all the
+    # frames is made.
+    else:
+        log.debug('average dark frames in groups of %d', nframes)
+        avg_data[groups] = data_groups.mean(axis=-3)
+        sum_squares = np.square(err_groups[..., 0, :, :])
+        for frame in range(1, nframes):
+            sum_squares += np.square(err_groups[..., frame, :, :])
+        avg_err[groups] = np.sqrt(sum_squares) / nframes
+
+    # Groups running past the last dark frame
+    for group in range(ncomplete, ngroups):
+        start = group * (nframes + groupgap)
+        end = start + nframes
+        log.debug('average dark frames %d to %d', start + 1, end)
+        avg_data[..., group, :, :] = data[..., start:end, :, :].mean(axis=-3)
+        avg_err[..., group, :, :] = np.sqrt(np.add.reduce(
+            err[..., start:end, :, :]**2, axis=-3)) / (end - start)
+
+
 def average_dark_frames(input_dark, ngroups, nframes, groupgap):
     """
     Averages the individual frames of data in a dark reference
@@ -168,29 +409,10 @@ def average_dark_frames(input_dark, ngroups, nframes, groupgap):
     # Do a direct copy of the 2-d DQ array into the new dark
     avg_dark.dq = input_dark.dq
 
-    # Loop over the groups of the input science data, copying or
-    # averaging the dark frames to match the group structure
-    start = 0
-
-    for group in range(ngroups):
-        end = start + nframes
-
-        # If there's only 1 frame per group, just copy the dark frames
-        if nframes == 1:
-            log.debug('copy dark frame %d', start)
-            avg_dark.data[group] = input_dark.data[start]
-            avg_dark.err[group] = input_dark.err[start]
-
-        # Otherwise average nframes into a new group: take the mean of
-        # the SCI arrays and the quadratic sum of the ERR arrays.
-        else:
-            log.debug('average dark frames %d to %d', start + 1, end)
-            avg_dark.data[group] = input_dark.data[start:end].mean(axis=0)
-            avg_dark.err[group] = np.sqrt(np.add.reduce(
-                input_dark.err[start:end]**2, axis=0)) / (end - start)
-
-        # Skip over unused frames
-        start = end + groupgap
+    # Copy or average the dark frames to match the group structure
+    # of the input science data
+    average_groups(input_dark.data, input_dark.err, avg_dark.data,
+                   avg_dark.err, nframes, groupgap)
 
     # Reset some metadata values for the averaged dark
     avg_dark.meta.exposure.nframes = nframes
@@ -250,31 +472,11 @@ def average_MIRIdark_frames(input_dark, nints, ngroups, nframes, groupgap):
     if(dint > nints):
         num_ints = nints
 
-    # Loop over valid integrations in dark reference file
-    # Loop over the groups of the input science data, copying or
-    # averaging the dark frames to match the group structure
-
-    for it in range(num_ints):
-        start = 0
-        for group in range(ngroups):
-            end = start + nframes
-
-            # If there's only 1 frame per group, just copy the dark frames
-            if nframes == 1:
-                log.debug('copy dark frame %d', start)
-                avg_dark.data[it, group] = input_dark.data[it, start]
-                avg_dark.err[it, group] = input_dark.err[it, start]
-
-            # Otherwise average nframes into a new group: take the mean of
-            # the SCI arrays and the quadratic sum of the ERR arrays.
-            else:
-                log.debug('average dark frames %d to %d', start + 1, end)
-                avg_dark.data[it, group] = input_dark.data[it, start:end].mean(axis=0)
-                avg_dark.err[it, group] = np.sqrt(np.add.reduce(
-                    input_dark.err[it, start:end]**2, axis=0)) / (end - start)
-
-        # Skip over unused frames
-            start = end + groupgap
+    # Copy or average the dark frames of the valid integrations in dark
+    # reference file to match the group structure of the input science data
+    average_groups(input_dark.data[:num_ints], input_dark.err[:num_ints],
+                   avg_dark.data[:num_ints], avg_dark.err[:num_ints],
+                   nframes, groupgap)
 
     # Reset some metadata values for the averaged dark
     avg_dark.meta.exposure.nframes = nframes
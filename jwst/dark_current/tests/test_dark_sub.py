@@ -2,6 +2,8 @@
 Unit tests for dark current correction
 """
 
+import os
+
 import pytest
 import numpy as np
 from numpy.testing import assert_allclose
@@ -11,6 +13,7 @@ from jwst.dark_current.dark_sub import (
     do_correction as darkcorr
     )
 from jwst.datamodels import RampModel, DarkModel, DarkMIRIModel, dqflags
+from jwst.lib.reffile_cache import ReferenceModelCache
 
 
 # Define frame_time and number of groups in the generated dark reffile
@@ -346,6 +349,64 @@ def test_frame_avg(make_rampmodel, make_darkmodel):
     np.testing.assert_array_equal(outfile.err[:, :], 0)
 
 
+def test_averaged_dark_cache(make_rampmodel, make_darkmodel, tmpdir):
+    '''Check that the frame-averaged dark is computed once for exposures
+    with the same readout pattern, and read back from the cache directory'''
+
+    cache = ReferenceModelCache()
+
+    dm_ramp = make_rampmodel(2, 4, 20, 30)
+    dm_ramp.meta.exposure.nframes = 2
+    dm_ramp.meta.exposure.groupgap = 1
+    dark = make_darkmodel(12, 20, 30)
+    dark.data[:] = np.arange(12)[:, np.newaxis, np.newaxis]
+    dark.data[1, :, 3, 4] = np.nan
+    dark_name = str(tmpdir.join('dark.fits'))
+    dark.save(dark_name)
+    cache_dir = tmpdir.mkdir('cache')
+
+    expected = darkcorr(dm_ramp, dark, dark_name=dark_name, cache=cache)
+    assert len(cache.models) == 1
+    assert darkcorr(dm_ramp, dark, dark_name=dark_name,
+                    cache=cache).data == pytest.approx(expected.data)
+    assert cache.hits == 1
+
+    # groups of frames 0-1, 3-4, 6-7 and 9-10 are averaged
+    assert expected.data[0, :, 0, 0] == pytest.approx([0.5, -2.5, -5.5, -8.5])
+    assert expected.data[1, :, 3, 4] == pytest.approx([1, 1, 1, 1])
+    assert np.isnan(dark.data[1, 0, 3, 4])
+
+    # another readout pattern is averaged separately
+    dm_ramp.meta.exposure.groupgap = 0
+    assert darkcorr(dm_ramp, dark, dark_name=dark_name,
+                    cache=cache).data[0, :, 0, 0] == pytest.approx(
+        [0.5, -1.5, -3.5, -5.5])
+    assert len(cache.models) == 2
+
+    # without a cache, or without a dark file, nothing is kept
+    darkcorr(dm_ramp, dark, dark_name=dark_name)
+    darkcorr(dm_ramp, dark, cache=cache)
+    assert len(cache.models) == 2
+
+    # the averaged dark file is written whole and read back by a new session
+    dm_ramp.meta.exposure.groupgap = 1
+    darkcorr(dm_ramp, dark, cache_dir=str(cache_dir), dark_name=dark_name)
+    cache_files = cache_dir.listdir()
+    assert len(cache_files) == 1
+    assert cache_files[0].basename.startswith('dark_')
+    assert cache_files[0].basename.endswith('_avgdark.fits')
+    dark.data[:] = 0
+    assert darkcorr(dm_ramp, dark, cache_dir=str(cache_dir),
+                    dark_name=dark_name).data == pytest.approx(expected.data)
+
+    # a new version of the dark file is averaged again
+    dark.save(dark_name)
+    os.utime(dark_name, (0, 0))
+    assert darkcorr(dm_ramp, dark, cache_dir=str(cache_dir),
+                    dark_name=dark_name).data == pytest.approx(dm_ramp.data)
+    assert len(cache_dir.listdir()) == 2
+
+
 @pytest.fixture(scope='function')
 def make_rampmodel():
     '''Make MIRI Ramp model for testing'''
@@ -2,6 +2,7 @@
 
 from ..stpipe import Step
 from .. import datamodels
+from ..lib import reffile_cache
 from . import dq_initialization
 
 
@@ -19,6 +20,10 @@ class DQInitStep(Step):
     with the pixeldq (or dq) attribute of the input model.
     """
 
+    spec = """
+        reference_cache_size = integer(default=0) # Bytes of reference models cached for later exposures, 0 for none
+    """
+
     reference_file_types = ['mask']
 
     def process(self, input):
@@ -70,14 +75,17 @@ class DQInitStep(Step):
             result.meta.cal_step.dq_init = 'SKIPPED'
             return result
 
-        # Load the reference file
-        mask_model = datamodels.MaskModel(self.mask_filename)
+        # Get the reference file, from the reference model cache if
+        # reference_cache_size is set
+        cache = reffile_cache.get_cache('dq_init', self.reference_cache_size)
+        mask_model = reffile_cache.get_reference_model(
+            input_model, self.mask_filename, datamodels.MaskModel, cache=cache)
 
         # Apply the step
         result = dq_initialization.correct_model(input_model, mask_model)
 
         # Close the data models for the input and ref file
         input_model.close()
-        mask_model.close()
+        reffile_cache.release_reference_model(mask_model, cache)
 
         return result
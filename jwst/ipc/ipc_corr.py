@@ -5,6 +5,7 @@
 from collections import namedtuple
 import logging
 import numpy as np
+from scipy import fft
 
 from ..lib import pipe_utils
 from . import x_irs2
@@ -12,6 +13,10 @@ from . import x_irs2
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
+# 2-D kernels with more pixels than this are applied with FFTs rather than
+# by adding shifted copies of the data
+FFT_KERNEL_SIZE = 25
+
 NumRefPixels = namedtuple("NumRefPixels",
                           ["bottom_rows", "top_rows",
                            "left_columns", "right_columns"])
@@ -101,20 +106,17 @@ def ipc_correction(input_model, ipc_model):
                nref.left_columns, nref.right_columns))
     log.debug("Shape of ipc image = %s" % repr(ipc_model.data.shape))
 
-    # Loop over all integrations and groups in input science data.
+    # Loop over all integrations in input science data, convolving all the
+    # groups of an integration in-place with the IPC kernel at once.
     for i in range(input_model.data.shape[0]):                  # integrations
-        for j in range(input_model.data.shape[1]):              # groups
-            # Convolve the current group in-place with the IPC kernel.
-            if is_irs2_format:
-                # Extract normal data from input IRS2-format data.
-                temp = x_irs2.from_irs2(output.data[i, j, :, :], irs2_mask,
-                                        detector)
-                ipc_convolve(temp, kernel, nref)
-                # Insert normal data back into original, IRS2-format data.
-                x_irs2.to_irs2(output.data[i, j, :, :], temp, irs2_mask,
-                               detector)
-            else:
-                ipc_convolve(output.data[i, j], kernel, nref)
+        if is_irs2_format:
+            # Extract normal data from input IRS2-format data.
+            temp = x_irs2.from_irs2(output.data[i], irs2_mask, detector)
+            ipc_convolve(temp, kernel, nref)
+            # Insert normal data back into original, IRS2-format data.
+            x_irs2.to_irs2(output.data[i], temp, irs2_mask, detector)
+        else:
+            ipc_convolve(output.data[i], kernel, nref)
 
     return output
 
@@ -201,9 +203,9 @@ def ipc_convolve(output_data, kernel, nref):
 
     Parameters
     ----------
-    output_data : ndarray, 2-D
-        A copy of the input science data for one group; this will be
-        modified in-place.
+    output_data : ndarray, 2-D or 3-D
+        A copy of the input science data for one group, or for all the
+        groups of an integration; this will be modified in-place.
 
     kernel : ndarray, 2-D or 4-D
         The IPC kernel; the input is corrected for IPC by convolving with
@@ -221,11 +223,6 @@ def ipc_convolve(output_data, kernel, nref):
             The number of reference columns at the right edge.
     """
 
-    bottom_rows = nref.bottom_rows
-    top_rows = nref.top_rows
-    left_columns = nref.left_columns
-    right_columns = nref.right_columns
-
     kshape = kernel.shape
 
     # This is the shape of the entire image, which may include reference
@@ -233,86 +230,64 @@ def ipc_convolve(output_data, kernel, nref):
     shape = output_data.shape
 
     # These axis lengths exclude reference pixels, if there are any.
-    ny = shape[0] - (bottom_rows + top_rows)
-    nx = shape[1] - (left_columns + right_columns)
+    ny = shape[-2] - (nref.bottom_rows + nref.top_rows)
+    nx = shape[-1] - (nref.left_columns + nref.right_columns)
 
-    # The temporary array temp is larger than the science part of
-    # output_data by a border (set to zero) that's about half of the
-    # kernel size, so the convolution can be done without checking for
-    # out of bounds.
+    # The science portion (not the reference pixels) of output_data, which
+    # is corrected in-place.
+    science = output_data[..., nref.bottom_rows:nref.bottom_rows + ny,
+                          nref.left_columns:nref.left_columns + nx]
+
+    # The temporary array temp is a copy of the science portion, padded by
+    # a border of zeros that's about half of the kernel size, so the
+    # convolution can be done without checking for out of bounds.
     # b_b, t_b, l_b, and r_b are the widths of the borders on the
     # bottom, top, left, and right, respectively.
     b_b = kshape[0] // 2
     t_b = kshape[0] - b_b - 1
     l_b = kshape[1] // 2
     r_b = kshape[1] - l_b - 1
-    tny = ny + b_b + t_b
-    yoff = bottom_rows                      # offset in output_data
-    tnx = nx + l_b + r_b
-    xoff = left_columns                     # offset in output_data
-
-    # Note that when we accumulate sums to output_data below, we will
-    # always use the same slice:  output_data[yoff:yoff+ny, xoff:xoff+nx].
-
-    # Copy the science portion (not the reference pixels) of output_data
-    # to this temporary array, then make subsequent changes in-place to
-    # output_data.
-    temp = np.zeros((tny, tnx), dtype=output_data.dtype)
-    temp[b_b:b_b + ny, l_b:l_b + nx] = \
-        output_data[yoff:yoff + ny, xoff:xoff + nx].copy()
-
-    # After setting this slice to zero, we'll incrementally add to it.
-    output_data[yoff:yoff + ny, xoff:xoff + nx] = 0.
-
-    if len(kshape) == 2:
-        # 2-D IPC kernel.  Loop over pixels of the deconvolution kernel.
-        # In this section, `part` has the same shape as `temp`.
-        middle_j = kshape[0] // 2
-        middle_i = kshape[1] // 2
-        for j in range(kshape[0]):
-            jstart = kshape[0] - j - 1
-            for i in range(kshape[1]):
-                if i == middle_i and j == middle_j:
-                    continue                # the middle pixel is done last
-                part = kernel[j, i] * temp
-                istart = kshape[1] - i - 1
-                output_data[yoff:yoff + ny, xoff:xoff + nx] += \
-                        part[jstart:jstart + ny, istart:istart + nx]
-        # The middle pixel of the IPC kernel is expected to be the largest,
-        # so add that last.
-        part = kernel[middle_j, middle_i] * temp
-        output_data[yoff:yoff + ny, xoff:xoff + nx] += \
-                part[middle_j:middle_j + ny, middle_i:middle_i + nx]
 
-    else:
-        # 4-D IPC kernel.  Extract a subset of the kernel:  all of the
-        # first two axes, but only the portion of the last two axes
-        # corresponding to the science data (i.e. possibly a subarray,
-        # and certainly excluding reference pixels).
-        k_temp = np.zeros((kshape[0], kshape[1], tny, tnx),
-                          dtype=kernel.dtype)
-        k_temp[:, :, b_b:b_b + ny, l_b:l_b + nx] = \
-            kernel[:, :, yoff:yoff + ny, xoff:xoff + nx]
-
-        # In this section, `part` has shape (ny, nx), which is smaller
-        # than `temp`.
-        middle_j = kshape[0] // 2
-        middle_i = kshape[1] // 2
-        for j in range(kshape[0]):
-            jstart = kshape[0] - j - 1
-            for i in range(kshape[1]):
-                if i == middle_i and j == middle_j:
-                    continue                # the middle pixel is done last
-                istart = kshape[1] - i - 1
-                # The slice of k_temp includes different pixels for the
-                # first or second axes within each loop, but the same slice
-                # for the last two axes.
-                # The slice of temp (a copy of the science data) includes
-                # a different offset for each loop.
-                part = k_temp[j, i, b_b:b_b + ny, l_b:l_b + nx] * \
-                       temp[jstart:jstart + ny, istart:istart + nx]
-                output_data[yoff:yoff + ny, xoff:xoff + nx] += part
-        # Add the product for the middle pixel last.
-        part = k_temp[middle_j, middle_i, b_b:b_b + ny, l_b:l_b + nx] * \
-               temp[middle_j:middle_j + ny, middle_i:middle_i + nx]
-        output_data[yoff:yoff + ny, xoff:xoff + nx] += part
+    if len(kshape) == 2 and kshape[0] * kshape[1] > FFT_KERNEL_SIZE:
+        # Large 2-D IPC kernel.  Multiply the Fourier transforms of the data
+        # and the kernel, padded to the size of the full linear convolution,
+        # and keep the part of the convolution centered on the science data.
+        fshape = (ny + kshape[0] - 1, nx + kshape[1] - 1)
+        product = (fft.rfft2(science.astype(np.float64), fshape) *
+                   fft.rfft2(kernel.astype(np.float64), fshape))
+        science[...] = fft.irfft2(product, fshape)[..., t_b:t_b + ny,
+                                                   r_b:r_b + nx]
+        return
+
+    pad = [(0, 0)] * (science.ndim - 2) + [(b_b, t_b), (l_b, r_b)]
+    temp = np.pad(science, pad, mode='constant')
+
+    # After setting the science portion to zero, we'll incrementally add
+    # to it, using the slice of temp shifted by the offset of each kernel
+    # pixel.
+    science[...] = 0.
+
+    # The middle pixel of the IPC kernel is expected to be the largest,
+    # so it is added last.
+    middle_j = kshape[0] // 2
+    middle_i = kshape[1] // 2
+    offsets = [(j, i, kshape[0] - j - 1, kshape[1] - i - 1)
+               for j in range(kshape[0]) for i in range(kshape[1])
+               if (j, i) != (middle_j, middle_i)]
+    offsets.append((middle_j, middle_i, middle_j, middle_i))
+
+    # Scratch array for the product of each kernel pixel and the data
+    part = np.empty(science.shape, dtype=np.result_type(kernel, temp))
+    for j, i, jstart, istart in offsets:
+        shifted = temp[..., jstart:jstart + ny, istart:istart + nx]
+        if len(kshape) == 2:
+            # 2-D IPC kernel, the same for all pixels.
+            np.multiply(kernel[j, i], shifted, out=part)
+        else:
+            # 4-D IPC kernel.  The last two axes of the kernel already
+            # match output_data; use the portion corresponding to the
+            # science data (i.e. excluding reference pixels).
+            np.multiply(kernel[j, i, nref.bottom_rows:nref.bottom_rows + ny,
+                               nref.left_columns:nref.left_columns + nx],
+                        shifted, out=part)
+        science += part
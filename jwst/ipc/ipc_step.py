@@ -1,5 +1,6 @@
 from ..stpipe import Step
 from .. import datamodels
+from ..lib import reffile_cache
 from . import ipc_corr
 
 __all__ = ["IPCStep"]
@@ -11,6 +12,10 @@ class IPCStep(Step):
     data model with the IPC reference data.
     """
 
+    spec = """
+        reference_cache_size = integer(default=0) # Bytes of reference models cached for later exposures, 0 for none
+    """
+
     reference_file_types = ['ipc']
 
     def process(self, input):
@@ -42,14 +47,18 @@ class IPCStep(Step):
                 result.meta.cal_step.ipc = 'SKIPPED'
                 return result
 
-            # Open the ipc reference file data model
-            ipc_model = datamodels.IPCModel(self.ipc_name)
+            # Get the ipc reference file data model, from the reference
+            # model cache if reference_cache_size is set
+            cache = reffile_cache.get_cache('ipc', self.reference_cache_size)
+            ipc_model = reffile_cache.get_reference_model(
+                input_model, self.ipc_name, datamodels.IPCModel,
+                subarray=False, cache=cache)
 
             # Do the ipc correction
             result = ipc_corr.do_correction(input_model, ipc_model)
 
             # Close the reference file and update the step status
-            ipc_model.close()
+            reffile_cache.release_reference_model(ipc_model, cache)
             result.meta.cal_step.ipc = 'COMPLETE'
 
         return result
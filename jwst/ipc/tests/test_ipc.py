@@ -0,0 +1,58 @@
+"""Test the IPC convolution of stacks of groups"""
+import numpy as np
+import pytest
+
+from jwst.ipc import ipc_corr
+
+
+def convolve_groups(data, kernel, nref):
+    """Convolve each group separately"""
+    result = data.copy()
+    for group in result:
+        ipc_corr.ipc_convolve(group, kernel, nref)
+    return result
+
+
+@pytest.mark.parametrize('kshape', [(3, 3), (3, 3, 30, 40)])
+def test_ipc_convolve_groups(kshape):
+    """All the groups of an integration are convolved at once"""
+    rng = np.random.RandomState(5)
+    data = rng.normal(size=(4, 30, 40)).astype(np.float32)
+    kernel = rng.uniform(0., 0.02, size=kshape).astype(np.float32)
+    kernel[1, 1] = 0.9
+    nref = ipc_corr.NumRefPixels(4, 3, 2, 1)
+
+    result = data.copy()
+    ipc_corr.ipc_convolve(result, kernel, nref)
+    np.testing.assert_array_equal(result, convolve_groups(data, kernel, nref))
+
+    # the reference pixels are not changed
+    np.testing.assert_array_equal(result[:, :4], data[:, :4])
+    np.testing.assert_array_equal(result[:, -3:], data[:, -3:])
+    np.testing.assert_array_equal(result[..., :2], data[..., :2])
+    np.testing.assert_array_equal(result[..., -1:], data[..., -1:])
+
+
+def test_ipc_convolve_fft():
+    """Large kernels are applied with FFTs"""
+    rng = np.random.RandomState(5)
+    data = rng.normal(size=(2, 30, 40)).astype(np.float32)
+    kernel = rng.uniform(0., 0.02, size=(7, 7)).astype(np.float32)
+    kernel[3, 3] = 0.5
+    nref = ipc_corr.NumRefPixels(4, 3, 2, 1)
+
+    # the direct convolution by shifted copies of the data
+    expected = np.zeros(data.shape)
+    science = data[:, 4:-3, 2:-1]
+    padded = np.pad(science, [(0, 0), (3, 3), (3, 3)], mode='constant')
+    for j in range(7):
+        for i in range(7):
+            expected[:, 4:-3, 2:-1] += (kernel[j, i] *
+                                        padded[:, 6 - j:6 - j + 23, 6 - i:6 - i + 37])
+
+    result = data.copy()
+    ipc_corr.ipc_convolve(result, kernel, nref)
+    assert result.dtype == np.float32
+    np.testing.assert_allclose(result[:, 4:-3, 2:-1], expected[:, 4:-3, 2:-1],
+                               atol=1e-5)
+    np.testing.assert_array_equal(result[:, :4], data[:, :4])
@@ -4,6 +4,7 @@ import logging
 import numpy as np
 from ..datamodels import dqflags
 from ..lib import reffile_utils
+from ..lib import pipe_utils
 from . import twopoint_difference as twopt
 from . import yintercept as yint
 import multiprocessing
@@ -12,7 +13,8 @@ log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
 def detect_jumps (input_model, gain_model, readnoise_model,
-                  rejection_threshold, do_yint, signal_threshold, max_cores=None):
+                  rejection_threshold, do_yint, signal_threshold, max_cores=None,
+                  tile_rows=None):
     """
     This is the high-level controlling routine for the jump detection process.
     It loads and sets the various input data and parameters needed by each of
@@ -29,20 +31,12 @@ def detect_jumps (input_model, gain_model, readnoise_model,
     appropriate instrument- and detector-dependent values for each pixel of an
     image.  Also, a 2-dimensional read noise array with appropriate values for
     each pixel is passed to the detection methods.
+
+    The 2-point difference method searches tile_rows rows of each
+    integration at a time (all the rows if tile_rows is None), which bounds
+    the size of its scratch arrays.
     """
-    if max_cores is None:
-        numslices = 1
-    else:
-        num_cores = multiprocessing.cpu_count()
-        log.info("Found %d possible cores to use for jump detection " % num_cores)
-        if max_cores == 'quarter':
-            numslices = num_cores // 4 or 1
-        elif max_cores == 'half':
-            numslices = num_cores // 2 or 1
-        elif max_cores == 'all':
-            numslices = num_cores
-        else:
-            numslices = 1
+    numslices = pipe_utils.number_of_processes(max_cores)
 
     # Load the data arrays that we need from the input model
     output_model = input_model.copy()
@@ -79,73 +73,125 @@ def detect_jumps (input_model, gain_model, readnoise_model,
         pdq[wh_g] = np.bitwise_or( pdq[wh_g], dqflags.pixel['DO_NOT_USE'] )
 
     # Apply gain to the SCI, ERR, and readnoise arrays so they're in units
-    # of electrons
-
-    data *= gain_2d
+    # of electrons.  When the rows are searched in several processes, the
+    # gain-scaled data and a copy of the gdq are placed in shared memory
+    # and data and gdq become views of them, so the processes work on the
+    # same arrays and only the row limits are sent to them.
+    shm_data = shm_gdq = None
+    if numslices > 1 and pipe_utils.shared_memory is not None:
+        shm_data, shared_data = pipe_utils.create_shared_array(data.shape,
+                                                               data.dtype)
+        np.multiply(data, gain_2d, out=shared_data)
+        shm_gdq, shared_gdq = pipe_utils.create_shared_array(gdq.shape,
+                                                             gdq.dtype)
+        shared_gdq[...] = gdq
+        data, gdq = shared_data, shared_gdq
+        del shared_data, shared_gdq
+    else:
+        data *= gain_2d
     err  *= gain_2d
     readnoise_2d *= gain_2d
 
-    # Apply the 2-point difference method as a first pass
-    log.info('Executing two-point difference method')
-    start = time.time()
-    numx = data.shape[-1]
-    numy = data.shape[-2]
-    median_slopes = np.zeros((numy, numx), dtype=np.float32)
-    yincrement = int(numy / numslices)
-    slices = []
-    # Slice up data, gdq, readnoise_2d into slices
-    # Each element of slices is a tuple of
-    # (data, gdq, readnoise_2d, rejection_threshold, nframes)
-    for i in range(numslices - 1):
-        slices.insert(i, (data[:, :, i * yincrement:(i + 1) * yincrement, :],
-                          gdq[:, :, i * yincrement:(i + 1) * yincrement, :],
-                          readnoise_2d[i * yincrement:(i + 1) * yincrement, :],
-                          rejection_threshold, nframes))
-    # last slice get the rest
-    slices.insert(numslices - 1, (data[:, :, (numslices - 1) * yincrement:numy, :],
-                                 gdq[:, :, (numslices - 1) * yincrement:numy, :],
-                                 readnoise_2d[(numslices - 1) * yincrement:numy, :],
-                                 rejection_threshold, nframes))
-    if numslices == 1:
-        median_slopes, gdq = twopt.find_crs(data, gdq, readnoise_2d, rejection_threshold, nframes)
-        elapsed = time.time() - start
-    else:
-        log.info("Creating %d processes for jump detection " % numslices)
-        pool = multiprocessing.Pool(processes=numslices)
-        real_result = pool.starmap(twopt.find_crs, slices)
-        k = 0
-        # Reconstruct median_slopes and gdq from the slice results
-        for resultslice in real_result:
-            if (len(real_result) == k + 1):  # last result
-                median_slopes[k * yincrement:numy, :] = resultslice[0]
-                gdq[:, :, k * yincrement:numy, :] = resultslice[1]
-            else:
-                median_slopes[k * yincrement:(k + 1) * yincrement, :] = resultslice[0]
-                gdq[:, :, k * yincrement:(k + 1) * yincrement, :] = resultslice[1]
-            k += 1
-        pool.terminate()
-        pool.close()
-        elapsed = time.time() - start
-    log.debug('Elapsed time = %g sec' % elapsed)
-
-    # Apply the y-intercept method as a second pass, if requested
-    if do_yint:
-
-        # Set up the ramp time array for the y-intercept method
-        group_time = output_model.meta.exposure.group_time
-        times = np.array([(k+1)*group_time for k in range(ngroups)])
-        median_slopes /= group_time
-
-        # Now apply the y-intercept method
-        log.info('Executing yintercept method')
+    try:
+        # Apply the 2-point difference method as a first pass
+        log.info('Executing two-point difference method')
         start = time.time()
-        yint.find_crs(data, err, gdq, times, readnoise_2d,
-                        rejection_threshold, signal_threshold, median_slopes)
+        numy = data.shape[-2]
+        if numslices == 1:
+            median_slopes, gdq = twopt.find_crs(data, gdq, readnoise_2d,
+                                                rejection_threshold, nframes,
+                                                tile_rows=tile_rows)
+        else:
+            # Rows of each slice; the last slice gets the rest
+            yincrement = int(numy / numslices)
+            row_limits = [(i * yincrement, (i + 1) * yincrement)
+                          for i in range(numslices - 1)]
+            row_limits.append(((numslices - 1) * yincrement, numy))
+
+            log.info("Creating %d processes for jump detection " % numslices)
+            if shm_data is not None:
+                # The processes set the jump flags directly in the shared gdq
+                data_info = (shm_data.name, data.shape, data.dtype.str)
+                gdq_info = (shm_gdq.name, gdq.shape, gdq.dtype.str)
+                slices = [(data_info, gdq_info, rlo, rhi,
+                           readnoise_2d[rlo:rhi, :], rejection_threshold,
+                           nframes, tile_rows)
+                          for rlo, rhi in row_limits]
+                with multiprocessing.Pool(processes=numslices) as pool:
+                    real_result = pool.starmap(_find_crs_slice, slices)
+                median_slopes = np.concatenate(real_result, axis=-2)
+            else:
+                # Without shared memory, send copies of the slices to the
+                # processes and copy the flags they set back into gdq
+                slices = [(data[:, :, rlo:rhi, :], gdq[:, :, rlo:rhi, :],
+                           readnoise_2d[rlo:rhi, :], rejection_threshold,
+                           nframes, tile_rows)
+                          for rlo, rhi in row_limits]
+                with multiprocessing.Pool(processes=numslices) as pool:
+                    real_result = pool.starmap(twopt.find_crs, slices)
+                for (rlo, rhi), result in zip(row_limits, real_result):
+                    gdq[:, :, rlo:rhi, :] = result[1]
+                median_slopes = np.concatenate(
+                    [result[0] for result in real_result], axis=-2)
         elapsed = time.time() - start
         log.debug('Elapsed time = %g sec' % elapsed)
 
-    # Update the DQ arrays of the output model with the jump detection results
-    output_model.groupdq = gdq
-    output_model.pixeldq = pdq
+        # Apply the y-intercept method as a second pass, if requested
+        if do_yint:
+
+            # Set up the ramp time array for the y-intercept method
+            group_time = output_model.meta.exposure.group_time
+            times = np.array([(k+1)*group_time for k in range(ngroups)])
+            median_slopes /= group_time
+
+            # Now apply the y-intercept method
+            log.info('Executing yintercept method')
+            start = time.time()
+            yint.find_crs(data, err, gdq, times, readnoise_2d,
+                          rejection_threshold, signal_threshold, median_slopes)
+            elapsed = time.time() - start
+            log.debug('Elapsed time = %g sec' % elapsed)
+
+        # Update the DQ arrays of the output model with the jump detection
+        # results; flags set in shared memory are copied out of it
+        if shm_gdq is None:
+            output_model.groupdq = gdq
+        else:
+            output_model.groupdq[...] = gdq
+        output_model.pixeldq = pdq
+    finally:
+        if shm_data is not None:
+            # The views must be released before the blocks are closed
+            del data, gdq
+            pipe_utils.release_shared_memory(shm_data)
+            pipe_utils.release_shared_memory(shm_gdq)
 
     return output_model
+
+
+def _find_crs_slice(data_info, gdq_info, rlo, rhi, readnoise_2d,
+                    rejection_threshold, nframes, tile_rows=None):
+    """
+    Run the two-point difference method on rows rlo:rhi of the data and
+    group DQ cubes held in shared memory, setting the jump flags directly in
+    the shared group DQ; run in a separate process by detect_jumps.
+    data_info and gdq_info are the (name, shape, dtype) of the shared memory
+    blocks. Returns the median slopes of the rows.
+    """
+    shm_data = pipe_utils.shared_memory.SharedMemory(name=data_info[0])
+    shm_gdq = pipe_utils.shared_memory.SharedMemory(name=gdq_info[0])
+    try:
+        data = np.ndarray(data_info[1], dtype=data_info[2],
+                          buffer=shm_data.buf)[:, :, rlo:rhi, :]
+        gdq = np.ndarray(gdq_info[1], dtype=gdq_info[2],
+                         buffer=shm_gdq.buf)[:, :, rlo:rhi, :]
+
+        median_slopes, gdq[...] = twopt.find_crs(data, gdq, readnoise_2d,
+                                                 rejection_threshold, nframes,
+                                                 tile_rows=tile_rows)
+        del data, gdq
+    finally:
+        shm_data.close()
+        shm_gdq.close()
+
+    return median_slopes
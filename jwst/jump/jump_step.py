@@ -17,6 +17,7 @@ class JumpStep(Step):
     spec = """
         rejection_threshold = float(default=4.0,min=0) # CR rejection threshold
         maximum_cores = option('quarter', 'half', 'all', default=None) # max number of processes to create
+        tile_rows = integer(default=None, min=1) # rows searched at once, None for all
     """
 
     # Prior to 04/26/17, the following were also in the spec above:
@@ -45,11 +46,14 @@ class JumpStep(Step):
             # Retrieve the parameter values
             rej_thresh = self.rejection_threshold
             max_cores = self.maximum_cores
+            tile_rows = self.tile_rows
             do_yint = self.do_yintercept
             sig_thresh = self.yint_threshold
             self.log.info('CR rejection threshold = %g sigma', rej_thresh)
             if self.maximum_cores is not None:
                 self.log.info('Maximum cores to use = %s', max_cores)
+            if tile_rows is not None:
+                self.log.info('Rows searched at once = %d', tile_rows)
             if do_yint:
                 self.log.info('Y-intercept signal threshold = %g', sig_thresh)
 
@@ -67,7 +71,8 @@ class JumpStep(Step):
 
             # Call the jump detection routine
             result = detect_jumps(input_model, gain_model, readnoise_model,
-                                   rej_thresh, do_yint, sig_thresh, max_cores)
+                                   rej_thresh, do_yint, sig_thresh, max_cores,
+                                   tile_rows)
 
             gain_model.close()
             readnoise_model.close()
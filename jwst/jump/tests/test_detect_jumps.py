@@ -89,6 +89,33 @@ def test_onecr_50_groups(setup_inputs):
     outdqcr = out_model.groupdq[0, 5, 5, 5]
     np.testing.assert_allclose(4, outdqcr)
 
+
+@pytest.mark.parametrize("use_shared_memory", [True, False])
+def test_multiprocessing_matches_single(setup_inputs, monkeypatch,
+                                        use_shared_memory):
+    # slices of rows detected in separate processes sharing the data, or
+    # given copies of it without shared memory
+    monkeypatch.setattr('multiprocessing.cpu_count', lambda: 3)
+    if not use_shared_memory:
+        monkeypatch.setattr('jwst.lib.pipe_utils.shared_memory', None)
+    rng = np.random.RandomState(4)
+    results = []
+    for max_cores in (None, 'all'):
+        model1, gdq, rnModel, pixdq, err, gain = setup_inputs(
+            ngroups=10, nints=2, nrows=31, ncols=20, gain=5, readnoise=7)
+        rng.seed(4)
+        model1.data[...] = (np.arange(10)[:, np.newaxis, np.newaxis] *
+                            rng.uniform(0., 20., (31, 20)) +
+                            rng.normal(0., 3., (2, 10, 31, 20)))
+        model1.data[rng.uniform(size=model1.data.shape) < 0.03] += 500.
+        model1.groupdq[1, 7:, 12, :] = 2
+        results.append(detect_jumps(model1, gain, rnModel, 4.0, False, 4.0,
+                                    max_cores))
+
+    assert np.count_nonzero(results[0].groupdq == 4) > 0
+    np.testing.assert_array_equal(results[1].groupdq, results[0].groupdq)
+    np.testing.assert_array_equal(results[1].pixeldq, results[0].pixeldq)
+
 # Need test for multi-ints near zero with positive and negative slopes
 
 @pytest.fixture
@@ -1,7 +1,7 @@
 import pytest
 import numpy as np
 
-from jwst.jump.twopoint_difference import find_crs
+from jwst.jump.twopoint_difference import find_crs, get_clipped_median
 from jwst.datamodels import dqflags
 
 
@@ -665,6 +665,67 @@ def test_first_last_group(setup_cube):
     assert outgdq[0, 3, 100, 100] == dqflags.group['JUMP_DET']
 
 
+def test_clipped_median_even_and_odd_pixels():
+    """Pixels with an odd number of differences left are not moved down"""
+    differences = np.array([[[5.0]], [[7.0]]])
+    sorted_index = np.zeros(differences.shape, dtype=np.intp)
+    # the second pixel has no difference left, as for a 2 group ramp with a
+    # saturated difference
+    diffs_to_ignore = np.array([[0], [1]])
+    median = get_clipped_median(1, diffs_to_ignore, differences, sorted_index)
+    np.testing.assert_array_equal(median, [[5.0], [7.0]])
+
+
+def test_multiple_crs_several_pixels(setup_cube):
+    ngroups = 10
+    data, gdq, nframes, read_noise, rej_threshold = setup_cube(ngroups)
+
+    #  pixels with one, two and three CRs, and one pixel whose second CR
+    #  saturates the rest of the ramp, are searched together
+    for col in (10, 11, 12, 13):
+        data[0, :, 100, col] = 20.0 * np.arange(ngroups)
+    data[0, 4:, 100, 10] += 1000.0
+    data[0, 2:, 100, 11] += 500.0
+    data[0, 7:, 100, 11] += 2000.0
+    data[0, 2:, 100, 12] += 800.0
+    data[0, 5:, 100, 12] += 300.0
+    data[0, 8:, 100, 12] += 1500.0
+    data[0, 3:, 100, 13] += 600.0
+    data[0, 6:, 100, 13] += 900.0
+    gdq[0, 8:, 100, 13] = dqflags.group['SATURATED']
+    median_diff, out_gdq = find_crs(data, gdq, read_noise, rej_threshold, nframes)
+
+    jump = dqflags.group['JUMP_DET']
+    assert np.where(out_gdq[0, :, 100, 10] == jump)[0].tolist() == [4]
+    assert np.where(out_gdq[0, :, 100, 11] == jump)[0].tolist() == [2, 7]
+    assert np.where(out_gdq[0, :, 100, 12] == jump)[0].tolist() == [2, 5, 8]
+    assert np.where(out_gdq[0, :, 100, 13] == jump)[0].tolist() == [3, 6]
+    #  the median slopes exclude the CRs
+    assert median_diff[0, 100, 10:13] == pytest.approx(20.0)
+
+
+@pytest.mark.parametrize('tile_rows', [1, 7, 50])
+def test_tile_rows(tile_rows):
+    nints, ngroups, nrows, ncols = 2, 8, 30, 20
+    rng = np.random.RandomState(12)
+    data = np.cumsum(rng.normal(20., 5., (nints, ngroups, nrows, ncols)),
+                     axis=1).astype(np.float32)
+    crs = rng.uniform(size=data.shape) < 0.05
+    data += np.cumsum(crs * 1000., axis=1).astype(np.float32)
+    gdq = np.zeros(data.shape, dtype=np.uint8)
+    gdq[:, 6:, 5:10] = dqflags.group['SATURATED']
+    gdq[:, 0, 20:] = dqflags.group['DO_NOT_USE']
+    read_noise = np.full((nrows, ncols), 10., dtype=np.float32)
+
+    median_diff, out_gdq = find_crs(data.copy(), gdq, read_noise, 4., 1)
+    tiled_median_diff, tiled_gdq = find_crs(data.copy(), gdq, read_noise, 4., 1,
+                                            tile_rows=tile_rows)
+
+    assert np.any(out_gdq & dqflags.group['JUMP_DET'])
+    np.testing.assert_array_equal(tiled_gdq, out_gdq)
+    np.testing.assert_array_equal(tiled_median_diff, median_diff)
+
+
 @pytest.fixture(scope='function')
 def setup_cube():
 
@@ -3,9 +3,9 @@ Two-Point Difference method for finding outliers in a 3-d ramp data cube.
 The scheme used in this variation of the method uses numpy array methods
 to compute first-differences and find the max outlier in each pixel while
 still working in the full 3-d data array. This makes detection of the first
-outlier very fast. We then iterate pixel-by-pixel over only those pixels
-that are already known to contain an outlier, to look for any additional
-outliers and set the appropriate DQ mask for all outliers in the pixel.
+outlier very fast. We then iterate over only those pixels that are already
+known to contain an outlier, all at once, to look for any additional
+outliers and set the appropriate DQ mask for all outliers in the pixels.
 This is MUCH faster than doing all the work on a pixel-by-pixel basis.
 """
 
@@ -19,16 +19,27 @@ log.setLevel(logging.DEBUG)
 HUGE_NUM = np.finfo(np.float32).max
 
 
-def find_crs(data, group_dq, read_noise, rej_threshold, nframes):
+def find_crs(data, group_dq, read_noise, rej_threshold, nframes,
+              tile_rows=None):
     """
     Find CRs/Jumps in each integration within the input data array.
     The input data array is assumed to be in units of electrons, i.e. already
     multiplied by the gain. We also assume that the read noise is in units of
     electrons.
+
+    The rows of each integration are searched in tiles of tile_rows rows
+    (all the rows if tile_rows is None). The first differences of a tile are
+    computed in scratch arrays that are reused for all the tiles, so the
+    memory used for the search scales with the size of a tile rather than
+    with the size of the integration.
     """
     gdq = group_dq.copy()
     # Get data characteristics
     (nints, ngroups, nrows, ncols) = data.shape
+    ndiffs = ngroups - 1
+    if tile_rows is None or tile_rows > nrows:
+        tile_rows = nrows
+    tile_rows = max(tile_rows, 1)
 
     # Create array for output median slope images
     median_slopes = np.zeros((nints, nrows, ncols), dtype=np.float32)
@@ -36,144 +47,211 @@ def find_crs(data, group_dq, read_noise, rej_threshold, nframes):
     # Square the read noise values, for use later
     read_noise_2 = read_noise**2
 
-    # Reset saturated values in input data array to NaN, so they don't get
-    # used in any of the subsequent calculations
-    saturated_pixels = np.where(np.bitwise_and(gdq, dqflags.group['SATURATED']))
-    data[saturated_pixels] = np.NaN
-
-    # Reset groups set to DO_NOT_USE in the input data array to NaN, so they don't get
-    # used in any of the subsequent calculations. For MIRI data the first and last group
-    # can be set to DO_NOT_USE.
-    wh_donotuse = np.where(np.bitwise_and(gdq, dqflags.group['DO_NOT_USE']))
-    data[wh_donotuse] = np.NaN
+    # Scratch arrays for the first differences of a tile, with the ngroups
+    # axis at the end to make memory access to the values for a given pixel
+    # faster; these have dimensions of [tile_rows, ncols, ndiffs]
+    diffs_dtype = np.result_type(data.dtype, np.float32)
+    first_diffs_buffer = np.empty((tile_rows, ncols, ndiffs), dtype=diffs_dtype)
+    positive_diffs_buffer = np.empty_like(first_diffs_buffer)
 
     # Loop over multiple integrations
     for integration in range(nints):
 
         log.info(' working on integration %d' % (integration+1))
 
-        # Roll the ngroups axis of data arrays to the end, to make
-        # memory access to the values for a given pixel faster
-        # new array has dimensions of [nrows, ncols, ngroups]
-        rolled_data = np.rollaxis(data[integration], 0, 3)
-
-        # Compute first differences of adjacent groups up the ramp
-        first_diffs = np.diff(rolled_data, axis=2)
-        nan_pixels = np.where(np.isnan(first_diffs))
-        first_diffs[nan_pixels] = 100000.
-
-        positive_first_diffs = np.abs(first_diffs)
-
-        # Make all the first diffs for saturated groups be equal to
-        # 100,000 to put them above the good values in the sorted index
-        matching_array = np.ones(shape=(positive_first_diffs.shape[0],
-                                        positive_first_diffs.shape[1],
-                                        positive_first_diffs.shape[2])) * 100000
-        #sat_groups is a 3D array that is true when the group is saturated
-        sat_groups = (positive_first_diffs == matching_array)
-        #number_sat_groups is a 2D array with the count of saturated groups for each pixel
-        number_sat_groups = (sat_groups * 1).sum(axis=2)
-        ndiffs = ngroups - 1
-        #Here we sort the 3D array along the last axis which is the group axis.
-        #np.argsort returns a 3D array with the last axis containing the indexes that would yield the groups in
-        #order.
-        sort_index = np.argsort(positive_first_diffs)
-        #median_diffs is a 2D array with the clipped median of each pixel
-        median_diffs = get_clipped_median(ndiffs, number_sat_groups, first_diffs, sort_index)
-
-        # Save initial estimate of the median slope for all pixels
-        median_slopes[integration] = median_diffs
-
-        # Compute uncertainties as the quadrature sum of the poisson noise
-        # in the first difference signal and read noise. Because the first
-        # differences can be biased by CRs/jumps, we use the median signal
-        # for computing the poisson noise. Here we lower the read noise
-        # by the square root of number of frames in the group.
-        # Sigma is a 2D array.
-        poisson_noise = np.sqrt(np.abs(median_diffs))
-        sigma = np.sqrt(poisson_noise * poisson_noise + read_noise_2 / nframes)
-
-        # Reset sigma to exclude pixels with both readnoise and signal=0
-        sigma_0_pixels = np.where(sigma == 0.)
-        if len(sigma_0_pixels[0] > 0):
-            log.debug('Twopt found %d pixels with sigma=0' % (len(sigma_0_pixels[0])))
-            log.debug('which will be reset so that no jump will be detected')
-            sigma[sigma_0_pixels] = HUGE_NUM
-
-        # Compute distance of each sample from the median in units of sigma;
-        # note that the use of "abs" means we'll detect both positive and
-        # negative outliers.
-        #ratio is a 2D array with the units of sigma deviation of the difference from the median.
-        ratio = np.abs(first_diffs - median_diffs[:, :, np.newaxis]) / sigma[:, :, np.newaxis]
-
-        # get the rows and columns of pixels of all pixels
-        # This seems like an obtuse way to set row and column.
-        row, col = np.where(number_sat_groups >= 0)
-        # Get the group index for each pixel of the largest non-saturated group, assuming the indicies are sorted.
-        # 2 is subtracted from ngroups because we are using differences and there is one less difference than the
-        # number of groups.
-        # This is a 2-D array.
-        max_value_index = ngroups - 2 - number_sat_groups
-
-        # Extract from the sorted group index the index of the largest non-saturated group.
-        max_index1d = sort_index[row, col, max_value_index[row, col]]
-        # Reshape the list of max indicies to be a 2-day array
-        max_index1 = np.reshape(max_index1d, (nrows, ncols))
-
-        #Is this redundant? Are r and c different than row and column?
-        r, c = np.indices(max_index1.shape)
-        # Get the row and column indices of pixels whose largest non-saturated ratio is above the threshold
-        row1, col1 = np.where(ratio[r, c, max_index1] > rej_threshold)
-        log.info('From highest outlier Two point found %d pixels with at least one CR' % (len(row1)))
-        number_pixels_with_cr = len(row1)
-        # Loop over all pixels that we found the first CR in
-        for j in range(number_pixels_with_cr):
-            # Extract the first diffs for the this pixel with at least one CR yielding a 1D array
-            pixel_masked_diffs = first_diffs[row1[j], col1[j]]
-            # Get the scalar readnoise^2 and number of saturated groups for this pixel.
-            pixel_rn2 = read_noise_2[row1[j], col1[j]]
-            pixel_sat_groups = number_sat_groups[row1[j], col1[j]]
-
-            # Create a CR mask and set 1st CR to be found
-            # cr_mask=0 designates a CR
-            pixel_cr_mask = np.ones(pixel_masked_diffs.shape, dtype=bool)
-            number_CRs_found = 1
-            pixel_sorted_index = sort_index[row1[j], col1[j], :]
-            pixel_cr_mask[pixel_sorted_index[ndiffs - pixel_sat_groups - 1]] = 0  #setting largest diff to be a CR
-            new_CR_found = True
-
-            # Loop and see if there is more than one CR, setting the mask as you go
-            while new_CR_found and ((ndiffs - number_CRs_found - pixel_sat_groups) > 1):
-                new_CR_found = False
-                # For this pixel get a new median difference excluding the number of CRs found and
-                # the number of saturated groups
-                pixel_med_diff = get_clipped_median(ndiffs, number_CRs_found + pixel_sat_groups,
-                                                       pixel_masked_diffs, pixel_sorted_index)
-                #recalculate the noise and ratio for this pixel now that we have rejected a CR
-                pixel_poisson_noise = np.sqrt(np.abs(pixel_med_diff))
-                pixel_sigma = np.sqrt(pixel_poisson_noise * pixel_poisson_noise + pixel_rn2 / nframes)
-                pixel_ratio = np.abs(pixel_masked_diffs - pixel_med_diff) / pixel_sigma
-
-                # Check if largest remaining difference is above threshold
-                if pixel_ratio[pixel_sorted_index[ndiffs - number_CRs_found - pixel_sat_groups - 1]] > rej_threshold:
-                    new_CR_found = True
-                    pixel_cr_mask[pixel_sorted_index[ndiffs - number_CRs_found - pixel_sat_groups - 1]] = 0
-                    number_CRs_found += 1
-
-            # Found all CRs for this pixel. Set CR flags in input DQ array for this pixel
-            gdq[integration, 1:, row1[j], col1[j]] = \
-                np.bitwise_or(gdq[integration, 1:, row1[j], col1[j]],
-                              dqflags.group['JUMP_DET'] * np.invert(pixel_cr_mask))
-
-            # Save the CR-cleaned median slope for this pixel
-            if not new_CR_found:  # the while loop ran at least one time
-                median_slopes[integration, row1[j], col1[j]] = pixel_med_diff
-
-        # Next pixel with an outlier (j loop)
+        number_pixels_with_cr = 0
+        for row_start in range(0, nrows, tile_rows):
+            row_stop = min(row_start + tile_rows, nrows)
+            tile_data = data[integration, :, row_start:row_stop]
+            tile_gdq = gdq[integration, :, row_start:row_stop]
+
+            # Reset saturated values and groups set to DO_NOT_USE in the input
+            # data array to NaN, so they don't get used in any of the
+            # subsequent calculations. For MIRI data the first and last group
+            # can be set to DO_NOT_USE.
+            tile_data[np.bitwise_and(tile_gdq, dqflags.group['SATURATED'] |
+                                     dqflags.group['DO_NOT_USE']) != 0] = np.NaN
+
+            # Compute first differences of adjacent groups up the ramp
+            first_diffs = first_diffs_buffer[:row_stop - row_start]
+            np.subtract(tile_data[1:], tile_data[:-1],
+                        out=first_diffs.transpose(2, 0, 1))
+            first_diffs[np.isnan(first_diffs)] = 100000.
+
+            positive_first_diffs = positive_diffs_buffer[:row_stop - row_start]
+            np.abs(first_diffs, out=positive_first_diffs)
+
+            # The first diffs for saturated groups are all equal to 100,000,
+            # which puts them above the good values in the sorted index.
+            # number_sat_groups is a 2D array with the count of saturated
+            # groups for each pixel
+            number_sat_groups = np.count_nonzero(positive_first_diffs == 100000.,
+                                                 axis=2)
+            # Here we sort the 3D array along the last axis which is the group
+            # axis. np.argsort returns a 3D array with the last axis containing
+            # the indexes that would yield the groups in order.
+            sort_index = np.argsort(positive_first_diffs, axis=2)
+            # median_diffs is a 2D array with the clipped median of each pixel
+            median_diffs = get_clipped_median(ndiffs, number_sat_groups,
+                                              first_diffs, sort_index)
+
+            # Save initial estimate of the median slope for all pixels
+            median_slopes[integration, row_start:row_stop] = median_diffs
+
+            # Compute uncertainties as the quadrature sum of the poisson noise
+            # in the first difference signal and read noise. Because the first
+            # differences can be biased by CRs/jumps, we use the median signal
+            # for computing the poisson noise. Here we lower the read noise
+            # by the square root of number of frames in the group.
+            # Sigma is a 2D array.
+            tile_read_noise_2 = read_noise_2[row_start:row_stop]
+            poisson_noise = np.sqrt(np.abs(median_diffs))
+            sigma = np.sqrt(poisson_noise * poisson_noise +
+                            tile_read_noise_2 / nframes)
+
+            # Reset sigma to exclude pixels with both readnoise and signal=0
+            sigma_0_pixels = np.where(sigma == 0.)
+            if len(sigma_0_pixels[0] > 0):
+                log.debug('Twopt found %d pixels with sigma=0' % (len(sigma_0_pixels[0])))
+                log.debug('which will be reset so that no jump will be detected')
+                sigma[sigma_0_pixels] = HUGE_NUM
+
+            # Get the group index for each pixel of the largest non-saturated
+            # difference, from the sorted group index. This is a 2-D array.
+            max_value_index = ndiffs - 1 - number_sat_groups
+            max_index1 = np.take_along_axis(
+                sort_index, max_value_index[:, :, np.newaxis], axis=2)
+
+            # Compute the distance of the largest non-saturated difference
+            # from the median in units of sigma; note that the use of "abs"
+            # means we'll detect both positive and negative outliers.
+            max_diffs = np.take_along_axis(first_diffs, max_index1, axis=2)[:, :, 0]
+            max_ratio = np.abs(max_diffs - median_diffs) / sigma
+
+            # Get the row and column indices of pixels whose largest
+            # non-saturated ratio is above the threshold
+            row1, col1 = np.where(max_ratio > rej_threshold)
+            number_pixels_with_cr += len(row1)
+            if len(row1) > 0:
+                cr_mask, med_diffs, no_new_cr = find_more_crs(
+                    first_diffs[row1, col1], sort_index[row1, col1],
+                    number_sat_groups[row1, col1], tile_read_noise_2[row1, col1],
+                    rej_threshold, nframes)
+
+                # Found all CRs for these pixels. Set CR flags in input DQ array
+                tile_gdq[1:, row1, col1] = \
+                    np.bitwise_or(tile_gdq[1:, row1, col1],
+                                  dqflags.group['JUMP_DET'] *
+                                  np.invert(cr_mask).transpose())
+
+                # Save the CR-cleaned median slope of the pixels for which the
+                # search for more CRs ran and found no further CR
+                median_slopes[integration, row_start + row1[no_new_cr],
+                              col1[no_new_cr]] = med_diffs[no_new_cr]
+        # Next tile of rows (tile loop)
+
+        log.info('From highest outlier Two point found %d pixels with at least one CR' % (number_pixels_with_cr))
     # Next integration (integration loop)
 
     return median_slopes, gdq
 
+def find_more_crs(diffs, sorted_index, sat_groups, read_noise_2, rej_threshold,
+                  nframes):
+    """
+    Look for additional CRs in pixels already known to contain one.
+
+    For all the pixels at once, the largest non-saturated difference is
+    flagged as a CR, then at each pass the clipped median of the pixels
+    still being searched is recomputed excluding the CRs found so far, and
+    the largest remaining difference of each pixel is flagged if it is above
+    the rejection threshold. A pixel is no longer searched once a pass finds
+    no new CR, or when too few differences are left; the passes end when no
+    pixel is being searched.
+
+    Parameters
+    ----------
+    diffs : float, 2D array
+        first differences of each pixel, [pixel, difference]
+
+    sorted_index : int, 2D array
+        indices that sort the absolute first differences of each pixel
+
+    sat_groups : int, 1D array
+        number of saturated differences of each pixel
+
+    read_noise_2 : float, 1D array
+        square of the read noise of each pixel
+
+    rej_threshold : float
+        CR rejection threshold, in sigma
+
+    nframes : int
+        number of frames averaged in a group
+
+    Returns
+    -------
+    cr_mask : bool, 2D array
+        False for the differences flagged as CRs, [pixel, difference]
+
+    med_diffs : float, 1D array
+        clipped median difference of each pixel at the last pass it was
+        searched
+
+    no_new_cr : bool, 1D array
+        True for the pixels whose last pass found no new CR, for which
+        med_diffs is the CR-cleaned median
+    """
+    npix, ndiffs = diffs.shape
+    pixels = np.arange(npix)
+
+    # Create a CR mask and set 1st CR to be found
+    # cr_mask=0 designates a CR
+    cr_mask = np.ones(diffs.shape, dtype=bool)
+    number_crs_found = np.ones(npix, dtype=np.intp)
+    cr_mask[pixels, sorted_index[pixels, ndiffs - sat_groups - 1]] = 0
+    new_cr_found = np.ones(npix, dtype=bool)
+    med_diffs = np.zeros(npix, dtype=diffs.dtype)
+
+    # Loop and see if there is more than one CR, setting the mask as you go
+    searched = pixels[(ndiffs - number_crs_found - sat_groups) > 1]
+    while searched.size > 0:
+        # For these pixels get a new median difference excluding the number
+        # of CRs found and the number of saturated groups
+        pix_ignore = number_crs_found[searched] + sat_groups[searched]
+        pix_diffs = diffs[searched]
+        pix_sorted_index = sorted_index[searched]
+        pix_med_diff = get_clipped_median(ndiffs, pix_ignore[:, np.newaxis],
+                                          pix_diffs[:, np.newaxis, :],
+                                          pix_sorted_index[:, np.newaxis, :])[:, 0]
+
+        # recalculate the noise and ratio for these pixels now that we have
+        # rejected a CR
+        pix_poisson_noise = np.sqrt(np.abs(pix_med_diff))
+        pix_sigma = np.sqrt(pix_poisson_noise * pix_poisson_noise +
+                            read_noise_2[searched] / nframes)
+        pix_sigma = pix_sigma.astype(np.result_type(pix_diffs.dtype,
+                                                    np.float32))
+        largest = pix_sorted_index[np.arange(searched.size),
+                                   ndiffs - pix_ignore - 1]
+        pix_ratio = (np.abs(pix_diffs[np.arange(searched.size), largest] -
+                            pix_med_diff) / pix_sigma)
+
+        # Check if largest remaining difference is above threshold
+        new_cr = pix_ratio > rej_threshold
+        new_cr_found[searched] = new_cr
+        med_diffs[searched] = pix_med_diff
+        cr_mask[searched[new_cr], largest[new_cr]] = 0
+        number_crs_found[searched[new_cr]] += 1
+
+        searched = searched[new_cr]
+        searched = searched[(ndiffs - number_crs_found[searched] -
+                             sat_groups[searched]) > 1]
+
+    # new_cr_found is still True for the pixels never searched
+    no_new_cr = np.logical_not(new_cr_found)
+
+    return cr_mask, med_diffs, no_new_cr
+
 
 def get_clipped_median(num_differences, diffs_to_ignore, differences, sorted_index):
     """
@@ -189,25 +267,25 @@ def get_clipped_median(num_differences, diffs_to_ignore, differences, sorted_ind
         # Get the index of the median value always excluding the highest value
         # In addition, decrease the index by 1 for every two diffs_to_ignore,
         # these will be saturated values in this case
-        row, col = np.indices(diffs_to_ignore.shape)
-        pixel_med_index = sorted_index[row, col, (num_differences - (diffs_to_ignore[row, col] + 1))//2]
-        pixel_med_diff = differences[row, col, pixel_med_index]
-
+        median_position = (num_differences - (diffs_to_ignore + 1)) // 2
+        pixel_med_index = np.take_along_axis(
+            sorted_index, median_position[..., np.newaxis], axis=-1)
+        pixel_med_diff = np.take_along_axis(differences, pixel_med_index, axis=-1)[..., 0]
 
         # For pixels with an even number of differences the median is the mean of the two central values.
         # So we need to get the value the other central difference one lower in the sorted index that the one found
-        # above.
-        even_group_rows, even_group_cols = np.where((num_differences - diffs_to_ignore - 1) % 2 == 0)
-        pixel_med_index2 = np.zeros_like(pixel_med_index)
-        pixel_med_index2[even_group_rows, even_group_cols] = sorted_index[even_group_rows,
-                                                                          even_group_cols,
-                                                                          (num_differences
-                                                                           - (diffs_to_ignore[even_group_rows,
-                                                                                              even_group_cols] + 3))//2]
-        # Average together the two central values
-        pixel_med_diff[even_group_rows, even_group_cols] = (pixel_med_diff[even_group_rows, even_group_cols] +
-                                                            differences[even_group_rows, even_group_cols,
-                                                            pixel_med_index2[even_group_rows, even_group_cols]])/2.0
+        # above.  Only the pixels with an even number of differences are
+        # moved down, as median_position - 1 may be out of range for others.
+        even_group = (num_differences - diffs_to_ignore - 1) % 2 == 0
+        if np.any(even_group):
+            lower_position = np.where(even_group, median_position - 1,
+                                      median_position)
+            pixel_med_index2 = np.take_along_axis(
+                sorted_index, lower_position[..., np.newaxis], axis=-1)
+            pixel_med_diff2 = np.take_along_axis(differences, pixel_med_index2, axis=-1)[..., 0]
+            # Average together the two central values
+            pixel_med_diff[even_group] = (pixel_med_diff[even_group] +
+                                          pixel_med_diff2[even_group]) / 2.0
 
     # The 1-D array case is a lot simplier.
     else:
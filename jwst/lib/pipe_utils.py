@@ -1,10 +1,20 @@
 """Pipeline utilities objects"""
+import logging
+import multiprocessing
 
 import numpy as np
 
 from ..associations.lib.dms_base import TSO_EXP_TYPES
 from ..datamodels import CubeModel
 
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python < 3.8
+    shared_memory = None
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
 # Model types that typically represent TSO's
 TSO_MODEL_TYPES = (CubeModel,)
 
@@ -83,3 +93,77 @@ def is_irs2(model):
         return True
     else:
         return False
+
+
+def number_of_processes(maximum_cores):
+    """ Number of processes to use for a maximum_cores step parameter
+
+    Parameters
+    ----------
+    maximum_cores : str or None
+       None, 'quarter', 'half' or 'all' of the available cores
+
+    Returns
+    -------
+    number of processes, at least 1
+    """
+    if maximum_cores is None:
+        return 1
+    num_cores = multiprocessing.cpu_count()
+    log.info("Found %d possible cores to use", num_cores)
+    if maximum_cores == 'quarter':
+        return num_cores // 4 or 1
+    elif maximum_cores == 'half':
+        return num_cores // 2 or 1
+    elif maximum_cores == 'all':
+        return num_cores
+    return 1
+
+
+def create_shared_array(shape, dtype):
+    """ Create an array in a new block of shared memory
+
+    The block should be given to release_shared_memory once all the views
+    of it, including the returned array, are deleted.
+
+    Parameters
+    ----------
+    shape : tuple
+       shape of the array
+    dtype : data-type
+       type of the array elements
+
+    Returns
+    -------
+    shm, arr : SharedMemory, ndarray
+       the shared memory block and an uninitialized array using it
+    """
+    dtype = np.dtype(dtype)
+    nbytes = int(np.prod(shape)) * dtype.itemsize
+    shm = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def to_shared_memory(arr):
+    """ Copy an array to a new block of shared memory
+
+    Parameters
+    ----------
+    arr : ndarray
+       array to copy
+
+    Returns
+    -------
+    shm : SharedMemory
+       shared memory block holding a copy of arr
+    """
+    shm, shared_arr = create_shared_array(arr.shape, arr.dtype)
+    shared_arr[...] = arr
+    del shared_arr
+    return shm
+
+
+def release_shared_memory(shm):
+    """ Close and free a shared memory block created by this process """
+    shm.close()
+    shm.unlink()
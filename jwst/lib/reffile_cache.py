@@ -0,0 +1,237 @@
+"""Cache of the reference file models used by the detector1 steps"""
+import logging
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from . import reffile_utils
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+
+class ReferenceModelCache():
+
+    def __init__(self, max_bytes=2**31):
+        """ Least recently used cache of reference file models
+
+        The models are stored by reference file path and, for models cut to
+        a science subarray, by subarray (see reference_model_key), so the
+        exposures of a program processed in the same process only open and
+        cut each reference file once. Models larger than max_bytes are not
+        stored.
+
+        Parameters
+        ----------
+        max_bytes : int
+           maximum size of the arrays held in the cache. The least recently
+           used models are dropped when the cache grows beyond this size.
+        """
+        self.max_bytes = max_bytes
+        self.models = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """ Return the model stored under key, or None """
+        model = self.models.get(key)
+        if model is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.models.move_to_end(key)
+        return model
+
+    def put(self, key, model):
+        """ Store a model under key, dropping the oldest models if needed
+
+        A model larger than max_bytes is not stored.
+        """
+        if key in self.models:
+            self.nbytes -= _model_nbytes(self.models.pop(key))
+        nbytes = _model_nbytes(model)
+        if nbytes > self.max_bytes:
+            return
+        self.models[key] = model
+        self.nbytes += nbytes
+        self._shrink()
+
+    def resize(self, max_bytes):
+        """ Set the maximum size, dropping the oldest models if needed """
+        self.max_bytes = max_bytes
+        self._shrink()
+
+    def _shrink(self):
+        while self.nbytes > self.max_bytes:
+            oldkey, oldmodel = self.models.popitem(last=False)
+            self.nbytes -= _model_nbytes(oldmodel)
+            oldmodel.close()
+
+    def holds(self, model):
+        """ TRUE if model is stored in the cache """
+        return any(value is model for value in self.models.values())
+
+    def clear(self):
+        """ Remove all the models from the cache """
+        for model in self.models.values():
+            model.close()
+        self.models.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+
+# caches shared by the exposures processed in this process, by name
+_caches = {}
+
+
+def get_cache(name, max_bytes):
+    """ Get the named reference model cache, with a size of max_bytes
+
+    Parameters
+    ----------
+    name : str
+       name of the cache, usually that of the step using it
+    max_bytes : int
+       maximum size of the arrays held in the cache. If 0, caching is
+       turned off: the cache is emptied and None is returned.
+
+    Returns
+    -------
+    cache : ReferenceModelCache or None
+       the cache, created when first used, or None if max_bytes is 0
+    """
+    cache = _caches.get(name)
+    if max_bytes is None or max_bytes <= 0:
+        if cache is not None:
+            cache.clear()
+            del _caches[name]
+        return None
+    if cache is None:
+        cache = _caches[name] = ReferenceModelCache(max_bytes)
+    else:
+        cache.resize(max_bytes)
+    return cache
+
+
+def _model_arrays(model):
+    return [value for key, value in model.items()
+            if isinstance(value, np.ndarray)]
+
+
+def _model_nbytes(model):
+    return sum(value.nbytes for value in _model_arrays(model))
+
+
+def reference_model_key(sci_model, ref_name, model_class, subarray):
+    """ Key identifying a reference model in the cache
+
+    Parameters
+    ----------
+    sci_model : JWST data model
+       science data model
+    ref_name : str
+       path of the reference file
+    model_class : type
+       data model class used to open the reference file
+    subarray : boolean
+       if TRUE the model is cut to the subarray of the science data
+
+    Returns
+    -------
+    key : tuple
+       the absolute path and modification time of the reference file, the
+       model class and, if subarray is TRUE, the subarray parameters and
+       data shape of the science data
+    """
+    path = os.path.abspath(ref_name)
+    key = (path, os.path.getmtime(path), model_class.__name__)
+    if subarray:
+        sub = sci_model.meta.subarray
+        key += (sub.xstart, sub.ystart, sub.xsize, sub.ysize,
+                sci_model.data.shape[-2:])
+    return key
+
+
+def get_reference_model(sci_model, ref_name, model_class, subarray=True,
+                        cache=None):
+    """ Open a reference file, or get it from a reference model cache
+
+    Without a cache, the reference file is just opened. With a cache, if
+    subarray is TRUE and the reference file does not match the subarray
+    of the science data, the model is cut to that subarray and its subarray
+    metadata are set to those of the science data, so that
+    reffile_utils.ref_matches_sci is TRUE for the returned model.
+
+    The arrays of a model from a cache are read-only, as the model is
+    shared with the later exposures using the same reference file. The
+    model should be given to release_reference_model once used, rather
+    than closed.
+
+    Parameters
+    ----------
+    sci_model : JWST data model
+       science data model
+    ref_name : str or JWST data model
+       path of the reference file. A data model, as given by a reference
+       file override, is not cached or cut to the science subarray.
+    model_class : type
+       data model class used to open the reference file
+    subarray : boolean
+       if TRUE cut the reference model to the subarray of the science data.
+       This is only supported for the model types handled by
+       reffile_utils.get_subarray_model.
+    cache : ReferenceModelCache or None
+       cache in which the model is looked up and stored, or None to not
+       cache the model
+
+    Returns
+    -------
+    ref_model : JWST data model
+    """
+    # Models given as step overrides are used as they are
+    if cache is None or not isinstance(ref_name, str):
+        return model_class(ref_name)
+
+    key = reference_model_key(sci_model, ref_name, model_class, subarray)
+    ref_model = cache.get(key)
+    if ref_model is not None:
+        log.debug('Using cached reference model for %s (%d hits, %d misses)',
+                  ref_name, cache.hits, cache.misses)
+        return ref_model
+
+    ref_model = model_class(ref_name)
+    if subarray and not reffile_utils.ref_matches_sci(sci_model, ref_model):
+        log.info('Extracting reference file subarray to match science data')
+        sub_model = reffile_utils.get_subarray_model(sci_model, ref_model)
+        if sub_model is not None:
+            # Copy the subarrays, so the cache does not hold on to the full
+            # reference arrays
+            sub_model = sub_model.copy()
+            sub_model.meta.subarray.xstart = sci_model.meta.subarray.xstart
+            sub_model.meta.subarray.ystart = sci_model.meta.subarray.ystart
+            sub_model.meta.subarray.xsize = sci_model.meta.subarray.xsize
+            sub_model.meta.subarray.ysize = sci_model.meta.subarray.ysize
+            ref_model.close()
+            ref_model = sub_model
+
+    for value in _model_arrays(ref_model):
+        value.flags.writeable = False
+    cache.put(key, ref_model)
+    return ref_model
+
+
+def release_reference_model(ref_model, cache):
+    """ Close a reference model, unless it is held by the cache
+
+    Parameters
+    ----------
+    ref_model : JWST data model
+       model returned by get_reference_model
+    cache : ReferenceModelCache or None
+       cache given to get_reference_model
+    """
+    if cache is None or not cache.holds(ref_model):
+        ref_model.close()
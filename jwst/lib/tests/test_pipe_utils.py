@@ -98,3 +98,10 @@ def test_is_irs2_2():
     x = np.ones((3200, 2), dtype=np.float32)
     model = datamodels.ImageModel(data=x)
     assert pipe_utils.is_irs2(model)
+
+
+@pytest.mark.parametrize("maximum_cores, expected",
+                         [(None, 1), ('quarter', 2), ('half', 4), ('all', 8)])
+def test_number_of_processes(monkeypatch, maximum_cores, expected):
+    monkeypatch.setattr(pipe_utils.multiprocessing, 'cpu_count', lambda: 8)
+    assert pipe_utils.number_of_processes(maximum_cores) == expected
@@ -0,0 +1,135 @@
+"""Test the cache of reference file models"""
+import numpy as np
+import pytest
+
+from jwst.datamodels import RampModel, SaturationModel
+from jwst.lib import reffile_cache, reffile_utils
+
+
+def make_sci(xstart=11, ystart=5, xsize=30, ysize=20):
+    """MIRI science subarray"""
+    sci = RampModel((1, 2, ysize, xsize))
+    sci.meta.instrument.name = 'MIRI'
+    sci.meta.subarray.xstart = xstart
+    sci.meta.subarray.ystart = ystart
+    sci.meta.subarray.xsize = xsize
+    sci.meta.subarray.ysize = ysize
+    return sci
+
+
+def make_ref(tmpdir):
+    """MIRI full frame saturation reference file"""
+    ref = SaturationModel((1024, 1032))
+    ref.data[:] = np.arange(1032)
+    ref.dq[:] = np.arange(1024)[:, np.newaxis]
+    ref.meta.instrument.name = 'MIRI'
+    ref.meta.subarray.xstart = 1
+    ref.meta.subarray.ystart = 1
+    ref.meta.subarray.xsize = 1032
+    ref.meta.subarray.ysize = 1024
+    ref_name = str(tmpdir.join('saturation.fits'))
+    ref.save(ref_name)
+    return ref_name
+
+
+def test_subarray_model_cached(tmpdir):
+    """The cut reference model matches the science data and is reused"""
+    sci = make_sci()
+    ref_name = make_ref(tmpdir)
+    cache = reffile_cache.ReferenceModelCache()
+
+    ref_model = reffile_cache.get_reference_model(sci, ref_name,
+                                                  SaturationModel, cache=cache)
+    assert ref_model.data.shape == (20, 30)
+    assert reffile_utils.ref_matches_sci(sci, ref_model)
+    np.testing.assert_array_equal(ref_model.data[0], np.arange(10, 40))
+    np.testing.assert_array_equal(ref_model.dq[:, 0], np.arange(4, 24))
+    with pytest.raises(ValueError):
+        ref_model.data[0, 0] = 0.
+
+    assert reffile_cache.get_reference_model(
+        sci, ref_name, SaturationModel, cache=cache) is ref_model
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.nbytes == ref_model.data.nbytes + ref_model.dq.nbytes
+
+    # another subarray, and the full model, are separate entries
+    other_model = reffile_cache.get_reference_model(
+        make_sci(xstart=1), ref_name, SaturationModel, cache=cache)
+    np.testing.assert_array_equal(other_model.data[0], np.arange(30))
+    full_model = reffile_cache.get_reference_model(
+        sci, ref_name, SaturationModel, subarray=False, cache=cache)
+    assert full_model.data.shape == (1024, 1032)
+    assert (cache.hits, cache.misses) == (1, 3)
+
+
+def test_cache_size_bound(tmpdir):
+    """The least recently used models are dropped first"""
+    ref_name = make_ref(tmpdir)
+    nbytes = 20 * 30 * 8
+    cache = reffile_cache.ReferenceModelCache(max_bytes=2 * nbytes)
+
+    models = [reffile_cache.get_reference_model(
+        make_sci(xstart=xstart), ref_name, SaturationModel,
+        cache=cache) for xstart in (1, 2, 3)]
+    assert len(cache.models) == 2
+    assert cache.nbytes == 2 * nbytes
+
+    # the first model was dropped, the last two are still cached
+    assert reffile_cache.get_reference_model(
+        make_sci(xstart=3), ref_name, SaturationModel,
+        cache=cache) is models[2]
+    assert reffile_cache.get_reference_model(
+        make_sci(xstart=1), ref_name, SaturationModel,
+        cache=cache) is not models[0]
+
+    cache.clear()
+    assert len(cache.models) == 0
+    assert cache.nbytes == 0
+
+
+def test_oversize_model_not_cached(tmpdir):
+    """A model larger than the cache is used, but not stored"""
+    ref_name = make_ref(tmpdir)
+    cache = reffile_cache.ReferenceModelCache(max_bytes=20 * 30 * 8)
+
+    small_model = reffile_cache.get_reference_model(
+        make_sci(), ref_name, SaturationModel, cache=cache)
+    full_model = reffile_cache.get_reference_model(
+        make_sci(), ref_name, SaturationModel, subarray=False, cache=cache)
+    assert full_model.data.shape == (1024, 1032)
+    assert cache.holds(small_model)
+    assert not cache.holds(full_model)
+    assert cache.nbytes == 20 * 30 * 8
+
+
+def test_cache_off(tmpdir):
+    """Without a cache, the reference file is just opened"""
+    ref_name = make_ref(tmpdir)
+    assert reffile_cache.get_cache('test', 0) is None
+
+    ref_model = reffile_cache.get_reference_model(make_sci(), ref_name,
+                                                  SaturationModel)
+    assert ref_model.data.shape == (1024, 1032)
+    assert ref_model.data.flags.writeable
+    reffile_cache.release_reference_model(ref_model, None)
+
+
+def test_named_cache(tmpdir):
+    """Named caches are kept between calls and resized"""
+    ref_name = make_ref(tmpdir)
+    nbytes = 20 * 30 * 8
+    cache = reffile_cache.get_cache('test', 2 * nbytes)
+    assert reffile_cache.get_cache('test', 2 * nbytes) is cache
+
+    for xstart in (1, 2):
+        reffile_cache.get_reference_model(
+            make_sci(xstart=xstart), ref_name, SaturationModel, cache=cache)
+    assert len(cache.models) == 2
+    assert reffile_cache.get_cache('test', nbytes) is cache
+    assert len(cache.models) == 1
+
+    # turning the cache off empties it
+    assert reffile_cache.get_cache('test', 0) is None
+    assert len(cache.models) == 0
+    assert reffile_cache.get_cache('test', nbytes) is not cache
+    reffile_cache.get_cache('test', 0)
@@ -1,15 +1,26 @@
 from ..datamodels import dqflags
 from ..lib import reffile_utils
+from ..lib.reffile_cache import reference_model_key
 from .linearity_func import apply_linearity_func
 
+from collections import OrderedDict
+
 import numpy as np
 import logging
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
+# Number of reference files whose prepared coefficients are kept
+MAX_CACHED_COEFFS = 2
+
+# Prepared coefficients and NaN coefficient flags, by reference file path
+# and modification time and science subarray; the least recently used
+# entries are dropped first
+_coeffs_cache = OrderedDict()
+
 
-def do_correction(input_model, lin_model):
+def do_correction(input_model, lin_model, lin_name=None):
     """
     Short Summary
     -------------
@@ -23,6 +34,10 @@ def do_correction(input_model, lin_model):
     lin_model: linearity model object
         linearity reference file data model
 
+    lin_name: string
+        path of the linearity reference file, used to cache the prepared
+        coefficients; if None they are not cached
+
     Returns
     -------
     output_model: data model object
@@ -36,7 +51,7 @@ def do_correction(input_model, lin_model):
     propagate_dq_info(output_model, lin_model)
 
     # Apply the linearity correction coeffs to the science data
-    apply_linearity(output_model, lin_model)
+    apply_linearity(output_model, lin_model, lin_name)
 
     return output_model
 
@@ -74,7 +89,7 @@ def propagate_dq_info(input, linearity_ref_model):
     input.pixeldq = np.bitwise_or(input.pixeldq, lindq)
 
 
-def apply_linearity(input, linearity_ref_model):
+def apply_linearity(input, linearity_ref_model, lin_name=None):
     """
     Short Summary
     -------------
@@ -89,37 +104,99 @@ def apply_linearity(input, linearity_ref_model):
 
     linearity_ref_model: linearity reference file model object
 
+    lin_name: string
+        path of the linearity reference file, or None
+
     Returns
     -------
     """
 
-    ramp = input.data
+    # The ramp is corrected in place; without an expanded DQ array all the
+    # groups are corrected
     dq = input.groupdq
-
-    # If the input data does not have an expanded DQ array, create one
     if len(dq) == 0:
-        dq = (ramp * 0).astype(np.uint32)
+        dq = None
+
+    lin_coeffs = get_coeffs(input, linearity_ref_model, lin_name)
+
+    # Get the DQ bit value that represents saturation
+    sat_val = dqflags.group['SATURATED']
+
+    # Apply the correction function
+    apply_linearity_func(input.data, dq, lin_coeffs, sat_val)
+
+
+def get_coeffs(input, linearity_ref_model, lin_name=None):
+    """
+    Short Summary
+    -------------
+    Get the linearity coefficients for the science data, with the
+    coefficients of the pixels flagged NO_LIN_CORR in the reference file or
+    having NaN coefficients set to leave the data unchanged, and flag the
+    pixels with NaN coefficients in the pixeldq of the science data.
+
+    The prepared coefficients are cached by reference file path and
+    modification time and by science subarray, as the reference models are
+    by reffile_cache.reference_model_key, so later exposures using the same
+    reference file skip the preparation. They are not cached without the
+    reference file path.
+
+    Parameters
+    ----------
+    input: data model object
+        science data model to be corrected
+
+    linearity_ref_model: linearity reference file model object
+
+    lin_name: string
+        path of the linearity reference file, or None
+
+    Returns
+    -------
+    lin_coeffs: 3D array
+        float32 array of correction coefficients; it is shared with the
+        cache and should not be modified
+    """
+    key = None
+    if isinstance(lin_name, str):
+        key = reference_model_key(input, lin_name, type(linearity_ref_model),
+                                  True) + (linearity_ref_model.coeffs.shape,)
+
+    if key in _coeffs_cache:
+        _coeffs_cache.move_to_end(key)
+        lin_coeffs, nan_array = _coeffs_cache[key]
+        log.debug('Using cached coefficients of %s', key[0])
+        if nan_array is not None:
+            input.pixeldq = np.bitwise_or(input.pixeldq, nan_array)
+        return lin_coeffs
 
     # Check for subarray mode
     if reffile_utils.ref_matches_sci(input, linearity_ref_model):
-        lin_coeffs = linearity_ref_model.coeffs
+        lin_coeffs = linearity_ref_model.coeffs.astype(np.float32)
         lin_dq = linearity_ref_model.dq
     else:
         sub_lin_model = reffile_utils.get_subarray_model(input, linearity_ref_model)
-        lin_coeffs = sub_lin_model.coeffs.copy()
+        lin_coeffs = sub_lin_model.coeffs.astype(np.float32)
         lin_dq = sub_lin_model.dq.copy()
 
     # Check for NO_LIN_CORR flags in the DQ extension of the ref file
     lin_coeffs = correct_for_flag(lin_coeffs, lin_dq)
 
     # Check for NaNs in the COEFFS extension of the ref file
+    nan_pixels = np.isnan(lin_coeffs).any(axis=0)
     lin_coeffs = correct_for_NaN(lin_coeffs, input)
 
-    # Get the DQ bit value that represents saturation
-    sat_val = dqflags.group['SATURATED']
+    if key is not None:
+        nan_array = None
+        if nan_pixels.any():
+            nan_array = np.where(nan_pixels, dqflags.pixel['NO_LIN_CORR'],
+                                 0).astype(np.uint32)
+        lin_coeffs.flags.writeable = False
+        _coeffs_cache[key] = (lin_coeffs, nan_array)
+        while len(_coeffs_cache) > MAX_CACHED_COEFFS:
+            _coeffs_cache.popitem(last=False)
 
-    # Apply the correction function
-    input.data = apply_linearity_func(ramp, dq, lin_coeffs, sat_val)
+    return lin_coeffs
 
 
 def correct_for_NaN(lin_coeffs, input):
@@ -146,22 +223,18 @@ def correct_for_NaN(lin_coeffs, input):
         updated array of correction coefficients in reference file
     """
 
-    wh_nan = np.where(np.isnan(lin_coeffs))
-    znan, ynan, xnan = wh_nan[0], wh_nan[1], wh_nan[2]
-    num_nan = 0
+    ynan, xnan = np.where(np.isnan(lin_coeffs).any(axis=0))
 
     nan_array = np.zeros((lin_coeffs.shape[1], lin_coeffs.shape[2]),
                          dtype=np.uint32)
 
     # If there are NaNs as the correction coefficients, update those
     # coefficients so that those SCI values will be unchanged.
-    if len(znan) > 0:
+    if len(ynan) > 0:
         ben_cor = ben_coeffs(lin_coeffs) # get benign coefficients
-        num_nan = len(znan)
 
-        for ii in range(num_nan):
-            lin_coeffs[:, ynan[ii], xnan[ii]] = ben_cor
-            nan_array[ynan[ii], xnan[ii]] = dqflags.pixel['NO_LIN_CORR']
+        lin_coeffs[:, ynan, xnan] = ben_cor[:, np.newaxis]
+        nan_array[ynan, xnan] = dqflags.pixel['NO_LIN_CORR']
 
         # Include these pixels in the output pixeldq
         input.pixeldq = np.bitwise_or(input.pixeldq, nan_array)
@@ -198,18 +271,14 @@ def correct_for_flag(lin_coeffs, lin_dq):
     """
 
     wh_flag = np.bitwise_and(lin_dq, dqflags.pixel['NO_LIN_CORR'])
-    num_flag = len(np.where(wh_flag > 0)[0])
-
-    wh_lin = np.where(wh_flag == dqflags.pixel['NO_LIN_CORR'])
-    yf, xf = wh_lin[0], wh_lin[1]
+    yf, xf = np.where(wh_flag == dqflags.pixel['NO_LIN_CORR'])
 
     # If there are pixels flagged as 'NO_LIN_CORR', update the corresponding
     #     coefficients so that those SCI values will be unchanged.
-    if (num_flag > 0):
+    if len(yf) > 0:
         ben_cor = ben_coeffs(lin_coeffs) # get benign coefficients
 
-        for ii in range(num_flag):
-            lin_coeffs[:, yf[ii], xf[ii]] = ben_cor
+        lin_coeffs[:, yf, xf] = ben_cor[:, np.newaxis]
 
         log.debug("Pixels were flagged in the DQ of the reference file as"
                   " NO_LIN_CORR ('Linearity correction not available'); for"
@@ -5,12 +5,17 @@ log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
 
+# Maximum size of the scratch array holding the corrected groups
+CHUNK_BYTES = 2**22
+
+
 def apply_linearity_func(ramparr, dqarr, coeffarr, dq_flag):
     """
     Short Summary
     -------------
     Apply linearity correction to individual groups in ramparr where dq
     has not been flagged as saturated in the saturation step with dq_flag.
+    The ramp is corrected in place, a chunk of groups at a time.
 
     Reference:
     http://www.stsci.edu/hst/wfc3/documents/handbooks/currentDHB/wfc3_Ch606.html
@@ -23,7 +28,8 @@ def apply_linearity_func(ramparr, dqarr, coeffarr, dq_flag):
     ----------
     ramparr: 4D array containing ramp data
 
-    dqarr: 4D array containing DQ information
+    dqarr: 4D array containing DQ information, or None if the ramp has
+           no group DQ, in which case all the groups are corrected
 
     coeffarr: 3D array containing pixel-by-pixel linearity coefficient values
               for each term in the polynomial fit.
@@ -43,25 +49,39 @@ def apply_linearity_func(ramparr, dqarr, coeffarr, dq_flag):
     # Number of coeffs is equal to the number of planes in coeff cube
     ncoeffs = coeffarr.shape[0]
 
+    # Number of groups corrected at once, and the scratch array in which
+    # the polynomial is evaluated
+    dtype = np.result_type(ramparr.dtype, coeffarr.dtype)
+    nchunk = max(1, min(ngroups, CHUNK_BYTES // (nrows * ncols * dtype.itemsize)))
+    scratch = np.empty((nchunk, nrows, ncols), dtype=dtype)
+
     # Apply the linearity correction one integration at a time.
     for ints in range(nints):
 
-        # Apply the linearity correction one group at a time
-        for plane in range(ngroups):
-
-            # Accumulate the polynomial terms into the corrected counts
-            scorr = coeffarr[ncoeffs - 1] * ramparr[ints, plane]
+        # Apply the linearity correction to a chunk of groups at a time
+        for first in range(0, ngroups, nchunk):
+            last = min(first + nchunk, ngroups)
+            groups = ramparr[ints, first:last]
+            scorr = scratch[:last - first]
+
+            # Only use the corrected signal where the original signal value
+            # has not been flagged by the saturation step.
+            # Otherwise keep the original signal.
+            if dqarr is None:
+                correct = True
+            else:
+                correct = np.bitwise_and(dqarr[ints, first:last], dq_flag) == 0
+                if not correct.any():
+                    continue
+
+            # Accumulate the polynomial terms into the corrected counts,
+            # using Horner's scheme
+            np.multiply(coeffarr[ncoeffs - 1], groups, out=scorr)
             for j in range(ncoeffs - 2, 0, -1):
-                scorr = (scorr + coeffarr[j]) * ramparr[ints, plane]
-            scorr = coeffarr[0] + scorr
-
-           # Only use the corrected signal where the original signal value
-           # has not been flagged by the saturation step.
-           # Otherwise use the original signal.
-            ramparr[ints, plane, :, :] = \
-                np.where(np.bitwise_and(dqarr[ints, plane, :, :], dq_flag),\
-                        ramparr[ints, plane, :, :], scorr)
+                np.add(scorr, coeffarr[j], out=scorr)
+                np.multiply(scorr, groups, out=scorr)
+            np.add(coeffarr[0], scorr, out=scorr)
 
-    del scorr
+            np.copyto(groups, scorr, where=correct)
 
     return ramparr
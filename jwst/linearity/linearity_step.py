@@ -1,5 +1,6 @@
 from ..stpipe import Step
 from .. import datamodels
+from ..lib import reffile_cache
 from . import linearity
 
 __all__ = ["LinearityStep"]
@@ -11,6 +12,10 @@ class LinearityStep(Step):
     detector response, using the "classic" polynomial method.
     """
 
+    spec = """
+        reference_cache_size = integer(default=0) # Bytes of reference models cached for later exposures, 0 for none
+    """
+
     reference_file_types = ['linearity']
 
 
@@ -31,14 +36,20 @@ class LinearityStep(Step):
                 result.meta.cal_step.linearity = 'SKIPPED'
                 return result
 
-            # Open the linearity reference file data model
-            lin_model = datamodels.LinearityModel(self.lin_name)
+            # Get the linearity reference file data model, from the
+            # reference model cache if reference_cache_size is set
+            cache = reffile_cache.get_cache('linearity',
+                                            self.reference_cache_size)
+            lin_model = reffile_cache.get_reference_model(
+                input_model, self.lin_name, datamodels.LinearityModel,
+                cache=cache)
 
             # Do the linearity correction
-            result = linearity.do_correction(input_model, lin_model)
+            result = linearity.do_correction(input_model, lin_model,
+                                             self.lin_name)
 
             # Close the reference file and update the step status
-            lin_model.close()
+            reffile_cache.release_reference_model(lin_model, cache)
             result.meta.cal_step.linearity = 'COMPLETE'
 
         return result
@@ -3,7 +3,9 @@
 Authors:
     M. Cracraft
 """
-from jwst.linearity import LinearityStep
+import pytest
+
+from jwst.linearity import LinearityStep, linearity, linearity_func
 from jwst.linearity.linearity import do_correction as lincorr
 from jwst.datamodels import dqflags, LinearityModel, RampModel
 import numpy as np
@@ -295,6 +297,55 @@ def test_err_array():
     np.testing.assert_allclose(im.err, outfile.err)
 
 
+def test_chunks_and_coeffs_cache(monkeypatch, tmpdir):
+    """Check that the correction does not depend on the number of groups
+    corrected at once, and that the cached coefficients of a reference file
+    give the same result, including the NO_LIN_CORR flags of NaN coefficients"""
+
+    nints, ngroups, ysize, xsize = 2, 7, 20, 30
+    im = make_rampmodel(nints, ngroups, ysize, xsize)
+    im.meta.instrument.detector = 'MIRIMAGE'
+    im.data[:] = np.random.RandomState(5).uniform(0, 40000, im.data.shape)
+    im.groupdq[0, 4:, 3, 4] = dqflags.group['SATURATED']
+    im.groupdq[1, :, 5, :] = dqflags.group['SATURATED']
+
+    ref_model = LinearityModel((4, ysize, xsize))
+    ref_model.dq = np.zeros((ysize, xsize), dtype=int)
+    ref_model.coeffs[:] = np.array([0.0, 0.85, 4.62e-06, -6.16e-11])[:, None, None]
+    ref_model.coeffs[2, 10, 10] = np.nan
+    ref_model.meta.subarray.xstart = 1
+    ref_model.meta.subarray.ystart = 1
+    ref_model.meta.subarray.xsize = xsize
+    ref_model.meta.subarray.ysize = ysize
+    lin_name = str(tmpdir.join('test_linearity.fits'))
+    ref_model.save(lin_name)
+
+    monkeypatch.setattr(linearity, '_coeffs_cache', type(linearity._coeffs_cache)())
+    expected = lincorr(im, ref_model, lin_name)
+    assert len(linearity._coeffs_cache) == 1
+    assert next(iter(linearity._coeffs_cache))[0] == lin_name
+
+    # not cached without the reference file path
+    lincorr(im, ref_model)
+    assert len(linearity._coeffs_cache) == 1
+
+    # one group at a time, with the coefficients from the cache
+    monkeypatch.setattr(linearity_func, 'CHUNK_BYTES', 1)
+    result = lincorr(im, ref_model, lin_name)
+    assert len(linearity._coeffs_cache) == 1
+
+    np.testing.assert_array_equal(result.data, expected.data)
+    np.testing.assert_array_equal(result.pixeldq, expected.pixeldq)
+    assert result.pixeldq[10, 10] == dqflags.pixel['NO_LIN_CORR']
+    assert result.data[0, 3, 10, 10] == im.data[0, 3, 10, 10]
+    assert result.data[0, 3, 3, 4] != im.data[0, 3, 3, 4]
+    assert result.data[0, 5, 3, 4] == im.data[0, 5, 3, 4]
+    np.testing.assert_array_equal(result.data[1, :, 5], im.data[1, :, 5])
+    assert result.data[0, 2, 6, 7] == pytest.approx(
+        0.85 * im.data[0, 2, 6, 7] + 4.62e-06 * im.data[0, 2, 6, 7]**2
+        - 6.16e-11 * im.data[0, 2, 6, 7]**3, rel=1e-5)
+
+
 def make_rampmodel(nints, ngroups, ysize, xsize):
     """Function to provide ramp model to tests"""
 
@@ -1,6 +1,10 @@
 """Primary code for performing outlier detection on JWST observations."""
 
 from functools import partial
+import multiprocessing
+import os
+import tempfile
+
 import numpy as np
 
 from stsci.image import median
@@ -9,6 +13,7 @@ from scipy import ndimage
 from drizzle.cdrizzle import tblot
 
 from .. import datamodels
+from ..lib.pipe_utils import number_of_processes
 from ..resample import resample
 from ..resample.resample_utils import build_driz_weight, calc_gwcs_pixmap
 from ..stpipe.step import Step
@@ -19,6 +24,14 @@ log.setLevel(logging.DEBUG)
 
 CRBIT = np.uint32(datamodels.dqflags.pixel['JUMP_DET'])
 
+# Median image and input models shared with the forked processes created by
+# OutlierDetection.iter_blot_median
+_parallel_args = None
+
+# Approximate size of the block of rows of the stack of resampled images
+# combined at once, when the stack is not held in memory
+CHUNK_BYTES = 2**27
+
 
 __all__ = ["OutlierDetection", "flag_cr", "abs_deriv"]
 
@@ -182,7 +195,31 @@ class OutlierDetection:
 
         pars = self.outlierpars
         save_intermediate_results = pars['save_intermediate_results']
-        if pars['resample_data']:
+        if pars['resample_data'] and not pars.get('in_memory', True):
+            # Create the resampled/mosaic image of each group of exposures
+            # in turn, and only keep it in the on-disk stack used to create
+            # the median image
+            sdriz = resample.ResampleData(self.input_models, single=True,
+                                          blendheaders=False, **pars)
+            groups = sdriz.drizzle_groups()
+            stack = None
+            for group in groups:
+                model = sdriz.drizzle_group(*group)
+                if save_intermediate_results:
+                    log.info("Writing out resampled exposures...")
+                    self.save_model(
+                        model,
+                        output_file=model.meta.filename,
+                        suffix=self.resample_suffix
+                    )
+                if stack is None:
+                    stack = ResampledStack(len(groups), model.data.shape,
+                                           model.data.dtype,
+                                           maskpt=pars.get('maskpt', 0.7))
+                    drizzled_models = [model]
+                stack.append(model)
+                del model
+        elif pars['resample_data']:
             # Start by creating resampled/mosaic images for
             # each group of exposures
             sdriz = resample.ResampleData(self.input_models, single=True,
@@ -212,7 +249,13 @@ class OutlierDetection:
         median_model.meta.wcs = drizzled_models[0].meta.wcs
 
         # Perform median combination on set of drizzled mosaics
-        median_model.data = self.create_median(drizzled_models)
+        if pars['resample_data'] and not pars.get('in_memory', True):
+            median_model.data = stack.median(nlow=pars.get('nlow', 0),
+                                             nhigh=pars.get('nhigh', 0))
+            stack.close()
+            del stack, drizzled_models
+        else:
+            median_model.data = self.create_median(drizzled_models)
 
         if save_intermediate_results:
             median_output_path = self.make_output_path(
@@ -226,16 +269,10 @@ class OutlierDetection:
 
         if pars['resample_data']:
             # Blot the median image back to recreate each input image specified
-            # in the original input list/ASN/ModelContainer
-            blot_models = self.blot_median(median_model)
-            if save_intermediate_results:
-                log.info("Writing out BLOT images...")
-                for model in blot_models:
-                    model_path = self.make_output_path(
-                        basename=model.meta.filename,
-                        suffix='blot'
-                    )
-                    model.save(model_path)
+            # in the original input list/ASN/ModelContainer, one image at a
+            # time as the images are compared
+            blot_models = self.iter_blot_median(
+                median_model, save=save_intermediate_results)
         else:
             # Median image will serve as blot image
             blot_models = datamodels.ModelContainer()
@@ -260,32 +297,30 @@ class OutlierDetection:
         - type of combination: fixed to 'median'
         - 'minmed' not implemented as an option
         """
-        resampled_sci = [i.data for i in resampled_models]
-        resampled_weight = [i.wht for i in resampled_models]
-
         nlow = self.outlierpars.get('nlow', 0)
         nhigh = self.outlierpars.get('nhigh', 0)
         maskpt = self.outlierpars.get('maskpt', 0.7)
 
+        if not self.outlierpars.get('in_memory', True):
+            # Combine the images block of rows by block of rows, from a
+            # stack of the images in memory-mapped files
+            stack = ResampledStack(len(resampled_models),
+                                   resampled_models[0].data.shape,
+                                   resampled_models[0].data.dtype,
+                                   maskpt=maskpt)
+            for model in resampled_models:
+                stack.append(model)
+            median_image = stack.median(nlow=nlow, nhigh=nhigh)
+            stack.close()
+            return median_image
+
+        resampled_sci = [i.data for i in resampled_models]
+        resampled_weight = [i.wht for i in resampled_models]
+
         # Create a mask for each input image, masking out areas where there is
         # no data or the data has very low weight
-        badmasks = []
-        for weight in resampled_weight:
-            # Create boolean masks for weight being zero or NaN
-            mask_zero_weight = np.equal(weight, 0.)
-            mask_nans = np.isnan(weight)
-            # Combine the masks
-            weight_masked = np.ma.array(weight, mask=np.logical_or(
-                mask_zero_weight, mask_nans))
-            # Sigma-clip the unmasked data
-            weight_masked = sigma_clip(weight_masked, sigma=3, maxiters=5)
-            mean_weight = np.mean(weight_masked)
-            # Mask pixels where weight falls below maskpt percent
-            weight_threshold = mean_weight * maskpt
-            badmask = np.less(weight, weight_threshold)
-            log.debug("Percentage of pixels with low weight: {}".format(
-                np.sum(badmask) / len(weight.flat) * 100))
-            badmasks.append(badmask)
+        badmasks = [low_weight_mask(weight, maskpt)
+                    for weight in resampled_weight]
 
         # Compute median of stack of images using `badmasks` to remove
         # low-weight values.  In the future we should use a masked array
@@ -297,29 +332,74 @@ class OutlierDetection:
 
     def blot_median(self, median_model):
         """Blot resampled median image back to the detector images."""
-        interp = self.outlierpars.get('interp', 'poly5')
-        sinscl = self.outlierpars.get('sinscl', 1.0)
-
-        # Initialize container for output blot images
         blot_models = datamodels.ModelContainer()
+        for model, blot_data in zip(self.input_models,
+                                    self.iter_blot_median(median_model)):
+            blot_models.append(make_blot_model(blot_data, model))
+        return blot_models
 
-        log.info("Blotting median...")
+    def iter_blot_median(self, median_model, save=False):
+        """Blot resampled median image back to each detector image in turn.
+
+        Parameters
+        ----------
+        median_model : ~jwst.datamodels.DataModel
+            the resampled median image
 
-        for model in self.input_models:
-            blotted_median = model.copy()
-            blot_root = '_'.join(model.meta.filename.replace(
-                '.fits', '').split('_')[:-1])
-            blotted_median.meta.filename = '{}_blot.fits'.format(blot_root)
+        save : bool
+            if True, write out each blotted image as it is created
 
-            # clean out extra data not related to blot result
-            blotted_median.err = None
-            blotted_median.dq = None
-            # apply blot to re-create model.data from median image
-            blotted_median.data = gwcs_blot(median_model, model, interp=interp,
-                                                     sinscl=sinscl)
-            blot_models.append(blotted_median)
+        Yields
+        ------
+        blot_data : ndarray
+            the median image blotted back to the next input image
+        """
+        global _parallel_args
+        interp = self.outlierpars.get('interp', 'poly5')
+        sinscl = self.outlierpars.get('sinscl', 1.0)
+        tolerance = self.outlierpars.get('pixmap_tolerance')
+        num_processes = min(
+            number_of_processes(self.outlierpars.get('maximum_cores')),
+            len(self.input_models))
 
-        return blot_models
+        log.info("Blotting median...")
+
+        pool = None
+        try:
+            if num_processes > 1:
+                # Blot the median image in forked processes, which share the
+                # median image and the input models with this process
+                _parallel_args = (median_model, self.input_models, interp,
+                                  sinscl, tolerance)
+                log.info("Creating %d processes for blotting %d images",
+                         num_processes, len(self.input_models))
+                context = multiprocessing.get_context('fork')
+                pool = context.Pool(processes=num_processes)
+                blots = pool.imap(_blot_worker, range(len(self.input_models)))
+            else:
+                # apply blot to re-create model.data from median image
+                blots = (gwcs_blot(median_model, model, interp=interp,
+                                   sinscl=sinscl, pixmap_tolerance=tolerance)
+                         for model in self.input_models)
+
+            for model, blot_data in zip(self.input_models, blots):
+                if save:
+                    blotted_median = make_blot_model(blot_data, model)
+                    model_path = self.make_output_path(
+                        basename=blotted_median.meta.filename,
+                        suffix='blot'
+                    )
+                    log.info("Writing out BLOT image to: {}".format(model_path))
+                    blotted_median.save(model_path)
+                    del blotted_median
+                yield blot_data
+        finally:
+            # Also stop the processes if the blotted images are not all
+            # used, or an error is raised
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+            _parallel_args = None
 
     def detect_outliers(self, blot_models):
         """Flag DQ array for cosmic rays in input images.
@@ -333,10 +413,10 @@ class OutlierDetection:
         input_models: JWST ModelContainer object
             data model container holding science ImageModels, modified in place
 
-        blot_models : JWST ModelContainer object
+        blot_models : JWST ModelContainer object or iterable
             data model container holding ImageModels of the median output frame
             blotted back to the wcs and frame of the ImageModels in
-            input_models
+            input_models, or iterable of the blotted data arrays
 
         Returns
         -------
@@ -354,6 +434,157 @@ class OutlierDetection:
                 self.inputs.dq[i, :, :] = self.input_models[i].dq
 
 
+class ResampledStack:
+    """Stack of resampled images and their low-weight masks, on disk.
+
+    The images and masks are written to memory-mapped files in a temporary
+    directory as they are appended, so that only one resampled image needs
+    to be held in memory, and the median is computed for blocks of rows of
+    the stack in turn.  The temporary directory is created in the directory
+    given by the TMPDIR environment variable, if that is set.
+    """
+
+    def __init__(self, nimages, shape, dtype, maskpt=0.7):
+        """
+        Parameters
+        ----------
+        nimages : int
+            the number of images that will be appended to the stack
+
+        shape : tuple
+            the shape of the resampled images
+
+        dtype : numpy dtype
+            the data type of the resampled images
+
+        maskpt : float
+            fraction of the mean weight below which pixels are masked
+        """
+        self.maskpt = maskpt
+        self.nimages = 0
+        self.tempdir = tempfile.TemporaryDirectory(prefix='outlier_')
+        shape = (nimages,) + tuple(shape)
+        self.sci = np.lib.format.open_memmap(
+            os.path.join(self.tempdir.name, 'sci.npy'), mode='w+',
+            dtype=dtype, shape=shape)
+        self.badmasks = np.lib.format.open_memmap(
+            os.path.join(self.tempdir.name, 'badmasks.npy'), mode='w+',
+            dtype=bool, shape=shape)
+
+    def append(self, model):
+        """Add the data and the low-weight mask of a resampled image."""
+        self.sci[self.nimages] = model.data
+        self.badmasks[self.nimages] = low_weight_mask(model.wht, self.maskpt)
+        self.nimages += 1
+
+    def median(self, nlow=0, nhigh=0, max_bytes=CHUNK_BYTES):
+        """Median of the stack, excluding the low-weight pixels.
+
+        Parameters
+        ----------
+        nlow, nhigh : int
+            the number of low and high values of each pixel to ignore
+
+        max_bytes : int
+            approximate size of the block of rows of the stack combined at
+            once
+
+        Returns
+        -------
+        median_image : ndarray
+        """
+        sci = self.sci[:self.nimages]
+        badmasks = self.badmasks[:self.nimages]
+        nrows, ncols = sci.shape[1:]
+        row_bytes = self.nimages * ncols * (sci.itemsize + 1)
+        nblock = max(1, min(nrows, max_bytes // max(row_bytes, 1)))
+        log.debug("Computing median in blocks of {} rows".format(nblock))
+
+        median_image = np.empty((nrows, ncols), dtype=sci.dtype)
+        for row in range(0, nrows, nblock):
+            rows = slice(row, row + nblock)
+            median(list(sci[:, rows]), output=median_image[rows],
+                   nlow=nlow, nhigh=nhigh, badmasks=badmasks[:, rows])
+        return median_image
+
+    def close(self):
+        """Remove the memory-mapped files."""
+        del self.sci, self.badmasks
+        self.tempdir.cleanup()
+
+
+def low_weight_mask(weight, maskpt):
+    """Mask the pixels of a resampled image with no data or low weight.
+
+    Parameters
+    ----------
+    weight : ndarray
+        the weight image of the resampled image
+
+    maskpt : float
+        fraction of the sigma-clipped mean weight below which pixels are
+        masked
+
+    Returns
+    -------
+    badmask : ndarray
+        boolean mask, True for the pixels with low weight
+    """
+    # Create boolean masks for weight being zero or NaN
+    mask_zero_weight = np.equal(weight, 0.)
+    mask_nans = np.isnan(weight)
+    # Combine the masks
+    weight_masked = np.ma.array(weight, mask=np.logical_or(
+        mask_zero_weight, mask_nans))
+    # Sigma-clip the unmasked data
+    weight_masked = sigma_clip(weight_masked, sigma=3, maxiters=5)
+    mean_weight = np.mean(weight_masked)
+    # Mask pixels where weight falls below maskpt percent
+    weight_threshold = mean_weight * maskpt
+    badmask = np.less(weight, weight_threshold)
+    log.debug("Percentage of pixels with low weight: {}".format(
+        np.sum(badmask) / len(weight.flat) * 100))
+    return badmask
+
+
+def _blot_worker(index):
+    """Blot the median image back to one input image in a forked process"""
+    median_model, input_models, interp, sinscl, tolerance = _parallel_args
+    return gwcs_blot(median_model, input_models[index], interp=interp,
+                     sinscl=sinscl, pixmap_tolerance=tolerance)
+
+
+def make_blot_model(blot_data, model):
+    """Create the blot product of an input image.
+
+    Only the blotted data array is stored, with the metadata and WCS of
+    the input image, rather than a copy of all the input arrays.
+
+    Parameters
+    ----------
+    blot_data : ndarray
+        the median image blotted back to the input image
+
+    model : ~jwst.datamodels.DataModel
+        the input image
+
+    Returns
+    -------
+    blotted_median : ~jwst.datamodels.ImageModel
+    """
+    blotted_median = datamodels.ImageModel(data=blot_data)
+    blotted_median.update(model)
+    blotted_median.meta.wcs = model.meta.wcs
+    blot_root = '_'.join(model.meta.filename.replace(
+        '.fits', '').split('_')[:-1])
+    blotted_median.meta.filename = '{}_blot.fits'.format(blot_root)
+
+    # clean out extra data not related to blot result
+    blotted_median.err = None
+    blotted_median.dq = None
+    return blotted_median
+
+
 def flag_cr(sci_image, blot_image, **pars):
     """Masks outliers in science image.
 
@@ -365,8 +596,9 @@ def flag_cr(sci_image, blot_image, **pars):
     sci_image : ImageModel
         the science data
 
-    blot_image : ImageModel
-        the blotted median image of the dithered science frames
+    blot_image : ImageModel or ndarray
+        the blotted median image of the dithered science frames, or its
+        data array
 
     pars : dict
         the user parameters for Outlier Detection
@@ -396,7 +628,10 @@ def flag_cr(sci_image, blot_image, **pars):
     exptime = sci_image.meta.exposure.exposure_time
 
     sci_data = sci_image.data * exptime
-    blot_data = blot_image.data * exptime
+    if isinstance(blot_image, np.ndarray):
+        blot_data = blot_image * exptime
+    else:
+        blot_data = blot_image.data * exptime
     blot_deriv = abs_deriv(blot_data)
 
     err_data = np.nan_to_num(sci_image.err)
@@ -521,7 +756,8 @@ def _absolute_subtract(array, tmp, out):
     return tmp, out
 
 
-def gwcs_blot(median_model, blot_img, interp='poly5', sinscl=1.0):
+def gwcs_blot(median_model, blot_img, interp='poly5', sinscl=1.0,
+              pixmap_tolerance=None):
     """
     Resample the output/resampled image to recreate an input image based on
     the input image's world coordinate system
@@ -543,11 +779,16 @@ def gwcs_blot(median_model, blot_img, interp='poly5', sinscl=1.0):
 
     sincscl : float, optional
         The scaling factor for sinc interpolation.
+
+    pixmap_tolerance : float, optional
+        If set, the pixel map is interpolated from a sparse grid, with this
+        largest error in pixels (see resample_utils.calc_gwcs_pixmap).
     """
     blot_wcs = blot_img.meta.wcs
 
     # Compute the mapping between the input and output pixel coordinates
-    pixmap = calc_gwcs_pixmap(blot_wcs, median_model.meta.wcs, blot_img.data.shape)
+    pixmap = calc_gwcs_pixmap(blot_wcs, median_model.meta.wcs, blot_img.data.shape,
+                              tolerance=pixmap_tolerance)
     log.debug("Pixmap shape: {}".format(pixmap[:, :, 0].shape))
     log.debug("Sci shape: {}".format(blot_img.data.shape))
 
@@ -3,6 +3,7 @@ from functools import partial
 
 from ..stpipe import Step
 from .. import datamodels
+from ..resample import resample_utils
 
 from . import outlier_detection
 from . import outlier_detection_scaled
@@ -62,10 +63,16 @@ class OutlierDetectionStep(Step):
         good_bits = integer(default=6)
         scale_detection = boolean(default=False)
         search_output_file = boolean(default=False)
+        in_memory = boolean(default=True)
+        maximum_cores = option('quarter', 'half', 'all', default=None) # max number of processes to create
+        pixmap_tolerance = float(default=None) # max error in pixels of interpolated pixel maps
+        pixmap_cache_size = integer(default=0) # max bytes of pixel maps cached for reuse, 0 for none
     """
 
     def process(self, input):
         """Perform outlier detection processing on input data."""
+        resample_utils.pixmap_cache.resize(self.pixmap_cache_size)
+
         with datamodels.open(input) as input_models:
             self.input_models = input_models
             if not isinstance(self.input_models, datamodels.ModelContainer):
@@ -107,6 +114,9 @@ class OutlierDetectionStep(Step):
                 'save_intermediate_results': self.save_intermediate_results,
                 'resample_data': self.resample_data,
                 'good_bits': self.good_bits,
+                'in_memory': self.in_memory,
+                'maximum_cores': self.maximum_cores,
+                'pixmap_tolerance': self.pixmap_tolerance,
                 'make_output_path': self.make_output_path,
             }
 
@@ -0,0 +1,141 @@
+"""Test the median combination of the resampled images"""
+import os
+
+import numpy as np
+import pytest
+
+from stsci.image import median
+
+from jwst.datamodels import DrizProductModel, ImageModel
+from jwst.outlier_detection import outlier_detection
+
+
+def make_resampled(nimages=5, shape=(23, 17)):
+    """Resampled images with random data and low weight edges"""
+    rng = np.random.RandomState(12)
+    models = []
+    for i in range(nimages):
+        model = DrizProductModel(shape)
+        model.data[:] = rng.normal(size=shape)
+        model.wht[:] = rng.uniform(0.9, 1.1, size=shape)
+        model.wht[:, :i] = 0.
+        model.wht[i, :] = 0.1
+        models.append(model)
+    return models
+
+
+@pytest.mark.parametrize('max_bytes', [1, 500, 2**27])
+@pytest.mark.parametrize('nlow, nhigh', [(0, 0), (1, 1)])
+def test_resampled_stack_median(max_bytes, nlow, nhigh):
+    """The median of the stack on disk matches the median in memory"""
+    models = make_resampled()
+    badmasks = [outlier_detection.low_weight_mask(model.wht, 0.7)
+                for model in models]
+    expected = median([model.data for model in models], nlow=nlow,
+                      nhigh=nhigh, badmasks=badmasks)
+
+    stack = outlier_detection.ResampledStack(len(models), models[0].data.shape,
+                                             models[0].data.dtype, maskpt=0.7)
+    tempdir = stack.tempdir.name
+    for model in models:
+        stack.append(model)
+    result = stack.median(nlow=nlow, nhigh=nhigh, max_bytes=max_bytes)
+    stack.close()
+
+    assert result.dtype == expected.dtype
+    np.testing.assert_array_equal(result, expected)
+    assert not np.isnan(result).any()
+    assert not os.path.exists(tempdir)
+
+
+def test_create_median_in_memory():
+    """The median does not depend on the in_memory parameter"""
+    models = make_resampled()
+    results = []
+    for in_memory in (True, False):
+        detection = outlier_detection.OutlierDetection(
+            models, reffiles={}, nlow=0, nhigh=1, maskpt=0.7, in_memory=in_memory)
+        results.append(detection.create_median(models))
+    np.testing.assert_array_equal(results[0], results[1])
+
+
+def test_make_blot_model():
+    """The blot product only holds the blotted data and the metadata"""
+    model = ImageModel((10, 12))
+    model.meta.filename = 'jw00001001001_01101_00001_nrca1_cal.fits'
+    model.meta.exposure.exposure_time = 10.
+    model.meta.wcs = None
+    blot_data = np.ones((10, 12), dtype=np.float32)
+
+    blot = outlier_detection.make_blot_model(blot_data, model)
+
+    assert blot.data is blot_data
+    assert blot.meta.filename == 'jw00001001001_01101_00001_nrca1_blot.fits'
+    assert blot.meta.exposure.exposure_time == 10.
+    assert model.meta.filename == 'jw00001001001_01101_00001_nrca1_cal.fits'
+
+
+def test_flag_cr_blot_data():
+    """Outliers are flagged the same from a blot model or its data array"""
+    rng = np.random.RandomState(5)
+    blot_data = rng.uniform(10., 20., size=(20, 20)).astype(np.float32)
+    dqs = []
+    for blot in (blot_data, ImageModel(data=blot_data)):
+        sci = ImageModel(data=blot_data + rng.normal(size=(20, 20)).astype(np.float32))
+        sci.data[5, 7] = 1000.
+        sci.err[:] = 1.
+        sci.meta.background.subtracted = False
+        sci.meta.background.level = 0.
+        sci.meta.exposure.exposure_time = 10.
+        outlier_detection.flag_cr(sci, blot, snr='4.0 3.0', scale='0.5 0.4')
+        dqs.append(sci.dq)
+
+    assert dqs[0][5, 7] & outlier_detection.CRBIT
+    np.testing.assert_array_equal(dqs[0], dqs[1])
+
+
+@pytest.fixture
+def blot_inputs(monkeypatch):
+    """Resampled and median images, blotted by adding them, on 4 cores"""
+    def fake_blot(median_model, model, **kwargs):
+        return median_model.data[:model.data.shape[0]] + model.data
+
+    monkeypatch.setattr(outlier_detection, 'gwcs_blot', fake_blot)
+    monkeypatch.setattr(outlier_detection.multiprocessing, 'cpu_count',
+                        lambda: 4)
+    models = make_resampled(nimages=6)
+    median_model = DrizProductModel(data=np.ones((30, 17), dtype=np.float32))
+    return models, median_model
+
+
+def test_iter_blot_median_parallel(blot_inputs):
+    """Blotting in processes gives the images in the order of the inputs"""
+    models, median_model = blot_inputs
+
+    blots = []
+    for maximum_cores in (None, 'all'):
+        detection = outlier_detection.OutlierDetection(
+            models, reffiles={}, maximum_cores=maximum_cores)
+        detection.input_models = models
+        blots.append(list(detection.iter_blot_median(median_model)))
+
+    assert len(blots[1]) == len(models)
+    for model, serial, parallel in zip(models, *blots):
+        np.testing.assert_array_equal(parallel, model.data + 1)
+        np.testing.assert_array_equal(parallel, serial)
+
+
+def test_iter_blot_median_parallel_closed(blot_inputs):
+    """The processes are stopped when the blotted images are not all used"""
+    models, median_model = blot_inputs
+
+    detection = outlier_detection.OutlierDetection(
+        models, reffiles={}, maximum_cores='all')
+    detection.input_models = models
+    blots = detection.iter_blot_median(median_model)
+    np.testing.assert_array_equal(next(blots), models[0].data + 1)
+    assert outlier_detection._parallel_args is not None
+
+    blots.close()
+    assert outlier_detection._parallel_args is None
+    assert not outlier_detection.multiprocessing.active_children()
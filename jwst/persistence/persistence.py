@@ -1,7 +1,6 @@
 #
 #  Module for correcting for persistence
 
-import math
 import numpy as np
 import logging
 from .. import datamodels
@@ -15,6 +14,11 @@ SCALEFACTOR = 2.
 from traps, compared with photon-generated charges.
 """
 
+CHUNK_BYTES = 2**26
+"""Approximate size of the persistence computed at once, for a chunk of
+groups of an integration.
+"""
+
 def no_NaN(input_model, fill_value,
            zap_nan=False, zap_zero=False):
     """Replace NaNs and/or zeros with a fill value.
@@ -61,6 +65,28 @@ def no_NaN(input_model, fill_value,
         return temp
 
 
+def family_axis(params, image):
+    """Shape per-family parameters to broadcast against image arrays.
+
+    Parameters
+    ----------
+    params : tuple of ndarray
+        Parameters with one element for each trap family.
+
+    image : ndarray
+        An image array, or array of selected pixels.
+
+    Returns
+    -------
+    tuple of ndarray
+        The parameters, with trailing axes of length one added so that
+        the first axis (the trap family) is prepended to the image axes.
+    """
+
+    shape = (-1,) + (1,) * np.ndim(image)
+    return tuple(np.reshape(par, shape) for par in params)
+
+
 class DataSet():
     """Input dataset to which persistence will be applied
 
@@ -211,9 +237,10 @@ class DataSet():
         nfamilies = len(par[0])
         if nfamilies <= 0:
             log.error("The trappars reference table is empty!")
+        # One value per trap family.
+        capture_param = self.get_capture_param(par)
+        decay_param = self.get_decay_param(par)
 
-        # Note that this might be a subarray.
-        persistence = np.zeros((shape[-2], shape[-1]), dtype=np.float64)
         (nints, ngroups, ny, nx) = shape
         t_group = self.output_obj.meta.exposure.group_time
 
@@ -228,6 +255,16 @@ class DataSet():
         else:
             log.debug("The input is not a subarray.")
 
+        # Without the times, the decay of the traps filled before the
+        # exposure cannot be computed
+        if self.traps_filled and (
+                self.traps_filled.meta.exposure.end_time is None or
+                self.output_obj.meta.exposure.start_time is None):
+            log.warning("The end time of the traps_filled model or the "
+                        "start time of the exposure is not set; the "
+                        "traps_filled model will not be used.")
+            self.traps_filled = None
+
         if not self.traps_filled:
             have_traps_filled = False
             self.traps_filled = datamodels.TrapsFilledModel(
@@ -259,29 +296,23 @@ class DataSet():
                         - self.traps_filled.meta.exposure.end_time) * 86400.
             log.debug("Decay time for previous traps-filled file = %g s",
                       to_start)
-            for k in range(nfamilies):
-                decay_param_k = self.get_decay_param(par, k)
-                decay = self.compute_decay(self.traps_filled.data[k],
-                                           decay_param_k, to_start)
-                self.traps_filled.data[k, :, :] -= decay
-                del decay
+            self.traps_filled.data -= self.compute_decay(
+                self.traps_filled.data, decay_param, to_start)
 
         """
         These will be full-frame:
             self.traps_filled           (nfamilies, det_ny, det_nx)
             self.trap_density (before extracting subarray)
             self.persistencesat (before extracting subarray)
-            decayed                     (nfamilies, det_ny, det_nx)
-            decayed_in_group            (det_ny, det_nx)
 
         These will be subarrays if the input object is a subarray:
             self.output_obj             (nints, ngroups, ny, nx)
             self.trap_density (after extracting subarray)
             self.persistencesat (after extracting subarray)
-            persistence
+            persistence                 (groups, ny, nx)
             self.output_pers
-            filled
-            cr_filled
+            filled                      (nfamilies, ny, nx)
+            cr_filled                   (nfamilies, ny, nx)
         """
 
         # If the science image is a subarray, extract matching sections of
@@ -321,74 +352,76 @@ class DataSet():
         else:
             self.output_pers = None
 
-        # Buffer for accumulating the number of decayed traps from the
-        # start of an integration to the current group (in the loop below).
-        decayed = np.zeros((nfamilies, det_ny, det_nx), dtype=np.float64)
+        # The traps of each family that were filled at the start of an
+        # integration decay by the same fraction in each group, so after
+        # group g a fraction 1 - (1 - decay_in_group)**(g + 1) of them has
+        # decayed.  The persistence in group g is the sum of the decayed
+        # traps of all the families.
+        decay_in_group = self.decay_fraction(decay_param, t_group)
+        remaining = ((1. - decay_in_group)[:, np.newaxis] **
+                     np.arange(1, ngroups + 1))
+        decayed = (1. - remaining).T            # (ngroups, nfamilies)
+
+        # Number of groups for which persistence is computed at once.
+        dtype = np.result_type(self.traps_filled.data, np.float32)
+        nchunk = max(1, min(ngroups, CHUNK_BYTES // (ny * nx * dtype.itemsize)))
 
         # self.traps_filled will be updated with each integration, to
         # account for charge capture and decay of traps.
-        filled = -1                             # just to ensure that it exists
         for integ in range(nints):
             self.get_group_info(integ)          # self.tgroup, etc.
-            decayed[:, :, :] = 0.               # initialize
             # slope has to be computed early in the loop over integrations,
             # before the data are modified by subtracting persistence.
             # The slope is needed for computing charge captures.
             (grp_slope, slope) = self.compute_slope(integ)
-            for group in range(ngroups):
-                persistence[:, :] = 0.          # initialize
-                for k in range(nfamilies):
-                    decay_param_k = self.get_decay_param(par, k)
-                    # Compute and subtract the decays during the reset.
-                    # Decays during the reset at the beginning of the
-                    # first integration have already been accounted for.
-                    if integ > 0 and group == 0 and self.nresets > 0:
-                        reset_time = self.tframe * self.nresets
-                        decay_during_reset = \
-                            self.compute_decay(self.traps_filled.data[k],
-                                               decay_param_k, reset_time)
-                        self.traps_filled.data[k, :, :] -= decay_during_reset
-                    # Decays during current group, for current trap family.
-                    decayed_in_group = \
-                        self.compute_decay(self.traps_filled.data[k],
-                                           decay_param_k, t_group)
-                    # Cumulative decay to the end of the current group.
-                    decayed[k, :, :] += decayed_in_group
-                    self.traps_filled.data[k, :, :] -= decayed_in_group
-                    if is_subarray:
-                        persistence += decayed[k, save_slice[0], save_slice[1]]
-                    else:
-                        persistence += decayed[k, :, :]
-                    del decayed_in_group
+            # Compute and subtract the decays during the reset.
+            # Decays during the reset at the beginning of the
+            # first integration have already been accounted for.
+            if integ > 0 and self.nresets > 0:
+                reset_time = self.tframe * self.nresets
+                self.traps_filled.data -= self.compute_decay(
+                    self.traps_filled.data, decay_param, reset_time)
+            # Traps filled at the start of the integration, within the
+            # science subarray.
+            start_filled = self.traps_filled.data[:, save_slice[0],
+                                                  save_slice[1]]
+            start_filled = start_filled.reshape(nfamilies, ny * nx)
+            start_filled = start_filled.astype(dtype)
+            for group in range(0, ngroups, nchunk):
+                groups = slice(group, min(group + nchunk, ngroups))
+                persistence = np.dot(decayed[groups].astype(dtype),
+                                     start_filled)
+                persistence = persistence.reshape((-1, ny, nx))
 
                 # Persistence was computed in DN.
-                self.output_obj.data[integ, group, :, :] -= persistence
+                self.output_obj.data[integ, groups, :, :] -= persistence
                 if self.save_persistence:
-                    self.output_pers.data[integ, group, :, :] = \
-                        persistence.copy()
-                if persistence.max() >= self.flag_pers_cutoff:
-                    mask = (persistence >= self.flag_pers_cutoff)
-                    self.output_obj.pixeldq[mask] |= dqflags.pixel['DO_NOT_USE']
+                    self.output_pers.data[integ, groups, :, :] = persistence
+                mask = (persistence >= self.flag_pers_cutoff).any(axis=0)
+                self.output_obj.pixeldq[mask] |= dqflags.pixel['DO_NOT_USE']
+                del persistence, mask
+            del start_filled
+
+            # Decays during all the groups, for all trap families.
+            self.traps_filled.data *= remaining[:, -1, np.newaxis, np.newaxis]
 
             # Update traps_filled with the number of traps that captured
             # a charge during the current integration.
-            for k in range(nfamilies):
-                capture_param_k = self.get_capture_param(par, k)
-                # This may be a subarray.
-                filled = self.predict_capture(capture_param_k,
-                                              self.trap_density.data,
-                                              integ, grp_slope, slope)
-                if is_subarray:
-                    self.traps_filled.data[k, save_slice[0],
-                                              save_slice[1]] += filled
-                else:
-                    self.traps_filled.data[k, :, :] += filled
-
-        del filled
+            # This may be a subarray.
+            filled = self.predict_capture(capture_param,
+                                          self.trap_density.data,
+                                          integ, grp_slope, slope)
+            self.traps_filled.data[:, save_slice[0], save_slice[1]] += filled
+            del filled
 
         # Update the start and end times (and other stuff) in the
         # traps_filled image to the times for the current exposure.
         self.traps_filled.update(self.output_obj, only="PRIMARY")
+        # traps_filled is full-frame, even if the science data are not.
+        self.traps_filled.meta.subarray.xstart = 1
+        self.traps_filled.meta.subarray.ystart = 1
+        self.traps_filled.meta.subarray.xsize = det_nx
+        self.traps_filled.meta.subarray.ysize = det_ny
 
         # meta.filename of traps_filled is now the name of the science file
         # that was passed as input to this step.  This is good, since we're
@@ -627,12 +660,10 @@ class DataSet():
         really_bad = np.where(upper < 0)
         upper[really_bad] = 0           # for the comparison with indx below
         del really_bad
-        temp = np.arange(ngroups - 1, dtype=np.int32)
-        temp2 = np.repeat(temp, nx * ny)
-        indx = temp2.reshape((ngroups - 1, ny, nx))
-        mask = np.where(indx >= upper)
+        indx = np.arange(ngroups - 1, dtype=np.int32)[:, np.newaxis, np.newaxis]
+        mask = (indx >= upper)
         sdiff[mask] = 0.                # zero values won't affect the sum
-        del temp, temp2, indx, mask
+        del indx, mask
         bad = np.where(upper <= 0)
         upper[bad] = 1                  # so we can divide by upper
 
@@ -661,8 +692,8 @@ class DataSet():
         return (grp_slope, slope)
 
 
-    def get_capture_param(self, par, k):
-        """Extract capture parameters for the current trap family.
+    def get_capture_param(self, par):
+        """Extract capture parameters for all the trap families.
 
         Parameters
         ----------
@@ -671,22 +702,20 @@ class DataSet():
             Each element of the tuple is a column from the table.  Each
             row of the table is for a different trap family.
 
-        k : int
-            Index of the current trap family
-
         Returns
         -------
-        tuple of three floats
-            These are the capture parameters for the current trap family.
+        tuple of three ndarray
+            These are the capture parameters, with one element for each
+            trap family.
         """
 
         (par0, par1, par2) = par[0:3]
 
-        return (par0[k], par1[k], par2[k])
+        return (par0, par1, par2)
 
 
-    def get_decay_param(self, par, k):
-        """Extract decay parameter(s) for the current trap family.
+    def get_decay_param(self, par):
+        """Extract decay parameter(s) for all the trap families.
 
         Parameters
         ----------
@@ -695,18 +724,16 @@ class DataSet():
             Each element of the tuple is a column from the table.  Each
             row of the table is for a different trap family.
 
-        k : int
-            Index of the current trap family
-
         Returns
         -------
-        float
-            This is the decay parameter for the current trap family.
+        ndarray
+            This is the decay parameter, with one element for each trap
+            family.
         """
 
         par3 = par[3]
 
-        return par3[k]
+        return par3
 
 
     def get_group_info(self, integ):
@@ -754,7 +781,7 @@ class DataSet():
                 self.nresets = 1
 
 
-    def predict_capture(self, capture_param_k, trap_density, integ,
+    def predict_capture(self, capture_param, trap_density, integ,
                         grp_slope, slope):
         """Compute the number of traps that will be filled in time dt.
 
@@ -762,11 +789,9 @@ class DataSet():
 
         Parameters
         ----------
-        capture_param_k : tuple of three floats
-            Three values read from a reference table.  These will be from
-            three separate columns but just one row; the row corresponds
-            to the current trap family.  (The _k in the variable name
-            indicates that the values are for one trap family.)
+        capture_param : tuple of three ndarray
+            Three columns read from a reference table, with one element
+            (row) for each trap family.
 
         trap_density : ndarray, 2-D
             Image of the total number of traps per pixel.
@@ -788,8 +813,9 @@ class DataSet():
 
         Returns
         -------
-        ndarray, 2-D
-            The computed traps_filled at the end of the integration.
+        ndarray, 3-D
+            The computed traps_filled at the end of the integration, one
+            image plane for each trap family.
         """
 
         data = self.output_obj.data[integ, :, :, :]
@@ -809,11 +835,8 @@ class DataSet():
         if hasattr(self.persistencesat, "dq"):
             mask = (np.bitwise_and(self.persistencesat.dq,
                                    dqflags.pixel["DO_NOT_USE"]) > 0)
-            mshape = mask.shape
-            mask = mask.reshape((1,) + mshape)
-            m3 = np.repeat(mask, ngroups, 0)
-            pflag[m3] = False
-            del mask, m3
+            pflag &= ~mask
+            del mask
 
         # All of these are 2-D arrays.
         sat_count = pflag.sum(axis=0, dtype=np.intp)
@@ -822,25 +845,23 @@ class DataSet():
         dt = totaltime - sattime
 
         # Traps that were filled due to the linear portion of the ramp.
-        ramp_traps_filled = self.predict_ramp_capture(
-                                capture_param_k,
-                                trap_density, slope, dt)
+        filled = self.predict_ramp_capture(capture_param,
+                                           trap_density, slope, dt)
 
-        filled = ramp_traps_filled.copy()
         mask = (sat_count > 0)
         any_saturated = np.any(mask)
         if any_saturated:
             # Traps that were filled due to the saturated portion of the ramp.
-            filled[mask] = self.predict_saturation_capture(
-                                capture_param_k,
+            filled[:, mask] = self.predict_saturation_capture(
+                                capture_param,
                                 trap_density[mask],
-                                ramp_traps_filled[mask],
+                                filled[:, mask],
                                 sattime[mask], sat_count[mask], ngroups)
-        del sat_count, sattime, ramp_traps_filled, mask
+        del sat_count, sattime, mask
 
         # Traps that were filled due to cosmic-ray jumps.
         cr_filled = self.delta_fcn_capture(
-                                capture_param_k,
+                                capture_param,
                                 trap_density, integ,
                                 grp_slope, ngroups, t_group)
         filled += cr_filled
@@ -848,18 +869,16 @@ class DataSet():
         return filled
 
 
-    def predict_ramp_capture(self, capture_param_k, trap_density, slope, dt):
+    def predict_ramp_capture(self, capture_param, trap_density, slope, dt):
         """Compute the number of traps that will be filled in time dt.
 
         This is based on Michael Regan's predictrampcapture3.pro.
 
         Parameters
         ----------
-        capture_param_k : tuple
-            Three values read from a reference table.  These will be from
-            three separate columns but just one row; the row corresponds
-            to the current trap family.  (The _k in the variable name
-            indicates that the values are for one trap family.)
+        capture_param : tuple of three ndarray
+            Three columns read from a reference table, with one element
+            (row) for each trap family.
 
         trap_density : ndarray, 2-D
             Image of the total number of traps per pixel.
@@ -877,17 +896,19 @@ class DataSet():
 
         Returns
         -------
-        ndarray, 2-D
-            The computed traps_filled at the end of the integration.
+        ndarray, 3-D
+            The computed traps_filled at the end of the integration, one
+            image plane for each trap family.
         """
 
-        (par0, par1, par2) = capture_param_k
-        if par1 == 0:
+        (par0, par1, par2) = family_axis(capture_param, trap_density)
+        zero = (par1 == 0)
+        for k in np.flatnonzero(zero):
             log.error("Capture parameter is zero; parameters are %g, %g, %g",
-                      par0, par1, par2)
-            tau = 1.e10                 # arbitrary "big" number
-        else:
-            tau = 1. / abs(par1)
+                      capture_param[0][k], capture_param[1][k],
+                      capture_param[2][k])
+        # arbitrary "big" number if par1 is zero
+        tau = 1. / np.where(zero, 1.e-10, np.abs(par1))
 
         traps_filled = (trap_density * slope**2
                         * (dt**2 * (par0 + par2) / 2.
@@ -898,7 +919,7 @@ class DataSet():
         return traps_filled
 
 
-    def predict_saturation_capture(self, capture_param_k, trap_density,
+    def predict_saturation_capture(self, capture_param, trap_density,
                                    incoming_filled_traps,
                                    sattime, sat_count, ngroups):
         """Compute number of traps filled due to saturated pixels.
@@ -912,25 +933,24 @@ class DataSet():
         `incoming_filled_traps` can be so small that `exp_filled_traps`
         would be negative.
 
-        `trap_density`, `incoming_filled_traps`, `sattime`, and `sat_count`
-        were all 2-D arrays in the calling function `predict_capture`, but
-        these arrays have been masked to select only ramps with at least
-        one saturated group, so in this function these arrays are 1-D.
+        `trap_density`, `sattime`, and `sat_count` were all 2-D arrays in
+        the calling function `predict_capture`, but these arrays have been
+        masked to select only ramps with at least one saturated group, so
+        in this function these arrays are 1-D, and `incoming_filled_traps`
+        is 2-D, with one row for each trap family.
 
         Parameters
         ----------
-        capture_param_k : tuple
-            Three values read from a reference table.  These will be from
-            three separate columns but just one row; the row corresponds
-            to the current trap family.  (The _k in the variable name
-            indicates that the values are for one trap family.)
+        capture_param : tuple of three ndarray
+            Three columns read from a reference table, with one element
+            (row) for each trap family.
 
         trap_density : ndarray
             Image of the total number of traps per pixel.
 
         incoming_filled_traps : ndarray
-            Traps filled due to linear portion of the ramp.
-            This may be modified in-place.
+            Traps filled due to linear portion of the ramp, for each trap
+            family.  This may be modified in-place.
 
         sattime : ndarray
             Time (seconds) during which each pixel was saturated.
@@ -945,16 +965,17 @@ class DataSet():
         Returns
         -------
         ndarray, 2-D
-            The computed traps_filled at the end of the integration.
+            The computed traps_filled at the end of the integration, one
+            row for each trap family.
         """
 
-        (par0, par1, par2) = capture_param_k
+        (par0, par1, par2) = family_axis(capture_param, trap_density)
         par1 = abs(par1)        # the minus sign will be specified explicitly
 
         # For each pixel that had no ramp before saturation, fill all the
         # instantaneous traps; otherwise, they were filled during the ramp.
         flag = (sat_count == ngroups)
-        incoming_filled_traps[flag] = trap_density[flag] * par2
+        incoming_filled_traps[:, flag] = trap_density[flag] * par2
 
         # Find out how many exponential traps have already been filled.
         exp_filled_traps = incoming_filled_traps - trap_density * par2
@@ -972,7 +993,7 @@ class DataSet():
         return total_filled_traps
 
 
-    def delta_fcn_capture(self, capture_param_k, trap_density, integ,
+    def delta_fcn_capture(self, capture_param, trap_density, integ,
                           grp_slope, ngroups, t_group):
         """Compute number of traps filled due to cosmic-ray jumps.
 
@@ -989,11 +1010,9 @@ class DataSet():
 
         Parameters
         ----------
-        capture_param_k : tuple
-            Three values read from a reference table.  These will be from
-            three separate columns but just one row; the row corresponds
-            to the current trap family.  (The _k in the variable name
-            indicates that the values are for one trap family.)
+        capture_param : tuple of three ndarray
+            Three columns read from a reference table, with one element
+            (row) for each trap family.
 
         trap_density : ndarray, 2-D
             Image of the total number of traps per pixel.
@@ -1016,38 +1035,38 @@ class DataSet():
 
         Returns
         -------
-        ndarray, 2-D
-            The computed cr_filled at the end of the integration.
+        ndarray, 3-D
+            The computed cr_filled at the end of the integration, one
+            image plane for each trap family.
         """
 
-        (par0, par1, par2) = capture_param_k
-        # cr_filled will be incremented group-by-group, depending on
-        # where cosmic rays were found in each group.
-        cr_filled = np.zeros_like(trap_density)
+        nfamilies = len(capture_param[0])
+        cr_filled = np.zeros((nfamilies,) + trap_density.shape,
+                             dtype=trap_density.dtype)
         data = self.output_obj.data[integ, :, :, :]
         gdq = self.output_obj.groupdq[integ, :, :, :]
         gdqflags = dqflags.group
 
         # If there's a CR hit in the first group, we can't determine its
-        # amplitude, so skip the first group.  Loop over all subsequent
-        # groups, checking (via the groupdq extension) for cosmic-ray hits.
-        for group in range(1, ngroups):
-            cr_flag = np.where(np.bitwise_and(gdq[group, :, :],
+        # amplitude, so skip the first group.  Find the cosmic-ray hits
+        # (via the groupdq extension) in all subsequent groups.
+        (z, y, x) = np.nonzero(np.bitwise_and(gdq[1:, :, :],
                                               gdqflags['JUMP_DET']) > 0)
-            if len(cr_flag[0]) > 0:
-                delta_t = (float(ngroups - group) - 0.5) * t_group
-                # z and z_prev are index arrays.
-                z = np.empty(len(cr_flag[0]), dtype=np.intp)
-                z[:] = group
-                z_prev = z - 1
-                # jump is a 1-D array, just for the CRs in the current group.
-                jump = ((data[z, cr_flag[0], cr_flag[1]]
-                       - data[z_prev, cr_flag[0], cr_flag[1]])
-                        - grp_slope[cr_flag])
-                jump = np.where(jump < 0., 0., jump)
-                cr_filled[cr_flag] += trap_density[cr_flag] * jump \
-                                      * (par0 * (1. - math.exp(par1 * delta_t))
-                                         + par2)
+        if len(z) > 0:
+            z += 1
+            delta_t = (ngroups - z - 0.5) * t_group
+            # jump is a 1-D array, for all the CRs.
+            jump = ((data[z, y, x] - data[z - 1, y, x]) - grp_slope[y, x])
+            jump = np.where(jump < 0., 0., jump)
+            (par0, par1, par2) = family_axis(capture_param, jump)
+            cr_capture = trap_density[y, x] * jump \
+                         * (par0 * (1. - np.exp(par1 * delta_t)) + par2)
+            # Sum the captures of the CRs in each pixel.
+            pixel = np.ravel_multi_index((y, x), trap_density.shape)
+            for k in range(nfamilies):
+                cr_filled[k] = np.bincount(
+                    pixel, weights=cr_capture[k],
+                    minlength=trap_density.size).reshape(trap_density.shape)
 
         cr_filled *= SCALEFACTOR
         return cr_filled
@@ -1060,14 +1079,14 @@ class DataSet():
 
         Parameters
         ----------
-        traps_filled : ndarray, 2-D
-            This is an image of the number of filled traps in each pixel
-            for the current trap family.
+        traps_filled : ndarray, 3-D
+            This is an image of the number of filled traps in each pixel,
+            one image plane for each trap family.
 
-        decay_param : float
-            The decay parameter.  This is negative, but otherwise it's
-            the reciprocal of the e-folding time for trap decay for the
-            current trap family.
+        decay_param : ndarray
+            The decay parameter for each trap family.  This is negative,
+            but otherwise it's the reciprocal of the e-folding time for
+            trap decay for the trap family.
 
         delta_t : float
             The time interval (unit = second) over which the trap decay
@@ -1075,15 +1094,37 @@ class DataSet():
 
         Returns
         -------
-        decayed : ndarray, 2-D
+        decayed : ndarray, 3-D
             Image of the computed number of trap decays for each pixel,
-            for the current trap family.
+            for each trap family.
         """
 
-        if decay_param == 0.:
-            decayed = traps_filled * 0.
-        else:
-            tau = 1. / abs(decay_param)
-            decayed = traps_filled * (1. - math.exp(-delta_t / tau))
+        fraction = self.decay_fraction(decay_param, delta_t)
+        decayed = traps_filled * fraction[:, np.newaxis, np.newaxis]
 
         return decayed
+
+
+    def decay_fraction(self, decay_param, delta_t):
+        """Compute the fraction of filled traps that decay in time delta_t.
+
+        Parameters
+        ----------
+        decay_param : ndarray
+            The decay parameter for each trap family.
+
+        delta_t : float
+            The time interval (unit = second) over which the trap decay
+            is to be computed.
+
+        Returns
+        -------
+        ndarray
+            The fraction of the filled traps of each trap family that
+            decay in time `delta_t`.  This is zero for a decay parameter
+            of zero.
+        """
+
+        rate = np.abs(np.asarray(decay_param, dtype=np.float64))
+
+        return np.where(rate == 0., 0., 1. - np.exp(-delta_t * rate))
@@ -1,11 +1,20 @@
 #! /usr/bin/env python
 
+import logging
+
 from ..stpipe import Step
 from .. import datamodels
 from . import persistence
 
 __all__ = ["PersistenceStep"]
 
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+# The updated trapsfilled models kept in memory, by detector, for the next
+# exposure of the same detector (see `keep_trapsfilled`).
+kept_traps_filled = {}
+
 
 class PersistenceStep(Step):
     """
@@ -27,6 +36,10 @@ class PersistenceStep(Step):
         # If `save_trapsfilled` is True, the updated trapsfilled file will
         # be written to an output file with suffix "_trapsfilled".
         save_trapsfilled = boolean(default=True)
+        # If `keep_trapsfilled` is True, the updated trapsfilled model will
+        # be kept in memory, and used as the input trapsfilled for the next
+        # exposure of the same detector if `input_trapsfilled` is not given.
+        keep_trapsfilled = boolean(default=False)
     """
 
     reference_file_types = ["trapdensity", "trappars", "persat"]
@@ -69,11 +82,14 @@ class PersistenceStep(Step):
             output_obj.meta.cal_step.persistence = "SKIPPED"
             return output_obj
 
-        if self.input_trapsfilled is None:
-            traps_filled_model = None
-        else:
+        detector = output_obj.meta.instrument.detector
+        if self.input_trapsfilled is not None:
             traps_filled_model = datamodels.TrapsFilledModel(
                                         self.input_trapsfilled)
+        elif self.keep_trapsfilled:
+            traps_filled_model = get_kept_traps_filled(output_obj)
+        else:
+            traps_filled_model = None
         trap_density_model = datamodels.TrapDensityModel(
                                 self.trap_density_filename)
         trappars_model = datamodels.TrapParsModel(self.trappars_filename)
@@ -97,7 +113,10 @@ class PersistenceStep(Step):
             self.save_model(
                 traps_filled, suffix='trapsfilled', force=self.save_trapsfilled
             )
-            traps_filled.close()
+            if self.keep_trapsfilled:
+                kept_traps_filled[detector] = traps_filled
+            else:
+                traps_filled.close()
 
         if output_pers is not None:             # output file of persistence
             self.save_model(output_pers, suffix='output_pers')
@@ -109,3 +128,39 @@ class PersistenceStep(Step):
         persat_model.close()
 
         return output_obj
+
+
+def get_kept_traps_filled(sci_model):
+    """Get a copy of the trapsfilled model kept for the detector.
+
+    Parameters
+    ----------
+    sci_model : RampModel
+        The science data.
+
+    Returns
+    -------
+    TrapsFilledModel or None
+        A copy of the trapsfilled model kept by a previous run of the step
+        for the same detector, or None if there is none, if the end time of
+        the kept model or the start time of the exposure is not set, or if
+        the kept model does not end before the start of the exposure.
+    """
+    detector = sci_model.meta.instrument.detector
+    kept = kept_traps_filled.get(detector)
+    if kept is None:
+        return None
+    end_time = kept.meta.exposure.end_time
+    start_time = sci_model.meta.exposure.start_time
+    if end_time is None or start_time is None:
+        log.warning("The end time of the trapsfilled model kept for %s, or "
+                    "the start time of the exposure, is not set, so it will "
+                    "not be used", detector)
+        return None
+    if end_time > start_time:
+        log.warning("The trapsfilled model kept for %s ends after the start "
+                    "of the exposure, so it will not be used", detector)
+        return None
+    log.info("Using the trapsfilled model kept from %s",
+             kept.meta.filename)
+    return kept.copy()
@@ -0,0 +1,149 @@
+"""Test the persistence correction"""
+import numpy as np
+import pytest
+
+from jwst import datamodels
+from jwst.datamodels import dqflags
+from jwst.persistence import persistence, persistence_step
+from jwst.persistence.persistence_step import PersistenceStep
+
+
+def make_sci(nints=2, ngroups=5, start_time=58000.01):
+    """NIRCam subarray ramp with some jumps"""
+    rng = np.random.RandomState(3)
+    shape = (nints, ngroups, 20, 30)
+    data = np.cumsum(rng.uniform(0., 3000., size=shape), axis=1)
+    sci = datamodels.RampModel(data=data.astype(np.float32),
+                               pixeldq=np.zeros(shape[-2:], dtype=np.uint32),
+                               groupdq=np.zeros(shape, dtype=np.uint8))
+    sci.groupdq[:, 2, 5:8, 5:8] = dqflags.group['JUMP_DET']
+    sci.groupdq[:, -1, 10:, 20:] = dqflags.group['SATURATED']
+    sci.meta.instrument.name = 'NIRCAM'
+    sci.meta.instrument.detector = 'NRCA1'
+    sci.meta.subarray.xstart = 11
+    sci.meta.subarray.ystart = 21
+    sci.meta.subarray.xsize = 30
+    sci.meta.subarray.ysize = 20
+    sci.meta.exposure.frame_time = 10.7
+    sci.meta.exposure.group_time = 10.7
+    sci.meta.exposure.ngroups = ngroups
+    sci.meta.exposure.nframes = 1
+    sci.meta.exposure.groupgap = 0
+    sci.meta.exposure.nresets_at_start = 1
+    sci.meta.exposure.nresets_between_ints = 1
+    sci.meta.exposure.start_time = start_time
+    sci.meta.exposure.end_time = start_time + 0.001
+    return sci
+
+
+def set_full_frame(model):
+    model.meta.subarray.xstart = 1
+    model.meta.subarray.ystart = 1
+    model.meta.subarray.xsize = 100
+    model.meta.subarray.ysize = 80
+
+
+def make_refs():
+    """Full frame trap density, trap parameters and persistence saturation"""
+    trap_density = datamodels.TrapDensityModel(
+        data=np.full((80, 100), 1.5, dtype=np.float32))
+    set_full_frame(trap_density)
+    persat = datamodels.PersistenceSatModel(
+        data=np.full((80, 100), 9000., dtype=np.float32))
+    set_full_frame(persat)
+    trappars = datamodels.TrapParsModel()
+    table = np.zeros(3, dtype=[('capture0', 'f4'), ('capture1', 'f4'),
+                               ('capture2', 'f4'), ('decay_param', 'f4')])
+    table['capture0'] = [180., 270., 5.]
+    table['capture1'] = [-0.0004, -0.001, -0.002]
+    table['capture2'] = [0.0003, 0.0002, 0.0001]
+    table['decay_param'] = [-0.0004, -0.002, 0.]
+    trappars.trappars_table = table
+    return trap_density, trappars, persat
+
+
+def test_decay_all_families():
+    """The persistence is the decay of the traps filled at the start"""
+    sci = make_sci(nints=1)
+    trap_density, trappars, persat = make_refs()
+    traps_filled = datamodels.TrapsFilledModel(
+        data=np.full((3, 80, 100), 1000., dtype=np.float32))
+    set_full_frame(traps_filled)
+    traps_filled.meta.exposure.end_time = sci.meta.exposure.start_time
+
+    dataset = persistence.DataSet(sci.copy(), traps_filled, 40., True,
+                                  trap_density, trappars, persat)
+    output, traps_filled, output_pers, skipped = dataset.do_all()
+    assert not skipped
+
+    # The decay of each trap family, group by group
+    expected = np.zeros(5)
+    for decay_param in trappars.trappars_table['decay_param']:
+        filled = 1000.
+        decayed = 0.
+        for group in range(5):
+            decay = filled * (1. - np.exp(-10.7 * abs(decay_param)))
+            filled -= decay
+            decayed += decay
+            expected[group] += decayed
+    assert output_pers.data[0, :, 0, 0] == pytest.approx(expected, rel=1e-6)
+    np.testing.assert_allclose(output.data, sci.data - output_pers.data,
+                               rtol=1e-6)
+
+    # Traps were filled in the science subarray only
+    assert traps_filled.data[2, 0, 0] == 1000.
+    assert np.all(traps_filled.data[2, 20:40, 10:40] > 1000.)
+    assert output.pixeldq[0, 0] == dqflags.pixel['DO_NOT_USE']
+
+
+def test_keep_trapsfilled(tmpdir):
+    """The trapsfilled model is carried over to the next exposure"""
+    trap_density, trappars, persat = make_refs()
+    ref_names = {}
+    for reftype, model in [('trapdensity', trap_density),
+                           ('trappars', trappars), ('persat', persat)]:
+        ref_names[reftype] = str(tmpdir.join(reftype + '.fits'))
+        model.save(ref_names[reftype])
+
+    step = PersistenceStep(keep_trapsfilled=True, save_trapsfilled=False)
+    step.get_reference_file = lambda model, reftype: ref_names[reftype]
+    persistence_step.kept_traps_filled.clear()
+    try:
+        first = step.process(make_sci())
+        kept = persistence_step.kept_traps_filled['NRCA1']
+        assert np.all(kept.data[:, 20:40, 10:40] > 0.)
+
+        # the traps filled by the first exposure decay in the second one
+        second = step.process(make_sci(start_time=58000.02))
+        assert np.all(second.data < make_sci().data)
+
+        # an exposure starting before the kept model ends does not use it
+        third = step.process(make_sci(start_time=58000.))
+        np.testing.assert_array_equal(third.data, first.data)
+
+        # nor does an exposure without a start time, or a kept model
+        # without an end time
+        no_start = make_sci()
+        no_start.meta.exposure.start_time = None
+        np.testing.assert_array_equal(step.process(no_start).data, first.data)
+        persistence_step.kept_traps_filled['NRCA1'].meta.exposure.end_time = None
+        np.testing.assert_array_equal(
+            step.process(make_sci(start_time=58000.02)).data, first.data)
+    finally:
+        persistence_step.kept_traps_filled.clear()
+
+
+def test_traps_filled_without_end_time():
+    """A traps_filled model without an end time is not used"""
+    sci = make_sci(nints=1)
+    trap_density, trappars, persat = make_refs()
+    traps_filled = datamodels.TrapsFilledModel(
+        data=np.full((3, 80, 100), 1000., dtype=np.float32))
+    set_full_frame(traps_filled)
+
+    dataset = persistence.DataSet(sci.copy(), traps_filled, 40., True,
+                                  trap_density, trappars, persat)
+    output, traps_filled, output_pers, skipped = dataset.do_all()
+    assert not skipped
+    assert traps_filled.data[2, 0, 0] == 0.
+    np.testing.assert_array_equal(output.data, sci.data)
@@ -477,7 +477,6 @@ def compute_slope(data_sect, input_var_sect,
     # Fit slopes for all pixels that have no cosmic ray hits anywhere in
     # the ramp, then fit slopes with one CR hit, then with two, etc.
     for num_cr in range(max_num_cr + 1):
-        ngroups = len(data_sect)
         ncr_mask = (sum_flagged == num_cr)
         # Number of detector pixels flagged with num_cr CRs within the ramp.
         nz = ncr_mask.sum(dtype=np.int32)
@@ -486,27 +485,17 @@ def compute_slope(data_sect, input_var_sect,
 
         # ramp_data will be a ramp with a 1-D array of pixels copied out
         # of data_sect.
-        ramp_data = np.empty((ngroups, nz), dtype=data_sect.dtype)
-        input_var_data = np.empty((ngroups, nz), dtype=data_sect.dtype)
-        prev_fit_data = np.empty((ngroups, nz), dtype=prev_fit.dtype)
-        prev_slope_data = np.empty(nz, dtype=prev_slope_sect.dtype)
-        prev_slope_data[:] = prev_slope_sect[ncr_mask]
-        readnoise = np.empty(nz, dtype=readnoise_sect.dtype)
-        readnoise[:] = readnoise_sect[ncr_mask]
+        ramp_data = data_sect[:, ncr_mask]
+        prev_fit_data = prev_fit[:, ncr_mask]
+        prev_slope_data = prev_slope_sect[ncr_mask]
+        readnoise = readnoise_sect[ncr_mask]
         if gain_sect is None:
             gain = None
         else:
-            gain = np.empty(nz, dtype=gain_sect.dtype)
-            gain[:] = gain_sect[ncr_mask]
-        cr_flagged_2d = np.empty((ngroups, nz), dtype=cr_flagged.dtype)
-        saturated_data = np.empty((ngroups, nz), dtype=prev_fit.dtype)
-        for k in range(ngroups):
-            ramp_data[k] = data_sect[k][ncr_mask]
-            input_var_data[k] = input_var_sect[k][ncr_mask]
-            prev_fit_data[k] = prev_fit[k][ncr_mask]
-            cr_flagged_2d[k] = cr_flagged[k][ncr_mask]
-            # This is for clobbering saturated pixels.
-            saturated_data[k] = saturated[k][ncr_mask]
+            gain = gain_sect[ncr_mask]
+        cr_flagged_2d = cr_flagged[:, ncr_mask]
+        # This is for clobbering saturated pixels.
+        saturated_data = saturated[:, ncr_mask]
 
         (result, variances) = \
                 gls_fit(ramp_data,
@@ -637,44 +626,33 @@ def gls_fit(ramp_data,
                  frame_time * (M + 1.) / 2.
 
     if num_cr > 0:
+        # The cumulative number of cosmic rays reaches n at the group hit
+        # by the n-th cosmic ray, and stays at n or more after it.
         sum_crs = cr_flagged_2d.cumsum(axis=0)
-        for k in range(ngroups):
-            s = slice(k, ngroups)
-            for n in range(1, num_cr + 1):
-                temp = np.where(np.logical_and(cr_flagged_2d[k] == 1,
-                                               sum_crs[k] == n))
-                if len(temp[0]) > 0:
-                    index = (temp[0], s, n + 1)
-                    x[index] = 1
-        del temp, index
+        for n in range(1, num_cr + 1):
+            x[:, :, n + 1] = np.transpose(sum_crs >= n, (1, 0))
+        del sum_crs
 
     y = np.transpose(ramp_data, (1, 0)).reshape((nz, ngroups, 1))
 
     # ramp_cov is an array of nz matrices, each ngroups x ngroups.
     # each matrix gives the covariance of that pixel's ramp data
-    ramp_cov = np.ones((nz, ngroups, ngroups), dtype=np.float64)
-
+    #
     # Use the previous fit to the data to populate the covariance matrix,
-    # for each of the nz pixels.  prev_fit_data has shape (ngroups, nz),
-    # similar to the ramp data, but we want the nz axis to be the first
-    # (we're constructing an array of nz matrix equations), so transpose
+    # for each of the nz pixels:  element (j, k) is the previous fit at
+    # group min(j, k).  prev_fit_data has shape (ngroups, nz), similar to
+    # the ramp data, but we want the nz axis to be the first (we're
+    # constructing an array of nz matrix equations), so transpose
     # prev_fit_data.
-    prev_fit_T = np.transpose(prev_fit_data, (1, 0))
-    for k in range(ngroups):
-        # Populate the upper right, row by row.
-        ramp_cov[:, k, k:ngroups] = prev_fit_T[:, k:k + 1]
-        # Populate the lower left, column by column.
-        ramp_cov[:, k:ngroups, k] = prev_fit_T[:, k:k + 1]
-        # Give saturated pixels a very high high variance (hence a low weight)
-        ramp_cov[:, k, k] += saturated_data[k, :]
+    prev_fit_T = np.transpose(prev_fit_data, (1, 0)).astype(np.float64)
+    groups = np.arange(ngroups)
+    ramp_cov = prev_fit_T[:, np.minimum.outer(groups, groups)]
     del prev_fit_T
 
-    # I is 2-D, but it can broadcast to 4-D.  This is used to add terms to
-    # the diagonal of the covariance matrix.
-    I = np.identity(ngroups)
-
-    rn3d = readnoise.reshape((nz, 1, 1))
-    ramp_cov += (I * rn3d**2)
+    # Give saturated pixels a very high high variance (hence a low weight),
+    # and add the read noise to the diagonal of the covariance matrix.
+    ramp_cov[:, groups, groups] += np.transpose(saturated_data, (1, 0))
+    ramp_cov[:, groups, groups] += (readnoise**2).reshape((nz, 1))
 
     # prev_slope_data must be non-negative.
     flags = prev_slope_data < 0.
@@ -688,20 +666,16 @@ def gls_fit(ramp_data,
     # shape of xT is (nz, 2 + num_cr, ngroups)
     xT = np.transpose(x, (0, 2, 1))
 
-    # shape of `ramp_invcov` is (nz, ngroups, ngroups)
-    I = I.reshape((1, ngroups, ngroups))
-    ramp_invcov = la.solve(ramp_cov, I)
-
-    del I
-
-    # temp1 = xT @ ramp_invcov
-    # np.einsum use is equivalent to matrix multiplication
-    # shape of temp1 is (nz, 2 + num_cr, ngroups)
-    temp1 = np.einsum('...ij,...jk->...ik', xT, ramp_invcov)
+    # Rather than inverting ramp_cov, solve ramp_cov @ [a, b] = [x, y] for
+    # a = ramp_cov^-1 @ x and b = ramp_cov^-1 @ y, with a single
+    # factorization of each covariance matrix.
+    # shape of invcov_xy is (nz, ngroups, 3 + num_cr)
+    invcov_xy = la.solve(ramp_cov, np.concatenate((x, y), axis=2))
+    del ramp_cov
 
     # temp_var = xT @ ramp_invcov @ x
     # shape of temp_var is (nz, 2 + num_cr, 2 + num_cr)
-    temp_var = np.einsum('...ij,...jk->...ik', temp1, x)
+    temp_var = np.matmul(xT, invcov_xy[:, :, :-1])
 
     # `fitparam_cov` is an array of nz covariance matrices.
     # fitparam_cov = (xT @ ramp_invcov @ x)^-1
@@ -722,10 +696,11 @@ def gls_fit(ramp_data,
 
     # [xT @ ramp_invcov @ y]
     # shape of temp2 is (nz, 2 + num_cr, 1)
-    temp2 = np.einsum('...ij,...jk->...ik', temp1, y)
+    temp2 = np.matmul(xT, invcov_xy[:, :, -1:])
+    del invcov_xy
 
     # shape of fitparam is (nz, 2 + num_cr, 1)
-    fitparam = np.einsum('...ij,...jk->...ik', fitparam_cov, temp2)
+    fitparam = np.matmul(fitparam_cov, temp2)
     r_shape = fitparam.shape
     fitparam2d = fitparam.reshape((r_shape[0], r_shape[1]))
     del fitparam
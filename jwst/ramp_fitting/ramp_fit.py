@@ -15,6 +15,8 @@
 
 import time
 import logging
+import multiprocessing
+import tempfile
 import numpy as np
 import warnings
 
@@ -33,7 +35,8 @@ BUFSIZE = 1024 * 30000  # 30Mb cache size for data section
 
 
 def ramp_fit(model, buffsize, save_opt, readnoise_model, gain_model,
-             algorithm, weighting):
+             algorithm, weighting, max_cores=None, segment_engine='vectorized',
+             streaming=False):
     """
     Calculate the count rate for each pixel in all data cube sections and all
     integrations, equal to the slope for all sections (intervals between
@@ -67,6 +70,21 @@ def ramp_fit(model, buffsize, save_opt, readnoise_model, gain_model,
         'optimal' specifies that optimal weighting should be used;
          currently the only weighting supported.
 
+    max_cores : string or None
+        Number of cores to use for OLS fitting: 'quarter', 'half' or 'all'
+        of the available cores, or None for a single process.
+
+    segment_engine : string
+        'vectorized' to find and fit all the segments of the OLS ramps at
+        once, or 'iterative' to use the segment by segment fitting of
+        fit_next_segment().
+
+    streaming : boolean
+        If True, the OLS fit reads, fits and stores the results of one
+        integration at a time, with the integration-specific results kept
+        in temporary files, to bound the memory used for exposures having
+        many integrations.
+
     Returns
     -------
     new_model : Data Model object
@@ -92,7 +110,7 @@ def ramp_fit(model, buffsize, save_opt, readnoise_model, gain_model,
     else:
         new_model, int_model, opt_model = \
                ols_ramp_fit(model, buffsize, save_opt, readnoise_model, \
-               gain_model, weighting)
+               gain_model, weighting, max_cores, segment_engine, streaming)
         gls_opt_model = None
 
     # Update data units in output models
@@ -108,7 +126,8 @@ def ramp_fit(model, buffsize, save_opt, readnoise_model, gain_model,
 
 
 def ols_ramp_fit(model, buffsize, save_opt, readnoise_model, gain_model,
-                 weighting):
+                 weighting, max_cores=None, segment_engine='vectorized',
+                 streaming=False):
     """
     Fit a ramp using ordinary least squares. Calculate the count rate for each
     pixel in all data cube sections and all integrations, equal to the weighted
@@ -136,6 +155,18 @@ def ols_ramp_fit(model, buffsize, save_opt, readnoise_model, gain_model,
         'optimal' specifies that optimal weighting should be used; currently
         the only weighting supported.
 
+    max_cores : string or None
+        Number of cores to use: 'quarter', 'half' or 'all' of the available
+        cores, or None for a single process. With more than one process the
+        rows of the image are split into slices fit in parallel.
+
+    segment_engine : string
+        'vectorized' (calc_slope_vectorized) or 'iterative' (calc_slope)
+
+    streaming : boolean
+        fit one integration at a time with ols_fit_streaming; not used if
+        save_opt is True
+
     Returns
     -------
     new_model : Data Model object
@@ -265,13 +296,6 @@ def ols_ramp_fit(model, buffsize, save_opt, readnoise_model, gain_model,
     max_seg = calc_num_seg(gdq_cube, n_int)
     del gdq_cube
 
-    f_max_seg = 0  # final number to use, usually overwritten by actual value
-
-    (dq_int, median_diffs_2d, num_seg_per_int, sat_0th_group_int) =\
-        utils.alloc_arrays_1(n_int, imshape)
-
-    opt_res = utils.OptRes(n_int, imshape, max_seg, nreads, save_opt)
-
     # Calculate number of (contiguous) rows per data section
     nrows = calc_nrows(model, buffsize, cubeshape, nreads)
 
@@ -289,6 +313,301 @@ def ols_ramp_fit(model, buffsize, save_opt, readnoise_model, gain_model,
     pixeldq = model.pixeldq.copy()
     pixeldq = utils.reset_bad_gain( pixeldq, gain_2d ) # Flag bad pixels in gain
 
+    if streaming and save_opt:
+        log.warning('The optional output product needs all the integrations,')
+        log.warning('  so they will be fit together instead of streamed.')
+        streaming = False
+
+    # Fit the ramps, either one integration at a time, all the rows at once,
+    #   or slices of rows in separate processes
+    number_slices = calc_num_slices(max_cores, cubeshape[1])
+    if streaming:
+        if number_slices > 1:
+            log.info('Integrations are streamed, so a single process is used')
+        log.info('Fitting the integrations one at a time')
+        opt_res = None
+        var_p4 = None
+        var_r4 = None
+        inv_var_both4 = None
+        (dq_int, slope_int, s_slope_by_var2, s_inv_var_both2, var_p3, var_r3,
+         var_both3, s_inv_var_p3, s_inv_var_r3) = \
+            ols_fit_streaming(model, pixeldq, readnoise_2d, gain_2d, nrows,
+                              max_seg, frame_time, group_time, ngroups,
+                              nreads, weighting, segment_engine)
+    elif number_slices == 1:
+        (opt_res, f_max_seg, dq_int, slope_int, s_slope_by_var2,
+         s_inv_var_both2, var_p3, var_r3, var_both3, s_inv_var_p3,
+         s_inv_var_r3, var_p4, var_r4, inv_var_both4) = \
+            ols_fit_rows(model.data, model.groupdq, pixeldq, readnoise_2d,
+                         gain_2d, nrows, max_seg, frame_time, group_time,
+                         ngroups, nreads, save_opt, weighting,
+                         segment_engine)
+    else:
+        log.info("Creating %d processes for ramp fitting" % number_slices)
+        (opt_res, f_max_seg, dq_int, slope_int, s_slope_by_var2,
+         s_inv_var_both2, var_p3, var_r3, var_both3, s_inv_var_p3,
+         s_inv_var_r3, var_p4, var_r4, inv_var_both4) = \
+            ols_fit_rows_multi(model, pixeldq, readnoise_2d, gain_2d, nrows,
+                               max_seg, number_slices, frame_time,
+                               group_time, ngroups, nreads, save_opt,
+                               weighting, segment_engine)
+
+    del gain_2d
+    del readnoise_2d
+
+    # Compute the 'dataset-averaged' slope
+    # Suppress, then re-enable harmless arithmetic warnings
+    warnings.filterwarnings("ignore", ".*invalid value.*", RuntimeWarning)
+    warnings.filterwarnings("ignore", ".*divide by zero.*", RuntimeWarning)
+    slope_dataset2 = s_slope_by_var2/s_inv_var_both2
+    warnings.resetwarnings()
+
+    del s_inv_var_both2, s_slope_by_var2
+
+    #  Replace nans in slope_dataset2 with 0 (for non-existing segments)
+    slope_dataset2[np.isnan(slope_dataset2)] = 0.
+
+    # Loop over data integrations to calculate integration-specific pedestal
+    if save_opt:
+        dq_slice = np.zeros((gdq_cube_shape[2],gdq_cube_shape[3]),
+                            dtype=np.uint32)
+
+        for num_int in range(0, n_int):
+            dq_slice =  model.get_section('groupdq')[num_int, 0, :, :]
+            opt_res.ped_int[ num_int, :, : ] = \
+                utils.calc_pedestal(num_int, slope_int, opt_res.firstf_int,
+                    dq_slice, nframes, groupgap, dropframes1)
+
+        del dq_slice
+
+    # Collect optional results for output
+    if save_opt:
+        gdq_cube = model.groupdq
+        opt_res.shrink_crmag(n_int, gdq_cube, imshape, nreads)
+        del gdq_cube
+
+        # Some contributions to these vars may be NaN as they are from ramps
+        # having PIXELDQ=DO_NOT_USE
+        var_p4[ np.isnan( var_p4 )] = 0.
+        var_r4[ np.isnan( var_r4 )] = 0.
+
+        # Truncate results at the maximum number of segments found
+        opt_res.slope_seg = opt_res.slope_seg[:,:f_max_seg,:,:]
+        opt_res.sigslope_seg = opt_res.sigslope_seg[:,:f_max_seg,:,:]
+        opt_res.yint_seg = opt_res.yint_seg[:,:f_max_seg,:,:]
+        opt_res.sigyint_seg = opt_res.sigyint_seg[:,:f_max_seg,:,:]
+        opt_res.weights = (inv_var_both4[:,:f_max_seg,:,:])**2.
+        opt_res.var_p_seg = var_p4[:,:f_max_seg,:,:]
+        opt_res.var_r_seg = var_r4[:,:f_max_seg,:,:]
+
+        opt_model = opt_res.output_optional(model, effintim)
+    else:
+        opt_model = None
+
+    if inv_var_both4 is not None:
+        del inv_var_both4
+
+    if var_p4 is not None:
+        del var_p4
+
+    if var_r4 is not None:
+        del var_r4
+
+    if pixeldq is not None:
+        del pixeldq
+
+    # For multiple-integration datasets, will output integration-specific
+    #    results to separate file named <basename> + '_integ.fits'
+    int_times = None
+    if n_int > 1:
+        if pipe_utils.is_tso(model) and hasattr(model, 'int_times'):
+            int_times = model.int_times
+        else:
+            int_times = None
+        int_model = utils.output_integ(model, slope_int, dq_int, effintim,
+                                       var_p3, var_r3, var_both3, int_times,
+                                       in_place=streaming)
+    else:
+        int_model = None
+
+    if opt_res is not None:
+        del opt_res
+
+    if slope_int is not None:
+        del slope_int
+    del var_p3
+    del var_r3
+    del var_both3
+    if int_times is not None:
+        del int_times
+
+    # Divide slopes by total (summed over all integrations) effective
+    #   integration time to give count rates.
+    c_rates = slope_dataset2 / effintim
+
+    # Compress all integration's dq arrays to create 2D PIXELDDQ array for
+    #   primary output
+    final_pixeldq = dq_compress_final(dq_int, n_int)
+
+    if dq_int is not None:
+        del dq_int
+
+    tstop = time.time()
+
+    log_stats(c_rates)
+
+    log.debug('Instrument: %s', instrume)
+    log.debug('Number of pixels in 2D array: %d', npix)
+    log.debug('Shape of 2D image: (%d, %d)' %(imshape))
+    log.debug('Shape of data cube: (%d, %d, %d)' %(orig_cubeshape))
+    log.debug('Buffer size (bytes): %d', buffsize)
+    log.debug('Number of rows per buffer: %d', nrows)
+    log.info('Number of groups per integration: %d', orig_nreads)
+    log.info('Number of integrations: %d', n_int)
+    log.debug('The execution time in seconds: %f', tstop - tstart)
+
+    # Compute the 2D variances due to Poisson and read noise
+    var_p2 = 1/(s_inv_var_p3.sum(axis=0))
+    var_r2 = 1/(s_inv_var_r3.sum(axis=0))
+
+    # Huge variances correspond to non-existing segments, so are reset to 0
+    #  to nullify their contribution.
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", "invalid value.*", RuntimeWarning)
+        var_p2[var_p2 > 0.1 * utils.LARGE_VARIANCE] = 0.
+        var_r2[var_r2 > 0.1 * utils.LARGE_VARIANCE] = 0.
+
+    # Some contributions to these vars may be NaN as they are from ramps
+    # having PIXELDQ=DO_NOT_USE
+    var_p2[ np.isnan( var_p2 )] = 0.
+    var_r2[ np.isnan( var_r2 )] = 0.
+
+    # Suppress, then re-enable, harmless arithmetic warning
+    warnings.filterwarnings("ignore", ".*invalid value.*", RuntimeWarning)
+    err_tot = np.sqrt(var_p2 + var_r2)
+    warnings.resetwarnings()
+
+    del s_inv_var_p3
+    del s_inv_var_r3
+
+    # Create new model for the primary output.
+    new_model = datamodels.ImageModel(data=c_rates.astype(np.float32),
+            dq=final_pixeldq.astype(np.uint32),
+            var_poisson=var_p2.astype(np.float32),
+            var_rnoise=var_r2.astype(np.float32),
+            err=err_tot.astype(np.float32))
+
+    new_model.update(model)  # ... and add all keys from input
+
+    return new_model, int_model, opt_model
+
+
+def ols_fit_rows(data, groupdq, pixeldq, readnoise_2d, gain_2d, nrows,
+                 max_seg, frame_time, group_time, ngroups, nreads, save_opt,
+                 weighting, segment_engine='vectorized', med_rates=None):
+    """
+    Fit the ramps of a set of contiguous image rows, in data sections of
+    nrows rows, and calculate the segment-specific, integration-specific and
+    dataset-averaged slopes and variances of these rows.
+
+    Parameters
+    ----------
+    data : float, 4D array
+        science data for the rows, [ integ, group, y, x ]
+
+    groupdq : int, 4D array
+        group DQ for the rows, [ integ, group, y, x ]
+
+    pixeldq : int, 2D array
+        pixel DQ for the rows, with bad gain pixels flagged
+
+    readnoise_2d : float, 2D array
+        readnoise for the rows
+
+    gain_2d : float, 2D array
+        gain for the rows
+
+    nrows : int
+        number of rows in a data section
+
+    max_seg : int
+        maximum number of segments fit, over all pixels of the dataset
+
+    frame_time : float
+        integration time from TGROUP keyword
+
+    group_time : float
+        time increment between groups
+
+    ngroups : int
+        number of groups per integration
+
+    nreads : int
+        number of reads in an integration
+
+    save_opt : boolean
+        calculate optional fitting results
+
+    weighting : string
+        'optimal' specifies that optimal weighting should be used; currently
+        the only weighting supported.
+
+    segment_engine : string
+        'vectorized' to fit the segments with calc_slope_vectorized(), or
+        'iterative' to fit them with calc_slope()
+
+    med_rates : float, 2D array or None
+        median rates of the rows, used to calculate the Poisson variances;
+        if None they are estimated from the first differences of the
+        integrations fit here
+
+    Returns
+    -------
+    opt_res : OptRes object
+        segment-specific results for the rows
+
+    f_max_seg : int
+        actual maximum number of segments fit in the rows
+
+    dq_int : int, 3D array
+        integration-specific DQ
+
+    slope_int : float, 3D array
+        integration-specific slopes
+
+    s_slope_by_var2, s_inv_var_both2 : float, 2D arrays
+        sums over integrations and segments of the slopes divided by their
+        combined variances, and of the inverse combined variances; their
+        ratio is the slope averaged over all integrations
+
+    var_p3, var_r3, var_both3 : float, 3D arrays
+        integration-specific variances due to Poisson noise, read noise and
+        both
+
+    s_inv_var_p3, s_inv_var_r3 : float, 3D arrays
+        sums over segments of the inverse Poisson and read noise variances
+
+    var_p4, var_r4, inv_var_both4 : float, 4D arrays or None
+        segment-specific Poisson and read noise variances, and inverse
+        combined variances; None if save_opt is False
+    """
+    n_int = data.shape[0]
+    imshape = data.shape[-2:]
+
+    f_max_seg = 0  # final number to use, usually overwritten by actual value
+
+    (dq_int, median_diffs_2d, num_seg_per_int, sat_0th_group_int) =\
+        utils.alloc_arrays_1(n_int, imshape)
+
+    opt_res = utils.OptRes(n_int, imshape, max_seg, nreads, save_opt)
+    pixeldq_sect = None
+
+    if segment_engine == 'iterative':
+        slope_function = calc_slope
+    else:
+        slope_function = calc_slope_vectorized
+
+
     # In this 'First Pass' over the data, loop over integrations and data
     #   sections to calculate the estimated median slopes, which will be used
     #   to calculate the variances. This is the same method to estimate slopes
@@ -299,13 +618,13 @@ def ols_ramp_fit(model, buffsize, save_opt, readnoise_model, gain_model,
     # Loop over data integrations:
     for num_int in range(0, n_int):
         # Loop over data sections
-        for rlo in range(0, cubeshape[1], nrows):
+        for rlo in range(0, imshape[0], nrows):
             rhi = rlo + nrows
 
-            if rhi > cubeshape[1]:
-                rhi = cubeshape[1]
+            if rhi > imshape[0]:
+                rhi = imshape[0]
 
-            data_sect = model.get_section('data')[num_int, :, rlo:rhi, :]
+            data_sect = data[num_int, :, rlo:rhi, :]
 
             # Skip data section if it is all NaNs
             if  np.all(np.isnan( data_sect)):
@@ -313,11 +632,11 @@ def ols_ramp_fit(model, buffsize, save_opt, readnoise_model, gain_model,
                 continue
 
             # first frame section for 1st group of current integration
-            ff_sect = model.get_section('data')[ num_int, 0, rlo:rhi, :].\
+            ff_sect = data[ num_int, 0, rlo:rhi, :].\
                 astype(np.float32)
 
             # Get appropriate sections
-            gdq_sect = model.get_section('groupdq')[num_int, :, rlo:rhi, :]
+            gdq_sect = groupdq[num_int, :, rlo:rhi, :]
             rn_sect = readnoise_2d[rlo:rhi, :]
             gain_sect = gain_2d[rlo:rhi, :]
 
@@ -328,59 +647,15 @@ def ols_ramp_fit(model, buffsize, save_opt, readnoise_model, gain_model,
             data_sect[ where_sat ] = np.NaN
             del where_sat
 
-            # Compute the first differences of all groups
-            first_diffs_sect = np.diff(data_sect, axis=0)
-
-            # If the dataset has only 1 group/integ, assume the 'previous group'
-            #   is all zeros, so just use data as the difference
-            if (first_diffs_sect.shape[0] == 0):
-                first_diffs_sect = data_sect.copy()
-            else:
-                # Similarly, for datasets having >1 group/integ and having
-                #   single-group segments, just use the data as the difference
-                wh_nan = np.where( np.isnan( first_diffs_sect[0,:,:]) )
-
-                if (len(wh_nan[0]) > 0):
-                    first_diffs_sect[0,:,:][wh_nan] = data_sect[0,:,:][wh_nan]
-
-                del wh_nan
-
-                i_group,i_yy,i_xx, = np.where( np.bitwise_and(gdq_sect[1:,:,:],
-                                              dqflags.group['JUMP_DET']) != 0)
-
-                # Mask all the first differences that are affected by a CR,
-                #   starting at group 1.  The purpose of starting at index 1 is
-                #   to shift all the indices down by 1, so they line up with the
-                #   indices in first_diffs.
-                first_diffs_sect[ i_group-1, i_yy, i_xx ] = np.NaN
-
-                del i_group, i_yy, i_xx
-
-                # Check for pixels in which there is good data in 0th group, but
-                #   all first_diffs for this ramp are NaN because there are too
-                #   few good groups past the 0th. Due to the shortage of good
-                #   data, the first_diffs will be set here equal to the data in
-                #   the 0th group.
-                wh_min = np.where( np.logical_and(np.isnan(first_diffs_sect)
-                              .all(axis=0), np.isfinite( data_sect[0,:,:])))
-                if len(wh_min[0] > 0):
-                    first_diffs_sect[0,:,:][wh_min] = data_sect[0,:,:][wh_min]
-
-                del wh_min
-
-            # All first differences affected by saturation and CRs have been set
-            #  to NaN, so compute the median of all non-NaN first differences.
-            with warnings.catch_warnings():
-                warnings.filterwarnings("ignore", "All-NaN.*", RuntimeWarning)
-                nan_med = np.nanmedian(first_diffs_sect, axis=0)
-            nan_med[np.isnan(nan_med)] = 0. # if all first_diffs_sect are nans
-            median_diffs_2d[ rlo:rhi, : ] += nan_med
+            if med_rates is None:
+                median_diffs_2d[rlo:rhi, :] += median_first_diffs(data_sect,
+                                                                  gdq_sect)
 
             # Calculate the slope of each segment
             t_dq_cube, inv_var, opt_res, f_max_seg, num_seg = \
-                 calc_slope(data_sect, gdq_sect, frame_time, opt_res, save_opt,
-                            rn_sect, gain_sect, max_seg, ngroups, weighting,
-                            f_max_seg)
+                 slope_function(data_sect, gdq_sect, frame_time, opt_res,
+                                save_opt, rn_sect, gain_sect, max_seg, ngroups,
+                                weighting, f_max_seg)
 
             del gain_sect
 
@@ -427,11 +702,11 @@ def ols_ramp_fit(model, buffsize, save_opt, readnoise_model, gain_model,
         del pixeldq_sect
 
     # Compute the final 2D array of differences; create rate array
-    median_diffs_2d /= n_int
-    med_rates = median_diffs_2d/group_time
+    if med_rates is None:
+        median_diffs_2d /= n_int
+        med_rates = median_diffs_2d/group_time
 
     del median_diffs_2d
-    del first_diffs_sect
 
     (var_p3, var_r3, var_p4, var_r4, var_both4, var_both3,
      inv_var_both4, s_inv_var_p3, s_inv_var_r3, s_inv_var_both3,
@@ -456,14 +731,14 @@ def ols_ramp_fit(model, buffsize, save_opt, readnoise_model, gain_model,
     for num_int in range(n_int):
 
         # Loop over data sections
-        for rlo in range(0, cubeshape[1], nrows):
+        for rlo in range(0, imshape[0], nrows):
             rhi = rlo + nrows
 
-            if rhi > cubeshape[1]:
-                rhi = cubeshape[1]
+            if rhi > imshape[0]:
+                rhi = imshape[0]
 
             # gdq_sect is: [ groups, y, x ]
-            gdq_sect = model.get_section('groupdq')[num_int, :, rlo:rhi, :]
+            gdq_sect = groupdq[num_int, :, rlo:rhi, :]
 
             rn_sect = readnoise_2d[rlo:rhi, :]
             gain_sect = gain_2d[rlo:rhi, :]
@@ -549,8 +824,6 @@ def ols_ramp_fit(model, buffsize, save_opt, readnoise_model, gain_model,
         del var_p4_int
         del var_p4_int2
 
-    del gain_2d
-
     var_p4 *= ( segs_4[:,:,:,:] > 0) # Zero out non-existing segments
     var_r4 *= ( segs_4[:,:,:,:] > 0)
 
@@ -564,9 +837,6 @@ def ols_ramp_fit(model, buffsize, save_opt, readnoise_model, gain_model,
     if num_seg_per_int is not None:
         del num_seg_per_int
 
-    if readnoise_2d is not None:
-        del readnoise_2d
-
     if rn_sect is not None:
         del rn_sect
 
@@ -590,19 +860,9 @@ def ols_ramp_fit(model, buffsize, save_opt, readnoise_model, gain_model,
     s_slope_by_var2 = s_slope_by_var3.sum(axis=0) # sum over integrations
     s_inv_var_both2 = s_inv_var_both3.sum(axis=0)
 
-    # Compute the 'dataset-averaged' slope
-    # Suppress, then re-enable harmless arithmetic warnings
-    warnings.filterwarnings("ignore", ".*invalid value.*", RuntimeWarning)
-    warnings.filterwarnings("ignore", ".*divide by zero.*", RuntimeWarning)
-    slope_dataset2 = s_slope_by_var2/s_inv_var_both2
-    warnings.resetwarnings()
-
-    del s_inv_var_both2, s_slope_by_var2, s_slope_by_var3, slope_by_var4
+    del s_slope_by_var3, slope_by_var4
     del s_inv_var_both3
 
-    #  Replace nans in slope_dataset2 with 0 (for non-existing segments)
-    slope_dataset2[np.isnan(slope_dataset2)] = 0.
-
     # Compute the integration-specific slope
     the_num = (opt_res.slope_seg * inv_var_both4).sum(axis=1)
 
@@ -624,141 +884,430 @@ def ols_ramp_fit(model, buffsize, save_opt, readnoise_model, gain_model,
     if sat_0th_group_int is not None:
         del sat_0th_group_int
 
-    # Loop over data integrations to calculate integration-specific pedestal
-    if save_opt:
-        dq_slice = np.zeros((gdq_cube_shape[2],gdq_cube_shape[3]),
-                            dtype=np.uint32)
 
-        for num_int in range(0, n_int):
-            dq_slice =  model.get_section('groupdq')[num_int, 0, :, :]
-            opt_res.ped_int[ num_int, :, : ] = \
-                utils.calc_pedestal(num_int, slope_int, opt_res.firstf_int,
-                    dq_slice, nframes, groupgap, dropframes1)
+    if not save_opt:
+        var_p4 = None
+        var_r4 = None
+        inv_var_both4 = None
 
-        del dq_slice
+    return (opt_res, f_max_seg, dq_int, slope_int, s_slope_by_var2,
+            s_inv_var_both2, var_p3, var_r3, var_both3, s_inv_var_p3,
+            s_inv_var_r3, var_p4, var_r4, inv_var_both4)
+
+
+def ols_fit_streaming(model, pixeldq, readnoise_2d, gain_2d, nrows, max_seg,
+                      frame_time, group_time, ngroups, nreads, weighting,
+                      segment_engine='vectorized'):
+    """
+    Fit the ramps one integration at a time, so that only the data and group
+    DQ of a single integration are held in memory; the input model may be
+    memory-mapped. In a first pass over the integrations the median rates
+    used for the Poisson variances are estimated, as in ols_fit_rows. In a
+    second pass each integration is fit with ols_fit_rows, its results are
+    written to the integration-specific arrays, which are backed by
+    temporary files, and its contributions to the dataset-averaged slope and
+    variances are accumulated. The optional results are not calculated.
+
+    Parameters
+    ----------
+    model : data model
+        input data model, assumed to be of type RampModel
+
+    pixeldq : int, 2D array
+        pixel DQ, with bad gain pixels flagged
+
+    readnoise_2d : float, 2D array
+        readnoise for all pixels
+
+    gain_2d : float, 2D array
+        gain for all pixels
+
+    nrows : int
+        number of rows in a data section
+
+    max_seg : int
+        maximum number of segments fit, over all pixels of the dataset
+
+    frame_time : float
+        integration time from TGROUP keyword
+
+    group_time : float
+        time increment between groups
+
+    ngroups : int
+        number of groups per integration
+
+    nreads : int
+        number of reads in an integration
+
+    weighting : string
+        'optimal' specifies that optimal weighting should be used; currently
+        the only weighting supported.
+
+    segment_engine : string
+        'vectorized' or 'iterative', see ols_fit_rows
+
+    Returns
+    -------
+    dq_int, slope_int, s_slope_by_var2, s_inv_var_both2, var_p3, var_r3,
+    var_both3 : arrays
+        as returned by ols_fit_rows; the 3D arrays are disk-backed
+
+    s_inv_var_p3, s_inv_var_r3 : float, 3D arrays
+        sums over segments and integrations of the inverse Poisson and read
+        noise variances, having a single plane
+    """
+    n_int = model.data.shape[0]
+    imshape = model.data.shape[-2:]
+
+    # First pass: estimate the median rates from all the integrations
+    median_diffs_2d = np.zeros(imshape, dtype=np.float32)
+    for num_int in range(n_int):
+        for rlo in range(0, imshape[0], nrows):
+            rhi = min(rlo + nrows, imshape[0])
+
+            data_sect = np.array(model.data[num_int, :, rlo:rhi, :])
+            if np.all(np.isnan(data_sect)):
+                continue
+
+            gdq_sect = model.groupdq[num_int, :, rlo:rhi, :]
+            where_sat = np.where(np.bitwise_and(gdq_sect,
+                                 dqflags.group['SATURATED']) != 0)
+            data_sect[where_sat] = np.NaN
+            del where_sat
+
+            median_diffs_2d[rlo:rhi, :] += median_first_diffs(data_sect,
+                                                              gdq_sect)
+            del data_sect
+
+    median_diffs_2d /= n_int
+    med_rates = median_diffs_2d/group_time
+    del median_diffs_2d
+
+    # Second pass: fit each integration and store its results
+    dq_int = _disk_array((n_int,) + imshape, np.uint32)
+    slope_int = _disk_array((n_int,) + imshape, np.float32)
+    var_p3 = _disk_array((n_int,) + imshape, np.float32)
+    var_r3 = _disk_array((n_int,) + imshape, np.float32)
+    var_both3 = _disk_array((n_int,) + imshape, np.float32)
+
+    s_slope_by_var2 = None
+    for num_int in range(n_int):
+        data = np.array(model.data[num_int:num_int + 1])
+        groupdq = np.array(model.groupdq[num_int:num_int + 1])
+
+        results = ols_fit_rows(data, groupdq, pixeldq, readnoise_2d, gain_2d,
+                               nrows, max_seg, frame_time, group_time,
+                               ngroups, nreads, False, weighting,
+                               segment_engine, med_rates)
+        del data, groupdq
+
+        dq_int[num_int] = results[2][0]
+        slope_int[num_int] = results[3][0]
+        var_p3[num_int] = results[6][0]
+        var_r3[num_int] = results[7][0]
+        var_both3[num_int] = results[8][0]
+
+        # Accumulate the sums over integrations
+        if s_slope_by_var2 is None:
+            s_slope_by_var2 = results[4]
+            s_inv_var_both2 = results[5]
+            s_inv_var_p3 = results[9]
+            s_inv_var_r3 = results[10]
+        else:
+            s_slope_by_var2 += results[4]
+            s_inv_var_both2 += results[5]
+            s_inv_var_p3 += results[9]
+            s_inv_var_r3 += results[10]
+        del results
+
+    return (dq_int, slope_int, s_slope_by_var2, s_inv_var_both2, var_p3,
+            var_r3, var_both3, s_inv_var_p3, s_inv_var_r3)
+
+
+def _disk_array(shape, dtype):
+    """
+    Create a zero-filled array backed by an anonymous temporary file, which
+    is removed when the array is deleted.
+
+    Parameters
+    ----------
+    shape : tuple
+        shape of the array
+
+    dtype : data-type
+        type of the array elements
+
+    Returns
+    -------
+    arr : numpy.memmap
+        the disk-backed array
+    """
+    with tempfile.TemporaryFile() as fd:
+        return np.memmap(fd, dtype=dtype, mode='w+', shape=shape)
+
+
+def median_first_diffs(data_sect, gdq_sect):
+    """
+    Calculate the median of the first differences of the ramps of a data
+    section for one integration, excluding the differences affected by
+    saturation and cosmic rays; used to estimate the median slopes from which
+    the Poisson variances of the segments are calculated.
+
+    Parameters
+    ----------
+    data_sect : float, 3D array
+        section of the data for one integration, [ group, y, x ], having
+        saturated groups set to NaN
+
+    gdq_sect : int, 3D array
+        section of the group DQ for one integration, [ group, y, x ]
+
+    Returns
+    -------
+    nan_med : float, 2D array
+        median first difference of each pixel of the section; 0 for pixels
+        having no valid differences
+    """
+    # Compute the first differences of all groups
+    first_diffs_sect = np.diff(data_sect, axis=0)
+
+    # If the dataset has only 1 group/integ, assume the 'previous group'
+    #   is all zeros, so just use data as the difference
+    if (first_diffs_sect.shape[0] == 0):
+        first_diffs_sect = data_sect.copy()
+    else:
+        # Similarly, for datasets having >1 group/integ and having
+        #   single-group segments, just use the data as the difference
+        wh_nan = np.where( np.isnan( first_diffs_sect[0,:,:]) )
+
+        if (len(wh_nan[0]) > 0):
+            first_diffs_sect[0,:,:][wh_nan] = data_sect[0,:,:][wh_nan]
+
+        del wh_nan
+
+        i_group,i_yy,i_xx, = np.where( np.bitwise_and(gdq_sect[1:,:,:],
+                                      dqflags.group['JUMP_DET']) != 0)
+
+        # Mask all the first differences that are affected by a CR,
+        #   starting at group 1.  The purpose of starting at index 1 is
+        #   to shift all the indices down by 1, so they line up with the
+        #   indices in first_diffs.
+        first_diffs_sect[ i_group-1, i_yy, i_xx ] = np.NaN
+
+        del i_group, i_yy, i_xx
+
+        # Check for pixels in which there is good data in 0th group, but
+        #   all first_diffs for this ramp are NaN because there are too
+        #   few good groups past the 0th. Due to the shortage of good
+        #   data, the first_diffs will be set here equal to the data in
+        #   the 0th group.
+        wh_min = np.where( np.logical_and(np.isnan(first_diffs_sect)
+                      .all(axis=0), np.isfinite( data_sect[0,:,:])))
+        if len(wh_min[0] > 0):
+            first_diffs_sect[0,:,:][wh_min] = data_sect[0,:,:][wh_min]
+
+        del wh_min
+
+    # All first differences affected by saturation and CRs have been set
+    #  to NaN, so compute the median of all non-NaN first differences.
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", "All-NaN.*", RuntimeWarning)
+        nan_med = np.nanmedian(first_diffs_sect, axis=0)
+    nan_med[np.isnan(nan_med)] = 0. # if all first_diffs_sect are nans
+
+    return nan_med
+
+
+def ols_fit_rows_multi(model, pixeldq, readnoise_2d, gain_2d, nrows,
+                       max_seg, number_slices, frame_time, group_time,
+                       ngroups, nreads, save_opt, weighting,
+                       segment_engine='vectorized'):
+    """
+    Fit the ramps with a pool of processes, each fitting a slice of
+    contiguous rows with ols_fit_rows. The data and group DQ cubes are
+    placed in shared memory, so only the row limits are sent to the
+    processes, and the results for the slices are stitched back together.
+    Without shared memory (Python < 3.8), copies of the slices of the cubes
+    are sent to the processes instead.
+
+    Parameters
+    ----------
+    model : data model
+        input data model, assumed to be of type RampModel
+
+    pixeldq : int, 2D array
+        pixel DQ, with bad gain pixels flagged
 
-    # Collect optional results for output
-    if save_opt:
-        gdq_cube = model.groupdq
-        opt_res.shrink_crmag(n_int, gdq_cube, imshape, nreads)
-        del gdq_cube
+    readnoise_2d : float, 2D array
+        readnoise for all pixels
 
-        # Some contributions to these vars may be NaN as they are from ramps
-        # having PIXELDQ=DO_NOT_USE
-        var_p4[ np.isnan( var_p4 )] = 0.
-        var_r4[ np.isnan( var_r4 )] = 0.
+    gain_2d : float, 2D array
+        gain for all pixels
 
-        # Truncate results at the maximum number of segments found
-        opt_res.slope_seg = opt_res.slope_seg[:,:f_max_seg,:,:]
-        opt_res.sigslope_seg = opt_res.sigslope_seg[:,:f_max_seg,:,:]
-        opt_res.yint_seg = opt_res.yint_seg[:,:f_max_seg,:,:]
-        opt_res.sigyint_seg = opt_res.sigyint_seg[:,:f_max_seg,:,:]
-        opt_res.weights = (inv_var_both4[:,:f_max_seg,:,:])**2.
-        opt_res.var_p_seg = var_p4[:,:f_max_seg,:,:]
-        opt_res.var_r_seg = var_r4[:,:f_max_seg,:,:]
+    nrows : int
+        number of rows in a data section
 
-        opt_model = opt_res.output_optional(model, effintim)
-    else:
-        opt_model = None
+    max_seg : int
+        maximum number of segments fit, over all pixels of the dataset
 
-    if inv_var_both4 is not None:
-        del inv_var_both4
+    number_slices : int
+        number of slices of rows, one per process
 
-    if var_p4 is not None:
-        del var_p4
+    frame_time : float
+        integration time from TGROUP keyword
 
-    if var_r4 is not None:
-        del var_r4
+    group_time : float
+        time increment between groups
 
-    if inv_var is not None:
-        del inv_var
+    ngroups : int
+        number of groups per integration
 
-    if pixeldq is not None:
-        del pixeldq
+    nreads : int
+        number of reads in an integration
 
-    # For multiple-integration datasets, will output integration-specific
-    #    results to separate file named <basename> + '_integ.fits'
-    int_times = None
-    if n_int > 1:
-        if pipe_utils.is_tso(model) and hasattr(model, 'int_times'):
-            int_times = model.int_times
-        else:
-            int_times = None
-        int_model = utils.output_integ(model, slope_int, dq_int, effintim,
-                                       var_p3, var_r3, var_both3, int_times)
-    else:
-        int_model = None
+    save_opt : boolean
+        calculate optional fitting results
 
-    if opt_res is not None:
-        del opt_res
+    weighting : string
+        'optimal' specifies that optimal weighting should be used; currently
+        the only weighting supported.
 
-    if slope_int is not None:
-        del slope_int
-    del var_p3
-    del var_r3
-    del var_both3
-    if int_times is not None:
-        del int_times
+    segment_engine : string
+        'vectorized' or 'iterative', see ols_fit_rows
 
-    # Divide slopes by total (summed over all integrations) effective
-    #   integration time to give count rates.
-    c_rates = slope_dataset2 / effintim
+    Returns
+    -------
+    The same values as ols_fit_rows, for the full image.
+    """
+    n_int = model.data.shape[0]
+    imshape = model.data.shape[-2:]
+    nrows_total = imshape[0]
+
+    # Rows of each slice; the last slice gets the remaining rows
+    yincrement = nrows_total // number_slices
+    row_limits = [(i * yincrement, (i + 1) * yincrement)
+                  for i in range(number_slices - 1)]
+    row_limits.append(((number_slices - 1) * yincrement, nrows_total))
+
+    fit_pars = (nrows, max_seg, frame_time, group_time, ngroups, nreads,
+                save_opt, weighting, segment_engine)
+    if pipe_utils.shared_memory is not None:
+        shm_data = pipe_utils.to_shared_memory(model.data)
+        shm_gdq = pipe_utils.to_shared_memory(model.groupdq)
+        try:
+            data_info = (shm_data.name, model.data.shape, model.data.dtype.str)
+            gdq_info = (shm_gdq.name, model.groupdq.shape,
+                        model.groupdq.dtype.str)
+            slices = [(data_info, gdq_info, rlo, rhi, pixeldq[rlo:rhi, :],
+                       readnoise_2d[rlo:rhi, :], gain_2d[rlo:rhi, :]) + fit_pars
+                      for rlo, rhi in row_limits]
+
+            with multiprocessing.Pool(processes=number_slices) as pool:
+                slice_results = pool.starmap(_fit_rows_slice, slices)
+        finally:
+            pipe_utils.release_shared_memory(shm_data)
+            pipe_utils.release_shared_memory(shm_gdq)
+    else:
+        slices = [(model.data[:, :, rlo:rhi, :], model.groupdq[:, :, rlo:rhi, :],
+                   pixeldq[rlo:rhi, :], readnoise_2d[rlo:rhi, :],
+                   gain_2d[rlo:rhi, :]) + fit_pars
+                  for rlo, rhi in row_limits]
 
-    # Compress all integration's dq arrays to create 2D PIXELDDQ array for
-    #   primary output
-    final_pixeldq = dq_compress_final(dq_int, n_int)
+        with multiprocessing.Pool(processes=number_slices) as pool:
+            slice_results = pool.starmap(_fit_rows_copy, slices)
 
-    if dq_int is not None:
-        del dq_int
+    # Stitch the slices back together along the row axis
+    opt_res = None
+    if save_opt:
+        opt_res = utils.OptRes(n_int, imshape, max_seg, nreads, save_opt)
+        for (rlo, rhi), results in zip(row_limits, slice_results):
+            opt_res.insert_rows(results[0], rlo, rhi, save_opt)
 
-    tstop = time.time()
+    f_max_seg = max(results[1] for results in slice_results)
 
-    log_stats(c_rates)
+    stitched = []
+    for k in range(2, len(slice_results[0])):
+        if slice_results[0][k] is None:
+            stitched.append(None)
+        else:
+            stitched.append(np.concatenate([results[k] for results in
+                                            slice_results], axis=-2))
 
-    log.debug('Instrument: %s', instrume)
-    log.debug('Number of pixels in 2D array: %d', npix)
-    log.debug('Shape of 2D image: (%d, %d)' %(imshape))
-    log.debug('Shape of data cube: (%d, %d, %d)' %(orig_cubeshape))
-    log.debug('Buffer size (bytes): %d', buffsize)
-    log.debug('Number of rows per buffer: %d', nrows)
-    log.info('Number of groups per integration: %d', orig_nreads)
-    log.info('Number of integrations: %d', n_int)
-    log.debug('The execution time in seconds: %f', tstop - tstart)
+    return (opt_res, f_max_seg) + tuple(stitched)
 
-    # Compute the 2D variances due to Poisson and read noise
-    var_p2 = 1/(s_inv_var_p3.sum(axis=0))
-    var_r2 = 1/(s_inv_var_r3.sum(axis=0))
 
-    # Huge variances correspond to non-existing segments, so are reset to 0
-    #  to nullify their contribution.
-    with warnings.catch_warnings():
-        warnings.filterwarnings("ignore", "invalid value.*", RuntimeWarning)
-        var_p2[var_p2 > 0.1 * utils.LARGE_VARIANCE] = 0.
-        var_r2[var_r2 > 0.1 * utils.LARGE_VARIANCE] = 0.
+def _fit_rows_slice(data_info, gdq_info, rlo, rhi, pixeldq, readnoise_2d,
+                    gain_2d, nrows, max_seg, frame_time, group_time, ngroups,
+                    nreads, save_opt, weighting, segment_engine):
+    """
+    Fit the ramps of rows rlo:rhi of the data and group DQ cubes held in
+    shared memory; run in a separate process by ols_fit_rows_multi.
+    data_info and gdq_info are the (name, shape, dtype) of the shared memory
+    blocks. The other arguments and the returned values are those of
+    ols_fit_rows, except that the OptRes object is dropped if save_opt
+    is False.
+    """
+    shm_data = pipe_utils.shared_memory.SharedMemory(name=data_info[0])
+    shm_gdq = pipe_utils.shared_memory.SharedMemory(name=gdq_info[0])
+    try:
+        data = np.ndarray(data_info[1], dtype=data_info[2],
+                          buffer=shm_data.buf)[:, :, rlo:rhi, :]
+        groupdq = np.ndarray(gdq_info[1], dtype=gdq_info[2],
+                             buffer=shm_gdq.buf)[:, :, rlo:rhi, :]
+
+        results = _fit_rows_copy(data, groupdq, pixeldq, readnoise_2d,
+                                 gain_2d, nrows, max_seg, frame_time,
+                                 group_time, ngroups, nreads, save_opt,
+                                 weighting, segment_engine)
+        del data, groupdq
+    finally:
+        shm_data.close()
+        shm_gdq.close()
+
+    return results
+
+
+def _fit_rows_copy(data, groupdq, pixeldq, readnoise_2d, gain_2d, nrows,
+                   max_seg, frame_time, group_time, ngroups, nreads, save_opt,
+                   weighting, segment_engine):
+    """
+    Fit the ramps of a slice of rows of the data and group DQ cubes; run in
+    a separate process by ols_fit_rows_multi when shared memory is not
+    available, and by _fit_rows_slice. The arguments and the returned values
+    are those of ols_fit_rows, except that the OptRes object is dropped if
+    save_opt is False.
+    """
+    results = ols_fit_rows(data, groupdq, pixeldq, readnoise_2d, gain_2d,
+                           nrows, max_seg, frame_time, group_time,
+                           ngroups, nreads, save_opt, weighting,
+                           segment_engine)
+    if not save_opt:
+        results = (None,) + results[1:]
 
-    # Some contributions to these vars may be NaN as they are from ramps
-    # having PIXELDQ=DO_NOT_USE
-    var_p2[ np.isnan( var_p2 )] = 0.
-    var_r2[ np.isnan( var_r2 )] = 0.
+    return results
 
-    # Suppress, then re-enable, harmless arithmetic warning
-    warnings.filterwarnings("ignore", ".*invalid value.*", RuntimeWarning)
-    err_tot = np.sqrt(var_p2 + var_r2)
-    warnings.resetwarnings()
 
-    del s_inv_var_p3
-    del s_inv_var_r3
+def calc_num_slices(max_cores, nrows_total):
+    """
+    Calculate the number of slices of rows, one per process, to fit.
 
-    # Create new model for the primary output.
-    new_model = datamodels.ImageModel(data=c_rates.astype(np.float32),
-            dq=final_pixeldq.astype(np.uint32),
-            var_poisson=var_p2.astype(np.float32),
-            var_rnoise=var_r2.astype(np.float32),
-            err=err_tot.astype(np.float32))
+    Parameters
+    ----------
+    max_cores : string or None
+        'quarter', 'half' or 'all' of the available cores, or None for a
+        single process
 
-    new_model.update(model)  # ... and add all keys from input
+    nrows_total : int
+        number of rows in the image
 
-    return new_model, int_model, opt_model
+    Returns
+    -------
+    number_slices : int
+        number of slices, at least 1 and at most the number of rows
+    """
+    number_slices = pipe_utils.number_of_processes(max_cores)
+    return max(min(number_slices, nrows_total), 1)
 
 
 def gls_ramp_fit(model,
@@ -1354,6 +1903,334 @@ def calc_slope(data_sect, gdq_sect, frame_time, opt_res, save_opt, rn_sect,
     return gdq_sect, inv_var, opt_res, f_max_seg, num_seg
 
 
+def calc_slope_vectorized(data_sect, gdq_sect, frame_time, opt_res, save_opt,
+                          rn_sect, gain_sect, i_max_seg, ngroups, weighting,
+                          f_max_seg):
+    """
+    Compute the slope of each segment for each pixel in the data cube section
+    for the current integration, with the same results as calc_slope().
+    Instead of advancing the segment of every pixel one iteration at a time
+    as fit_next_segment() does, all the segment boundaries are found at once
+    from the group DQ, the segments are classified with the same cases as in
+    fit_next_segment(), and all the segments are fit together.
+
+    Datasets having 1 or 2 groups per integration, a number of groups that
+    does not match the data cube, unweighted fitting and single-pixel
+    sections are handed to calc_slope().
+
+    Parameters
+    ----------
+    data_sect : float, 3D array
+        section of input data cube array
+
+    gdq_sect : int, 3D array
+        section of GROUPDQ data quality array
+
+    frame_time : float
+        integration time
+
+    opt_res : OptRes object
+        contains quantities related to fitting for optional output
+
+    save_opt : boolean
+       save optional fitting results
+
+    rn_sect : float, 2D array
+        read noise values for all pixels in data section
+
+    gain_sect : float, 2D array
+        gain values for all pixels in data section
+
+    i_max_seg : int
+        used for size of initial allocation of arrays for optional results;
+        maximum possible number of segments within the ramp, based on the
+        number of CR flags
+
+    ngroups : int
+        number of groups per integration
+
+    weighting : string
+        'optimal' specifies that optimal weighting should be used; currently
+        the only weighting supported.
+
+    f_max_seg : int
+        actual maximum number of segments within a ramp, based on the fitting
+        of all ramps; later used when truncating arrays before output.
+
+    Returns
+    -------
+    gdq_sect : int, 3D array
+        data quality flags for pixels in section
+
+    inv_var : float, 1D array
+        values of 1/variance for good pixels
+
+    opt_res : OptRes object
+        contains quantities related to fitting for optional output
+
+    f_max_seg : int
+        actual maximum number of segments within a ramp, updated here based on
+        fitting ramps in the current data section; later used when truncating
+        arrays before output.
+
+    num_seg : int, 1D array
+        numbers of segments for good pixels
+    """
+    nreads, asize2, asize1 = data_sect.shape
+
+    # Short ramps, unweighted fits and single pixels, which have nothing to
+    #   vectorize, are fit with calc_slope()
+    if (ngroups <= 2 or ngroups != nreads or weighting.lower() != 'optimal'
+            or asize2 * asize1 == 1):
+        return calc_slope(data_sect, gdq_sect, frame_time, opt_res, save_opt,
+                          rn_sect, gain_sect, i_max_seg, ngroups, weighting,
+                          f_max_seg)
+
+    npix = asize2 * asize1  # number of pixels in section of 2D array
+
+    data_2d = data_sect.reshape(nreads, npix)
+    good = (gdq_sect.reshape(nreads, npix) == 0)  # initial flags for ramp
+
+    # Number of good groups before each group: good_cum[g] is the number of
+    #   good groups in groups 0 to g-1
+    good_cum = np.zeros((nreads + 1, npix), dtype=np.int32)
+    np.cumsum(good, axis=0, out=good_cum[1:])
+    tot_good = good_cum[-1]
+
+    # The segments end at each flagged group after the 0th group, and at the
+    #   final group. Each segment starts at the end of the previous segment
+    #   of the pixel, or at the 0th group. The segments are ordered by pixel,
+    #   then by group.
+    is_end = np.logical_not(good)
+    is_end[0, :] = False
+    is_end[-1, :] = True
+    seg_pix, seg_end = np.nonzero(is_end.T)
+    first_seg = np.ones(seg_pix.size, dtype=bool)
+    first_seg[1:] = seg_pix[1:] != seg_pix[:-1]
+    seg_start = np.zeros_like(seg_end)
+    seg_start[1:] = seg_end[:-1]
+    seg_start[first_seg] = 0
+
+    l_interval = seg_end - seg_start
+    at_end = (seg_end == nreads - 1)
+
+    # Classify the segments as in fit_next_segment():
+    # CASE A) Long enough (segment has >2 groups), at end of ramp
+    case_a = (l_interval > 1) & at_end
+    # CASE B) Long enough (segment has >2 groups), not at end of ramp
+    case_b = (l_interval > 2) & ~at_end
+    # CASE E) 2 groups at end of ramp, at least 1 of them good
+    case_e = ((l_interval == 1) & at_end &
+              (tot_good[seg_pix] - good_cum[seg_start, seg_pix] > 0))
+    # CASE F) 2 good groups, not at end of ramp
+    case_f = (l_interval == 2) & ~at_end
+    # CASE G) the 0th group is the only good group of the ramp
+    only_0th = good[0, :] & ~good[1, :] & (tot_good == 1)
+    case_g = only_0th[seg_pix] & (seg_end == 1)
+    # All other segments (including CASE H) are not fit
+
+    fit_seg = np.where(case_a | case_b | case_e | case_f | case_g)[0]
+    s_pix = seg_pix[fit_seg]
+    s_start = seg_start[fit_seg]
+    s_end = seg_end[fit_seg]
+
+    # The groups fit run from the start of the segment to the final good
+    #   group of the segment; the start group is included even if it is a
+    #   cosmic ray.
+    s_last = np.where(good[s_end, s_pix], s_end, s_end - 1)
+    s_ngroups = s_last - s_start + 1
+
+    nfit = fit_seg.size
+    slope = np.zeros(nfit, dtype=np.float32)
+    intercept = np.zeros(nfit, dtype=np.float32)
+    variance = np.zeros(nfit, dtype=np.float32)
+    sig_intercept = np.zeros(nfit, dtype=np.float32)
+    sig_slope = np.zeros(nfit, dtype=np.float32)
+
+    rn_1d = rn_sect.reshape(npix)
+    gain_1d = gain_sect.reshape(npix)
+
+    # Segments having only the 0th group: use the data of that group
+    wh_1 = np.where(s_ngroups == 1)[0]
+    slope[wh_1] = data_2d[0, s_pix[wh_1]]
+    variance[wh_1] = utils.LARGE_VARIANCE
+
+    # Segments having 2 groups: use the difference of the groups
+    wh_2 = np.where(s_ngroups == 2)[0]
+    if len(wh_2) > 0:
+        pix_2 = s_pix[wh_2]
+        second_read = s_start[wh_2] + 1
+        data_0 = data_2d[s_start[wh_2], pix_2]
+        data_1 = data_2d[second_read, pix_2]
+        rn_2 = rn_1d[pix_2].astype(np.float64)
+        slope[wh_2] = data_1 - data_0
+        intercept[wh_2] = (data_1.astype(np.float64) * (1. - second_read) +
+                           data_0.astype(np.float64) * second_read)
+        variance[wh_2] = 2.0 * rn_2 * rn_2
+        sig_slope[wh_2] = np.sqrt(2) * rn_2
+        sig_intercept[wh_2] = np.sqrt(2) * rn_2
+
+    # Segments having >2 groups: optimally weighted fit
+    wh_3 = np.where(s_ngroups > 2)[0]
+    if len(wh_3) > 0:
+        slope_3, intercept_3, sig_slope_3, sig_intercept_3 = \
+            fit_segments_opt(data_2d, rn_1d, gain_1d, s_pix[wh_3],
+                             s_start[wh_3], s_last[wh_3])
+        slope[wh_3] = slope_3
+        intercept[wh_3] = intercept_3
+        sig_slope[wh_3] = sig_slope_3
+        sig_intercept[wh_3] = sig_intercept_3
+        variance[wh_3] = sig_slope_3**2.  # variance due to fit values
+
+    # Segments of CASES A, B and E are used only if their variance is
+    #   positive
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", "invalid value.*", RuntimeWarning)
+        use = (case_f[fit_seg] | case_g[fit_seg] | (variance > 0.))
+    use = np.where(use)[0]
+    u_pix = s_pix[use]
+
+    # Index of each used segment within its pixel
+    first_use = np.ones(use.size, dtype=bool)
+    first_use[1:] = u_pix[1:] != u_pix[:-1]
+    first_index = np.maximum.accumulate(np.where(first_use, np.arange(use.size), 0))
+    u_seg = np.arange(use.size) - first_index
+
+    num_seg = np.bincount(u_pix, minlength=npix).astype(np.int32)
+
+    # Running sums of the inverse variances over the segments of each pixel
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", "divide by zero.*", RuntimeWarning)
+        seg_inv_var = 1.0 / variance[use]
+    inv_var_segs = np.zeros((num_seg.max() if npix > 0 else 0, npix),
+                            dtype=np.float32)
+    inv_var_segs[u_seg, u_pix] = seg_inv_var
+    inv_var_segs = np.cumsum(inv_var_segs, axis=0, dtype=np.float32)
+    if inv_var_segs.shape[0] > 0:
+        inv_var = inv_var_segs[-1].copy()
+    else:
+        inv_var = np.zeros(npix, dtype=np.float32)
+
+    # Create object to hold optional results, and add the results
+    opt_res.init_2d(npix, i_max_seg, save_opt)
+    opt_res.slope_2d[u_seg, u_pix] = slope[use]
+    if save_opt:
+        opt_res.interc_2d[u_seg, u_pix] = intercept[use]
+        opt_res.siginterc_2d[u_seg, u_pix] = sig_intercept[use]
+        opt_res.sigslope_2d[u_seg, u_pix] = sig_slope[use]
+        opt_res.inv_var_2d[u_seg, u_pix] = inv_var_segs[u_seg, u_pix]
+
+    if use.size > 0:
+        f_max_seg = max(f_max_seg, num_seg.max())
+
+    return gdq_sect, inv_var, opt_res, f_max_seg, num_seg
+
+
+def fit_segments_opt(data_2d, rn_1d, gain_1d, pix, first, last):
+    """
+    Fit segments having more than 2 groups, all at once, using the optimal
+    weighting of calc_opt_sums() and calc_opt_fit().
+
+    Parameters
+    ----------
+    data_2d : float, 2D array
+        values for all pixels in data section, [ group, pixel ]
+
+    rn_1d : float, 1D array
+        read noise values for all pixels in data section
+
+    gain_1d : float, 1D array
+        gain values for all pixels in data section
+
+    pix : int, 1D array
+        pixel of each segment
+
+    first : int, 1D array
+        first group of each segment
+
+    last : int, 1D array
+        final group of each segment
+
+    Returns
+    -------
+    slope : float, 1D array
+       weighted slope of each segment
+
+    intercept : float, 1D array
+       y-intercept of each segment
+
+    sig_slope : float, 1D array
+       sigma of slope of each segment
+
+    sig_intercept : float, 1D array
+       sigma of y-intercept of each segment
+    """
+    nreads = data_2d.shape[0]
+    nsegs = last - first + 1
+    rows = np.arange(nsegs.max())[:, np.newaxis]
+    in_seg = rows < nsegs
+    groups = np.minimum(first + rows, nreads - 1)
+
+    data_seg = np.where(in_seg, data_2d[groups, pix], 0.).astype(data_2d.dtype)
+
+    # Calculate the SNR of each segment from the readnoise, the gain, and the
+    #   difference between the last and first groups
+    data_diff = data_2d[last, pix] - data_2d[first, pix]
+    rn_2_r = rn_1d[pix] * rn_1d[pix]
+    gain_sect_r = gain_1d[pix]
+
+    sigma_ir = data_diff * 0.0
+    numer_ir = data_diff * 0.0
+    sqrt_arg = rn_2_r + data_diff * gain_sect_r
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", "invalid value.*", RuntimeWarning)
+        wh_pos = np.where((sqrt_arg >= 0.) & (gain_sect_r != 0.))
+    numer_ir[wh_pos] = np.sqrt(rn_2_r[wh_pos] + \
+                                data_diff[wh_pos] * gain_sect_r[wh_pos])
+    sigma_ir[wh_pos] = numer_ir[wh_pos] / gain_sect_r[wh_pos]
+    snr = data_diff * 0.
+    snr[wh_pos] = data_diff[wh_pos] / sigma_ir[wh_pos]
+    snr[np.isnan(snr)] = 0.0
+    snr[snr < 0.] = 0.0
+
+    power_wt_r = calc_power(snr)  # get the weighting exponent for this SNR
+
+    # The number of groups used for the weights counts the nonzero values in
+    #   the segment, and also the non-finite values of the rest of the ramp,
+    #   as in calc_opt_sums()
+    nonzero_cum = np.zeros((nreads + 1, data_2d.shape[1]), dtype=np.int32)
+    np.cumsum(data_2d != 0., axis=0, out=nonzero_cum[1:])
+    nonfinite_cum = np.zeros((nreads + 1, data_2d.shape[1]), dtype=np.int32)
+    np.cumsum(~np.isfinite(data_2d), axis=0, out=nonfinite_cum[1:])
+    num_nz = (nonzero_cum[last + 1, pix] - nonzero_cum[first, pix] +
+              nonfinite_cum[-1, pix] -
+              (nonfinite_cum[last + 1, pix] - nonfinite_cum[first, pix]))
+    nrd_prime = (num_nz - 1) / 2.
+
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", "divide by zero.*", RuntimeWarning)
+        warnings.filterwarnings("ignore", "invalid value.*", RuntimeWarning)
+        invrdns2_r = 1./rn_2_r
+
+        # Optimal weights for each group of each segment
+        wt_h = (abs((abs(rows - nrd_prime) / nrd_prime) ** power_wt_r) *
+                invrdns2_r).astype(np.float32)
+    wt_h[np.isnan(wt_h)] = 0.
+    wt_h[np.isinf(wt_h)] = 0.
+
+    xvalues = (first + rows) * in_seg
+    data_seg[np.isnan(data_seg)] = 0.
+
+    # Create weighted sums for Poisson noise and read noise
+    nreads_wtd = (wt_h * in_seg).sum(axis=0)  # using optimal weights
+    sumx = (xvalues * wt_h).sum(axis=0)
+    sumxx = (xvalues**2 * wt_h).sum(axis=0)
+    sumy = (data_seg * wt_h).sum(axis=0)
+    sumxy = (xvalues * wt_h * data_seg).sum(axis=0)
+
+    return calc_opt_fit(nreads_wtd, sumxx, sumx, sumxy, sumy)
+
+
 def fit_next_segment(start, end_st, end_heads, pixel_done, data_sect, mask_2d,
                      mask_2d_init, inv_var, num_seg, opt_res, save_opt, rn_sect,
                      gain_sect, ngroups, weighting, f_max_seg):
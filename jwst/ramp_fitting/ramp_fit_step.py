@@ -23,6 +23,9 @@ class RampFitStep (Step):
         int_name = string(default='')
         save_opt = boolean(default=False) # Save optional output
         opt_name = string(default='')
+        maximum_cores = option('quarter', 'half', 'all', default=None) # max number of processes to create
+        segment_engine = option('vectorized', 'iterative', default='vectorized') # OLS segment fitting engine
+        streaming = boolean(default=False) # Fit one integration at a time to limit memory use
     """
 
     # Prior to 04/26/17, the following were also in the spec above:
@@ -38,7 +41,11 @@ class RampFitStep (Step):
 
     def process(self, input):
 
-        with datamodels.RampModel(input) as input_model:
+        # When streaming, the arrays of a FITS input that need no scaling
+        #   are memory-mapped, so integrations are read as they are fit
+        memmap = None if self.streaming else False
+
+        with datamodels.RampModel(input, memmap=memmap) as input_model:
 
             readnoise_filename = self.get_reference_file(input_model,
                                                           'readnoise')
@@ -59,6 +66,10 @@ class RampFitStep (Step):
 
             log.info('Using algorithm = %s' % self.algorithm)
             log.info('Using weighting = %s' % self.weighting)
+            if self.maximum_cores is not None:
+                log.info('Maximum cores to use = %s', self.maximum_cores)
+            if self.streaming:
+                log.info('Streaming the integrations')
 
             buffsize = ramp_fit.BUFSIZE
             if self.algorithm == "GLS":
@@ -67,7 +78,8 @@ class RampFitStep (Step):
             out_model, int_model, opt_model, gls_opt_model = ramp_fit.ramp_fit(
                 input_model, buffsize,
                 self.save_opt, readnoise_model, gain_model, self.algorithm,
-                self.weighting
+                self.weighting, self.maximum_cores, self.segment_engine,
+                self.streaming
             )
 
             readnoise_model.close()
@@ -520,6 +520,127 @@ def test_miri_first_last():
     np.testing.assert_allclose( new_mod.data, 10./3., rtol=1E-5)
 
 
+def setup_random_ramps(ngroups=8, nints=2, nrows=21, ncols=7):
+    '''Create ramps with random slopes, cosmic rays and saturation
+    '''
+    model1, gdq, rnModel, pixdq, err, gain = setup_inputs(ngroups=ngroups,
+        nints=nints, nrows=nrows, ncols=ncols, readnoise=5, gain=2)
+    gdq = model1.groupdq
+    rng = np.random.RandomState(12)
+    slopes = rng.uniform(0., 50., (nrows, ncols))
+    model1.data[...] = (np.arange(ngroups)[:, np.newaxis, np.newaxis] *
+                        slopes + rng.normal(0., 3., (nints, ngroups, nrows, ncols)))
+    jumps = rng.uniform(size=gdq.shape) < 0.05
+    gdq[jumps] = dqflags.group['JUMP_DET']
+    model1.data[jumps] += 500.
+    gdq[:, 6:, 3, :] = dqflags.group['SATURATED']
+    gdq[0, :, 10, 2] = dqflags.group['SATURATED']
+    return model1, rnModel, gain
+
+
+@pytest.mark.parametrize("use_shared_memory", [True, False])
+def test_multiprocessing_matches_single(monkeypatch, use_shared_memory):
+    '''Fitting slices of rows in separate processes gives the same results,
+    with or without shared memory
+    '''
+    monkeypatch.setattr('multiprocessing.cpu_count', lambda: 3)
+    if not use_shared_memory:
+        monkeypatch.setattr('jwst.lib.pipe_utils.shared_memory', None)
+    results = []
+    for max_cores in (None, 'all'):
+        model1, rnModel, gain = setup_random_ramps()
+        results.append(ramp_fit(model1, 512, True, rnModel, gain, 'OLS',
+                                'optimal', max_cores))
+
+    single, multi = results
+    for name in ('data', 'dq', 'var_poisson', 'var_rnoise', 'err'):
+        np.testing.assert_allclose(getattr(multi[0], name),
+                                   getattr(single[0], name), rtol=1e-6)
+        np.testing.assert_allclose(getattr(multi[1], name),
+                                   getattr(single[1], name), rtol=1e-6)
+    for name in ('slope', 'sigslope', 'var_poisson', 'var_rnoise', 'yint',
+                 'sigyint', 'pedestal', 'weights', 'crmag'):
+        np.testing.assert_allclose(getattr(multi[2], name),
+                                   getattr(single[2], name), rtol=1e-6)
+
+
+@pytest.mark.parametrize("ngroups", [3, 4, 8])
+def test_segment_engines_match(ngroups):
+    '''The vectorized and iterative segment fitting give the same results
+    '''
+    results = []
+    for segment_engine in ('iterative', 'vectorized'):
+        model1, rnModel, gain = setup_random_ramps(ngroups=ngroups)
+        results.append(ramp_fit(model1, 512, True, rnModel, gain, 'OLS',
+                                'optimal', None, segment_engine))
+
+    iterative, vectorized = results
+    for name in ('data', 'dq', 'var_poisson', 'var_rnoise', 'err'):
+        np.testing.assert_allclose(getattr(vectorized[0], name),
+                                   getattr(iterative[0], name), rtol=1e-5)
+        np.testing.assert_allclose(getattr(vectorized[1], name),
+                                   getattr(iterative[1], name), rtol=1e-5)
+    for name in ('slope', 'sigslope', 'var_poisson', 'var_rnoise', 'yint',
+                 'sigyint', 'pedestal', 'weights', 'crmag'):
+        np.testing.assert_allclose(getattr(vectorized[2], name),
+                                   getattr(iterative[2], name), rtol=1e-5)
+
+
+def test_streaming_matches_in_memory(tmp_path):
+    '''Fitting one integration at a time from a memory-mapped file gives
+       the same results as fitting all the integrations at once
+    '''
+    model1, rnModel, gain = setup_random_ramps(nints=4)
+    filename = str(tmp_path / 'ramp.fits')
+    model1.save(filename)
+    in_memory = ramp_fit(model1, 512, False, rnModel, gain, 'OLS', 'optimal')
+
+    model1, rnModel, gain = setup_random_ramps(nints=4)
+    with RampModel(filename, memmap=None) as model2:
+        streamed = ramp_fit(model2, 512, False, rnModel, gain, 'OLS',
+                            'optimal', None, 'vectorized', True)
+
+    for name in ('data', 'dq', 'var_poisson', 'var_rnoise', 'err'):
+        np.testing.assert_array_equal(getattr(streamed[0], name),
+                                      getattr(in_memory[0], name))
+        np.testing.assert_array_equal(getattr(streamed[1], name),
+                                      getattr(in_memory[1], name))
+    assert streamed[2] is None
+
+
+def test_gls_fit_cosmic_ray_amplitudes():
+    '''GLS recovers the slope and the cosmic-ray amplitudes of noiseless
+       ramps having jumps
+    '''
+    from jwst.ramp_fitting import gls_fit
+
+    ngroups, nrows, ncols = 8, 3, 4
+    group_time = 10.
+    slopes = np.arange(1., nrows * ncols + 1.).reshape(nrows, ncols)
+    times = np.arange(ngroups) * group_time + group_time
+    data = times[:, np.newaxis, np.newaxis] * slopes + 100.
+    gdq = np.zeros((ngroups, nrows, ncols), dtype=np.uint8)
+    jump = dqflags.group['JUMP_DET']
+    gdq[3, 0, 1] = jump
+    data[3:, 0, 1] += 500.
+    gdq[2, 1, 2] = jump
+    gdq[6, 1, 2] = jump
+    data[2:, 1, 2] += 300.
+    data[6:, 1, 2] += 700.
+    readnoise = np.full((nrows, ncols), 10.)
+
+    (intercept, int_var, slope, slope_var, cr, cr_var) = \
+        gls_fit.determine_slope(data, np.ones_like(data), gdq, readnoise,
+                                None, group_time, group_time, 1, 2,
+                                dqflags.group['SATURATED'], jump)
+
+    np.testing.assert_allclose(slope, slopes, rtol=1e-8)
+    np.testing.assert_allclose(intercept, 100., rtol=1e-8)
+    np.testing.assert_allclose(cr[0, 1], [500., 0.], atol=1e-6)
+    np.testing.assert_allclose(cr[1, 2], [300., 700.], rtol=1e-8)
+    assert np.all(slope_var > 0.)
+
+
 def setup_small_cube(ngroups=10, nints=1, nrows=2, ncols=2, deltatime=10.,
         gain=1., readnoise =10.):
     '''Create input MIRI datacube having the specified dimensions
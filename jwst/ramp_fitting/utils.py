@@ -140,6 +140,42 @@ class OptRes:
                 self.firstf_int[num_int, rlo:rhi, :] = ff_sect
 
 
+    def insert_rows(self, opt_res, rlo, rhi, save_opt):
+        """
+        Copy the results for a slice of rows, held in another OptRes
+        object, to the 4D and 3D arrays of this object.
+
+        Parameters
+        ----------
+        opt_res : OptRes object
+            results for rows rlo:rhi
+
+        rlo : int
+            first row of slice
+
+        rhi : int
+            last row of slice (exclusive)
+
+        save_opt : boolean
+            save optional fitting results
+
+        Returns
+        -------
+        None
+        """
+        self.slope_seg[:, :, rlo:rhi, :] = opt_res.slope_seg
+        if save_opt:
+            self.yint_seg[:, :, rlo:rhi, :] = opt_res.yint_seg
+            self.sigyint_seg[:, :, rlo:rhi, :] = opt_res.sigyint_seg
+            self.sigslope_seg[:, :, rlo:rhi, :] = opt_res.sigslope_seg
+            self.inv_var_seg[:, :, rlo:rhi, :] = opt_res.inv_var_seg
+            self.firstf_int[:, rlo:rhi, :] = opt_res.firstf_int
+            self.ped_int[:, rlo:rhi, :] = opt_res.ped_int
+            self.cr_mag_seg[:, :, rlo:rhi, :] = opt_res.cr_mag_seg
+            self.var_p_seg[:, :, rlo:rhi, :] = opt_res.var_p_seg
+            self.var_r_seg[:, :, rlo:rhi, :] = opt_res.var_r_seg
+
+
     def append_arr(self, num_seg, g_pix, intercept, slope, sig_intercept,
                    sig_slope, inv_var, save_opt):
         """
@@ -667,7 +703,7 @@ def calc_pedestal(num_int, slope_int, firstf_int, dq_first, nframes, groupgap,
 
 
 def output_integ(model, slope_int, dq_int, effintim, var_p3, var_r3, var_both3,
-                 int_times):
+                 int_times, in_place=False):
     """
     Construct the output integration-specific results. Any variance values that
     are a large fraction of the default value LARGE_VARIANCE correspond to
@@ -702,6 +738,11 @@ def output_integ(model, slope_int, dq_int, effintim, var_p3, var_r3, var_both3,
     int_times : bintable, or None
         The INT_TIMES table, if it exists in the input, else None
 
+    in_place : boolean
+        If True, slope_int and var_both3 are overwritten with the output
+        rates and errors instead of being copied, so that disk-backed
+        arrays are not loaded into memory
+
     Returns
     -------
     cubemod : Data Model object
@@ -716,8 +757,13 @@ def output_integ(model, slope_int, dq_int, effintim, var_p3, var_r3, var_both3,
     var_both3[ var_both3 > 0.4 * LARGE_VARIANCE ] = 0.
 
     cubemod = datamodels.CubeModel()
-    cubemod.data = slope_int / effintim
-    cubemod.err = np.sqrt(var_both3)
+    if in_place:
+        slope_int /= effintim
+        cubemod.data = slope_int
+        cubemod.err = np.sqrt(var_both3, out=var_both3)
+    else:
+        cubemod.data = slope_int / effintim
+        cubemod.err = np.sqrt(var_both3)
     cubemod.dq = dq_int
     cubemod.var_poisson = var_p3
     cubemod.var_rnoise = var_r3
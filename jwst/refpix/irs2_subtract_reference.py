@@ -1,13 +1,18 @@
 import logging
 
 import numpy as np
+from scipy import fft
 from scipy.ndimage.filters import convolve1d
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
+# Maximum size in bytes of the Fourier transforms of the groups that are
+# filtered at once
+FFT_CHUNK_BYTES = 2**28
+
 def correct_model(input_model, irs2_model,
-                  scipix_n_default=16, refpix_r_default=4, pad=8):
+                  scipix_n_default=16, refpix_r_default=4, pad=8, workers=1):
     """Process IRS^2 data.
 
     Parameters
@@ -31,6 +36,9 @@ def correct_model(input_model, irs2_model,
         of each row (new-row overhead).  The padding is needed to preserve
         the phase of temporally periodic signals.
 
+    workers: int
+        Number of threads used for the Fourier transforms.
+
     Returns
     -------
     output_model: ramp model
@@ -145,7 +153,7 @@ def correct_model(input_model, irs2_model,
         # below.  The last axis of output_model.data should be 2048.
         data0 = data[integ, :, :, :]
         data0 = subtract_reference(data0, alpha, beta, irs2_mask,
-                                   scipix_n, refpix_r, pad)
+                                   scipix_n, refpix_r, pad, workers=workers)
         data[integ, :, :, nx - ny:] = data0
     temp_data = data[:, :, :, nx - ny:]
     del data
@@ -262,7 +270,7 @@ def exclude_ref(output_model, irs2_mask):
         output_model.err = temp_array[..., irs2_mask]
 
 def subtract_reference(data0, alpha, beta, irs2_mask,
-                       scipix_n, refpix_r, pad):
+                       scipix_n, refpix_r, pad, workers=1):
     """Subtract reference output and pixels for the current integration.
 
     Parameters
@@ -302,6 +310,9 @@ def subtract_reference(data0, alpha, beta, irs2_mask,
         The effective number of pixels sampled during the pause at the end
         of each row (new-row overhead).
 
+    workers: int
+        Number of threads used for the Fourier transforms.
+
     Returns
     -------
     data0: ramp data
@@ -479,8 +490,7 @@ def subtract_reference(data0, alpha, beta, irs2_mask,
     #                        row, hnorm, hnorm1, s, aa , n_iter_norm
     fft_interp_norm(dd0, np.ones((ny, nx // 4), dtype=np.int64),
                     row, hnorm, hnorm1,
-                    ny, ngroups, aa, n_iter_norm)
-    data0[0, :, :, :] = dd0.copy()
+                    ny, ngroups, aa, n_iter_norm, workers=workers)
     del aa, dd0
 
 #;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;
@@ -541,43 +551,23 @@ def subtract_reference(data0, alpha, beta, irs2_mask,
     # s[2] = shape[1] = ny
     # s[3] = shape[0] = ngroups
 
-    # IDL and numpy differ in where they apply the normalization for the
-    # FFT.  This really shouldn't matter.
-    normalization = float(shape_d[2] * shape_d[3])
-
-    if beta is not None:
-        # IDL:  refout0 = reform(data0[*,*,*,0], sd[1] * sd[2], sd[3])
-        refout0 = data0[0, :, :, :].reshape((shape_d[1],
-                                           shape_d[2] * shape_d[3]))
-        # IDL:  refout0 = fft(refout0, dim=1, /over)
-        # Divide by the length of the axis to be consistent with IDL.
-        refout0 = np.fft.fft(refout0, axis=1) / normalization
-
+    # IDL:  refout0 = reform(data0[*,*,*,0], sd[1] * sd[2], sd[3])
     # IDL:  r0 = reform(r0, sd[1] * sd[2], sd[3], 5, /over)
-    r0 = r0.reshape((5, shape_d[1], shape_d[2] * shape_d[3]))
-    r0 = r0.astype(np.complex64)
-    r0f = ["dummy", 1, 1, 1, 1]         # elements 1 - 4 populated in loop
-    for k in range(1, 5):
-        r0f[k] = np.fft.fft(r0[k, :, :], axis=1) / normalization
-
     # IDL:  for k=0,3 do oBridge[k]->Execute,
     #           "for i=0, s3-1 do r0[*,i] *= alpha"
-    for k in range(1, 5):
-        for i in range(ngroups):
-            # Each element of r0f is the fft of r0[k, :, :], for some k.
-            r0f[k][i, :] *= alpha[k - 1]
-
     # IDL:  for k=0,3 do oBridge[k]->Execute,
     #           "for i=0, s3-1 do r0[*,i] += beta * refout0[*,i]"
-    if beta is not None:
-        for k in range(1, 5):
-            for i in range(ngroups):
-                r0f[k][i, :] += (beta[k - 1] * refout0[i, :])
-
     # IDL:  for k=0,3 do oBridge[k]->Execute,
     #           "r0 = fft(r0, 1, dim=1, /overwrite)", /nowait
-    for k in range(1, 5):
-        r0[k, :, :] = np.fft.ifft(r0f[k], axis=1) * normalization
+    # The four sectors of all the groups are transformed together; r0[0],
+    # from the reference output, is not used and is left unchanged.
+    if beta is not None:
+        refout0 = data0[0, :, :, :].reshape((shape_d[1],
+                                             shape_d[2] * shape_d[3]))
+    else:
+        refout0 = None
+    r0 = r0.reshape((5, shape_d[1], shape_d[2] * shape_d[3]))
+    apply_alpha_beta(r0[1:], refout0, alpha, beta, workers=workers)
 
     # sd[1] = shape_d[3]   row (712)
     # sd[2] = shape_d[2]   ny (2048)
@@ -585,7 +575,6 @@ def subtract_reference(data0, alpha, beta, irs2_mask,
     # sd[4] = shape_d[0]   5
     # IDL:  r0 = reform(r0, sd[1], sd[2], sd[3], 5, /over)
     r0 = r0.reshape(shape_d)
-    r0 = r0.real
     r0 = r0[:, :, :, hnorm1]
     data0 = data0[:, :, :, hnorm1]
 
@@ -613,21 +602,113 @@ def subtract_reference(data0, alpha, beta, irs2_mask,
 
     return data0
 
+def hermitian_part(coeff):
+    """Hermitian part of Fourier coefficients, for the non-negative frequencies
+
+    For a real sequence x with Fourier transform X, the real part of the
+    inverse transform of X * coeff is the inverse real transform of the
+    non-negative frequencies of X times the Hermitian part of coeff,
+    (coeff[k] + conj(coeff[-k])) / 2.
+
+    Parameters
+    ----------
+    coeff: ndarray
+        Complex coefficients; the last axis is the frequency.
+
+    Returns
+    -------
+    ndarray
+        The Hermitian part of coeff at the frequencies 0 to n // 2, where n
+        is the length of the last axis of coeff.
+    """
+    nelem = coeff.shape[-1]
+    freq = np.arange(nelem // 2 + 1)
+    return (coeff[..., freq] + np.conj(coeff[..., -freq % nelem])) / 2.
+
+
+def group_chunk(nsectors, ngroups, nelem):
+    """Number of groups whose Fourier transforms fit in FFT_CHUNK_BYTES"""
+    group_bytes = nsectors * (nelem // 2 + 1) * np.dtype(np.complex128).itemsize
+    return int(min(max(FFT_CHUNK_BYTES // group_bytes, 1), ngroups))
+
+
+def apply_alpha_beta(r0, refout0, alpha, beta, workers=1):
+    """Apply the alpha and beta Fourier coefficients to the reference data.
+
+    Each sector k of each group of r0 is replaced, in place, by the real
+    part of the inverse Fourier transform of
+    fft(r0[k]) * alpha[k] + fft(refout0) * beta[k].  The data are real, so
+    this is done with real Fourier transforms of half the length, applying
+    the Hermitian parts of alpha and beta.  All the sectors of as many
+    groups as fit in FFT_CHUNK_BYTES are transformed at once.
+
+    Parameters
+    ----------
+    r0: ndarray, shape (nsectors, ngroups, nelem)
+        The time-ordered reference data of each sector and group.
+
+    refout0: ndarray, shape (ngroups, nelem), or None
+        The time-ordered reference output of each group.  Not used if beta
+        is None.
+
+    alpha: ndarray, shape (nsectors, nelem)
+        Complex Fourier coefficients applied to the reference data.
+
+    beta: ndarray, shape (nsectors, nelem), or None
+        Complex Fourier coefficients applied to the reference output.
+
+    workers: int
+        Number of threads used for the Fourier transforms.
+    """
+    nsectors, ngroups, nelem = r0.shape
+    alpha_h = hermitian_part(alpha)[:, np.newaxis, :]
+    if beta is not None:
+        beta_h = hermitian_part(beta)[:, np.newaxis, :]
+    chunk = group_chunk(nsectors, ngroups, nelem)
+    for start in range(0, ngroups, chunk):
+        stop = min(start + chunk, ngroups)
+        r0f = fft.rfft(r0[:, start:stop].astype(np.float64), axis=-1,
+                       overwrite_x=True, workers=workers)
+        r0f *= alpha_h
+        if beta is not None:
+            refoutf = fft.rfft(refout0[start:stop].astype(np.float64), axis=-1,
+                               overwrite_x=True, workers=workers)
+            r0f += beta_h * refoutf
+            del refoutf
+        r0[:, start:stop] = fft.irfft(r0f, nelem, axis=-1, overwrite_x=True,
+                                      workers=workers)
+        del r0f
+
+
 def fft_interp_norm(dd0, mask0, row, hnorm, hnorm1,
-                    ny, ngroups, aa, n_iter_norm):
+                    ny, ngroups, aa, n_iter_norm, workers=1):
+    """Fourier filter the time-ordered data of all the groups, in place.
+
+    The values of the normal pixels selected by mask0 are restored after
+    each of the n_iter_norm iterations.  The filter aa is symmetric, so the
+    data are filtered with real Fourier transforms, for as many groups at
+    once as fit in FFT_CHUNK_BYTES.
+    """
 
     mm = np.zeros((ny, row), dtype=np.int8)
     mm[:, hnorm1] = mask0[:, hnorm]
-    hm = (mm != 0)                      # 2-D boolean mask
-    for j in range(ngroups):
-        dd = dd0[j, :, :].copy()
-        p = dd.flatten()                        # make a copy, not a view
+    hm = (mm != 0).ravel()              # 1-D boolean mask
+    nelem = ny * row
+    aa_half = aa[:nelem // 2 + 1]
+    chunk = group_chunk(1, ngroups, nelem)
+    for start in range(0, ngroups, chunk):
+        stop = min(start + chunk, ngroups)
+        p = dd0[start:stop].reshape((stop - start, nelem))
+        dd = p[:, hm]                   # a copy of the normal pixels
         for it in range(n_iter_norm):
-            pp = np.fft.fft(p)
-            pp *= aa
-            p[:] = np.fft.ifft(pp).real
-            p[hm.ravel()] = dd[hm]
-        dd0[j, :, :] = p.reshape((ny, row))
+            pp = fft.rfft(p.astype(np.float64), axis=-1, overwrite_x=True,
+                          workers=workers)
+            pp *= aa_half
+            p[...] = fft.irfft(pp, nelem, axis=-1, overwrite_x=True,
+                               workers=workers)
+            del pp
+            p[:, hm] = dd
+        dd0[start:stop] = p.reshape((stop - start, ny, row))
 
 def ols_line(x, y):
     """Fit a straight line using ordinary least squares."""
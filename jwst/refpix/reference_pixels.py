@@ -98,6 +98,51 @@ BAD_REFERENCE_PIXELS = 1
 SUBARRAY_DOESNTFIT = 2
 SUBARRAY_SKIPPED = 3
 
+
+def sigma_clip_groups(data, low=3.0, high=3.0):
+    """Sigma-clipped means of many groups of pixels at once
+
+    This is the same iterative clipping as scipy.stats.sigmaclip, applied
+    to each group along the last axis of data, with all the groups clipped
+    together in each iteration
+
+    Parameters:
+    -----------
+
+    data: NDArray
+        Array of pixels to be sigma-clipped, the last axis holding the pixels
+        of each group
+
+    low: float
+        lower clipping boundary, in standard deviations from the mean
+
+    high: float
+        upper clipping boundary, in standard deviations from the mean
+
+    Returns:
+    --------
+
+    mean: NDArray
+        clipped mean of each group
+
+    """
+    data = data.astype(np.float64)
+    keep = np.ones(data.shape, dtype=bool)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        while True:
+            npix = keep.sum(axis=-1)
+            mean = np.where(keep, data, 0.).sum(axis=-1) / npix
+            deviation = np.where(keep, data - mean[..., np.newaxis], 0.)
+            std = np.sqrt((deviation * deviation).sum(axis=-1) / npix)
+            clipped = (keep &
+                       (data >= (mean - std * low)[..., np.newaxis]) &
+                       (data <= (mean + std * high)[..., np.newaxis]))
+            if np.array_equal(clipped, keep):
+                break
+            keep = clipped
+    return mean
+
+
 class Dataset():
     """Base Class to handle passing stuff from routine to routine
 
@@ -185,7 +230,9 @@ class Dataset():
         -----------
 
         data: NDArray
-            Array of pixels to be sigma-clipped
+            Array of pixels to be sigma-clipped.  If it has more dimensions
+            than dq, the leading dimensions index groups that are clipped
+            separately
 
         dq: NDArray
             DQ array for data
@@ -199,8 +246,9 @@ class Dataset():
         Returns:
         --------
 
-        mean: float
-            clipped mean of data array
+        mean: float or NDArray
+            clipped mean of data array, or array of the clipped means of
+            each group
 
         """
 
@@ -213,6 +261,10 @@ class Dataset():
         if len(goodpixels[0]) == 0:
             return None
         #
+        # Clip all the groups at once
+        if data.ndim > dq.ndim:
+            return sigma_clip_groups(data[(Ellipsis,) + goodpixels], low, high)
+        #
         # scipy routine fails if the pixels all have exactly the same value
         if np.std(data[goodpixels], dtype=np.float64) != 0.0:
             clipped_ref, lowlim, uplim = stats.sigmaclip(data[goodpixels],
@@ -344,7 +396,7 @@ class NIRDataset(Dataset):
         -----------
 
         group: NDArray
-            The group that is being processed
+            The group that is being processed, or a stack of groups
 
         amplifier: string ['A'|'B'|'C'|'D']
             String corresponding to the amplifier being processed
@@ -365,7 +417,7 @@ class NIRDataset(Dataset):
         rowstart, rowstop, colstart, colstop = \
             NIR_reference_sections[amplifier][top_or_bottom]
 
-        oddref = group[rowstart:rowstop, colstart:colstop: 2]
+        oddref = group[..., rowstart:rowstop, colstart:colstop: 2]
         odddq = self.pixeldq[rowstart:rowstop, colstart:colstop: 2]
         return oddref, odddq
 
@@ -377,7 +429,7 @@ class NIRDataset(Dataset):
         -----------
 
         group: NDArray
-            The group that is being processed
+            The group that is being processed, or a stack of groups
 
         amplifier: string ['A'|'B'|'C'|'D']
             String corresponding to the amplifier being processed
@@ -401,7 +453,7 @@ class NIRDataset(Dataset):
         #
         # Even columns start on the second column
         colstart = colstart + 1
-        evenref = group[rowstart:rowstop, colstart:colstop: 2]
+        evenref = group[..., rowstart:rowstop, colstart:colstop: 2]
         evendq = self.pixeldq[rowstart:rowstop, colstart:colstop: 2]
         return evenref, evendq
 
@@ -414,7 +466,7 @@ class NIRDataset(Dataset):
         -----------
 
         group: NDArray
-            Group that is being processed
+            Group that is being processed, or a stack of groups
 
         amplifier: string (['A'|'B'|'C'|'D'])
             Amplifier that is being processed
@@ -444,7 +496,7 @@ class NIRDataset(Dataset):
         -----------
 
         group: NDArray
-            Group that is being processed
+            Group that is being processed, or a stack of groups
 
         amplifier: string (['A'|'B'|'C'|'D'])
             Amplifier that is being processed
@@ -473,7 +525,7 @@ class NIRDataset(Dataset):
         -----------
 
         group: NDArray
-            Group that is being processed
+            Group that is being processed, or a stack of groups
 
         amplifier: string (['A'|'B'|'C'|'D'])
             Amplifier that is being processed
@@ -507,7 +559,7 @@ class NIRDataset(Dataset):
         else:
             rowstart, rowstop, colstart, colstop = \
                 NIR_reference_sections[amplifier][top_or_bottom]
-            ref = group[rowstart:rowstop, colstart:colstop]
+            ref = group[..., rowstart:rowstop, colstart:colstop]
             dq = self.pixeldq[rowstart:rowstop, colstart:colstop]
             mean = self.sigma_clip(ref, dq)
             if mean is None: self.bad_reference_pixels = True
@@ -521,7 +573,7 @@ class NIRDataset(Dataset):
         -----------
 
         group: NDArray
-            Group that is being processed
+            Group that is being processed, or a stack of groups
 
         Returns:
         --------
@@ -556,7 +608,7 @@ class NIRDataset(Dataset):
         ----------
 
         group: NDArray
-            Group that is being processed
+            Group that is being processed, or a stack of groups
 
         refvalues: dictionary
             Dictionary of reference pixel clipped means
@@ -583,23 +635,50 @@ class NIRDataset(Dataset):
                 evenrefbottom = refvalues[amplifier]['even']['bottom']
                 #
                 # For now, just average the top and bottom corrections
-                oddrefsignal = 0.5 * (oddreftop + oddrefbottom)
-                evenrefsignal = 0.5 * (evenreftop + evenrefbottom)
-                oddslice = (slice(datarowstart, datarowstop, 1),
+                oddrefsignal = self.group_values(0.5 * (oddreftop + oddrefbottom), group)
+                evenrefsignal = self.group_values(0.5 * (evenreftop + evenrefbottom), group)
+                oddslice = (Ellipsis,
+                            slice(datarowstart, datarowstop, 1),
                             slice(datacolstart, datacolstop, 2))
-                evenslice = (slice(datarowstart, datarowstop, 1),
+                evenslice = (Ellipsis,
+                             slice(datarowstart, datarowstop, 1),
                              slice(datacolstart + 1, datacolstop, 2))
-                group[oddslice] = group[oddslice] - oddrefsignal
-                group[evenslice] = group[evenslice] - evenrefsignal
+                group[oddslice] -= oddrefsignal
+                group[evenslice] -= evenrefsignal
             else:
                 reftop = refvalues[amplifier]['top']
                 refbottom = refvalues[amplifier]['bottom']
-                refsignal = 0.5 * (reftop + refbottom)
-                dataslice = (slice(datarowstart, datarowstop, 1),
+                refsignal = self.group_values(0.5 * (reftop + refbottom), group)
+                dataslice = (Ellipsis,
+                             slice(datarowstart, datarowstop, 1),
                              slice(datacolstart, datacolstop, 1))
-                group[dataslice] = group[dataslice] - refsignal
+                group[dataslice] -= refsignal
         return
 
+    def group_values(self, values, group):
+        """Shape a value per group, or a single value, so that it can be
+        subtracted from every pixel of the groups
+
+        Parameters:
+        -----------
+
+        values: float or NDArray
+            Value, or array of one value for each group
+
+        group: NDArray
+            Group, or stack of groups, from which the values will be
+            subtracted
+
+        Returns:
+        --------
+
+        values: NDArray
+            The values, cast to the type of the group data, with two
+            trailing axes to broadcast over the rows and columns
+
+        """
+        return np.asarray(values, dtype=group.dtype)[..., np.newaxis, np.newaxis]
+
     def create_reflected(self, data, smoothing_length):
         """Make an array bigger by extending it at the top and bottom by
         an amount equal to .5(smoothing length-1)
@@ -610,7 +689,8 @@ class NIRDataset(Dataset):
         -----------
 
         data: NDArray
-            input data array
+            input data array; the extension is along the second to last
+            axis
 
         smoothing_length: integer (should be odd, will be converted if not)
             smoothing length.  Amount by which the input array is extended is
@@ -626,16 +706,13 @@ class NIRDataset(Dataset):
 
         """
 
-        nrows, ncols = data.shape
         if smoothing_length % 2 == 0:
             log.info("Smoothing length must be odd, adding 1")
             smoothing_length = smoothing_length + 1
-        newheight = nrows + smoothing_length - 1
-        reflected = np.zeros((newheight, ncols), dtype=data.dtype)
         bufsize = smoothing_length // 2
-        reflected[bufsize:bufsize + nrows] = data[:]
-        reflected[:bufsize] = data[bufsize:0:-1]
-        reflected[-(bufsize):] = data[-2:-(bufsize+2):-1]
+        reflected = np.concatenate((data[..., bufsize:0:-1, :],
+                                    data,
+                                    data[..., -2:-(bufsize+2):-1, :]), axis=-2)
         return reflected
 
     def median_filter(self, data, dq, smoothing_length):
@@ -646,7 +723,7 @@ class NIRDataset(Dataset):
         -----------
 
         data: NDArray
-            input 2-d science array
+            input 2-d science array, or stack of 2-d arrays
 
         dq: NDArray
             input 2-d dq array
@@ -658,21 +735,43 @@ class NIRDataset(Dataset):
         --------
 
         result: NDArray
-            1-d array that is a median filtered version of the input data
+            1-d array that is a median filtered version of the input data,
+            or stack of 1-d arrays
         """
 
         augmented_data = self.create_reflected(data, smoothing_length)
         augmented_dq = self.create_reflected(dq, smoothing_length)
-        nrows, ncols = data.shape
-        result = np.zeros(nrows)
-        for i in range(nrows):
-            rowstart = i
-            rowstop = rowstart + smoothing_length
-            goodpixels = np.where(np.bitwise_and(augmented_dq[rowstart:rowstop],
-                                                 dqflags.pixel['DO_NOT_USE']) == 0)
-            window = augmented_data[rowstart:rowstop][goodpixels]
-            result[i] = np.median(window)
-        return result
+        nrows = data.shape[-2]
+        #
+        # The boxes around all the rows, with the pixels flagged DO_NOT_USE
+        # set to NaN, so they are sorted after the good pixels
+        goodpixels = np.bitwise_and(augmented_dq, dqflags.pixel['DO_NOT_USE']) == 0
+        goodboxes = np.stack([goodpixels[i:i + nrows]
+                              for i in range(smoothing_length)], axis=-1)
+        boxes = np.stack([augmented_data[..., i:i + nrows, :]
+                          for i in range(smoothing_length)], axis=-1)
+        boxes = np.where(goodboxes, boxes, np.nan)
+        boxes = boxes.reshape(boxes.shape[:-2] + (-1,))
+        goodboxes = goodboxes.reshape(nrows, -1)
+        ngood = goodboxes.sum(axis=-1)
+        #
+        # A good pixel with a NaN value makes the median NaN
+        hasnan = np.isnan(boxes).sum(axis=-1) > boxes.shape[-1] - ngood
+        boxes.sort(axis=-1)
+        #
+        # The median of the ngood good pixels of each box is the central
+        # sorted value, or the mean of the two central values
+        upper = np.take_along_axis(
+            boxes, np.broadcast_to(ngood // 2, boxes.shape[:-1])[..., np.newaxis],
+            axis=-1)[..., 0]
+        lower = np.take_along_axis(
+            boxes, np.broadcast_to(np.maximum(ngood - 1, 0) // 2,
+                                   boxes.shape[:-1])[..., np.newaxis],
+            axis=-1)[..., 0]
+        with np.errstate(invalid='ignore'):
+            result = np.where(ngood % 2 == 1, upper, (lower + upper) / 2)
+        result[hasnan | (ngood == 0)] = np.nan
+        return result.astype(np.float64)
 
     def calculate_side_ref_signal(self, group, colstart, colstop):
         """Calculate the reference pixel signal from the side reference pixels
@@ -683,7 +782,7 @@ class NIRDataset(Dataset):
         -----------
 
         group: NDArray
-            Group that is being processed
+            Group that is being processed, or a stack of groups
 
         colstart: integer
             Starting column
@@ -700,7 +799,7 @@ class NIRDataset(Dataset):
         """
 
         smoothing_length = self.side_smoothing_length
-        data = group[:, colstart:colstop + 1]
+        data = group[..., colstart:colstop + 1]
         dq = self.pixeldq[:, colstart:colstop + 1]
         return self.median_filter(data, dq, smoothing_length)
 
@@ -712,23 +811,24 @@ class NIRDataset(Dataset):
         -----------
 
         left: NDArray
-            1-d array of median-filtered reference pixel values from the left side
+            1-d array of median-filtered reference pixel values from the left side,
+            or stack of 1-d arrays
 
         right: NDArray
-            1-d array of median-filtered reference pixel values from the right side
+            1-d array of median-filtered reference pixel values from the right side,
+            or stack of 1-d arrays
 
         Returns:
         --------
 
         sidegroup: NDArray
-            2-d array of average reference pixel vector replicated horizontally
+            average reference pixel vector as a column, to be broadcast along
+            the rows of the group
 
         """
 
         combined = 0.5 * (left + right)
-        sidegroup = np.zeros((2048, 2048))
-        for column in range(2048):
-            sidegroup[:, column] = combined
+        sidegroup = combined[..., np.newaxis]
         return sidegroup
 
     def apply_side_correction(self, group, sidegroup):
@@ -738,21 +838,21 @@ class NIRDataset(Dataset):
         -----------
 
         group: NDArray
-            Group being processed
+            Group being processed, or a stack of groups
 
         sidegroup: NDArray
-            Side reference pixel signal replicated horizontally
+            Side reference pixel signal, broadcast along the rows
 
         Returns:
         --------
 
         corrected_group: NDArray
-            The group corrected for the side reference pixel signal
+            The group corrected in place for the side reference pixel signal
 
         """
 
-        corrected_group = group - self.side_gain * sidegroup
-        return corrected_group
+        group -= self.side_gain * sidegroup
+        return group
 
     def do_side_correction(self, group):
         """Do all the steps of the side reference pixel correction
@@ -761,13 +861,13 @@ class NIRDataset(Dataset):
         -----------
 
         group: NDArray
-            Group being processed
+            Group being processed, or a stack of groups
 
         Returns:
         --------
 
         corrected_group: NDArray
-            Corredted group
+            Group corrected in place
 
         """
 
@@ -786,31 +886,27 @@ class NIRDataset(Dataset):
     def do_fullframe_corrections(self):
         """Do Reference Pixels Corrections for all amplifiers, NIR detectors
         First read of each integration is NOT subtracted, as the signal is removed
-        in the superbias subtraction step"""
+        in the superbias subtraction step.  All the groups of an integration
+        are corrected at once"""
         #
         #  First transform pixeldq array to detector coordinates
         self.DMS_to_detector_dq()
 
         for integration in range(self.nints):
-            for group in range(self.ngroups):
-                #
-                # Get the reference values from the top and bottom reference
-                # pixels
-                #
-                self.DMS_to_detector(integration, group)
-                thisgroup = self.group
-                refvalues = self.get_refvalues(thisgroup)
-                if self.bad_reference_pixels:
-                    break
-                self.do_top_bottom_correction(thisgroup, refvalues)
-                if self.use_side_ref_pixels:
-                    corrected_group = self.do_side_correction(thisgroup)
-                    self.group = corrected_group
-                else:
-                    self.group = thisgroup
-                #
-                #  Now transform back from detector to DMS coordinates.
-                self.detector_to_DMS(integration, group)
+            #
+            # The groups of the integration in detector coordinates; this is
+            # a view of the input data, which is corrected in place
+            groups = self.DMS_to_detector_groups(self.input_model.data[integration])
+            #
+            # Get the reference values from the top and bottom reference
+            # pixels
+            #
+            refvalues = self.get_refvalues(groups)
+            if self.bad_reference_pixels:
+                break
+            self.do_top_bottom_correction(groups, refvalues)
+            if self.use_side_ref_pixels:
+                self.do_side_correction(groups)
         log.setLevel(logging.INFO)
         return
 
@@ -823,55 +919,49 @@ class NIRDataset(Dataset):
         #
         refdq = dqflags.pixel['REFERENCE_PIXEL']
         #
-        # This transforms the pixeldq array from DMS to detector coordinates,
-        # only needs to be done once
-        self.DMS_to_detector_dq()
-        # Determined refpix indices to use on each group
-        refpixindices = np.where(np.bitwise_and(self.pixeldq, refdq) == refdq)
-        nrefpixels = len(refpixindices[0])
-        if nrefpixels == 0:
+        # The subarray pixeldq array and the full frame detector column of
+        # each subarray pixel, in detector coordinates
+        pixeldq = self.DMS_to_detector_groups(self.input_model.pixeldq)
+        columns = np.zeros(self.full_shape, dtype=np.intp)
+        detector_columns = self.DMS_to_detector_groups(columns)
+        detector_columns[:] = np.arange(detector_columns.shape[-1])
+        columns = self.DMS_to_detector_groups(
+            columns[self.rowstart:self.rowstop, self.colstart:self.colstop])
+        # Determined refpix to use on each group
+        refpixels = np.bitwise_and(pixeldq, refdq) == refdq
+        if not np.any(refpixels):
             self.bad_reference_pixels = True
             return
         if self.odd_even_columns:
-            oddrefpixindices_row = []
-            oddrefpixindices_col = []
-            evenrefpixindices_row = []
-            evenrefpixindices_col = []
-            for i in range(nrefpixels):
-                if (refpixindices[1][i] % 2) == 0:
-                    evenrefpixindices_row.append(refpixindices[0][i])
-                    evenrefpixindices_col.append(refpixindices[1][i])
-                else:
-                    oddrefpixindices_row.append(refpixindices[0][i])
-                    oddrefpixindices_col.append(refpixindices[1][i])
-            evenrefpixindices = (np.array(evenrefpixindices_row),
-                                 np.array(evenrefpixindices_col))
-            oddrefpixindices = (np.array(oddrefpixindices_row),
-                                np.array(oddrefpixindices_col))
+            evenrefpixels = refpixels & (columns % 2 == 0)
+            oddrefpixels = refpixels & (columns % 2 == 1)
+            #
+            # Index of the first subarray column that is an even detector column
+            firsteven = columns[0, 0] % 2
 
         for integration in range(self.nints):
-            for group in range(self.ngroups):
-                #
-                # Get the reference values from the top and bottom reference
-                # pixels
-                #
-                self.DMS_to_detector(integration, group)
-                thisgroup = self.group
+            #
+            # The groups of the integration in detector coordinates; this is
+            # a view of the input data, which is corrected in place
+            groups = self.DMS_to_detector_groups(self.input_model.data[integration])
 
-                if self.odd_even_columns:
-                    evenrefpixvalue = self.sigma_clip(thisgroup[evenrefpixindices],
-                                                      self.pixeldq[evenrefpixindices])
-                    oddrefpixvalue = self.sigma_clip(thisgroup[oddrefpixindices],
-                                                      self.pixeldq[oddrefpixindices])
-                    thisgroup[:, 0::2] -= evenrefpixvalue
-                    thisgroup[:, 1::2] -= oddrefpixvalue
-                else:
-                    refpixvalue = self.sigma_clip(thisgroup[refpixindices],
-                                                  self.pixeldq[refpixindices])
-                    thisgroup -= refpixvalue
-                #
-                #  Now transform back from detector to DMS coordinates.
-                self.detector_to_DMS(integration, group)
+            if self.odd_even_columns:
+                evenrefpixvalue = self.sigma_clip(groups[:, evenrefpixels],
+                                                  pixeldq[evenrefpixels])
+                oddrefpixvalue = self.sigma_clip(groups[:, oddrefpixels],
+                                                 pixeldq[oddrefpixels])
+                if evenrefpixvalue is None or oddrefpixvalue is None:
+                    self.bad_reference_pixels = True
+                    break
+                groups[..., firsteven::2] -= self.group_values(evenrefpixvalue, groups)
+                groups[..., 1 - firsteven::2] -= self.group_values(oddrefpixvalue, groups)
+            else:
+                refpixvalue = self.sigma_clip(groups[:, refpixels],
+                                              pixeldq[refpixels])
+                if refpixvalue is None:
+                    self.bad_reference_pixels = True
+                    break
+                groups -= self.group_values(refpixvalue, groups)
         log.setLevel(logging.INFO)
         return
 
@@ -891,6 +981,10 @@ class NRS1Dataset(NIRDataset):
         self.group = np.swapaxes(self.group, 0, 1)
         self.restore_group(integration, group)
 
+    def DMS_to_detector_groups(self, groups):
+        # View of a group, or stack of groups, in detector coordinates
+        return np.swapaxes(groups, -2, -1)
+
     def DMS_to_detector_dq(self):
         # pixeldq only has to be done once
         self.pixeldq = np.swapaxes(self.pixeldq, 0, 1)
@@ -904,6 +998,10 @@ class NRS2Dataset(NIRDataset):
         self.get_group(integration, group)
         self.group = np.swapaxes(self.group, 0, 1)[::-1, ::-1]
 
+    def DMS_to_detector_groups(self, groups):
+        # View of a group, or stack of groups, in detector coordinates
+        return np.swapaxes(groups, -2, -1)[..., ::-1, ::-1]
+
     def DMS_to_detector_dq(self):
         # pixeldq only has to be done once
         self.pixeldq = np.swapaxes(self.pixeldq, 0, 1)[::-1, ::-1]
@@ -923,6 +1021,10 @@ class NRCA1Dataset(NIRDataset):
         self.get_group(integration, group)
         self.group = self.group[:, ::-1]
 
+    def DMS_to_detector_groups(self, groups):
+        # View of a group, or stack of groups, in detector coordinates
+        return groups[..., ::-1]
+
     def DMS_to_detector_dq(self):
         # pixeldq only has to be done once
         self.pixeldq = self.pixeldq[:, ::-1]
@@ -942,6 +1044,10 @@ class NRCA2Dataset(NIRDataset):
         self.get_group(integration, group)
         self.group = self.group[::-1]
 
+    def DMS_to_detector_groups(self, groups):
+        # View of a group, or stack of groups, in detector coordinates
+        return groups[..., ::-1, :]
+
     def DMS_to_detector_dq(self):
         # pixeldq only has to be done once
         self.pixeldq = self.pixeldq[::-1]
@@ -961,6 +1067,10 @@ class NRCA3Dataset(NIRDataset):
         self.get_group(integration, group)
         self.group = self.group[:, ::-1]
 
+    def DMS_to_detector_groups(self, groups):
+        # View of a group, or stack of groups, in detector coordinates
+        return groups[..., ::-1]
+
     def DMS_to_detector_dq(self):
         # pixeldq only has to be done once
         self.pixeldq = self.pixeldq[:, ::-1]
@@ -980,6 +1090,10 @@ class NRCA4Dataset(NIRDataset):
         self.get_group(integration, group)
         self.group = self.group[::-1]
 
+    def DMS_to_detector_groups(self, groups):
+        # View of a group, or stack of groups, in detector coordinates
+        return groups[..., ::-1, :]
+
     def DMS_to_detector_dq(self):
         # pixeldq only has to be done once
         self.pixeldq = self.pixeldq[::-1]
@@ -999,6 +1113,10 @@ class NRCALONGDataset(NIRDataset):
         self.get_group(integration, group)
         self.group = self.group[:, ::-1]
 
+    def DMS_to_detector_groups(self, groups):
+        # View of a group, or stack of groups, in detector coordinates
+        return groups[..., ::-1]
+
     def DMS_to_detector_dq(self):
         # pixeldq only has to be done once
         self.pixeldq = self.pixeldq[:, ::-1]
@@ -1018,6 +1136,10 @@ class NRCB1Dataset(NIRDataset):
         self.get_group(integration, group)
         self.group = self.group[::-1]
 
+    def DMS_to_detector_groups(self, groups):
+        # View of a group, or stack of groups, in detector coordinates
+        return groups[..., ::-1, :]
+
     def DMS_to_detector_dq(self):
         # pixeldq only has to be done once
         self.pixeldq = self.pixeldq[::-1]
@@ -1037,6 +1159,10 @@ class NRCB2Dataset(NIRDataset):
         self.get_group(integration, group)
         self.group = self.group[:, ::-1]
 
+    def DMS_to_detector_groups(self, groups):
+        # View of a group, or stack of groups, in detector coordinates
+        return groups[..., ::-1]
+
     def DMS_to_detector_dq(self):
         # pixeldq only has to be done once
         self.pixeldq = self.pixeldq[:, ::-1]
@@ -1057,6 +1183,10 @@ class NRCB3Dataset(NIRDataset):
         self.get_group(integration, group)
         self.group = self.group[::-1]
 
+    def DMS_to_detector_groups(self, groups):
+        # View of a group, or stack of groups, in detector coordinates
+        return groups[..., ::-1, :]
+
     def DMS_to_detector_dq(self):
         # pixeldq only has to be done once
         self.pixeldq = self.pixeldq[::-1]
@@ -1076,6 +1206,10 @@ class NRCB4Dataset(NIRDataset):
         self.get_group(integration, group)
         self.group = self.group[:, ::-1]
 
+    def DMS_to_detector_groups(self, groups):
+        # View of a group, or stack of groups, in detector coordinates
+        return groups[..., ::-1]
+
     def DMS_to_detector_dq(self):
         # pixeldq only has to be done once
         self.pixeldq = self.pixeldq[:, ::-1]
@@ -1095,6 +1229,10 @@ class NRCBLONGDataset(NIRDataset):
         self.get_group(integration, group)
         self.group = self.group[::-1]
 
+    def DMS_to_detector_groups(self, groups):
+        # View of a group, or stack of groups, in detector coordinates
+        return groups[..., ::-1, :]
+
     def DMS_to_detector_dq(self):
         # pixeldq only has to be done once
         self.pixeldq = self.pixeldq[::-1]
@@ -1115,6 +1253,10 @@ class NIRISSDataset(NIRDataset):
         self.get_group(integration, group)
         self.group = np.swapaxes(self.group[::-1, ::-1], 0, 1)
 
+    def DMS_to_detector_groups(self, groups):
+        # View of a group, or stack of groups, in detector coordinates
+        return np.swapaxes(groups[..., ::-1, ::-1], -2, -1)
+
     def DMS_to_detector_dq(self):
         # pixeldq only has to be done once
         self.pixeldq = np.swapaxes(self.pixeldq[::-1, ::-1], 0, 1)
@@ -1134,6 +1276,10 @@ class GUIDER1Dataset(NIRDataset):
         self.get_group(integration, group)
         self.group = self.group[::-1, ::-1]
 
+    def DMS_to_detector_groups(self, groups):
+        # View of a group, or stack of groups, in detector coordinates
+        return groups[..., ::-1, ::-1]
+
     def DMS_to_detector_dq(self):
         # pixeldq only has to be done once
         self.pixeldq = self.pixeldq[::-1, ::-1]
@@ -1153,6 +1299,10 @@ class GUIDER2Dataset(NIRDataset):
         self.get_group(integration, group)
         self.group = self.group[:, ::-1]
 
+    def DMS_to_detector_groups(self, groups):
+        # View of a group, or stack of groups, in detector coordinates
+        return groups[..., ::-1]
+
     def DMS_to_detector_dq(self):
         # pixeldq only has to be done once
         self.pixeldq = self.pixeldq[:, ::-1]
@@ -23,6 +23,7 @@ class RefPixStep(Step):
         side_smoothing_length = integer(default=11)
         side_gain = float(default=1.0)
         odd_even_rows = boolean(default=True)
+        maximum_cores = option('quarter', 'half', 'all', default=None) # max number of threads for the IRS2 Fourier transforms
     """
 
     reference_file_types = ['refpix']
@@ -46,8 +47,13 @@ class RefPixStep(Step):
                     return result
 
                 irs2_model = datamodels.IRS2Model(self.irs2_name)
+                workers = pipe_utils.number_of_processes(self.maximum_cores)
+                if self.maximum_cores is not None:
+                    self.log.info('Using %d threads for the Fourier transforms'
+                                  % workers)
                 result = irs2_subtract_reference.correct_model(input_model,
-                                                               irs2_model)
+                                                               irs2_model,
+                                                               workers=workers)
                 if result.meta.cal_step.refpix != 'SKIPPED':
                     result.meta.cal_step.refpix = 'COMPLETE'
                 irs2_model.close()
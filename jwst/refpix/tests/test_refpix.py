@@ -3,6 +3,7 @@ import pytest
 
 from jwst.datamodels import RampModel, dqflags
 from jwst.refpix import RefPixStep
+from jwst.refpix import irs2_subtract_reference
 from jwst.refpix.reference_pixels import Dataset, NIRDataset, correct_model, create_dataset
 
 
@@ -523,6 +524,37 @@ def test_do_top_bottom_correction(setup_cube):
             decimal=1)
 
 
+def test_groups_match_single_group(setup_cube):
+    '''Test the reference values and side signal of a stack of groups
+    against those of each group.'''
+
+    ngroups = 3
+    input_model = setup_cube('NIRCAM', 'NRCA1', ngroups, 2048, 2048)
+    rng = np.random.RandomState(5)
+    input_model.data[0] = rng.normal(1000., 20., (ngroups, 2048, 2048))
+    input_model.data[0, 1, 2, 100] = 1.e5
+    input_model.pixeldq[100:110, 1] = dqflags.pixel['DO_NOT_USE']
+    init_dataset = NIRDataset(input_model, True, True, 11, 1.0)
+    groups = input_model.data[0]
+
+    refvalues = init_dataset.get_refvalues(groups)
+    left = init_dataset.calculate_side_ref_signal(groups, 0, 3)
+    for group in range(ngroups):
+        group_refvalues = init_dataset.get_refvalues(groups[group])
+        for amplifier in 'ABCD':
+            for odd_even in ('odd', 'even'):
+                for top_bottom in ('top', 'bottom'):
+                    assert (refvalues[amplifier][odd_even][top_bottom][group] ==
+                            pytest.approx(group_refvalues[amplifier][odd_even][top_bottom],
+                                          rel=1e-6))
+
+        data = init_dataset.create_reflected(groups[group, :, :4], 11)
+        dq = init_dataset.create_reflected(init_dataset.pixeldq[:, :4], 11)
+        expected = [np.median(data[row:row + 11][(dq[row:row + 11] & dqflags.pixel['DO_NOT_USE']) == 0])
+                    for row in range(2048)]
+        np.testing.assert_array_equal(left[group], expected)
+
+
 def test_do_top_bottom_correction_no_evenOdd(setup_cube):
     '''Test top/bottom correction with no even/odd.'''
 
@@ -608,6 +640,31 @@ def make_rampmodel(ngroups, ysize, xsize):
     return dm_ramp
 
 
+@pytest.mark.parametrize('chunk_bytes', [1, 2**28])
+def test_irs2_apply_alpha_beta(monkeypatch, chunk_bytes):
+    '''Test the real Fourier transforms of the IRS2 correction against
+    the complex transforms of each sector and group.'''
+
+    monkeypatch.setattr(irs2_subtract_reference, 'FFT_CHUNK_BYTES', chunk_bytes)
+    rng = np.random.RandomState(9)
+    nsectors, ngroups, nelem = 4, 3, 712
+    r0 = rng.normal(size=(nsectors, ngroups, nelem)).astype(np.float32)
+    refout0 = rng.normal(size=(ngroups, nelem)).astype(np.float32)
+    alpha = (rng.normal(size=(nsectors, nelem)) +
+             1j * rng.normal(size=(nsectors, nelem))).astype(np.complex64)
+    beta = (rng.normal(size=(nsectors, nelem)) +
+            1j * rng.normal(size=(nsectors, nelem))).astype(np.complex64)
+
+    expected = np.zeros_like(r0)
+    for k in range(nsectors):
+        for i in range(ngroups):
+            expected[k, i] = np.fft.ifft(np.fft.fft(r0[k, i]) * alpha[k] +
+                                         np.fft.fft(refout0[i]) * beta[k]).real
+
+    irs2_subtract_reference.apply_alpha_beta(r0, refout0, alpha, beta, workers=2)
+    np.testing.assert_allclose(r0, expected, atol=1e-5)
+
+
 @pytest.fixture(scope='function')
 def setup_cube():
     ''' Set up fake data to test.'''
@@ -16,7 +16,7 @@ class GWCSDrizzle:
     """
     def __init__(self, product, outwcs=None, single=False,
                  wt_scl="exptime", pixfrac=1.0, kernel="square",
-                 fillval="INDEF"):
+                 fillval="INDEF", pixmap_tolerance=None, strip_rows=None):
         """
         Create a new Drizzle output object and set the drizzle parameters.
 
@@ -55,6 +55,19 @@ class GWCSDrizzle:
         fillval : str, otional
             The value a pixel is set to in the output if the input image does
             not overlap it. The default value of INDEF does not set a value.
+
+        pixmap_tolerance : float, optional
+            If set, the pixel map of each input image is interpolated from a
+            sparse grid, with this largest error in output pixels.  By default
+            the WCS transforms are evaluated at every input pixel.
+
+        strip_rows : int, optional
+            If set, each input image is drizzled in strips of this many rows,
+            so that only the band of output rows overlapped by each strip is
+            read from and written to the output arrays of product, which may
+            then be memory-mapped arrays larger than the available memory
+            (see drizzle_strips).  By default the input images are drizzled
+            whole.
         """
 
         # Initialize the object fields
@@ -69,6 +82,8 @@ class GWCSDrizzle:
         self.kernel = kernel
         self.fillval = fillval
         self.pixfrac = pixfrac
+        self.pixmap_tolerance = pixmap_tolerance
+        self.strip_rows = strip_rows
 
         self.sciext = "SCI"
         self.whtext = "WHT"
@@ -202,7 +217,9 @@ class GWCSDrizzle:
                             pscale_ratio=pscale_ratio, uniqid=self.uniqid,
                             xmin=xmin, xmax=xmax, ymin=ymin, ymax=ymax,
                             pixfrac=self.pixfrac, kernel=self.kernel,
-                            fillval=self.fillval)
+                            fillval=self.fillval,
+                            pixmap_tolerance=self.pixmap_tolerance,
+                            strip_rows=self.strip_rows)
 
     def blot_image(self, blotwcs, interp='poly5', sinscl=1.0):
         """
@@ -263,7 +280,8 @@ def dodrizzle(insci, input_wcs, inwht,
               expin, in_units, wt_scl,
               pscale_ratio=1.0, uniqid=1,
               xmin=0, xmax=0, ymin=0, ymax=0,
-              pixfrac=1.0, kernel='square', fillval="INDEF"):
+              pixfrac=1.0, kernel='square', fillval="INDEF",
+              pixmap_tolerance=None, strip_rows=None):
     """
     Low level routine for performing 'drizzle' operation on one image.
 
@@ -368,6 +386,14 @@ def dodrizzle(insci, input_wcs, inwht,
         The value a pixel is set to in the output if the input image does
         not overlap it. The default value of INDEF does not set a value.
 
+    pixmap_tolerance: float, optional
+        If set, the pixel map is interpolated from a sparse grid, with this
+        largest error in output pixels (see resample_utils.calc_gwcs_pixmap).
+
+    strip_rows: int, optional
+        If set, the input image is drizzled in strips of this many rows,
+        each into the band of output rows it overlaps (see drizzle_strips).
+
     Returns
     -------
     A tuple with three values: a version string, the number of pixels
@@ -422,7 +448,8 @@ def dodrizzle(insci, input_wcs, inwht,
 
     # Compute the mapping between the input and output pixel coordinates
     # for use in drizzle.cdrizzle.tdriz
-    pixmap = resample_utils.calc_gwcs_pixmap(input_wcs, output_wcs, insci.shape)
+    pixmap = resample_utils.calc_gwcs_pixmap(input_wcs, output_wcs, insci.shape,
+                                             tolerance=pixmap_tolerance)
     # pixmap[np.isnan(pixmap)] = -10
     # print("Number of NaNs: ", len(np.isnan(pixmap)) / 2)
     # inwht[np.isnan(pixmap[:,:,0])] = 0.
@@ -439,6 +466,23 @@ def dodrizzle(insci, input_wcs, inwht,
 
     # Call 'drizzle' to perform image combination
     log.info('Drizzling {} --> {}'.format(insci.shape, outsci.shape))
+    if strip_rows:
+        return drizzle_strips(
+            insci, inwht, pixmap,
+            outsci, outwht, outcon,
+            strip_rows,
+            uniqid=uniqid,
+            xmin=xmin, xmax=xmax,
+            ymin=ymin, ymax=ymax,
+            scale=pscale_ratio,
+            pixfrac=pixfrac,
+            kernel=kernel,
+            in_units=in_units,
+            expscale=expscale,
+            wtscale=wt_scl,
+            fillstr=fillval
+            )
+
     _vers, nmiss, nskip = cdrizzle.tdriz(
         insci, inwht, pixmap,
         outsci, outwht, outcon,
@@ -455,3 +499,97 @@ def dodrizzle(insci, input_wcs, inwht,
         )
 
     return _vers, nmiss, nskip
+
+
+def drizzle_strips(insci, inwht, pixmap, outsci, outwht, outcon, strip_rows,
+                   xmin=0, xmax=0, ymin=0, ymax=0, **tdriz_pars):
+    """
+    Drizzle an input image in strips of rows.
+
+    Each strip of input rows is drizzled into a copy of the band of output
+    rows it overlaps, which is then written back to the output arrays.  Only
+    these rows of the output arrays are read and written, so the outputs may
+    be memory-mapped arrays: for each input image, only the part of the
+    output frame it covers is loaded in memory, one band at a time.
+
+    The bands span the full width of the output, and are padded by a margin
+    larger than the drizzle kernel.  The strips are passed to cdrizzle.tdriz
+    with a few rows of the input image on either side, which it uses for the
+    pixel footprints but does not drizzle, so the result is the same as
+    drizzling the whole image, up to floating point rounding.
+
+    Parameters
+    ----------
+
+    insci, inwht : 2d array
+        The input image and its pixel by pixel weighting.
+
+    pixmap : 3d array
+        The output pixel coordinates of each input pixel.
+
+    outsci, outwht, outcon : 2d array
+        The output image, weight and context plane, updated in place.
+
+    strip_rows : int
+        The number of input rows drizzled at once.
+
+    xmin, xmax, ymin, ymax : int, optional
+        The bounding rectangle of the input pixels to drizzle, as given to
+        cdrizzle.tdriz.
+
+    tdriz_pars : dict
+        The other parameters of cdrizzle.tdriz.
+
+    Returns
+    -------
+    A tuple with three values: the version string of cdrizzle, the number
+    of pixels on the input image that do not overlap the output image, and
+    the number of complete lines on the input image that do not overlap the
+    output image.
+    """
+    nrows, ncols = insci.shape
+    if xmax is None or xmax == xmin:
+        xmax = ncols
+    if ymax is None or ymax == ymin:
+        ymax = nrows
+
+    pixfrac = tdriz_pars.get('pixfrac', 1.0)
+    scale = tdriz_pars.get('scale', 1.0)
+    halo = int(np.ceil(max(pixfrac, 1.0))) + 1
+
+    _vers, nmiss, nskip = '', 0, 0
+    for row0 in range(ymin, ymax, strip_rows):
+        row1 = min(row0 + strip_rows, ymax)
+        halo0 = max(row0 - halo, 0)
+        halo1 = min(row1 + halo, nrows)
+        strip_pixmap = pixmap[halo0:halo1]
+
+        # Pad the band of output rows by a few times the largest distance
+        # between neighboring input pixels in the output frame
+        step = max(np.abs(np.diff(strip_pixmap, axis=0)).max(initial=0.),
+                   np.abs(np.diff(strip_pixmap, axis=1)).max(initial=0.))
+        margin = int(np.ceil(4 * max(step, 1.) * max(pixfrac, 1.) *
+                             max(scale, 1. / scale))) + 2
+        out0 = max(int(np.floor(strip_pixmap[..., 1].min())) - margin, 0)
+        out1 = min(int(np.ceil(strip_pixmap[..., 1].max())) + margin + 1,
+                   outsci.shape[0])
+        if out0 >= out1:
+            nmiss += (row1 - row0) * (xmax - xmin)
+            nskip += row1 - row0
+            continue
+
+        bands = [np.array(array[out0:out1]) for array in
+                 (outsci, outwht, outcon)]
+        _vers, strip_miss, strip_skip = cdrizzle.tdriz(
+            insci[halo0:halo1], inwht[halo0:halo1], strip_pixmap - [0, out0],
+            *bands,
+            xmin=xmin, xmax=xmax,
+            ymin=row0 - halo0, ymax=row1 - halo0,
+            **tdriz_pars
+            )
+        for array, band in zip((outsci, outwht, outcon), bands):
+            array[out0:out1] = band
+        nmiss += strip_miss
+        nskip += strip_skip
+
+    return _vers, nmiss, nskip
@@ -1,8 +1,11 @@
 import logging
-from collections import OrderedDict
+import multiprocessing
+import tempfile
+
 import numpy as np
 
 from .. import datamodels
+from ..lib.pipe_utils import number_of_processes
 
 from . import gwcs_drizzle
 from . import resample_utils
@@ -11,6 +14,14 @@ from ..model_blender import blendmeta
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
+# ResampleData, groups of input images and, for outputs on disk, output
+# products shared with the forked processes created by
+# ResampleData.drizzle_groups_parallel
+_parallel_args = None
+
+# Number of input rows drizzled at once to outputs on disk
+DRIZZLE_STRIP_ROWS = 256
+
 __all__ = ["ResampleData"]
 
 
@@ -44,6 +55,11 @@ class ResampleData:
 
         output : str
             filename for output
+
+        pars : dict
+            drizzle parameters.  If in_memory is False, the output arrays
+            are memory-mapped to temporary files, and the input images are
+            drizzled to them in strips of DRIZZLE_STRIP_ROWS rows.
         """
         self.input_models = input_models
         self.drizpars = pars
@@ -54,7 +70,11 @@ class ResampleData:
         # Define output WCS based on all inputs, including a reference WCS
         self.output_wcs = resample_utils.make_output_wcs(self.input_models)
         log.debug('Output mosaic size: {}'.format(self.output_wcs.data_size))
-        self.blank_output = datamodels.DrizProductModel(self.output_wcs.data_size)
+        if self.drizpars.get('in_memory', True):
+            self.blank_output = datamodels.DrizProductModel(self.output_wcs.data_size)
+        else:
+            # The arrays are created on disk for each output product
+            self.blank_output = datamodels.DrizProductModel()
 
         # update meta data and wcs
         self.blank_output.update(input_models[0])
@@ -85,10 +105,91 @@ class ResampleData:
     def do_drizzle(self):
         """ Perform drizzling operation on input images's to create a new output
         """
+        groups = self.drizzle_groups()
+        num_processes = 1
+        if self.drizpars['single']:
+            num_processes = min(
+                number_of_processes(self.drizpars.get('maximum_cores')),
+                len(groups))
+        if num_processes > 1:
+            for output_model in self.drizzle_groups_parallel(groups,
+                                                             num_processes):
+                self.output_models.append(output_model)
+        else:
+            for obs_product, exposure, texptime in groups:
+                output_model = self.drizzle_group(obs_product, exposure,
+                                                  texptime)
+                self.output_models.append(output_model)
+
+    def drizzle_groups_parallel(self, groups, num_processes):
+        """ Drizzle groups of input images to separate outputs in processes
+
+        Each process drizzles one group at a time to its own output arrays
+        (see _drizzle_group_worker), which are returned to this process and
+        stored in the output product.  The output metadata are created in
+        this process, and the input images are sky subtracted in place as
+        they would be by drizzle_group.  If the output arrays are on disk,
+        the output products are created beforehand, and the processes
+        drizzle to their memory-mapped arrays, which are shared with this
+        process.
+
+        The processes are forked, so they share the input models and the
+        output WCS with this process without pickling them.
+
+        Parameters
+        ----------
+        groups : list of tuples
+            the output filename, the list of input models and the exposure
+            time of each output product, as given by drizzle_groups
+
+        num_processes : int
+            number of processes to create
+
+        Yields
+        ------
+        output_model : DrizProductModel
+            the drizzled output product of each group, in order
+        """
+        global _parallel_args
+        output_models = None
+        if not self.drizpars.get('in_memory', True):
+            output_models = [self.new_output_model(obs_product, len(exposure))
+                             for obs_product, exposure, texptime in groups]
+        _parallel_args = (self, groups, output_models)
+
+        log.info("Creating %d processes for drizzling %d groups",
+                 num_processes, len(groups))
+        context = multiprocessing.get_context('fork')
+        try:
+            with context.Pool(processes=num_processes) as pool:
+                results = pool.imap(_drizzle_group_worker, range(len(groups)))
+                for index, arrays in enumerate(results):
+                    obs_product, exposure, texptime = groups[index]
+                    if output_models is None:
+                        output_model = self.new_output_model(obs_product)
+                        (output_model.data, output_model.wht,
+                         output_model.con) = arrays
+                    else:
+                        output_model = output_models[index]
+                    for img in exposure:
+                        self.subtract_background(img)
+                    self.update_output_meta(output_model, exposure, texptime)
+                    yield output_model
+        finally:
+            _parallel_args = None
+
+    def drizzle_groups(self):
+        """ Define the output products and the input images drizzled to each
+
+        Returns
+        -------
+        list of tuples
+            The output filename, the list of input models and the total
+            exposure time of each output product.
+        """
         # Set up information about what outputs we need to create: single or final
         # Key: value from metadata for output/observation name
         # Value: full filename for output file
-        driz_outputs = OrderedDict()
 
         # Look for input configuration parameter telling the code to run
         # in single-drizzle mode (mosaic all detectors in a single observation)
@@ -106,57 +207,160 @@ class ResampleData:
             for exposure in exposures:
                 total_exposure_time += exposure[0].meta.exposure.exposure_time
             group_exptime = [total_exposure_time]
-        pointings = len(self.input_models.group_names)
 
-        for obs_product, exposure, texptime in zip(driz_outputs, exposures,
-                                                   group_exptime):
-            output_model = self.blank_output.copy()
-            output_model.meta.filename = obs_product
-            saved_model_type = output_model.meta.model_type
+        return list(zip(driz_outputs, exposures, group_exptime))
+
+    def drizzle_group(self, obs_product, exposure, texptime):
+        """ Drizzle a group of input images to one output product
+
+        Parameters
+        ----------
+        obs_product : str
+            filename of the output product
+
+        exposure : list of DataModels
+            the input models drizzled to the output product
+
+        texptime : float
+            exposure time of the output product
+
+        Returns
+        -------
+        output_model : DrizProductModel
+            the drizzled output product
+        """
+        output_model = self.new_output_model(obs_product, len(exposure))
+        self.drizzle_images(output_model, exposure)
+        self.update_output_meta(output_model, exposure, texptime)
+
+        return output_model
+
+    def new_output_model(self, obs_product, nimages=1):
+        """ Create an empty output product, with blended metadata if needed
+
+        Parameters
+        ----------
+        obs_product : str
+            filename of the output product
+
+        nimages : int
+            number of input images drizzled to the output product, used for
+            the number of context planes of outputs on disk
+
+        Returns
+        -------
+        output_model : DrizProductModel
+        """
+        output_model = self.blank_output.copy()
+        output_model.meta.filename = obs_product
+        saved_model_type = output_model.meta.model_type
+
+        if not self.drizpars.get('in_memory', True):
+            self.memmap_output_arrays(output_model, nimages)
+
+        if self.drizpars['blendheaders']:
+            self.blend_output_metadata(output_model)
+            output_model.meta.model_type = saved_model_type
+
+        return output_model
+
+    def memmap_output_arrays(self, output_model, nimages):
+        """ Create the arrays of an output product on disk
+
+        The data, weight and context arrays are memory-mapped to anonymous
+        temporary files, created in the directory given by the TMPDIR
+        environment variable if that is set, which are deleted when the
+        arrays are closed.  The context array has all the planes needed for
+        nimages input images, as planes added while drizzling would be held
+        in memory, and is 2D, like the in-memory one, if only one plane is
+        needed.
+
+        Parameters
+        ----------
+        output_model : DrizProductModel
+            the output product, updated in place
+
+        nimages : int
+            number of input images drizzled to the output product
+        """
+        shape = tuple(self.output_wcs.data_size)
+        numplanes = (nimages - 1) // 32 + 1
+        conshape = shape if numplanes == 1 else (numplanes,) + shape
+        log.debug('Creating {} output arrays on disk'.format(shape))
+        output_model.data = _temporary_memmap(shape, np.float32)
+        output_model.wht = _temporary_memmap(shape, np.float32)
+        output_model.con = _temporary_memmap(conshape, np.int32)
+
+    def drizzle_images(self, output_model, exposure):
+        """ Drizzle input images to the arrays of an output product
 
-            if self.drizpars['blendheaders']:
-                self.blend_output_metadata(output_model)
-                output_model.meta.model_type = saved_model_type
+        Parameters
+        ----------
+        output_model : DrizProductModel
+            the output product, updated in place
+
+        exposure : list of DataModels
+            the input models, sky subtracted in place
+        """
+        # Initialize the output with the wcs
+        strip_rows = None
+        if not self.drizpars.get('in_memory', True):
+            strip_rows = DRIZZLE_STRIP_ROWS
+        driz = gwcs_drizzle.GWCSDrizzle(output_model,
+                                        single=self.drizpars['single'],
+                                        pixfrac=self.drizpars['pixfrac'],
+                                        kernel=self.drizpars['kernel'],
+                                        fillval=self.drizpars['fillval'],
+                                        pixmap_tolerance=self.drizpars.get('pixmap_tolerance'),
+                                        strip_rows=strip_rows)
 
-            exposure_times = {'start': [], 'end': []}
+        for n, img in enumerate(exposure):
+            self.subtract_background(img)
 
-            # Initialize the output with the wcs
-            driz = gwcs_drizzle.GWCSDrizzle(output_model,
-                                            single=self.drizpars['single'],
-                                            pixfrac=self.drizpars['pixfrac'],
-                                            kernel=self.drizpars['kernel'],
-                                            fillval=self.drizpars['fillval'])
+            outwcs_pscale = output_model.meta.wcsinfo.cdelt1
+            wcslin_pscale = img.meta.wcsinfo.cdelt1
 
-            for n, img in enumerate(exposure):
-                exposure_times['start'].append(img.meta.exposure.start_time)
-                exposure_times['end'].append(img.meta.exposure.end_time)
+            inwht = resample_utils.build_driz_weight(img,
+                weight_type=self.drizpars['weight_type'],
+                good_bits=self.drizpars['good_bits'])
+            driz.add_image(img.data, img.meta.wcs, inwht=inwht,
+                    expin=img.meta.exposure.exposure_time,
+                    pscale_ratio=outwcs_pscale / wcslin_pscale)
 
-                # apply sky subtraction
-                blevel = img.meta.background.level
-                if not img.meta.background.subtracted and blevel is not None:
-                    img.data -= blevel
+    @staticmethod
+    def subtract_background(img):
+        """ Apply sky subtraction to an input image in place """
+        blevel = img.meta.background.level
+        if not img.meta.background.subtracted and blevel is not None:
+            img.data -= blevel
 
-                outwcs_pscale = output_model.meta.wcsinfo.cdelt1
-                wcslin_pscale = img.meta.wcsinfo.cdelt1
+    def update_output_meta(self, output_model, exposure, texptime):
+        """ Update the exposure and WCS metadata of an output product
 
-                inwht = resample_utils.build_driz_weight(img,
-                    weight_type=self.drizpars['weight_type'],
-                    good_bits=self.drizpars['good_bits'])
-                driz.add_image(img.data, img.meta.wcs, inwht=inwht,
-                        expin=img.meta.exposure.exposure_time,
-                        pscale_ratio=outwcs_pscale / wcslin_pscale)
+        Parameters
+        ----------
+        output_model : DrizProductModel
+            the output product, updated in place
 
-            # Update some basic exposure time values based on all the inputs
-            output_model.meta.exposure.exposure_time = texptime
-            output_model.meta.exposure.start_time = min(exposure_times['start'])
-            output_model.meta.exposure.end_time = max(exposure_times['end'])
-            output_model.meta.resample.product_exposure_time = texptime
-            output_model.meta.resample.weight_type = self.drizpars['weight_type']
-            output_model.meta.resample.pointings = pointings
+        exposure : list of DataModels
+            the input models drizzled to the output product
+
+        texptime : float
+            exposure time of the output product
+        """
+        pointings = len(self.input_models.group_names)
 
-            self.update_fits_wcs(output_model)
+        # Update some basic exposure time values based on all the inputs
+        output_model.meta.exposure.exposure_time = texptime
+        output_model.meta.exposure.start_time = min(
+            img.meta.exposure.start_time for img in exposure)
+        output_model.meta.exposure.end_time = max(
+            img.meta.exposure.end_time for img in exposure)
+        output_model.meta.resample.product_exposure_time = texptime
+        output_model.meta.resample.weight_type = self.drizpars['weight_type']
+        output_model.meta.resample.pointings = pointings
 
-            self.output_models.append(output_model)
+        self.update_fits_wcs(output_model)
 
     def update_fits_wcs(self, model):
         """
@@ -175,3 +379,34 @@ class ResampleData:
         model.meta.wcsinfo.pc1_2 = transform[2].matrix.value[0][1]
         model.meta.wcsinfo.pc2_1 = transform[2].matrix.value[1][0]
         model.meta.wcsinfo.pc2_2 = transform[2].matrix.value[1][1]
+
+
+def _drizzle_group_worker(index):
+    """ Drizzle one group of input images in a forked process
+
+    Parameters
+    ----------
+    index : int
+        index of the group in the groups given to drizzle_groups_parallel
+
+    Returns
+    -------
+    tuple or None
+        the data, weight and context arrays of the drizzled output, or None
+        if the output arrays are on disk, in which case they are drizzled in
+        place
+    """
+    resample_data, groups, output_models = _parallel_args
+    obs_product, exposure, texptime = groups[index]
+    if output_models is not None:
+        resample_data.drizzle_images(output_models[index], exposure)
+        return None
+    output_model = resample_data.blank_output.copy()
+    resample_data.drizzle_images(output_model, exposure)
+    return output_model.data, output_model.wht, output_model.con
+
+
+def _temporary_memmap(shape, dtype):
+    """ Zero-filled array memory-mapped to an anonymous temporary file """
+    return np.memmap(tempfile.TemporaryFile(prefix='resample_'), mode='w+',
+                     shape=shape, dtype=dtype)
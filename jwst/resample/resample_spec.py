@@ -240,7 +240,8 @@ class ResampleSpecData:
                                 single=self.drizpars['single'],
                                 pixfrac=self.drizpars['pixfrac'],
                                 kernel=self.drizpars['kernel'],
-                                fillval=self.drizpars['fillval'])
+                                fillval=self.drizpars['fillval'],
+                                pixmap_tolerance=self.drizpars.get('pixmap_tolerance'))
 
             for n, img in enumerate(group):
                 exposure_times['start'].append(img.meta.exposure.start_time)
@@ -2,7 +2,7 @@ __all__ = ["ResampleSpecStep"]
 
 from .. import datamodels
 from ..datamodels import MultiSlitModel, ModelContainer
-from . import resample_spec, ResampleStep
+from . import resample_spec, resample_utils, ResampleStep
 from ..exp_to_source import multislit_to_container
 from ..assign_wcs.util import update_s_region_spectral
 
@@ -19,6 +19,8 @@ class ResampleSpecStep(ResampleStep):
     """
 
     def process(self, input):
+        resample_utils.pixmap_cache.resize(self.pixmap_cache_size)
+
         input = datamodels.open(input)
 
         # If single DataModel input, wrap in a ModelContainer
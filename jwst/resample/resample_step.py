@@ -7,6 +7,7 @@ from ..extern.configobj.validate import Validator
 from ..extern.configobj.configobj import ConfigObj
 from .. import datamodels
 from . import resample
+from . import resample_utils
 from ..assign_wcs import util
 
 log = logging.getLogger(__name__)
@@ -33,12 +34,18 @@ class ResampleStep(Step):
         good_bits = integer(min=0, default=6)
         single = boolean(default=False)
         blendheaders = boolean(default=True)
+        maximum_cores = option('quarter', 'half', 'all', default=None) # max number of processes to create
+        pixmap_tolerance = float(default=None) # max error in pixels of interpolated pixel maps
+        pixmap_cache_size = integer(default=0) # max bytes of pixel maps cached for reuse, 0 for none
+        in_memory = boolean(default=True) # if False, create the output arrays in temporary files
     """
 
     reference_file_types = ['drizpars']
 
     def process(self, input):
 
+        resample_utils.pixmap_cache.resize(self.pixmap_cache_size)
+
         input = datamodels.open(input)
 
         # If single input, wrap in a ModelContainer
@@ -163,7 +170,10 @@ class ResampleStep(Step):
         kwargs = dict(
             good_bits=self.good_bits,
             single=self.single,
-            blendheaders=self.blendheaders
+            blendheaders=self.blendheaders,
+            maximum_cores=self.maximum_cores,
+            pixmap_tolerance=self.pixmap_tolerance,
+            in_memory=self.in_memory
             )
 
         kwargs.update(all_drizpars)
@@ -1,7 +1,12 @@
+import hashlib
+import io
 import logging
 import warnings
+from collections import OrderedDict
 
+import asdf
 import numpy as np
+from scipy.interpolate import RectBivariateSpline
 from astropy import wcs as fitswcs
 from astropy.coordinates import SkyCoord
 from astropy.modeling.models import Scale, AffineTransformation2D
@@ -14,6 +19,125 @@ from ..assign_wcs.util import wcs_from_footprints, wcs_bbox_from_shape
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
+# Initial spacing, in pixels, of the sparse grid on which the WCS transforms
+# are evaluated when the pixel map is interpolated
+PIXMAP_STEPSIZE = 16
+
+
+class PixmapCache():
+
+    def __init__(self, max_bytes=0):
+        """ Least recently used cache of pixel maps
+
+        The pixel maps are stored by the content of the input and output
+        WCS, so that the maps computed for an input image when drizzling it
+        are reused when the median image is blotted back to it in outlier
+        detection, and when it is drizzled again to the final product.
+        For interpolated pixel maps, only the splines fit to the sparse grid
+        are stored. Pixel maps computed in forked worker processes are not
+        stored in the cache of the parent process, so the cache only helps
+        serial runs.
+
+        Parameters
+        ----------
+        max_bytes : int
+           maximum size of the arrays held in the cache. The least recently
+           used pixel maps are dropped when the cache grows beyond this size,
+           and pixel maps larger than it are not stored; 0 turns the cache
+           off.
+        """
+        self.max_bytes = max_bytes
+        self.pixmaps = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """ Return the pixel map stored under key, or None """
+        pixmap = self.pixmaps.get(key)
+        if pixmap is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.pixmaps.move_to_end(key)
+        return pixmap
+
+    def put(self, key, pixmap):
+        """ Store a pixel map under key, dropping the oldest maps if needed
+
+        A pixel map larger than max_bytes is not stored.
+        """
+        if key in self.pixmaps:
+            self.nbytes -= _pixmap_nbytes(self.pixmaps.pop(key))
+        nbytes = _pixmap_nbytes(pixmap)
+        if nbytes > self.max_bytes:
+            return
+        self.pixmaps[key] = pixmap
+        self.nbytes += nbytes
+        self._shrink()
+
+    def resize(self, max_bytes):
+        """ Set the maximum size, dropping the oldest maps if needed """
+        self.max_bytes = max_bytes
+        self._shrink()
+
+    def _shrink(self):
+        while self.nbytes > self.max_bytes:
+            oldkey, oldpixmap = self.pixmaps.popitem(last=False)
+            self.nbytes -= _pixmap_nbytes(oldpixmap)
+
+    def clear(self):
+        """ Remove all the pixel maps from the cache """
+        self.pixmaps.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+
+# cache shared by resample and outlier detection in this process, resized
+# by the pixmap_cache_size parameter of the steps; it is off by default
+pixmap_cache = PixmapCache()
+
+
+def _pixmap_nbytes(pixmap):
+    if isinstance(pixmap, np.ndarray):
+        return pixmap.nbytes
+    return sum(spline.tck[0].nbytes + spline.tck[1].nbytes +
+               spline.tck[2].nbytes for spline in pixmap)
+
+
+def pixmap_key(in_wcs, out_wcs, bounding_box, tolerance):
+    """ Key identifying a pixel map in the cache
+
+    Parameters
+    ----------
+    in_wcs, out_wcs : `~gwcs.wcs.WCS` or `~astropy.wcs.WCS`
+        input and output WCS
+    bounding_box : tuple
+        bounding box of the input pixels
+    tolerance : float or None
+        tolerance of the interpolated pixel map
+
+    Returns
+    -------
+    key : tuple or None
+        digests of the WCS objects serialized to ASDF, the bounding box and
+        the tolerance, or None if the WCS objects cannot be serialized
+    """
+    digests = []
+    for wcs in (in_wcs, out_wcs):
+        buff = io.BytesIO()
+        try:
+            asdf.AsdfFile({'wcs': wcs}).write_to(buff)
+        except Exception as err:
+            # WCS objects without an ASDF representation are not cached
+            log.debug("Pixel map not cached: {}".format(err))
+            return None
+        digests.append(hashlib.sha1(buff.getvalue()).hexdigest())
+    bounding_box = tuple(tuple(float(v) for v in axis)
+                         for axis in bounding_box)
+    return tuple(digests) + (bounding_box, tolerance)
+
 
 def make_output_wcs(input_models):
     """ Generate output WCS here based on footprints of all input WCS objects
@@ -95,8 +219,32 @@ def shape_from_bounding_box(bounding_box):
     return tuple(reversed(size))
 
 
-def calc_gwcs_pixmap(in_wcs, out_wcs, shape=None):
+def calc_gwcs_pixmap(in_wcs, out_wcs, shape=None, tolerance=None,
+                     cache=pixmap_cache):
     """ Return a pixel grid map from input frame to output frame.
+
+    Parameters
+    ----------
+    in_wcs, out_wcs : `~gwcs.wcs.WCS` or `~astropy.wcs.WCS`
+        input and output WCS
+    shape : tuple, optional
+        shape of the input data, used for the bounding box instead of the
+        bounding box of the input WCS
+    tolerance : float, optional
+        if set, the WCS transforms are evaluated on a sparse grid, and the
+        pixel map is interpolated from it, provided the interpolation error
+        is below this value (in output pixels) where it is checked; see
+        interpolate_pixmap.  By default the transforms are evaluated at
+        every pixel.
+    cache : PixmapCache or None
+        cache in which the pixel map is looked up and stored; it is not
+        used if None or if its size is 0
+
+    Returns
+    -------
+    pixmap : ndarray
+        output pixel coordinates of each input pixel, -1 where the
+        transforms are undefined.  Pixel maps from the cache are read-only.
     """
     if shape:
         bb = wcs_bbox_from_shape(shape)
@@ -105,13 +253,113 @@ def calc_gwcs_pixmap(in_wcs, out_wcs, shape=None):
         bb = in_wcs.bounding_box
         log.debug("Bounding box from WCS: {}".format(in_wcs.bounding_box))
 
+    # The key serializes both WCS, so it is only built if the cache is on
+    key = None
+    if cache is not None and cache.max_bytes > 0:
+        key = pixmap_key(in_wcs, out_wcs, bb, tolerance)
+        pixmap = cache.get(key) if key is not None else None
+        if isinstance(pixmap, np.ndarray):
+            log.debug("Using cached pixel map")
+            return pixmap
+        elif pixmap is not None:
+            log.debug("Using cached pixel map splines")
+            return evaluate_pixmap(pixmap, bb)
+
+    if tolerance:
+        splines = interpolate_pixmap(reproject(in_wcs, out_wcs), bb,
+                                     tolerance)
+        if splines is not None:
+            if key is not None:
+                cache.put(key, splines)
+            return evaluate_pixmap(splines, bb)
+
     grid = wcstools.grid_from_bounding_box(bb)
     pixmap = np.dstack(reproject(in_wcs, out_wcs)(grid[0], grid[1]))
     pixmap[np.isnan(pixmap)] = -1
 
+    if key is not None:
+        pixmap.flags.writeable = False
+        cache.put(key, pixmap)
     return pixmap
 
 
+def _pixel_axes(bounding_box):
+    """ Pixel coordinates along x and y of the grid of a bounding box """
+    x0, x1 = np.floor(bounding_box[0][0] + 0.5), np.ceil(bounding_box[0][1] - 0.5)
+    y0, y1 = np.floor(bounding_box[1][0] + 0.5), np.ceil(bounding_box[1][1] - 0.5)
+    return np.arange(x0, x1 + 1, dtype=float), np.arange(y0, y1 + 1, dtype=float)
+
+
+def _sparse_indices(npix, stepsize):
+    """ Every stepsize'th index, and the last one """
+    indices = np.arange(0, npix, stepsize)
+    if indices[-1] != npix - 1:
+        indices = np.append(indices, npix - 1)
+    return indices
+
+
+def interpolate_pixmap(transform, bounding_box, tolerance,
+                       stepsize=PIXMAP_STEPSIZE):
+    """ Fit splines to a pixel map evaluated on a sparse grid
+
+    The transform is evaluated every stepsize pixels, and bicubic splines
+    are fit to the output coordinates.  The splines are checked against the
+    transform at the centers of the grid cells, and the grid spacing is
+    halved until the largest error is below tolerance.
+
+    Parameters
+    ----------
+    transform : callable
+        function of the input x, y pixel arrays returning the output x, y
+        pixel arrays, as returned by reproject
+    bounding_box : tuple
+        bounding box of the input pixels
+    tolerance : float
+        largest error, in output pixels, of the interpolated pixel map
+    stepsize : int
+        initial spacing, in pixels, of the sparse grid
+
+    Returns
+    -------
+    splines : tuple of `~scipy.interpolate.RectBivariateSpline` or None
+        the splines of the output x and y coordinates, or None if the
+        transform is undefined at some of the sparse grid points or the
+        tolerance cannot be met with a sparse grid
+    """
+    x, y = _pixel_axes(bounding_box)
+    while stepsize > 1:
+        ix = _sparse_indices(x.size, stepsize)
+        iy = _sparse_indices(y.size, stepsize)
+        if ix.size < 4 or iy.size < 4:
+            break
+        sparse = transform(*np.meshgrid(x[ix], y[iy]))
+        if not all(np.isfinite(coord).all() for coord in sparse):
+            log.debug("Pixel map undefined on the sparse grid, not interpolated")
+            return None
+        splines = tuple(RectBivariateSpline(y[iy], x[ix], coord)
+                        for coord in sparse)
+
+        # Check the splines at the centers of the grid cells
+        cx = x[(ix[:-1] + ix[1:]) // 2]
+        cy = y[(iy[:-1] + iy[1:]) // 2]
+        exact = transform(*np.meshgrid(cx, cy))
+        error = max(np.max(np.abs(spline(cy, cx) - coord))
+                    for spline, coord in zip(splines, exact))
+        if error <= tolerance:
+            log.debug("Pixel map interpolated from a grid with step {}, "
+                      "error {:.3g} pixels".format(stepsize, error))
+            return splines
+        stepsize //= 2
+    log.debug("Pixel map tolerance not met on a sparse grid, not interpolated")
+    return None
+
+
+def evaluate_pixmap(splines, bounding_box):
+    """ Evaluate the splines of interpolate_pixmap on every input pixel """
+    x, y = _pixel_axes(bounding_box)
+    return np.dstack([spline(y, x) for spline in splines])
+
+
 def reproject(wcs1, wcs2):
     """
     Given two WCSs or transforms return a function which takes pixel
@@ -0,0 +1,64 @@
+"""Test drizzling input images in strips of rows"""
+import numpy as np
+import pytest
+from astropy.modeling.models import Mapping, Polynomial2D, Rotation2D, Scale, Shift
+from gwcs import WCS
+
+from jwst.resample import gwcs_drizzle
+
+
+def input_wcs():
+    """ Imaging WCS with a polynomial distortion """
+    distortion = (Mapping((0, 1, 0, 1)) |
+                  Polynomial2D(2, c0_0=3., c1_0=1.01, c0_1=0.002, c2_0=2e-4,
+                               c1_1=-1e-4) &
+                  Polynomial2D(2, c0_0=-2., c1_0=-0.003, c0_1=0.99,
+                               c0_2=3e-4))
+    return WCS(distortion | (Scale(1e-5) & Scale(1e-5)),
+               input_frame='detector', output_frame='world')
+
+
+def output_wcs():
+    """ Rotated output frame, larger than the input images """
+    transform = ((Scale(1e5) & Scale(1e5)) | Rotation2D(25.) |
+                 (Shift(40.) & Shift(10.)))
+    return WCS(transform.inverse, input_frame='detector',
+               output_frame='world')
+
+
+@pytest.mark.parametrize('kernel, pixfrac, scale', [
+    ('square', 1.0, 1.0),
+    ('square', 2.5, 1.0),
+    ('turbo', 0.8, 1.0),
+    ('gaussian', 1.0, 0.5),
+    ('point', 1.0, 1.0),
+    ('lanczos3', 1.0, 1.0),
+])
+def test_dodrizzle_strips(kernel, pixfrac, scale):
+    """ Drizzling in strips gives the outputs of drizzling whole images """
+    rng = np.random.RandomState(5)
+    shape = (60, 50)
+    outputs = []
+    for strip_rows in (None, 7):
+        outsci = np.zeros((110, 120), dtype=np.float32)
+        outwht = np.zeros_like(outsci)
+        outcon = np.zeros((1,) + outsci.shape, dtype=np.int32)
+        for uniqid in (1, 2):
+            rng.seed(uniqid)
+            insci = rng.normal(10., 1., shape).astype(np.float32)
+            inwht = rng.uniform(0.5, 1., shape).astype(np.float32)
+            gwcs_drizzle.dodrizzle(insci, input_wcs(), inwht, output_wcs(),
+                                   outsci, outwht, outcon, 1.0, 'cps', 1.0,
+                                   pscale_ratio=scale, uniqid=uniqid,
+                                   pixfrac=pixfrac, kernel=kernel,
+                                   strip_rows=strip_rows)
+        outputs.append((outsci, outwht, outcon))
+
+    (sci, wht, con), (strip_sci, strip_wht, strip_con) = outputs
+    assert np.count_nonzero(wht) > 1000
+    assert np.count_nonzero(wht == 0) > 1000
+    # compare where the weights are not dominated by rounding errors
+    good = wht > 1e-4 * wht.max()
+    np.testing.assert_allclose(strip_wht, wht, rtol=0, atol=1e-5 * wht.max())
+    np.testing.assert_allclose(strip_sci[good], sci[good], rtol=1e-5)
+    np.testing.assert_array_equal(strip_con[:, good], con[:, good])
@@ -0,0 +1,114 @@
+"""Test drizzling the groups of exposures in single mode"""
+import numpy as np
+import pytest
+from astropy.modeling import models
+from gwcs import wcs
+
+from jwst import datamodels
+from jwst.resample import gwcs_drizzle, resample
+
+
+def fake_dodrizzle(insci, input_wcs, inwht, output_wcs, outsci, outwht,
+                   outcon, expin, in_units, wt_scl, uniqid=1, **kwargs):
+    """Stand-in for cdriz, adding the weighted image to the outputs"""
+    outsci += insci * inwht
+    outwht += inwht
+    outcon[0] |= 1 << (uniqid - 1)
+
+
+@pytest.fixture
+def fake_drizzle(monkeypatch):
+    """Drizzle with fake_dodrizzle, without output FITS WCS, on 4 cores"""
+    monkeypatch.setattr(gwcs_drizzle, 'dodrizzle', fake_dodrizzle)
+    monkeypatch.setattr(resample.ResampleData, 'update_fits_wcs',
+                        lambda self, model: None)
+    monkeypatch.setattr(resample.multiprocessing, 'cpu_count', lambda: 4)
+
+
+def make_resample(nexposures=4, shape=(8, 10), **pars):
+    """ResampleData for exposures of two detectors, without a real WCS"""
+    rng = np.random.RandomState(9)
+    input_models = datamodels.ModelContainer()
+    for i in range(nexposures):
+        for detector in ('NRCA1', 'NRCA2'):
+            model = datamodels.ImageModel(
+                data=rng.normal(10., 1., shape).astype(np.float32))
+            model.meta.instrument.detector = detector
+            model.meta.observation.program_number = '00001'
+            model.meta.observation.observation_number = '001'
+            model.meta.observation.visit_number = '001'
+            model.meta.observation.visit_group = '01'
+            model.meta.observation.sequence_id = '1'
+            model.meta.observation.activity_id = '01'
+            model.meta.observation.exposure_number = str(i + 1)
+            model.meta.exposure.exposure_time = 10. + i
+            model.meta.exposure.start_time = 58000. + i
+            model.meta.exposure.end_time = 58000.5 + i
+            model.meta.background.subtracted = False
+            model.meta.background.level = 0.5 * i
+            model.meta.wcs = None
+            model.meta.wcsinfo.cdelt1 = 1.
+            input_models.append(model)
+
+    resample_data = resample.ResampleData.__new__(resample.ResampleData)
+    resample_data.input_models = input_models
+    resample_data.drizpars = dict(single=True, blendheaders=False, pixfrac=1.,
+                                  kernel='square', fillval='INDEF',
+                                  weight_type='exptime', good_bits=6, **pars)
+    resample_data.output_wcs = wcs.WCS(
+        models.Shift(0.) & models.Shift(0.), input_frame='detector',
+        output_frame='world')
+    resample_data.output_wcs.data_size = shape
+    if pars.get('in_memory', True):
+        resample_data.blank_output = datamodels.DrizProductModel(shape)
+    else:
+        resample_data.blank_output = datamodels.DrizProductModel()
+    resample_data.blank_output.meta.wcs = resample_data.output_wcs
+    resample_data.blank_output.meta.wcsinfo.cdelt1 = 1.
+    resample_data.output_models = datamodels.ModelContainer()
+    return resample_data
+
+
+def test_drizzle_groups_parallel(fake_drizzle):
+    """Drizzling the groups in processes gives the sequential outputs"""
+    serial = make_resample()
+    serial.do_drizzle()
+    parallel = make_resample(maximum_cores='all')
+    parallel.do_drizzle()
+
+    assert len(parallel.output_models) == len(serial.output_models) == 4
+    for first, second in zip(serial.output_models, parallel.output_models):
+        assert second.meta.filename == first.meta.filename
+        assert second.meta.exposure.exposure_time == first.meta.exposure.exposure_time
+        assert second.meta.exposure.start_time == first.meta.exposure.start_time
+        np.testing.assert_array_equal(second.data, first.data)
+        np.testing.assert_array_equal(second.wht, first.wht)
+        np.testing.assert_array_equal(second.con, first.con)
+        assert np.all(second.con == 3)
+
+    # the inputs are sky subtracted in place in both modes
+    for first, second in zip(serial.input_models, parallel.input_models):
+        np.testing.assert_array_equal(second.data, first.data)
+
+
+@pytest.mark.parametrize('maximum_cores', [None, 'all'])
+def test_drizzle_on_disk(fake_drizzle, maximum_cores):
+    """The outputs on disk are memory-mapped, with the in-memory values"""
+    in_memory = make_resample()
+    in_memory.do_drizzle()
+    on_disk = make_resample(in_memory=False, maximum_cores=maximum_cores)
+    on_disk.do_drizzle()
+
+    assert len(on_disk.output_models) == len(in_memory.output_models) == 4
+    for first, second in zip(in_memory.output_models, on_disk.output_models):
+        assert second.meta.filename == first.meta.filename
+        for array in (second.data, second.wht, second.con):
+            assert isinstance(array, np.memmap)
+        np.testing.assert_array_equal(second.data, first.data)
+        np.testing.assert_array_equal(second.wht, first.wht)
+        np.testing.assert_array_equal(second.con, first.con)
+        assert np.all(second.con == 3)
+
+    # the context planes for all the inputs are created on disk
+    output_model = on_disk.new_output_model('many_cal.fits', 33)
+    assert output_model.con.shape == (2, 8, 10)
@@ -1,5 +1,11 @@
-from jwst.datamodels import SlitModel
+import copy
+
+import numpy as np
+from astropy.modeling.models import Mapping, Polynomial2D, Scale
+from gwcs import WCS
 
+from jwst.datamodels import SlitModel
+from jwst.resample import resample_utils
 from jwst.resample.resample_spec import find_dispersion_axis
 
 
@@ -14,3 +20,102 @@ def test_find_dispersion_axis():
 
     dm.meta.wcsinfo.dispersion_direction = 2    # vertical
     assert find_dispersion_axis(dm) == 1        # Y axis for wcs functions
+
+
+def distorted_wcs(shift=0.):
+    """ Simple imaging WCS with a polynomial distortion """
+    distortion = (Mapping((0, 1, 0, 1)) |
+                  Polynomial2D(3, c0_0=shift, c1_0=1.01, c0_1=0.002, c2_0=2e-5,
+                               c1_1=-1e-5, c3_0=1e-8) &
+                  Polynomial2D(3, c0_0=-shift, c1_0=-0.003, c0_1=0.99,
+                               c0_2=3e-5, c2_1=2e-9))
+    return WCS(distortion | (Scale(1e-5) & Scale(1e-5)),
+               input_frame='detector', output_frame='world')
+
+
+def output_wcs():
+    return WCS(Scale(1.1e-5) & Scale(1.1e-5), input_frame='detector',
+               output_frame='world')
+
+
+def test_calc_gwcs_pixmap_interpolated():
+    """ The interpolated pixel map is within tolerance of the exact one """
+    shape = (200, 300)
+    exact = resample_utils.calc_gwcs_pixmap(distorted_wcs(), output_wcs(),
+                                            shape, cache=None)
+    pixmap = resample_utils.calc_gwcs_pixmap(distorted_wcs(), output_wcs(),
+                                             shape, tolerance=0.001,
+                                             cache=None)
+    assert pixmap.shape == exact.shape == (200, 300, 2)
+    assert np.max(np.abs(pixmap - exact)) < 0.001
+
+
+def test_interpolate_pixmap_undefined():
+    """ The pixel map is not interpolated where the transform is undefined """
+    def transform(x, y):
+        return np.where(x > 50, np.nan, x), y
+
+    bb = resample_utils.wcs_bbox_from_shape((100, 100))
+    assert resample_utils.interpolate_pixmap(transform, bb, 0.01) is None
+    assert resample_utils.interpolate_pixmap(lambda x, y: (x, y), bb,
+                                             0.01) is not None
+
+
+def test_pixmap_cache():
+    """ Pixel maps are reused for WCS objects with the same content """
+    cache = resample_utils.PixmapCache(max_bytes=2**30)
+    shape = (50, 60)
+    pixmap = resample_utils.calc_gwcs_pixmap(distorted_wcs(), output_wcs(),
+                                             shape, cache=cache)
+    assert not pixmap.flags.writeable
+    assert resample_utils.calc_gwcs_pixmap(
+        distorted_wcs(), copy.deepcopy(output_wcs()), shape,
+        cache=cache) is pixmap
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # other input WCS, and interpolated pixel maps, are separate entries
+    other = resample_utils.calc_gwcs_pixmap(distorted_wcs(shift=1.),
+                                            output_wcs(), shape, cache=cache)
+    np.testing.assert_allclose(other[..., 0], pixmap[..., 0] + 1 / 1.1)
+    interpolated = resample_utils.calc_gwcs_pixmap(
+        distorted_wcs(), output_wcs(), shape, tolerance=0.01, cache=cache)
+    assert resample_utils.calc_gwcs_pixmap(
+        distorted_wcs(), output_wcs(), shape, tolerance=0.01,
+        cache=cache) is not interpolated
+    assert (cache.hits, cache.misses) == (2, 3)
+    assert len(cache.pixmaps) == 3
+    assert cache.nbytes < 3 * pixmap.nbytes
+
+    cache.clear()
+    assert len(cache.pixmaps) == 0
+    assert cache.nbytes == 0
+
+
+def test_pixmap_cache_size(monkeypatch):
+    """ Pixel maps larger than the cache are not stored """
+    shape = (50, 60)
+    nbytes = shape[0] * shape[1] * 2 * 8
+    cache = resample_utils.PixmapCache(max_bytes=nbytes)
+    pixmap = resample_utils.calc_gwcs_pixmap(distorted_wcs(), output_wcs(),
+                                             shape, cache=cache)
+    assert cache.nbytes == pixmap.nbytes == nbytes
+
+    # the new map replaces the old one
+    resample_utils.calc_gwcs_pixmap(distorted_wcs(shift=1.), output_wcs(),
+                                    shape, cache=cache)
+    assert len(cache.pixmaps) == 1
+    assert cache.nbytes == nbytes
+
+    # a larger map is not stored
+    resample_utils.calc_gwcs_pixmap(distorted_wcs(), output_wcs(),
+                                    (60, 60), cache=cache)
+    assert len(cache.pixmaps) == 1
+
+    # a size of 0 turns the cache off, without building the keys
+    cache.resize(0)
+    assert len(cache.pixmaps) == 0
+    monkeypatch.setattr(resample_utils, 'pixmap_key', None)
+    resample_utils.calc_gwcs_pixmap(distorted_wcs(), output_wcs(), shape,
+                                    cache=cache)
+    assert cache.nbytes == 0
+    assert cache.misses == 3
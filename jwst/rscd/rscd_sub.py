@@ -9,6 +9,10 @@ from .. import datamodels
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
+# Approximate size of the correction computed at once, for a chunk of
+# integrations
+CHUNK_BYTES = 2**24
+
 
 def do_correction(input_model, rscd_model):
     """
@@ -73,117 +77,98 @@ def do_correction(input_model, rscd_model):
         output.meta.cal_step.rscd = 'SKIPPED'
         return output
 
-    # Determine the parameters that rely only on ngroups
-    ngroups2 = sci_ngroups * sci_ngroups
-    b1_even = param['even']['ascale'] * (
-        param['even']['illum_zp'] +
-        param['even']['illum_slope'] * sci_ngroups +
-        param['even']['illum2'] * ngroups2)
-
-    b1_odd = param['odd']['ascale'] * (
-        param['odd']['illum_zp'] +
-        param['odd']['illum_slope'] * sci_ngroups +
-        param['odd']['illum2'] * ngroups2)
-
-    sat_final_slope_even = (
-        param['even']['sat_zp'] + param['even']['sat_slope'] * sci_ngroups +
-        param['even']['sat2'] * ngroups2 + param['even']['sat_rowterm'])
-
-    sat_final_slope_odd = (
-        param['odd']['sat_zp'] + param['odd']['sat_slope'] * sci_ngroups +
-        param['odd']['sat2'] * ngroups2 + param['odd']['sat_rowterm'])
-
-    b2_even = param['even']['pow'].item()
-    b2_odd = param['odd']['pow'].item()
-    b3_even = param['even']['param3'].item()
-    b3_odd = param['odd']['param3'].item()
-    crossopt_even = param['even']['crossopt'].item()
-    crossopt_odd = param['odd']['crossopt'].item()
-    sat_mzp_even = param['even']['sat_mzp'].item()
-    sat_mzp_odd = param['odd']['sat_mzp'].item()
-    sat_scale_even = param['even']['sat_scale'].item()
-    sat_scale_odd = param['odd']['sat_scale'].item()
-    tau_even = param['even']['tau'].item()
-    tau_odd = param['odd']['tau'].item()
-
-    # loop over all integrations except the first
-    mdelta = int(sci_nints / 10) + 1
-    for i in range(1, sci_nints):
-        if ((i + 1) % mdelta) == 0:
-            log.info(' Working on integration %d', i + 1)
+    # Correct chunks of integrations at once, all but the first
+    nchunk = max(1, CHUNK_BYTES // (input_model.data[0].size * 8))
+    for start in range(1, sci_nints, nchunk):
+        ints = slice(start, min(start + nchunk, sci_nints))
+        log.info(' Working on integrations %d to %d', ints.start + 1,
+                 ints.stop)
 
         sat, dn_last23, dn_lastfit = \
-            get_DNaccumulated_last_int(input_model, i, sci_ngroups)
-
-        lastframe_even = dn_last23[1::2, :]
-        lastframe_odd = dn_last23[0::2, :]
-
-        correction_even = lastframe_even.copy() * 0.0
-        correction_odd = lastframe_odd.copy() * 0.0
-        factor2_even = lastframe_even.copy() * 0.0
-        factor2_odd = lastframe_odd.copy() * 0.0
-        a1_even = lastframe_even.copy() * 0.0
-        a1_odd = lastframe_odd.copy() * 0.0
-
-        counts2_even = lastframe_even - crossopt_even
-        counts2_odd = lastframe_odd - crossopt_odd
-
-        counts2_even[np.where(counts2_even < 0)] = 0.0
-        counts2_odd[np.where(counts2_odd < 0)] = 0.0
-
-        # Find where counts2 > 0 and is finite
-        good_even = np.where((counts2_even > 0) & np.isfinite(counts2_even))
-        good_odd = np.where((counts2_odd > 0) & np.isfinite(counts2_odd))
-        #__________________________________________________________________
-        # even row values
-        factor2_even[good_even] = 1.0 / \
-            (np.exp(counts2_even[good_even] / b3_even) - 1)
-        a1_even = b1_even * (np.power(counts2_even, b2_even)) * factor2_even
-        #___________________________________________________________________
-        # odd row values
-        factor2_odd[good_odd] = 1.0 / \
-            (np.exp(counts2_odd[good_odd] / b3_odd) - 1)
-        a1_odd = b1_odd * (np.power(counts2_odd, b2_odd)) * factor2_odd
-        #___________________________________________________________________
-        # SATURATED DATA
-        counts3_even = dn_lastfit[1::2, :] * sat_scale_even
-        counts3_odd = dn_lastfit[0::2, :] * sat_scale_odd
-
-        a1_sat_even = sat_final_slope_even * counts3_even + sat_mzp_even
-        a1_sat_odd = sat_final_slope_odd * counts3_odd + sat_mzp_odd
-
-        sat_even = sat[1::2, :]
-        sat_odd = sat[0::2, :]
-
-        # loop over groups in input science data:
-        for j in range(sci_ngroups):
-
-            # Compute the correction factors for even and odd rows
-            T = (j + 1)
-            eterm_even = np.exp(-T / tau_even)
-            eterm_odd = np.exp(-T / tau_odd)
-
-            # Apply the corrections to even and odd rows:
-            # the first row is defined as odd (python index 0)
-            # the second row is the first even row (python index of 1)
-            correction_odd = lastframe_odd * a1_odd * 0.01 * eterm_odd
-            correction_even = lastframe_even * a1_even * 0.01 * eterm_even
-            correction_sat_odd = lastframe_odd * a1_sat_odd * 0.01 * eterm_odd
-            correction_sat_even = lastframe_even * a1_sat_even * 0.01 * \
-                eterm_even
-            sat_index_even = np.where(sat_even)
-            sat_index_odd = np.where(sat_odd)
-            correction_even[sat_index_even] = \
-                correction_sat_even[sat_index_even]
-            correction_odd[sat_index_odd] = correction_sat_odd[sat_index_odd]
-            output.data[i, j, 0::2, :] += correction_odd
-            output.data[i, j, 1::2, :] += correction_even
+            get_DNaccumulated_last_int(input_model, ints, sci_ngroups)
+
+        # Apply the corrections to even and odd rows:
+        # the first row is defined as odd (python index 0)
+        # the second row is the first even row (python index of 1)
+        for rows, row_param in ((slice(0, None, 2), param['odd']),
+                                (slice(1, None, 2), param['even'])):
+            output.data[ints, :, rows, :] += rscd_correction(
+                dn_last23[:, rows, :], dn_lastfit[:, rows, :],
+                sat[:, rows, :], row_param, sci_ngroups)
 
     output.meta.cal_step.rscd = 'COMPLETE'
 
     return output
 
 
+def rscd_correction(lastframe, lastframe_fit, sat, row_param, sci_ngroups):
+
+    """
+    Compute the correction for all the groups of a set of integrations,
+    for either the even or the odd rows
+
+    Parameters
+    ----------
+    lastframe: last frame of the previous integrations, extrapolated from
+        the second and third to last frames
+    lastframe_fit: last frame of the previous integrations, extrapolated
+        from the fit to the ramp
+    sat: the previous integration for this pixel saturated: yes/no
+    row_param: parameters from the reference file for this row type
+    sci_ngroups: number of groups/integration
+
+    return values
+    -------------
+    correction: correction to be added to the science data, with the
+        groups along the second axis
+    """
+
+    # Determine the parameters that rely only on ngroups
+    ngroups2 = sci_ngroups * sci_ngroups
+    b1 = row_param['ascale'] * (
+        row_param['illum_zp'] +
+        row_param['illum_slope'] * sci_ngroups +
+        row_param['illum2'] * ngroups2)
+
+    sat_final_slope = (
+        row_param['sat_zp'] + row_param['sat_slope'] * sci_ngroups +
+        row_param['sat2'] * ngroups2 + row_param['sat_rowterm'])
+
+    b2 = row_param['pow'].item()
+    b3 = row_param['param3'].item()
+    crossopt = row_param['crossopt'].item()
+    sat_mzp = row_param['sat_mzp'].item()
+    sat_scale = row_param['sat_scale'].item()
+    tau = row_param['tau'].item()
+
+    factor2 = lastframe * 0.0
+
+    counts2 = lastframe - crossopt
+    counts2[counts2 < 0] = 0.0
+
+    # Find where counts2 > 0 and is finite
+    good = (counts2 > 0) & np.isfinite(counts2)
+    factor2[good] = 1.0 / (np.exp(counts2[good] / b3) - 1)
+    a1 = b1 * (np.power(counts2, b2)) * factor2
+
+    # The correction decays exponentially with the group number
+    eterm = np.exp(-np.arange(1, sci_ngroups + 1) / tau)
+
+    correction = lastframe * a1 * 0.01
+    correction = correction[:, np.newaxis] * \
+        eterm.astype(correction.dtype)[:, np.newaxis, np.newaxis]
+
+    # SATURATED DATA
+    sat_index = np.where(sat)
+    counts3 = lastframe_fit[sat_index] * sat_scale
+    a1_sat = sat_final_slope.item() * counts3 + sat_mzp
+    correction_sat = lastframe[sat_index] * a1_sat * 0.01
+    correction[sat_index[0], :, sat_index[1], sat_index[2]] = \
+        correction_sat[:, np.newaxis] * eterm
+
+    return correction
+
+
 def get_rscd_parameters(input_model, rscd_model):
 
     """
@@ -289,7 +274,7 @@ def get_rscd_parameters(input_model, rscd_model):
     return param
 
 
-def get_DNaccumulated_last_int(input_model, i, sci_ngroups):
+def get_DNaccumulated_last_int(input_model, ints, sci_ngroups):
 
     """
     Find the accumulated DN from the last integration
@@ -302,7 +287,8 @@ def get_DNaccumulated_last_int(input_model, i, sci_ngroups):
     Parameters
     ----------
     input_model: input ramp data
-    i: integration #
+    ints: slice of the integrations to be corrected; the values are found
+        for the integrations before them
     sci_ngroups: number of frames/integration
 
     return values
@@ -312,13 +298,9 @@ def get_DNaccumulated_last_int(input_model, i, sci_ngroups):
     dn_lastfrane_fit: extrapolated last frame using the fit to the entire ramp
     """
 
-    nrows = input_model.data.shape[2]
-    ncols = input_model.data.shape[3]
-    dn_lastframe2 = input_model.data[i - 1][sci_ngroups - 2]
-    dn_lastframe3 = input_model.data[i - 1][sci_ngroups - 3]
-    dn_lastframe23 = dn_lastframe2.copy() * 0.0
-    dn_lastframe_fit = dn_lastframe2.copy() * 0.0
-    saturated = np.full((nrows, ncols), False)
+    prev = slice(ints.start - 1, ints.stop - 1)
+    dn_lastframe2 = input_model.data[prev, sci_ngroups - 2]
+    dn_lastframe3 = input_model.data[prev, sci_ngroups - 3]
 
     diff = dn_lastframe2 - dn_lastframe3
     dn_lastframe23 = dn_lastframe2 + diff
@@ -328,27 +310,27 @@ def get_DNaccumulated_last_int(input_model, i, sci_ngroups):
     ref_flag = datamodels.dqflags.pixel['REFERENCE_PIXEL']
 
     # mark the locations of reference pixels
-    refpix_2d = np.bitwise_and(input_model.pixeldq, ref_flag)
-    dn_lastframe23[np.where(refpix_2d)] = 0.0
+    refpix_2d = np.bitwise_and(input_model.pixeldq, ref_flag) > 0
+    dn_lastframe23[:, refpix_2d] = 0.0
 
     # load the ramp data needed for computing slopes
-    ramp3d = input_model.data[i - 1, 1:sci_ngroups - 1]
-    groupdq3d = input_model.groupdq[i - 1, 1:sci_ngroups - 1]
-    satmask3d = (groupdq3d == sat_flag)
-    saturated = satmask3d.any(axis=0)
+    ramp = input_model.data[prev, 1:sci_ngroups - 1]
+    groupdq = input_model.groupdq[prev, 1:sci_ngroups - 1]
+    satmask = (groupdq == sat_flag)
+    saturated = satmask.any(axis=1)
 
     # compute the slopes
-    slope, intercept, ngood = ols_fit(ramp3d, groupdq3d)
+    slope, intercept, ngood = ols_fit(ramp, groupdq)
 
     dn_lastframe_fit = slope * sci_ngroups + intercept
 
     # reset the results for pixels with zero slope
-    slope0 = np.where(slope == 0)
+    slope0 = (slope == 0)
     dn_lastframe_fit[slope0] = dn_lastframe23[slope0]
 
     # reset the results for reference pixels
-    dn_lastframe23[np.where(refpix_2d)] = 0.0
-    dn_lastframe_fit[np.where(refpix_2d)] = 0.0
+    dn_lastframe23[:, refpix_2d] = 0.0
+    dn_lastframe_fit[:, refpix_2d] = 0.0
 
     return saturated, dn_lastframe23, dn_lastframe_fit
 
@@ -360,23 +342,24 @@ def ols_fit(y, dq):
     needed for the RSCD correction.
     This routine does a simple ordinary least squares fit to
     non-saturating data.
+    The ramps are along the third to last axis, so the ramps of several
+    integrations are fit at once.
     """
 
     sat_flag = datamodels.dqflags.group['SATURATED']
     shape = y.shape
 
     # Find ramp values that are saturated
-    x = np.arange(shape[0], dtype=np.float64)[:, np.newaxis, np.newaxis] * \
-        np.ones(shape)
+    x = np.arange(shape[-3], dtype=np.float64)[:, np.newaxis, np.newaxis]
     good_data = np.bitwise_and(dq, sat_flag) == 0
-    ngood = good_data.sum(axis=0)
+    ngood = good_data.sum(axis=-3)
 
     # Compute sums of unsaturated (good) x/y values
-    sumx = (x * good_data).sum(axis=0)
-    sumy = (y * good_data).sum(axis=0)
-    sumxy = (x * y * good_data).sum(axis=0)
-    sumxx = (x * x * good_data).sum(axis=0)
-    nelem = good_data.sum(axis=0)
+    sumx = (x * good_data).sum(axis=-3)
+    sumy = (y * good_data).sum(axis=-3)
+    sumxy = (x * y * good_data).sum(axis=-3)
+    sumxx = (x * x * good_data).sum(axis=-3)
+    nelem = good_data.sum(axis=-3)
 
     # Compute the slopes and intercepts
     denom = nelem * sumxx - sumx * sumx
@@ -385,7 +368,7 @@ def ols_fit(y, dq):
         intercept = (sumxx * sumy - sumx * sumxy) / denom
 
     # Reset results to zero for pixels having < 3 unsaturated values
-    bad = np.where(ngood < 3)
+    bad = (ngood < 3)
     slope[bad] = 0.0
     intercept[bad] = 0.0
 
@@ -0,0 +1,72 @@
+"""Test the RSCD correction"""
+import numpy as np
+
+from jwst import datamodels
+from jwst.datamodels import dqflags
+from jwst.rscd import rscd_sub
+
+
+def make_models(nints=6, ngroups=8, nrows=20, ncols=16):
+    """MIRI ramps with some saturation, and an RSCD reference table"""
+    rng = np.random.RandomState(2)
+    data = np.cumsum(rng.uniform(0., 3000., size=(nints, ngroups, nrows, ncols)),
+                     axis=1).astype(np.float32)
+    model = datamodels.RampModel(data=data,
+                                 pixeldq=np.zeros((nrows, ncols), dtype=np.uint32),
+                                 groupdq=np.zeros(data.shape, dtype=np.uint8))
+    model.groupdq[:, 5:, :10, :] = dqflags.group['SATURATED']
+    model.pixeldq[:, :4] = dqflags.pixel['REFERENCE_PIXEL']
+    model.meta.instrument.name = 'MIRI'
+    model.meta.exposure.readpatt = 'FAST'
+    model.meta.subarray.name = 'FULL'
+
+    names = ['TAU', 'ASCALE', 'POW', 'ILLUM_ZP', 'ILLUM_SLOPE', 'ILLUM2',
+             'PARAM3', 'CROSSOPT', 'SAT_ZP', 'SAT_SLOPE', 'SAT_2', 'SAT_MZP',
+             'SAT_ROWTERM', 'SAT_SCALE']
+    table = np.zeros(2, dtype=[('READPATT', 'S13'), ('SUBARRAY', 'S4'),
+                               ('ROWS', 'S4')] + [(name, 'f4') for name in names])
+    table['READPATT'] = 'FAST'
+    table['SUBARRAY'] = 'FULL'
+    table['ROWS'] = ['EVEN', 'ODD']
+    values = [[1.7, 2.3], [1.3e-3, 1.1e-3], [1.1, 1.2], [3., 2.], [0.1, 0.2],
+              [-0.01, -0.02], [3000., 4000.], [100., 200.], [0.01, 0.02],
+              [1e-4, 2e-4], [1e-6, 2e-6], [0.1, 0.2], [0.001, 0.002],
+              [0.9, 0.8]]
+    for name, value in zip(names, values):
+        table[name] = value
+    rscd_model = datamodels.RSCDModel()
+    rscd_model.rscd_table = table
+    return model, rscd_model
+
+
+def test_ols_fit_integrations():
+    """The ramps of several integrations are fit at once"""
+    model, _ = make_models()
+    ramps = model.data[:, 1:-1]
+    dq = model.groupdq[:, 1:-1]
+    slope, intercept, ngood = rscd_sub.ols_fit(ramps, dq)
+    for i in range(ramps.shape[0]):
+        expected = rscd_sub.ols_fit(ramps[i], dq[i])
+        np.testing.assert_array_equal(slope[i], expected[0])
+        np.testing.assert_array_equal(intercept[i], expected[1])
+        np.testing.assert_array_equal(ngood[i], expected[2])
+
+
+def test_correction_chunks(monkeypatch):
+    """The correction does not depend on the number of integrations
+    corrected at once"""
+    model, rscd_model = make_models()
+    result = rscd_sub.do_correction(model, rscd_model)
+    assert result.meta.cal_step.rscd == 'COMPLETE'
+
+    # the first integration is not corrected, the others are
+    np.testing.assert_array_equal(result.data[0], model.data[0])
+    assert np.all(result.data[1:, :, :, 4:] > model.data[1:, :, :, 4:])
+
+    # the correction decays with the group number
+    correction = result.data[1:] - model.data[1:]
+    assert np.all(np.diff(correction[:, :, :, 4:], axis=1) < 0)
+
+    monkeypatch.setattr(rscd_sub, 'CHUNK_BYTES', 1)
+    np.testing.assert_array_equal(
+        rscd_sub.do_correction(model, rscd_model).data, result.data)
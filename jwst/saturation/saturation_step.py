@@ -2,6 +2,7 @@
 
 from ..stpipe import Step
 from .. import datamodels
+from ..lib import reffile_cache
 from . import saturation
 
 
@@ -13,6 +14,10 @@ class SaturationStep(Step):
     This Step sets saturation flags.
     """
 
+    spec = """
+        reference_cache_size = integer(default=0) # Bytes of reference models cached for later exposures, 0 for none
+    """
+
     reference_file_types = ['saturation']
 
     def process(self, input):
@@ -32,14 +37,19 @@ class SaturationStep(Step):
                 result.meta.cal_step.saturation = 'SKIPPED'
                 return result
 
-            # Open the reference file data model
-            ref_model = datamodels.SaturationModel(self.ref_name)
+            # Get the reference file data model, from the reference model
+            # cache if reference_cache_size is set
+            cache = reffile_cache.get_cache('saturation',
+                                            self.reference_cache_size)
+            ref_model = reffile_cache.get_reference_model(
+                input_model, self.ref_name, datamodels.SaturationModel,
+                cache=cache)
 
             # Do the saturation check
             sat = saturation.do_correction(input_model, ref_model)
 
             # Close the reference file and update the step status
-            ref_model.close()
+            reffile_cache.release_reference_model(ref_model, cache)
             sat.meta.cal_step.saturation = 'COMPLETE'
 
         return sat
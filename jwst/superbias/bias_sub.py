@@ -36,8 +36,11 @@ def do_correction(input_model, bias_model):
     if not reffile_utils.ref_matches_sci(input_model, bias_model):
         bias_model = reffile_utils.get_subarray_model(input_model, bias_model)
 
-    # Replace NaN's in the superbias with zeros
-    bias_model.data[np.isnan(bias_model.data)] = 0.0
+    # Replace NaN's in the superbias with zeros, in a copy, as the
+    # reference model may be shared with other exposures
+    if np.isnan(bias_model.data).any():
+        bias_model = bias_model.copy()
+        bias_model.data[np.isnan(bias_model.data)] = 0.0
 
     # Subtract the bias ref image from the science data
     output_model = subtract_bias(input_model, bias_model)
@@ -1,5 +1,6 @@
 from ..stpipe import Step
 from .. import datamodels
+from ..lib import reffile_cache
 from . import bias_sub
 
 __all__ = ["SuperBiasStep"]
@@ -12,7 +13,7 @@ class SuperBiasStep(Step):
     """
 
     spec = """
-
+        reference_cache_size = integer(default=0) # Bytes of reference models cached for later exposures, 0 for none
     """
 
     reference_file_types = ['superbias']
@@ -34,15 +35,20 @@ class SuperBiasStep(Step):
                 result.meta.cal_step.superbias = 'SKIPPED'
                 return result
 
-            # Open the superbias ref file data model
-            bias_model = datamodels.SuperBiasModel(self.bias_name)
+            # Get the superbias ref file data model, from the reference
+            # model cache if reference_cache_size is set
+            cache = reffile_cache.get_cache('superbias',
+                                            self.reference_cache_size)
+            bias_model = reffile_cache.get_reference_model(
+                input_model, self.bias_name, datamodels.SuperBiasModel,
+                cache=cache)
 
             # Do the bias subtraction
             result = bias_sub.do_correction(input_model, bias_model)
 
             # Close the superbias reference file model and
             # set the step status to complete
-            bias_model.close()
+            reffile_cache.release_reference_model(bias_model, cache)
             result.meta.cal_step.superbias = 'COMPLETE'
 
         return result
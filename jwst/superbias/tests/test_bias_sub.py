@@ -113,6 +113,23 @@ def test_nans_in_superbias(setup_full_cube):
     assert np.array_equal(output.data[0, :, 50, 50], data.data[0, :, 50, 50] - blevel)
 
 
+def test_read_only_superbias(setup_full_cube):
+    '''Check that a read-only superbias with NaNs, as shared by the reference
+       file cache, is not modified.'''
+
+    data, bias = setup_full_cube(2, 2048, 2048)
+    data.data[:] = 2000.
+    bias.data[:] = 2000.
+    bias.data[500, 500] = np.nan
+    bias.data.flags.writeable = False
+
+    output = do_correction(data, bias)
+
+    assert np.isnan(bias.data[500, 500])
+    assert np.array_equal(output.data[0, :, 500, 500], data.data[0, :, 500, 500])
+    assert np.array_equal(output.data[0, :, 50, 50], data.data[0, :, 50, 50] - 2000.)
+
+
 def test_full_step(setup_full_cube):
     '''Test full run of the SuperBiasStep.'''
 
@@ -97,7 +97,7 @@ setup(
         'jsonschema>=2.3,<4',
         'numpy>=1.16',
         'photutils>=0.7',
-        'scipy>=1.0',
+        'scipy>=1.4',
         'spherical-geometry>=1.2',
         'stsci.image>=2.3.3',
         'stsci.imagestats>=1.4',